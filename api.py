@@ -0,0 +1,118 @@
+import io
+
+from parser_file import ParserFile, Diagnostic
+from parser_ import parse
+from ir import generator, program, optimize as optimize_ir, serialize
+import asm_gen
+
+# Compiles source held in memory, for embedding the compiler in a service instead of running
+# main.py on files.
+#
+#   result = api.compile_source(b"module m\n...", "m.txt", target="linux-x86_64")
+#   if not result.ok:
+#       print("\n".join(diagnostic.format() for diagnostic in result.diagnostics))
+#
+# Nothing gets read, written or printed: the source is a str or utf-8 bytes, errors come back as
+# parser_file.Diagnostic and the generated code as a str, or bytes for object files. A call
+# builds its own ParserFile, parser, IR and Program and the backends only share tables which
+# don't change, so threads can compile at the same time. Code gets generated in the calling
+# thread; threads don't run python at the same time though, compiling many units from a pool
+# of threads takes about as long as compiling them one after the other (python3 -m bench.api).
+#
+# A bad target or asking a target for an object file it can't write raises ValueError, they
+# are mistakes of the caller and not of the source. Anything else goes wrong as a Diagnostic:
+# bytes which aren't utf-8, and the exceptions of parts of the language the compiler can't
+# handle yet, pointing at the token they came from when they have one.
+
+
+class Result:
+    __slots__ = "ok", "diagnostics", "code", "ir", "program", "remarks"
+    def __init__(self, diagnostics):
+        self.ok = True
+        self.diagnostics = diagnostics # list[parser_file.Diagnostic]
+        self.code = None # str, bytes of an object file, None without a target or after errors
+        self.ir = None # the IR file (ir.serialize) when asked for
+        self.program = None # the resolved ir.program.Program
+        self.remarks = list() # the inlining remarks of optimize, formatted
+
+
+def compile_source(source, filename="<memory>", target=None, optimize=False, object_file=False,
+    emit_ir=False) -> Result:
+    """
+    Result of compiling source, a str or bytes, filename is what errors get reported against.
+    target is an asm_gen.ASM_ARCH name, None only resolves and type checks the program
+    """
+    backend = None
+    if target is not None:
+        backend = asm_gen.generator(target)
+        if backend is None:
+            raise ValueError(f"No assembly generator for {target}")
+        if object_file and not hasattr(backend, "generate_object"):
+            raise ValueError(f"{target} can't write object files")
+
+    diagnostics = list()
+    result = Result(diagnostics)
+    try:
+        src = ParserFile(filename, source, diagnostics)
+    except UnicodeDecodeError as e:
+        diagnostics.append(_decode_error(filename, e))
+        result.ok = False
+        return result
+
+    try:
+        _compile(src, result, backend, optimize, object_file, emit_ir)
+    except Exception as e:
+        # parts of the language the compiler can't handle yet, most raise with the token
+        where = e.args[0] if e.args and hasattr(e.args[0], "pos") else None
+        if where is not None:
+            src.error(where, f"{src.get_token_string(where)!r} is not supported yet")
+        else:
+            diagnostics.append(Diagnostic(filename, None, None, 0,
+                f"Internal compiler error: {type(e).__name__}: {e}", None))
+        result.ok = False
+        result.code = result.program = None
+    return result
+
+
+def _decode_error(filename, error) -> Diagnostic:
+    data = error.object
+    line_start = data.rfind(b"\n", 0, error.start) + 1
+    line_end = data.find(b"\n", error.start)
+    line = data[line_start : len(data) if line_end < 0 else line_end]
+    column = len(data[line_start : error.start].decode(errors="replace")) + 1
+    return Diagnostic(filename, data.count(b"\n", 0, error.start) + 1, column,
+        max(1, error.end - error.start), f"Source is not valid utf-8: {error.reason}",
+        line.decode(errors="replace"))
+
+
+def _compile(src, result, backend, optimize, object_file, emit_ir):
+    tree, num_errors = parse(src.filename, src)
+    if num_errors:
+        result.ok = False
+        return
+
+    num_errors, rep = generator.generate(src, tree)
+    if num_errors:
+        result.ok = False
+        return
+    if emit_ir:
+        result.ir = serialize.dumps(src, rep)
+
+    num_errors, prog = program.build(src, rep)
+    if num_errors:
+        result.ok = False
+        return
+    result.program = prog
+
+    if optimize:
+        remarks = list()
+        optimize_ir.optimize(prog, remarks)
+        result.remarks = [remark.format(src) for remark in remarks]
+
+    if backend is not None:
+        out = io.BytesIO() if object_file else io.StringIO()
+        gen = backend.generate_object if object_file else backend.generate
+        if not gen(src, prog, out):
+            result.ok = False
+            return
+        result.code = out.getvalue()
@@ -4,34 +4,68 @@ import platform
 from importlib import import_module
     
 # Every asm generator lives in it's own sub-module which is imported dynamically
-# They should have have a generate(src, ast) -> io.StringIO | None function which gets called
-# to generate assembly for the target (None here means there was some kind of error)
+# They should have have a generate(src, program, out, stats=None, jobs=1) -> bool function which gets called
+# to generate assembly for the target (False here means there was some kind of error)
+# program is the resolved IR from ir.program.build() and out is the text file the assembly
+# gets written to, generators should write each function out as soon as it is done instead
+# of holding the whole module in memory.
+# stats is None or a dict the generators put their statistics in by section: generators using
+# asm_gen.regalloc put the statistics of every function under "regalloc" and the ones running
+# asm_gen.peephole over their instructions count the rules that fired under "peephole".
+# jobs is how many processes the generator may use, generators using asm_gen.parallel generate
+# the functions in a process pool and write out the same as with one job.
+# Generators which can write object files directly have a
+# generate_object(src, program, out, stats=None, jobs=1) -> bool function as well, out is then a
+# binary file the ELF object gets written to.
 
 # map from os-arch to ..os_arch (search path for importlib.import_module())
 # (..os_arch is the relative path to the module)
 ASM_ARCH: dict = {
     "foo-arch": "..foo_arch",
     "linux-aarch64": "..linux_aarch64",
+    "linux-x86_64": "..linux_x86_64",
+    "python": "..python",
+    "c": "..c",
 }
 
 def list_targets():
     targets = ASM_ARCH.keys()
     print("\n".join(reversed(targets)))
 
-def gen_asm(src, ast, target: str | None):
-    
+def generator(target: str | None):
+    """the module generating code for target (None: this machine), None if there isn't one"""
     if target is None:
         target = f"{sys.platform}-{platform.machine()}"
 
     asm_generator = ASM_ARCH.get(target)
     if asm_generator is None:
-        print(f"No assembly generator for {target}")
         return None
-    
-    generator_module = import_module(asm_generator, "asm_gen.__init__")
+    return import_module(asm_generator, "asm_gen.__init__")
 
-    out = generator_module.generate(src, ast)
+def gen_asm(src, program, target: str | None, out, stats=None, jobs=1) -> bool:
     
+    if target is None:
+        target = f"{sys.platform}-{platform.machine()}"
+
+    generator_module = generator(target)
+    if generator_module is None:
+        print(f"No assembly generator for {target}")
+        return False
+
+    return generator_module.generate(src, program, out, stats, jobs)
     
 
 
+def gen_obj(src, program, target: str | None, out, stats=None, jobs=1) -> bool:
+    if target is None:
+        target = f"{sys.platform}-{platform.machine()}"
+
+    generator_module = generator(target)
+    if generator_module is None:
+        print(f"No assembly generator for {target}")
+        return False
+
+    if not hasattr(generator_module, "generate_object"):
+        print(f"{target} can't write object files, generate assembly and assemble it instead")
+        return False
+    return generator_module.generate_object(src, program, out, stats, jobs)
@@ -0,0 +1,387 @@
+import math
+import subprocess
+
+import ir.core as ir
+from ir.core import OpEnum
+from ir.program import is_int
+from ir.vm import wrap_int
+from asm_gen import parallel
+
+# Emits portable C99 for the program, it can then be built with the system C compiler.
+# Integer operands get converted to the type of the result and the arithmetic is done on
+# uint64_t and converted back, so fixed width integers wrap the same way as in ir.vm instead of
+# being undefined behaviour. Shift counts get checked so counts of 64 or more and negative ones
+# shift every bit out, and division goes through ml_div() and friends unless the divisor is a
+# constant other than 0 and -1: dividing by zero raises SIGFPE and INT64_MIN / -1 wraps around.
+# Shifting a negative value right relies on the compiler shifting it arithmetically, which gcc
+# and clang do.
+#
+# names get prefixed so they never collide with C or libc names:
+#   ml_<global>  ml_<function>  v_<local>  t<uid>  ml_<struct>  m_<member>
+#
+# The functions get generated by asm_gen.parallel, every process collects the types first so
+# they all name the slice types the same.
+
+_HEADER: str = '''\
+/* generated by mylang from module {name} */
+#include <signal.h>
+#include <stdint.h>
+#include <stdlib.h>
+
+static void ml_trap(void) {{ raise(SIGFPE); abort(); }}
+static inline int64_t ml_div(int64_t a, int64_t b) {{
+    if (b == 0) ml_trap();
+    return b == -1 ? (int64_t)(0 - (uint64_t)a) : a / b;
+}}
+static inline int64_t ml_mod(int64_t a, int64_t b) {{
+    if (b == 0) ml_trap();
+    return b == -1 ? 0 : a % b;
+}}
+static inline uint64_t ml_udiv(uint64_t a, uint64_t b) {{
+    if (b == 0) ml_trap();
+    return a / b;
+}}
+static inline uint64_t ml_umod(uint64_t a, uint64_t b) {{
+    if (b == 0) ml_trap();
+    return a % b;
+}}
+
+'''
+
+_OPERATORS: dict = {
+    OpEnum.BIN_ADD: "+",
+    OpEnum.BIN_SUB: "-",
+    OpEnum.BIN_MUL: "*",
+    OpEnum.BIN_DIV: "/",
+    OpEnum.BIN_MOD: "%",
+    OpEnum.BIN_AND: "&",
+    OpEnum.BIN_OR: "|",
+    OpEnum.BIN_XOR: "^",
+    OpEnum.BIN_SHL: "<<",
+    OpEnum.BIN_SHR: ">>",
+}
+
+# operations which have to be done on unsigned integers to wrap around
+_WRAPPING: tuple = (OpEnum.BIN_ADD, OpEnum.BIN_SUB, OpEnum.BIN_MUL)
+
+
+def func_name(name):
+    return "ml_" + name.replace(".", "__")
+
+
+def member_name(name):
+    return "m_" + name
+
+
+def c_string(val: bytes):
+    s = '"'
+    for ch in val:
+        if ch in (ord('"'), ord('\\')):
+            s += '\\' + chr(ch)
+        elif 0x20 <= ch < 0x7f and ch != ord('?'):
+            s += chr(ch)
+        else:
+            s += f"\\{ch:03o}"
+    return s + '"'
+
+
+def c_int(val, typ):
+    bits = typ.bit_length or 64
+    if isinstance(typ, ir.UintType):
+        return f"UINT{bits}_C({val})" if bits == 64 else f"(uint{bits}_t){val}u"
+    elif val == -(1 << 63):
+        return "INT64_MIN"
+    return f"INT{bits}_C({val})" if bits == 64 else f"(int{bits}_t){val}"
+
+
+def c_float(val):
+    # inf and nan have no literals without math.h
+    if math.isnan(val):
+        return "(0.0 / 0.0)"
+    elif math.isinf(val):
+        return "(1.0 / 0.0)" if val > 0 else "(-1.0 / 0.0)"
+    return repr(val)
+
+
+class CGenerator:
+    __slots__ = "program", "func", "lines", "types", "defined", "slices"
+    def __init__(self, program):
+        self.program = program
+        self.func = None
+        self.lines = None
+        self.types = list() # type definitions in the order they are needed
+        self.defined = set()
+        self.slices = dict() # slice type str -> name
+
+    def emit(self, line):
+        self.lines.append("    " + line)
+
+    def type_of(self, val):
+        return self.program.type_of(self.func, val)
+
+    def ctype(self, typ, name=""):
+        sep = " " if name else ""
+        match typ:
+            case ir.IntType():
+                return f"int{typ.bit_length}_t{sep}{name}"
+            case ir.UintType():
+                return f"uint{typ.bit_length}_t{sep}{name}"
+            case ir.FloatType():
+                return f"{'double' if typ.bit_length == 64 else 'float'}{sep}{name}"
+            case ir.BoolType():
+                return f"uint8_t{sep}{name}"
+            case ir.VoidType() | None:
+                return f"void{sep}{name}"
+            case ir.PointerType():
+                return self.ctype(typ.to, "*" + name)
+            case ir.StructType():
+                self.define(typ)
+                return f"ml_{typ.name}{sep}{name}"
+            case ir.SliceType():
+                return f"{self.slice_type(typ)}{sep}{name}"
+            case _:
+                raise NotImplementedError(typ)
+
+    def slice_type(self, typ):
+        # sized slices are arrays wrapped in a struct so they get copied like the other backends do,
+        # unsized ones are a pointer and a length
+        key = str(typ)
+        name = self.slices.get(key)
+        if name is not None:
+            return name
+
+        elem = self.ctype(typ.type).replace(" ", "").replace("*", "p")
+        if typ.len is None:
+            name = f"ml_slice_{elem}"
+            body = f"{self.ctype(typ.type, '*data')}; uint64_t len;"
+        else:
+            name = f"ml_arr_{elem}_{typ.len}"
+            body = f"{self.ctype(typ.type, f'data[{typ.len}]')};"
+
+        self.slices[key] = name
+        self.types.append(f"typedef struct {{ {body} }} {name};")
+        return name
+
+    def define(self, struct):
+        if struct in self.defined:
+            return
+        self.defined.add(struct)
+
+        members = " ".join(f"{self.ctype(typ, member_name(name))};" for name, typ in struct.members)
+        self.types.append(f"struct ml_{struct.name} {{ {members or 'uint8_t empty;'} }};")
+
+    def operand(self, val):
+        match val:
+            case int():
+                return f"t{val}"
+            case ir.Constant(const=bytes()):
+                return c_string(val.const)
+            case ir.Constant(const=float()):
+                return c_float(val.const)
+            case ir.Constant():
+                return c_int(val.const, val.type)
+            case str() if val in self.func.locals:
+                return f"v_{val}"
+            case str():
+                return func_name(val)
+
+    def convert(self, val, typ):
+        src_typ = self.type_of(val)
+
+        if isinstance(val, ir.Constant) and is_int(src_typ) and is_int(typ):
+            return c_int(wrap_int(val.const, typ), typ)
+        elif isinstance(val, ir.Constant) and isinstance(typ, ir.SliceType):
+            if typ.len is None:
+                return f"({self.ctype(typ)}){{ (uint8_t *){self.operand(val)}, {len(val.const)} }}"
+            return f"({self.ctype(typ)}){{ {self.operand(val)} }}"
+        elif isinstance(typ, ir.SliceType) and isinstance(src_typ, ir.SliceType) \
+            and typ.len is None and src_typ.len is not None:
+            return f"({self.ctype(typ)}){{ {self.operand(val)}.data, {src_typ.len} }}"
+        elif src_typ != typ and (is_int(typ) or isinstance(typ, ir.FloatType)):
+            return f"({self.ctype(typ)}){self.operand(val)}"
+        return self.operand(val)
+
+    def instr(self, instr):
+        op, _, _, *operands = instr
+
+        match op:
+            case OpEnum.VAR_DECL:
+                name, typ, val = operands
+                target = self.operand(name)
+                if val is None:
+                    expr = "{0}" if isinstance(typ, (ir.StructType, ir.SliceType)) else "0"
+                    if self.func is self.program.init:
+                        return # globals are zero initialised already
+                else:
+                    expr = self.convert(val, typ)
+
+                if self.func is self.program.init:
+                    self.emit(f"{target} = {expr};")
+                else:
+                    self.emit(f"{self.ctype(typ, target)} = {expr};")
+
+            case OpEnum.ASSIGN:
+                name, val = operands
+                self.emit(f"{self.operand(name)} = {self.convert(val, self.type_of(name))};")
+
+            case OpEnum.MEMBER_ACCESS:
+                ret, obj, member = operands
+                self.emit(f"{self.ctype(self.func.types[ret], f't{ret}')} = {self.operand(obj)}.{member_name(member)};")
+
+            case OpEnum.MEMBER_ASSIGN:
+                obj, member, val = operands
+                typ = self.type_of(obj).member(member)
+                self.emit(f"{self.operand(obj)}.{member_name(member)} = {self.convert(val, typ)};")
+
+            case OpEnum.SLICE_INDEXING:
+                ret, slice_, idx = operands
+                self.emit(f"{self.ctype(self.func.types[ret], f't{ret}')} = "
+                    f"{self.operand(slice_)}.data[{self.operand(idx)}];")
+
+            case OpEnum.FUNC_CALL:
+                ret, callee, args = operands
+                callee_func = self.program.callee(callee)
+                args = ", ".join(self.convert(arg, typ) for arg, (_, typ) in zip(args, callee_func.args))
+                call = f"{func_name(callee_func.name)}({args})"
+                if isinstance(callee_func.ret, ir.VoidType):
+                    self.emit(f"{call};")
+                else:
+                    self.emit(f"{self.ctype(callee_func.ret, f't{ret}')} = {call};")
+
+            case OpEnum.RETURN_STMT:
+                val, = operands
+                self.emit(f"return {self.convert(val, self.func.ret)};")
+
+            case OpEnum.UNARY_NEG | OpEnum.UNARY_NOT:
+                ret, expr = operands
+                typ = self.func.types[ret]
+                sign = "-" if op == OpEnum.UNARY_NEG else "~"
+                if is_int(typ):
+                    expr = f"({self.ctype(typ)})({sign}(uint64_t){self.operand(expr)})"
+                else:
+                    expr = f"{sign}{self.operand(expr)}"
+                self.emit(f"{self.ctype(typ, f't{ret}')} = {expr};")
+
+            case OpEnum.NOP:
+                pass
+
+            case _:
+                ret, lhs, rhs = operands
+                typ = self.func.types[ret]
+                if is_int(typ):
+                    expr = f"({self.ctype(typ)})({self.integer(op, typ, lhs, rhs)})"
+                else:
+                    expr = f"{self.convert(lhs, typ)} {_OPERATORS[op]} {self.convert(rhs, typ)}"
+                self.emit(f"{self.ctype(typ, f't{ret}')} = {expr};")
+
+    def integer(self, op, typ, lhs, rhs):
+        """expression of an integer operation with the semantics of ir.vm, before it gets
+        converted to typ"""
+        count = wrap_int(rhs.const, typ) if isinstance(rhs, ir.Constant) else None
+        signed = isinstance(typ, ir.IntType)
+        lhs, rhs = self.convert(lhs, typ), self.convert(rhs, typ)
+        if op in _WRAPPING:
+            return f"(uint64_t){lhs} {_OPERATORS[op]} (uint64_t){rhs}"
+
+        if op in (OpEnum.BIN_DIV, OpEnum.BIN_MOD):
+            if count is not None and count != 0 and not (signed and count == -1):
+                return f"{lhs} {_OPERATORS[op]} {rhs}"
+            name = ("ml_div" if op == OpEnum.BIN_DIV else "ml_mod") if signed \
+                else ("ml_udiv" if op == OpEnum.BIN_DIV else "ml_umod")
+            return f"{name}({lhs}, {rhs})"
+
+        if op == OpEnum.BIN_SHL:
+            if count is not None:
+                return f"(uint64_t){lhs} << {count}" if 0 <= count < 64 else "0"
+            return f"(uint64_t){rhs} < 64 ? (uint64_t){lhs} << {rhs} : 0"
+        elif op == OpEnum.BIN_SHR and signed:
+            # shifting by 63 gives the sign in every bit
+            if count is not None:
+                return f"(int64_t){lhs} >> {count if 0 <= count < 64 else 63}"
+            return f"(int64_t){lhs} >> ((uint64_t){rhs} < 64 ? {rhs} : 63)"
+        elif op == OpEnum.BIN_SHR:
+            if count is not None:
+                return f"(uint64_t){lhs} >> {count}" if 0 <= count < 64 else "0"
+            return f"(uint64_t){rhs} < 64 ? (uint64_t){lhs} >> {rhs} : 0"
+        return f"{lhs} {_OPERATORS[op]} {rhs}"
+
+    def signature(self, func, name=None):
+        name = func_name(func.name) if name is None else name
+        args = ", ".join(self.ctype(typ, f"v_{arg}") for arg, typ in func.args) or "void"
+        return self.ctype(func.ret, f"{name}({args})")
+
+    def function(self, func, name=None):
+        self.func = func
+        self.lines = list()
+        for instr in func.body:
+            self.instr(instr)
+
+        return f"{self.signature(func, name)} {{\n" + "\n".join(self.lines) + "\n}\n"
+
+    def collect_types(self, func):
+        # every type a function uses has to be defined before the first function gets written
+        for typ in (func.ret, *func.locals.values(), *func.types.values()):
+            if typ is not None and not isinstance(typ, ir.FuncType):
+                self.ctype(typ)
+
+    def prepare(self):
+        for struct in self.program.structs.values():
+            self.define(struct)
+        for typ in self.program.globals.values():
+            if not isinstance(typ, ir.FuncType):
+                self.ctype(typ)
+        for func in (*self.program.functions.values(), self.program.init):
+            self.collect_types(func)
+
+    def generate(self, out, jobs=1):
+        program = self.program
+        self.prepare()
+
+        out.write(_HEADER.format(name=program.name))
+        for struct in program.structs.values():
+            out.write(f"typedef struct ml_{struct.name} ml_{struct.name};\n")
+        out.write("\n".join(self.types) + "\n\n")
+
+        globals_ = [f"static {self.ctype(typ, func_name(name))};" for name, typ in program.globals.items()]
+        out.write("\n".join(globals_) + "\n\n")
+        prototypes = [f"{self.signature(func)};" for func in (*program.functions.values(),
+            *program.externs.values())]
+        out.write("\n".join(prototypes) + "\n\n")
+
+        # functions get written one by one as they come in so only a few of them are ever held in memory
+        results = parallel.map_functions(program, _generator, _function, jobs)
+        for func in program.functions.values():
+            out.write(next(results) + "\n")
+        # a module without main gets initialized before the main of the program like on the native targets
+        out.write(("static " if "main" in program.functions else "static __attribute__((constructor)) ")
+            + next(results) + "\n")
+
+        if "main" in program.functions:
+            ret = program.functions["main"].ret
+            call = "ml_main(argc, (uint8_t **)argv)"
+            out.write("int main(int argc, char **argv) {\n    ml__init();\n")
+            out.write(f"    {call};\n    return 0;\n}}\n" if isinstance(ret, ir.VoidType)
+                else f"    return (int){call};\n}}\n")
+
+        return True
+
+
+def _generator(program):
+    gen = CGenerator(program)
+    gen.prepare()
+    return gen
+
+
+def _function(gen, func):
+    # runs in the asm_gen.parallel workers
+    return gen.function(func, "ml__init" if func is gen.program.init else None)
+
+
+def generate(src, program, out, stats=None, jobs=1) -> bool:
+    return CGenerator(program).generate(out, jobs)
+
+
+def build(c_file, exe_file, cc="cc", flags=("-O2",)):
+    """Builds an executable with the system C compiler, returns the exit code of the compiler"""
+    return subprocess.run([cc, *flags, "-o", exe_file, c_file]).returncode
+
@@ -0,0 +1,196 @@
+import struct
+
+# Relocatable ELF64 (little endian) object files for the native backends, so they don't need an
+# external assembler.
+#
+# A backend adds its sections, appends the encoded code and data to them and defines the symbols
+# and relocations they need, write() lays it all out. Symbols are referred to by name, names that
+# get referenced but never defined end up as undefined global symbols for the linker to resolve.
+# Local symbols starting with .L stay out of the symbol table like with the assembler, relocations
+# against them go against their section instead.
+#
+#   obj = elf.Object(elf.EM_X86_64)
+#   text = obj.section(".text", elf.SHT_PROGBITS, elf.SHF_ALLOC | elf.SHF_EXECINSTR, 16)
+#   obj.define("ml_main", text, len(text.data), bind=elf.STB_GLOBAL, type=elf.STT_FUNC)
+#   text.data += code
+#   text.reloc(offset, "ml_f", R_X86_64_PLT32, -4)
+#   obj.write(fp)
+
+EM_X86_64: int = 62
+EM_AARCH64: int = 183
+
+SHT_PROGBITS: int = 1
+SHT_SYMTAB: int = 2
+SHT_STRTAB: int = 3
+SHT_RELA: int = 4
+SHT_NOBITS: int = 8
+SHT_INIT_ARRAY: int = 14
+
+SHF_WRITE: int = 0x1
+SHF_ALLOC: int = 0x2
+SHF_EXECINSTR: int = 0x4
+SHF_INFO_LINK: int = 0x40
+
+STB_LOCAL: int = 0
+STB_GLOBAL: int = 1
+
+STT_NOTYPE: int = 0
+STT_OBJECT: int = 1
+STT_FUNC: int = 2
+STT_SECTION: int = 3
+
+_EHDR: struct.Struct = struct.Struct("<16sHHIQQQIHHHHHH")
+_SHDR: struct.Struct = struct.Struct("<IIQQQQIIQQ")
+_SYM: struct.Struct = struct.Struct("<IBBHQQ")
+_RELA: struct.Struct = struct.Struct("<QQq")
+
+# the data directives the backends put into .rodata, (struct format, size)
+_DIRECTIVES: dict = {
+    ".byte": ("<B", 1),
+    ".short": ("<H", 2),
+    ".hword": ("<H", 2),
+    ".long": ("<I", 4),
+    ".word": ("<I", 4),
+    ".quad": ("<Q", 8),
+    ".xword": ("<Q", 8),
+}
+
+
+def directive_bytes(directive) -> bytes:
+    """the bytes of a data directive like `.quad 4607182418800017408` or `.byte 104, 105`"""
+    name, _, values = directive.partition(" ")
+    fmt, size = _DIRECTIVES[name]
+    return b"".join(struct.pack(fmt, int(val, 0) & ((1 << size * 8) - 1))
+        for val in values.split(","))
+
+
+class Section:
+    __slots__ = "name", "type", "flags", "align", "data", "size", "relocs"
+    def __init__(self, name, type, flags, align):
+        self.name = name
+        self.type = type
+        self.flags = flags
+        self.align = align
+        self.data = bytearray()
+        self.size = 0 # of SHT_NOBITS sections, which have no data
+        self.relocs = list() # (offset, symbol name, type, addend)
+
+    def offset(self):
+        return self.size if self.type == SHT_NOBITS else len(self.data)
+
+    def align_to(self, align, fill=b"\0"):
+        self.align = max(self.align, align)
+        pad = -self.offset() % align
+        if self.type == SHT_NOBITS:
+            self.size += pad
+        else:
+            self.data += fill * pad
+
+    def reloc(self, offset, symbol, type, addend=0):
+        self.relocs.append((offset, symbol, type, addend))
+
+
+class Symbol:
+    __slots__ = "name", "section", "value", "size", "bind", "type"
+    def __init__(self, name, section, value, size, bind, type):
+        self.name = name
+        self.section = section # None for undefined symbols
+        self.value = value
+        self.size = size
+        self.bind = bind
+        self.type = type
+
+
+class Object:
+    __slots__ = "machine", "sections", "symbols"
+    def __init__(self, machine):
+        self.machine = machine
+        self.sections = dict() # name -> Section
+        self.symbols = dict() # name -> Symbol
+
+    def section(self, name, type, flags, align=1):
+        """the section called name, it gets added the first time"""
+        section = self.sections.get(name)
+        if section is None:
+            section = self.sections[name] = Section(name, type, flags, align)
+        return section
+
+    def define(self, name, section, value, size=0, bind=STB_LOCAL, type=STT_NOTYPE):
+        symbol = self.symbols[name] = Symbol(name, section, value, size, bind, type)
+        return symbol
+
+    def write(self, out):
+        """writes the object file to the binary file out"""
+        sections = list(self.sections.values())
+        index = {section.name: i + 1 for i, section in enumerate(sections)}
+
+        strtab = bytearray(b"\0")
+        def string(table, name):
+            pos = len(table)
+            table += name.encode() + b"\0"
+            return pos
+
+        # locals have to come before the globals, every section gets a section symbol for the
+        # relocations against it
+        names = {symbol for section in sections for _, symbol, _, _ in section.relocs}
+        undefined = sorted(name for name in names if name not in self.symbols)
+        symbols = [*(Symbol("", section, 0, 0, STB_LOCAL, STT_SECTION) for section in sections),
+            *(symbol for symbol in self.symbols.values()
+                if symbol.bind == STB_LOCAL and not symbol.name.startswith(".L"))]
+        first_global = len(symbols) + 1
+        symbols += [symbol for symbol in self.symbols.values() if symbol.bind != STB_LOCAL]
+        symbols += [Symbol(name, None, 0, 0, STB_GLOBAL, STT_NOTYPE) for name in undefined]
+        sym_index = {symbol.name: i + 1 for i, symbol in enumerate(symbols) if symbol.name}
+
+        symtab = bytearray(_SYM.size)
+        for symbol in symbols:
+            shndx = 0 if symbol.section is None else index[symbol.section.name]
+            symtab += _SYM.pack(string(strtab, symbol.name) if symbol.name else 0,
+                symbol.bind << 4 | symbol.type, 0, shndx, symbol.value, symbol.size)
+
+        # (name, type, flags, data, size, link, info, align, entsize) of every section header
+        headers = [(section.name, section.type, section.flags, section.data, section.size, 0, 0,
+            section.align, 0) for section in sections]
+        symtab_index = len(sections) + sum(1 for section in sections if section.relocs) + 1
+        for section in sections:
+            if section.relocs:
+                rela = bytearray()
+                for offset, name, type, addend in section.relocs:
+                    symbol = self.symbols.get(name)
+                    if symbol is not None and name.startswith(".L"):
+                        num = index[symbol.section.name]
+                        addend += symbol.value
+                    else:
+                        num = sym_index[name]
+                    rela += _RELA.pack(offset, num << 32 | type, addend)
+                headers.append((".rela" + section.name, SHT_RELA, SHF_INFO_LINK, rela, 0,
+                    symtab_index, index[section.name], 8, _RELA.size))
+        headers.append((".symtab", SHT_SYMTAB, 0, symtab, 0, symtab_index + 1, first_global, 8,
+            _SYM.size))
+        headers.append((".strtab", SHT_STRTAB, 0, strtab, 0, 0, 0, 1, 0))
+        shstrtab = bytearray(b"\0")
+        headers.append((".shstrtab", SHT_STRTAB, 0, shstrtab, 0, 0, 0, 1, 0))
+        names = [string(shstrtab, header[0]) for header in headers]
+
+        pos = _EHDR.size
+        table = bytearray(_SHDR.size)
+        body = bytearray()
+        for (_, type, flags, data, size, link, info, align, entsize), name in zip(headers, names):
+            pad = -pos % align
+            body += b"\0" * pad
+            pos += pad
+            if type != SHT_NOBITS:
+                size = len(data)
+            table += _SHDR.pack(name, type, flags, 0, pos, size, link, info, align, entsize)
+            if type != SHT_NOBITS:
+                body += data
+                pos += len(data)
+        pad = -pos % 8
+        body += b"\0" * pad
+        pos += pad
+
+        ident = b"\x7fELF" + bytes((2, 1, 1, 0)) + b"\0" * 8
+        out.write(_EHDR.pack(ident, 1, self.machine, 1, 0, 0, pos, 0, _EHDR.size, 0, 0,
+            _SHDR.size, len(headers) + 1, len(headers)))
+        out.write(body)
+        out.write(table)
@@ -0,0 +1,238 @@
+import re
+import struct
+
+# Machine code for the instructions asm_gen.linux_aarch64 collects, for writing object files
+# directly. Aliases (mov, mul, asr, sxtw, ...) get the encodings the assembler gives them, so the
+# code is the same as assembling the text output.
+#
+# adrp and the :lo12: add after it get the page and page offset relocations, bl and b a call or
+# jump relocation, .L labels of the same function (b, cbz and cbnz) get resolved right away. Only the instructions
+# the backend generates are known, anything else raises a ValueError.
+
+R_AARCH64_ABS64: int = 257
+R_AARCH64_ADR_PREL_PG_HI21: int = 275
+R_AARCH64_ADD_ABS_LO12_NC: int = 277
+R_AARCH64_JUMP26: int = 282
+R_AARCH64_CALL26: int = 283
+
+_REG_RE = re.compile(r"([xwds])(\d+)|(xzr|wzr|sp|wsp)")
+_MEM_RE = re.compile(r"\[(\w+)(?:, #(-?\d+))?\](!?)")
+
+# the unscaled (ldur/stur) encodings of the loads and stores by mnemonic and register kind, the
+# scaled ones with an unsigned offset have bit 24 set, (encoding, access size)
+_LOAD_STORE: dict = {
+    ("str", "x"): (0xf8000000, 8), ("ldr", "x"): (0xf8400000, 8),
+    ("str", "w"): (0xb8000000, 4), ("ldr", "w"): (0xb8400000, 4),
+    ("str", "d"): (0xfc000000, 8), ("ldr", "d"): (0xfc400000, 8),
+    ("str", "s"): (0xbc000000, 4), ("ldr", "s"): (0xbc400000, 4),
+    ("strh", "w"): (0x78000000, 2), ("ldrh", "w"): (0x78400000, 2),
+    ("strb", "w"): (0x38000000, 1), ("ldrb", "w"): (0x38400000, 1),
+    ("ldrsw", "x"): (0xb8800000, 4), ("ldrsh", "x"): (0x78800000, 2), ("ldrsb", "x"): (0x38800000, 1),
+}
+
+# register (shifted) forms of the 64-bit data processing instructions, bit 31 cleared for w
+_SHIFTED: dict = {"add": 0x8b000000, "sub": 0xcb000000, "and": 0x8a000000, "orr": 0xaa000000,
+    "eor": 0xca000000}
+_SHIFT_TYPES: dict = {"lsl": 0, "lsr": 1, "asr": 2}
+_TWO_SOURCE: dict = {"sdiv": 0x9ac00c00, "udiv": 0x9ac00800, "lsl": 0x9ac02000, "lsr": 0x9ac02400,
+    "asr": 0x9ac02800}
+
+# double precision, bit 22 cleared for single precision
+# condition codes of csel
+_CONDITIONS: dict = {"eq": 0, "ne": 1, "hs": 2, "lo": 3, "hi": 8, "ls": 9, "ge": 10, "lt": 11,
+    "gt": 12, "le": 13}
+
+_FLOAT_OPS: dict = {"fadd": 0x1e602800, "fsub": 0x1e603800, "fmul": 0x1e600800, "fdiv": 0x1e601800}
+
+# (encoding, destination kind, source kind) of the conversions and moves between register files
+_CONVERT: dict = {
+    ("fmov", "d", "d"): 0x1e604000, ("fmov", "s", "s"): 0x1e204000,
+    ("fmov", "d", "x"): 0x9e670000, ("fmov", "x", "d"): 0x9e660000,
+    ("fmov", "s", "w"): 0x1e270000, ("fmov", "w", "s"): 0x1e260000,
+    ("fneg", "d", "d"): 0x1e614000, ("fneg", "s", "s"): 0x1e214000,
+    ("fcvt", "d", "s"): 0x1e22c000, ("fcvt", "s", "d"): 0x1e624000,
+    ("fcvtzs", "x", "d"): 0x9e780000, ("fcvtzs", "x", "s"): 0x9e380000,
+    ("scvtf", "d", "x"): 0x9e620000, ("scvtf", "s", "x"): 0x9e220000,
+    ("ucvtf", "d", "x"): 0x9e630000, ("ucvtf", "s", "x"): 0x9e230000,
+}
+
+
+def _reg(operand):
+    """(kind, number) of a register, kind is x, w, d or s and sp is x 31 like xzr"""
+    match = _REG_RE.fullmatch(operand)
+    if match is None:
+        return None
+    if match[3] is not None:
+        return match[3][0] if match[3][0] == "w" else "x", 31
+    return match[1], int(match[2])
+
+
+def _imm(operand):
+    return int(operand[1:], 0) if operand.startswith("#") else None
+
+
+class Encoder:
+    __slots__ = "section", "code", "labels", "fixups"
+    def __init__(self, section):
+        self.section = section # elf.Section the code gets appended to
+        self.code = section.data
+        self.labels = dict() # label -> offset of the labels in the current function
+        self.fixups = list() # (offset of the branch, label, bits of the offset, lowest bit)
+
+    def emit(self, word):
+        self.code += struct.pack("<I", word)
+
+    def function(self, instrs):
+        """appends the code of a function, labels are (name + ":",) and local to it"""
+        self.labels = dict()
+        self.fixups = list()
+        for instr in instrs:
+            if instr[0].endswith(":"):
+                self.labels[instr[0][:-1]] = len(self.code)
+            else:
+                self.encode(instr[0], instr[1:])
+
+        for pos, label, bits, low in self.fixups:
+            if label not in self.labels:
+                raise ValueError(f"undefined label {label!r}")
+            word, = struct.unpack_from("<I", self.code, pos)
+            word |= (((self.labels[label] - pos) >> 2) & ((1 << bits) - 1)) << low
+            struct.pack_into("<I", self.code, pos, word)
+
+    def branch(self, word, target, reloc):
+        if target.startswith(".L"):
+            self.fixups.append((len(self.code), target, 26, 0))
+        else:
+            self.section.reloc(len(self.code), target, reloc)
+        self.emit(word)
+
+    def encode(self, op, operands):
+        regs = [_reg(operand) for operand in operands]
+        kinds = "".join(reg[0] if reg is not None else "_" for reg in regs)
+        nums = [reg[1] if reg is not None else None for reg in regs]
+        sf = 0x80000000 if kinds[:1] == "x" else 0
+
+        match op, len(operands):
+            case "ret", 0:
+                self.emit(0xd65f03c0)
+            case "bl", 1:
+                self.branch(0x94000000, operands[0], R_AARCH64_CALL26)
+            case "b", 1:
+                self.branch(0x14000000, operands[0], R_AARCH64_JUMP26)
+            case "cbz" | "cbnz", 2:
+                self.fixups.append((len(self.code), operands[1], 19, 5))
+                self.emit(sf | (0x34000000 if op == "cbz" else 0x35000000) | nums[0])
+            case "brk", 1:
+                self.emit(0xd4200000 | _imm(operands[0]) << 5)
+            case "cmp", 2 if kinds[1] == "_":
+                self.emit(sf | 0x7100001f | _imm(operands[1]) << 10 | nums[0] << 5)
+            case "csel", 4:
+                self.emit(sf | 0x1a800000 | nums[2] << 16 | _CONDITIONS[operands[3]] << 12
+                    | nums[1] << 5 | nums[0])
+            case "adrp", 2:
+                self.section.reloc(len(self.code), operands[1], R_AARCH64_ADR_PREL_PG_HI21)
+                self.emit(0x90000000 | nums[0])
+
+            case "movz" | "movk", 3:
+                imm, shift = _imm(operands[1]), _imm(operands[2].split()[1])
+                self.emit(sf | (0x52800000 if op == "movz" else 0x72800000) | (shift // 16) << 21
+                    | imm << 5 | nums[0])
+            case "mov", 2 if kinds[1] == "_":
+                # only mov Xd, #0 gets generated, wider immediates go through movz
+                self.encode("movz", (operands[0], operands[1], "lsl #0"))
+            case "mov", 2 if "sp" in operands:
+                self.emit(sf | 0x11000000 | nums[1] << 5 | nums[0])
+            case "mov", 2:
+                self.emit(sf | 0x2a0003e0 | nums[1] << 16 | nums[0])
+
+            case "add" | "sub", 3 if operands[2].startswith(":lo12:"):
+                self.section.reloc(len(self.code), operands[2][6:], R_AARCH64_ADD_ABS_LO12_NC)
+                self.emit(sf | 0x11000000 | nums[1] << 5 | nums[0])
+            case "add" | "sub", 3 if kinds[2] == "_":
+                self.emit(sf | (0x11000000 if op == "add" else 0x51000000) | _imm(operands[2]) << 10
+                    | nums[1] << 5 | nums[0])
+            case "add" | "sub", 3 if "sp" in operands[:2]:
+                # the extended register form is the one which can use sp, uxtx is lsl
+                self.emit(sf | _SHIFTED[op] | 0x00206000 | nums[2] << 16 | nums[1] << 5 | nums[0])
+            case _, 3 | 4 if op in _SHIFTED and kinds[:3] in ("xxx", "www"):
+                shift, amount = 0, 0
+                if len(operands) == 4:
+                    shift_type, amount = operands[3].split()
+                    shift, amount = _SHIFT_TYPES[shift_type], _imm(amount)
+                self.emit(_SHIFTED[op] & 0x7fffffff | sf | shift << 22 | nums[2] << 16
+                    | amount << 10 | nums[1] << 5 | nums[0])
+            case "neg" | "mvn", 2:
+                self.emit(sf | (0x4b0003e0 if op == "neg" else 0x2a2003e0) | nums[1] << 16 | nums[0])
+
+            case "mul", 3:
+                self.emit(sf | 0x1b007c00 | nums[2] << 16 | nums[1] << 5 | nums[0])
+            case "madd" | "msub", 4:
+                self.emit(sf | (0x1b000000 if op == "madd" else 0x1b008000) | nums[2] << 16
+                    | nums[3] << 10 | nums[1] << 5 | nums[0])
+            case _, 3 if op in _TWO_SOURCE and kinds[2] != "_":
+                self.emit(_TWO_SOURCE[op] & 0x7fffffff | sf | nums[2] << 16 | nums[1] << 5 | nums[0])
+            case "asr" | "lsr" | "lsl", 3:
+                # bitfield moves, lsl #s is ubfm #(-s mod 64), #(63 - s)
+                size = 64 if sf else 32
+                shift = _imm(operands[2])
+                immr, imms = (-shift % size, size - 1 - shift) if op == "lsl" else (shift, size - 1)
+                base = 0x13000000 if op == "asr" else 0x53000000
+                self.emit(sf | (0x00400000 if sf else 0) | base | immr << 16 | imms << 10
+                    | nums[1] << 5 | nums[0])
+            case "sxtb" | "sxth" | "sxtw" | "uxtb" | "uxth", 2:
+                imms = {"b": 7, "h": 15, "w": 31}[op[-1]]
+                base = 0x13000000 if op[0] == "s" else 0x53000000
+                self.emit(sf | (0x00400000 if sf else 0) | base | imms << 10 | nums[1] << 5 | nums[0])
+
+            case "stp" | "ldp", 3 | 4:
+                self.pair(op, nums, operands)
+            case _, 2 if op.startswith(("ld", "st")):
+                self.load_store(op, regs[0], operands[1])
+
+            case _, 3 if op in _FLOAT_OPS:
+                self.emit(_FLOAT_OPS[op] & ~(0 if kinds[0] == "d" else 0x00400000) | nums[2] << 16
+                    | nums[1] << 5 | nums[0])
+            case _, 2 if (op, kinds[0], kinds[1]) in _CONVERT:
+                self.emit(_CONVERT[op, kinds[0], kinds[1]] | nums[1] << 5 | nums[0])
+
+            case _:
+                raise ValueError(f"can't encode {op} {', '.join(operands)}")
+
+    def load_store(self, op, reg, address):
+        kind, num = reg
+        match = _MEM_RE.fullmatch(address)
+        if match is None or match[3]:
+            raise ValueError(f"can't encode {op} {address}")
+        base = _reg(match[1])[1]
+        offset = int(match[2] or 0)
+
+        unscaled = op.startswith(("ldur", "stur"))
+        if unscaled:
+            op = op.replace("ldur", "ldr").replace("stur", "str")
+        word, size = _LOAD_STORE[op, kind]
+        if not unscaled and offset >= 0 and offset % size == 0 and offset // size < 4096:
+            self.emit(word | 0x01000000 | (offset // size) << 10 | base << 5 | num)
+        elif -256 <= offset < 256:
+            self.emit(word | (offset & 0x1ff) << 12 | base << 5 | num)
+        else:
+            raise ValueError(f"can't encode {op} {address}")
+
+    def pair(self, op, nums, operands):
+        # stp x29, x30, [sp, #-16]! and ldp x29, x30, [sp], #16
+        match = _MEM_RE.fullmatch(operands[2])
+        base = _reg(match[1])[1]
+        if len(operands) == 4:
+            word, offset = 0xa8800000, _imm(operands[3]) # post-index
+        elif match[3]:
+            word, offset = 0xa9800000, int(match[2]) # pre-index
+        else:
+            word, offset = 0xa9000000, int(match[2] or 0)
+        if op == "ldp":
+            word |= 0x00400000
+        self.emit(word | ((offset // 8) & 0x7f) << 15 | nums[1] << 10 | base << 5 | nums[0])
+
+
+def init_array(section, symbol):
+    """an entry of .init_array calling symbol"""
+    section.reloc(len(section.data), symbol, R_AARCH64_ABS64)
+    section.data += b"\0" * 8
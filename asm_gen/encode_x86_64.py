@@ -0,0 +1,283 @@
+import struct
+
+# Machine code for the instructions asm_gen.linux_x86_64 collects, for writing object files
+# directly. It picks the same encodings as the GNU assembler (shortest displacements and
+# immediates, the register to register forms of mov and the ALU ops with the source in the reg
+# field) so the code is the same as assembling the text output.
+#
+# Symbols get a relocation, calls and jumps go through the PLT like the assembler does it and
+# everything else is %rip relative. Jumps to .L labels of the same function get resolved right
+# away. Only the instructions the backend generates are known, anything else raises a ValueError.
+
+R_X86_64_64: int = 1
+R_X86_64_PC32: int = 2
+R_X86_64_PLT32: int = 4
+
+_GPRS: tuple = ("rax", "rcx", "rdx", "rbx", "rsp", "rbp", "rsi", "rdi")
+_REGS: dict = dict()
+for _i, _name in enumerate(_GPRS):
+    _REGS["%" + _name] = (_i, 8)
+    _REGS["%e" + _name[1:]] = (_i, 4)
+    _REGS["%" + _name[1:]] = (_i, 2)
+for _i, _name in enumerate(("al", "cl", "dl", "bl", "spl", "bpl", "sil", "dil")):
+    _REGS["%" + _name] = (_i, 1)
+for _i in range(8, 16):
+    _REGS[f"%r{_i}"] = (_i, 8)
+    _REGS[f"%r{_i}d"] = (_i, 4)
+    _REGS[f"%r{_i}w"] = (_i, 2)
+    _REGS[f"%r{_i}b"] = (_i, 1)
+for _i in range(16):
+    _REGS[f"%xmm{_i}"] = (_i, 16)
+
+
+# opcode of reg -> r/m, r/m -> reg, the /n of the immediate forms and the short %rax, imm32 form
+_ALU: dict = {
+    "add": (0x01, 0x03, 0, 0x05),
+    "or": (0x09, 0x0b, 1, 0x0d),
+    "and": (0x21, 0x23, 4, 0x25),
+    "sub": (0x29, 0x2b, 5, 0x2d),
+    "xor": (0x31, 0x33, 6, 0x35),
+    "cmp": (0x39, 0x3b, 7, 0x3d),
+}
+
+_SHIFTS: dict = {"shl": 4, "shr": 5, "sar": 7}
+
+# second opcode byte of the conditional moves, 0x0f first
+_CMOV: dict = {"cmovaeq": 0x43, "cmoveq": 0x44, "cmovaq": 0x47}
+
+# (mandatory prefix, opcode) of the scalar sse instructions, all r/m -> reg
+_SSE: dict = {
+    "addsd": (0xf2, 0x58), "subsd": (0xf2, 0x5c), "mulsd": (0xf2, 0x59), "divsd": (0xf2, 0x5e),
+    "addss": (0xf3, 0x58), "subss": (0xf3, 0x5c), "mulss": (0xf3, 0x59), "divss": (0xf3, 0x5e),
+    "cvtsd2ss": (0xf2, 0x5a), "cvtss2sd": (0xf3, 0x5a),
+    "xorps": (None, 0x57), "xorpd": (0x66, 0x57),
+}
+
+# the sign and zero extending moves, (opcode bytes, source size)
+_EXTEND: dict = {
+    "movsbq": (b"\x0f\xbe", 1), "movswq": (b"\x0f\xbf", 2), "movslq": (b"\x63", 4),
+    "movzbq": (b"\x0f\xb6", 1), "movzwq": (b"\x0f\xb7", 2),
+}
+
+_SIZES: dict = {"b": 1, "w": 2, "l": 4, "q": 8}
+
+
+def _operand(val):
+    """("reg", number, size) with size 16 for xmm registers, ("imm", value),
+    ("mem", base, index, scale, disp, symbol) or ("sym", name)"""
+    if not isinstance(val, str): # linux_x86_64.Location
+        if not val.base.startswith("%"):
+            return ("mem", None, None, 1, val.disp, val.base)
+        index = None if val.index is None else _REGS[val.index][0]
+        return ("mem", _REGS[val.base][0], index, val.scale, val.disp, None)
+    if val.startswith("%"):
+        return ("reg", *_REGS[val])
+    if val.startswith("$"):
+        return ("imm", int(val[1:], 0))
+    return ("sym", val)
+
+
+def _fits8(val):
+    return -128 <= val < 128
+
+
+class Encoder:
+    __slots__ = "section", "code", "labels", "fixups"
+    def __init__(self, section):
+        self.section = section # elf.Section the code gets appended to
+        self.code = section.data
+        self.labels = dict() # label -> offset of the labels in the current function
+        self.fixups = list() # (offset of rel32, label)
+
+    def instr(self, prefix, rex_w, opcode, reg, rm, imm=b"", byte_regs=()):
+        """appends an instruction with a ModRM byte, reg is the number in the reg field and rm
+        an operand from _operand(), byte_regs are the 8-bit registers it uses"""
+        rex = 0x48 if rex_w else 0x40
+        if reg > 7:
+            rex |= 0x04
+        if rm[0] == "reg":
+            rex |= 0x01 if rm[1] > 7 else 0
+        elif rm[0] == "mem":
+            if rm[1] is not None and rm[1] > 7:
+                rex |= 0x01
+            if rm[2] is not None and rm[2] > 7:
+                rex |= 0x02
+        # spl, bpl, sil and dil only exist with a REX prefix
+        needs_rex = rex != 0x40 or any(4 <= num < 8 for num in byte_regs)
+
+        code = self.code
+        if prefix is not None:
+            code.append(prefix)
+        if needs_rex:
+            code.append(rex)
+        code += opcode
+
+        if rm[0] == "reg":
+            code.append(0xc0 | (reg & 7) << 3 | (rm[1] & 7))
+            code += imm
+            return
+
+        _, base, index, scale, disp, symbol = rm
+        if base is None:
+            # %rip relative, the displacement is relative to the end of the instruction
+            code.append((reg & 7) << 3 | 0x05)
+            self.section.reloc(len(code), symbol, R_X86_64_PC32, disp - 4 - len(imm))
+            code += b"\0\0\0\0"
+            code += imm
+            return
+
+        if disp == 0 and base & 7 != 5:
+            mod, disp_bytes = 0x00, b""
+        elif _fits8(disp):
+            mod, disp_bytes = 0x40, struct.pack("<b", disp)
+        else:
+            mod, disp_bytes = 0x80, struct.pack("<i", disp)
+        if index is not None:
+            code.append(mod | (reg & 7) << 3 | 0x04)
+            code.append((scale.bit_length() - 1) << 6 | (index & 7) << 3 | (base & 7))
+        elif base & 7 == 4:
+            code.append(mod | (reg & 7) << 3 | 0x04)
+            code.append(0x24)
+        else:
+            code.append(mod | (reg & 7) << 3 | (base & 7))
+        code += disp_bytes
+        code += imm
+
+    def branch(self, opcode, target):
+        code = self.code
+        code += opcode
+        if target.startswith(".L"):
+            self.fixups.append((len(code), target))
+        else:
+            self.section.reloc(len(code), target, R_X86_64_PLT32, -4)
+        code += b"\0\0\0\0"
+
+    def function(self, instrs):
+        """appends the code of a function, labels are (name + ":",) and local to it"""
+        self.labels = dict()
+        self.fixups = list()
+        for instr in instrs:
+            if instr[0].endswith(":"):
+                self.labels[instr[0][:-1]] = len(self.code)
+            else:
+                self.encode(instr[0], [_operand(val) for val in instr[1:]])
+
+        for pos, label in self.fixups:
+            if label not in self.labels:
+                raise ValueError(f"undefined label {label!r}")
+            self.code[pos : pos + 4] = struct.pack("<i", self.labels[label] - pos - 4)
+
+    def encode(self, op, operands):
+        code = self.code
+        match op, operands:
+            case ("ret" | "leave" | "cqto", []):
+                code += {"ret": b"\xc3", "leave": b"\xc9", "cqto": b"\x48\x99"}[op]
+            case ("pushq", [("reg", num, 8)]):
+                if num > 7:
+                    code.append(0x41)
+                code.append(0x50 | (num & 7))
+            case ("call", [("sym", target)]):
+                self.branch(b"\xe8", target)
+            case ("jmp", [("sym", target)]):
+                self.branch(b"\xe9", target)
+
+            case ("movabsq", [("imm", val), ("reg", num, 8)]):
+                code.append(0x49 if num > 7 else 0x48)
+                code.append(0xb8 | (num & 7))
+                code += struct.pack("<Q", val & ((1 << 64) - 1))
+            case ("movq", [("reg", src, 16), ("reg", dst, 16)]):
+                self.instr(0xf3, False, b"\x0f\x7e", dst, operands[0])
+            case ("movq", [("reg", _, 16), ("mem", *_)]):
+                self.instr(0x66, False, b"\x0f\xd6", operands[0][1], operands[1])
+            case ("movq", [("mem", *_), ("reg", dst, 16)]):
+                self.instr(0xf3, False, b"\x0f\x7e", dst, operands[0])
+            case ("movq", [("reg", src, 16), ("reg", _, 8)]):
+                self.instr(0x66, True, b"\x0f\x7e", src, operands[1])
+            case ("movq", [("reg" | "mem", *_), ("reg", dst, 16)]):
+                self.instr(0x66, True, b"\x0f\x6e", dst, operands[0])
+            case ("movb" | "movw" | "movl" | "movq", [src, dst]):
+                self.mov(_SIZES[op[-1]], src, dst)
+            case (_, [src, ("reg", dst, 8)]) if op in _EXTEND:
+                opcode, size = _EXTEND[op]
+                self.instr(None, True, opcode, dst, src, byte_regs=(src[1],) if size == 1 and src[0] == "reg" else ())
+            case ("leaq", [("mem", *_), ("reg", dst, 8)]):
+                self.instr(None, True, b"\x8d", dst, operands[0])
+
+            case (_, [src, dst]) if op[:-1] in _ALU and op[-1] in "lq":
+                self.alu(op[:-1], op[-1] == "q", src, dst)
+            case ("imulq", [("imm", val), ("reg", dst, 8)]):
+                self.imul(val, operands[1], dst)
+            case ("imulq", [("imm", val), src, ("reg", dst, 8)]):
+                self.imul(val, src, dst)
+            case ("imulq", [src, ("reg", dst, 8)]):
+                self.instr(None, True, b"\x0f\xaf", dst, src)
+            case (_, [("reg", 1, 1), dst]) if op[:-1] in _SHIFTS:
+                self.instr(None, True, b"\xd3", _SHIFTS[op[:-1]], dst)
+            case (_, [("imm", 1), dst]) if op[:-1] in _SHIFTS:
+                self.instr(None, True, b"\xd1", _SHIFTS[op[:-1]], dst)
+            case (_, [("imm", val), dst]) if op[:-1] in _SHIFTS:
+                self.instr(None, True, b"\xc1", _SHIFTS[op[:-1]], dst, bytes((val & 0xff,)))
+            case (_, [src, ("reg", dst, 8)]) if op in _CMOV:
+                self.instr(None, True, bytes((0x0f, _CMOV[op])), dst, src)
+            case ("negq" | "notq" | "idivq" | "divq", [dst]):
+                self.instr(None, True, b"\xf7", {"notq": 2, "negq": 3, "divq": 6, "idivq": 7}[op], dst)
+
+            case ("movsd" | "movss", [("reg", _, 16), ("mem", *_)]):
+                self.instr(0xf2 if op == "movsd" else 0xf3, False, b"\x0f\x11", operands[0][1], operands[1])
+            case ("movsd" | "movss", [src, ("reg", dst, 16)]):
+                self.instr(0xf2 if op == "movsd" else 0xf3, False, b"\x0f\x10", dst, src)
+            case ("movaps", [("reg", _, 16), ("mem", *_)]):
+                self.instr(None, False, b"\x0f\x29", operands[0][1], operands[1])
+            case ("movaps", [src, ("reg", dst, 16)]):
+                self.instr(None, False, b"\x0f\x28", dst, src)
+            case ("cvtsi2sdq" | "cvtsi2ssq", [src, ("reg", dst, 16)]):
+                self.instr(0xf2 if op == "cvtsi2sdq" else 0xf3, True, b"\x0f\x2a", dst, src)
+            case ("cvttsd2siq" | "cvttss2siq", [src, ("reg", dst, 8)]):
+                self.instr(0xf2 if op == "cvttsd2siq" else 0xf3, True, b"\x0f\x2c", dst, src)
+            case (_, [src, ("reg", dst, 16)]) if op in _SSE:
+                prefix, opcode = _SSE[op]
+                self.instr(prefix, False, bytes((0x0f, opcode)), dst, src)
+
+            case _:
+                raise ValueError(f"can't encode {op} {operands}")
+
+    def imul(self, val, src, dst):
+        if _fits8(val):
+            self.instr(None, True, b"\x6b", dst, src, struct.pack("<b", val))
+        else:
+            self.instr(None, True, b"\x69", dst, src, struct.pack("<i", val))
+
+    def mov(self, size, src, dst):
+        prefix = 0x66 if size == 2 else None
+        byte_regs = tuple(val[1] for val in (src, dst) if val[0] == "reg") if size == 1 else ()
+        if src[0] == "imm":
+            if size == 1:
+                self.instr(None, False, b"\xc6", 0, dst, bytes((src[1] & 0xff,)))
+            else:
+                imm = struct.pack("<H" if size == 2 else "<I", src[1] & ((1 << min(size, 4) * 8) - 1))
+                self.instr(prefix, size == 8, b"\xc7", 0, dst, imm)
+        elif src[0] == "reg":
+            self.instr(prefix, size == 8, b"\x88" if size == 1 else b"\x89", src[1], dst, b"", byte_regs)
+        else:
+            self.instr(prefix, size == 8, b"\x8a" if size == 1 else b"\x8b", dst[1], src, b"", byte_regs)
+
+    def alu(self, name, wide, src, dst):
+        to_rm, from_rm, ext, short = _ALU[name]
+        if src[0] == "imm":
+            val = src[1]
+            if _fits8(val):
+                self.instr(None, wide, b"\x83", ext, dst, struct.pack("<b", val))
+            elif dst[0] == "reg" and dst[1] == 0:
+                self.code += bytes((0x48, short) if wide else (short,)) + struct.pack("<i", val)
+            else:
+                self.instr(None, wide, b"\x81", ext, dst, struct.pack("<i", val))
+        elif src[0] == "reg":
+            self.instr(None, wide, bytes((to_rm,)), src[1], dst)
+        else:
+            self.instr(None, wide, bytes((from_rm,)), dst[1], src)
+
+
+def init_array(section, symbol):
+    """an entry of .init_array calling symbol"""
+    section.reloc(len(section.data), symbol, R_X86_64_64)
+    section.data += b"\0" * 8
@@ -1,7 +1,4 @@
-
-from io import StringIO
-
-def generate(src, ast):
+def generate(src, program, out, stats=None, jobs=1) -> bool:
     print("foo arch!")
-    return StringIO("foo!")
-    
+    out.write("foo!")
+    return True
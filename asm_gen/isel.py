@@ -0,0 +1,323 @@
+import ir.core as ir
+from ir.core import OpEnum
+from ir.program import is_int, values
+from ir.vm import wrap_int
+from asm_gen.regalloc import reg_class
+
+# Tree pattern instruction selection for the native backends, bottom up rewriting like BURS.
+#
+# trees() turns the integer arithmetic and the indexing of a function into expression trees. A
+# uid which is used once, by the instruction right after the instructions computing it, becomes a
+# subtree of its user instead of a value of its own, so the instructions of a tree are always
+# next to each other and get computed all at once at the last one (its root). Nothing the
+# register allocator hands out gets written in between, so the values a tree reads are still
+# there when it gets computed.
+#
+# A backend describes its instructions with a table of Rules, nonterminal <- pattern with a
+# cost. A pattern is a nonterminal (a chain rule), a leaf (VAL, CONST, BASE) or a tuple of an
+# operator and the patterns of its operands:
+#
+#   Rule("reg", ("ADD", "reg", ("MUL", "reg", "reg")), 1, madd)
+#
+# label() finds the cheapest way to get every node as every nonterminal bottom up, select() walks
+# the cheapest cover top down and calls emit(sel, node, *operands) of each rule with what the
+# rules of its operands gave back. Patterns of commutative operators match both ways round.
+# Rules can have a cond(gen, node, *operand nodes) saying if they apply, like an immediate
+# which has to fit into the instruction. label() is most of the time of selecting, every pattern
+# gets compiled into a matcher function once and a node only gets the rules whose operators fit
+# the operators of its kids (Patterns.candidates()).
+#
+# Patterns.naive() keeps the rules of one operator on operands in registers, which is what
+# lowering one IR instruction at a time gives, to compare the costs with.
+
+COMMUTATIVE: frozenset = frozenset(("ADD", "MUL", "AND", "OR", "XOR"))
+
+_OPS: dict = {
+    OpEnum.BIN_ADD: "ADD",
+    OpEnum.BIN_SUB: "SUB",
+    OpEnum.BIN_MUL: "MUL",
+    OpEnum.BIN_DIV: "DIV",
+    OpEnum.BIN_MOD: "MOD",
+    OpEnum.BIN_AND: "AND",
+    OpEnum.BIN_OR: "OR",
+    OpEnum.BIN_XOR: "XOR",
+    OpEnum.BIN_SHL: "SHL",
+    OpEnum.BIN_SHR: "SHR",
+    OpEnum.UNARY_NEG: "NEG",
+    OpEnum.UNARY_NOT: "NOT",
+}
+
+_INDEX_TYPE = ir.IntType(None, 64)
+
+
+class Node:
+    __slots__ = "op", "kids", "typ", "val", "need", "costs"
+    def __init__(self, op, kids, typ, val=None):
+        self.op = op
+        self.kids = kids
+        self.typ = typ # what the node computes, leaves are converted to it
+        self.val = val # IR value of a leaf
+        # registers computing the node takes, when the operands that need more go first
+        if not kids:
+            self.need = 1
+        elif len(kids) == 2:
+            # most nodes, one more than the kids when both need the same
+            lhs, rhs = kids[0].need, kids[1].need
+            self.need = lhs + 1 if lhs == rhs else max(lhs, rhs)
+        else:
+            needs = sorted((kid.need for kid in kids), reverse=True)
+            self.need = max(need + i for i, need in enumerate(needs))
+        self.costs = None # nonterminal -> (cost, rule, [(nonterminal, node)] of the operands)
+
+    __repr__ = lambda self: f"{self.op}({', '.join(map(repr, self.kids))})" if self.kids \
+        else f"{self.op}({self.val!r})"
+
+
+class Rule:
+    __slots__ = "nt", "pattern", "cost", "emit", "cond"
+    def __init__(self, nt, pattern, cost, emit, cond=None):
+        self.nt = nt
+        self.pattern = pattern
+        self.cost = cost
+        self.emit = emit # (sel, node, *operands) -> result
+        self.cond = cond # (gen, node, *operand nodes) -> bool
+
+
+def _is_nt(pattern):
+    return isinstance(pattern, str) and pattern.islower()
+
+
+class Patterns:
+    __slots__ = "rules", "pool", "naive_nts", "by_op", "chains", "shapes"
+    def __init__(self, rules, pool, naive_nts=("reg",)):
+        self.rules = tuple(rules)
+        self.pool = tuple(pool) # scratch registers the trees get computed in
+        self.naive_nts = tuple(naive_nts) # where naive() keeps operands
+        self.by_op = dict() # operator or leaf -> [(rule, matcher(node, operands), swapped)]
+        self.chains = dict() # nonterminal -> chain rules from it
+        self.shapes = dict() # (operator, operators of the kids) -> what candidates() gave back
+        for rule in self.rules:
+            pattern = rule.pattern
+            if _is_nt(pattern):
+                self.chains.setdefault(pattern, list()).append(rule)
+                continue
+            op = pattern if isinstance(pattern, str) else pattern[0]
+            self.by_op.setdefault(op, list()).append((rule, _matcher(pattern, False), False))
+            if op in COMMUTATIVE and pattern[1] != pattern[2]:
+                self.by_op[op].append((rule, _matcher(pattern, True), True))
+
+    def candidates(self, node):
+        """[(rule, matcher)] of the rules of node's operator fitting the operators of its kids"""
+        shape = (node.op, *[kid.op for kid in node.kids])
+        found = self.shapes.get(shape)
+        if found is None:
+            found = self.shapes[shape] = [(rule, match) for rule, match, swapped
+                in self.by_op.get(node.op, ()) if _fits(rule.pattern, swapped, shape[1:])]
+        return found
+
+    def max_need(self):
+        return len(self.pool)
+
+    def naive(self):
+        """the rules of one operator on operands in naive_nts (and the leaves) without conditions"""
+        def one_op(pattern):
+            return isinstance(pattern, str) and not _is_nt(pattern) \
+                or not isinstance(pattern, str) and all(kid in self.naive_nts for kid in pattern[1:])
+        return Patterns((rule for rule in self.rules if rule.cond is None and one_op(rule.pattern)),
+            self.pool, self.naive_nts)
+
+
+class Forest:
+    __slots__ = "roots", "folded"
+    def __init__(self):
+        self.roots = dict() # position in the body -> tree computed there
+        self.folded = dict() # position -> uid of the instructions computed by a later tree
+
+
+def const(node):
+    """value of a CONST node converted to its type"""
+    val = int(node.val.const) if node.val.const is not None else 0
+    return wrap_int(val, node.typ) if is_int(node.typ) else val
+
+
+def trees(program, func, max_need) -> Forest:
+    """the trees of func, none of them needs more than max_need registers"""
+    forest = Forest()
+    counts = dict()
+    for instr in func.body:
+        for val in values(instr):
+            if isinstance(val, int):
+                counts[val] = counts.get(val, 0) + 1
+
+    # (uid, position, tree) of the trees computed by the instructions right before the current
+    # one, it can take its operands from the end so the instructions of a tree stay together
+    pending = list()
+
+    def build(op, typ, operands):
+        kids = [None] * len(operands)
+        taken = list()
+        while pending:
+            uid, _, sub = pending[-1]
+            # operands used once (the other use is where they are defined) and of the right type
+            slot = next((i for i, val in enumerate(operands) if kids[i] is None and val == uid), None)
+            if slot is None or counts[uid] != 2 or sub.typ != typ:
+                break
+            kids[slot] = sub
+            taken.append(pending.pop())
+
+        leaves = [Node("CONST" if isinstance(val, ir.Constant) else "VAL", [], typ, val)
+            for val in operands]
+        tree = Node(op, [kid or leaf for kid, leaf in zip(kids, leaves)], typ)
+        if tree.need > max_need:
+            pending.extend(reversed(taken))
+            return Node(op, leaves, typ)
+        for uid, start, _ in taken:
+            del forest.roots[start]
+            forest.folded[start] = uid
+        return tree
+
+    for pos, instr in enumerate(func.body):
+        op, _, _, *operands = instr
+        if op in _OPS and reg_class(func.types[operands[0]]) == "int":
+            ret, *operands = operands
+            forest.roots[pos] = build(_OPS[op], func.types[ret], operands)
+            pending.append((ret, pos, forest.roots[pos]))
+        elif op == OpEnum.SLICE_INDEXING:
+            _, slice_, idx = operands
+            typ = program.type_of(func, slice_)
+            index = build("INDEX", _INDEX_TYPE, [idx]).kids[0]
+            forest.roots[pos] = Node("INDEX", [Node("BASE", [], typ, slice_), index], typ)
+            pending.clear()
+        else:
+            pending.clear()
+    return forest
+
+
+def label(node, patterns, gen):
+    """fills in node.costs of the tree, gen is what the conditions of the rules get"""
+    for kid in node.kids:
+        label(kid, patterns, gen)
+
+    costs = node.costs = dict()
+    for rule, match in patterns.candidates(node):
+        operands = list()
+        if not match(node, operands):
+            continue
+        if rule.cond is not None and not rule.cond(gen, node, *[kid for _, kid in operands]):
+            continue
+        cost = rule.cost
+        for nt, kid in operands:
+            cost += kid.costs[nt][0]
+        best = costs.get(rule.nt)
+        if best is None or cost < best[0]:
+            costs[rule.nt] = (cost, rule, operands)
+
+    # chain rules until nothing gets any cheaper
+    changed = True
+    while changed:
+        changed = False
+        for nt, (cost, _, _) in list(costs.items()):
+            for rule in patterns.chains.get(nt, ()):
+                if rule.cond is not None and not rule.cond(gen, node, node):
+                    continue
+                if rule.nt not in costs or cost + rule.cost < costs[rule.nt][0]:
+                    costs[rule.nt] = (cost + rule.cost, rule, [(nt, node)])
+                    changed = True
+
+
+def _fits(pattern, swapped, kid_ops):
+    if isinstance(pattern, str):
+        return True
+    subs = pattern[:0:-1] if swapped else pattern[1:]
+    if len(subs) != len(kid_ops):
+        return False
+    for sub, op in zip(subs, kid_ops):
+        if not ((_is_nt(sub) or sub == op) if isinstance(sub, str) else sub[0] == op):
+            return False
+    return True
+
+
+def _matcher(pattern, swapped):
+    """
+    function(node, operands) -> bool of whether pattern matches node (with the operands of the
+    root the other way round when swapped), it appends the (nonterminal, node) of the operands
+    """
+    if isinstance(pattern, str) and _is_nt(pattern):
+        def match(node, operands):
+            if pattern not in node.costs:
+                return False
+            operands.append((pattern, node))
+            return True
+        return match
+    elif isinstance(pattern, str):
+        return lambda node, operands: node.op == pattern
+
+    op, subs = pattern[0], pattern[1:]
+    if len(subs) == 2 and all(_is_nt(sub) for sub in subs):
+        # the most common pattern, an operator on two operands which are already computed
+        first, second = subs[::-1] if swapped else subs
+        def match(node, operands):
+            kids = node.kids
+            if node.op != op or len(kids) != 2:
+                return False
+            lhs, rhs = kids
+            if first not in lhs.costs or second not in rhs.costs:
+                return False
+            if swapped:
+                operands += ((second, rhs), (first, lhs)) # in the order of the pattern
+            else:
+                operands += ((first, lhs), (second, rhs))
+            return True
+        return match
+
+    matchers = tuple(_matcher(sub, False) for sub in subs)
+    def match(node, operands):
+        kids = node.kids
+        if node.op != op or len(kids) != len(matchers):
+            return False
+        for sub, kid in zip(matchers, kids[::-1] if swapped else kids):
+            if not sub(kid, operands):
+                return False
+        return True
+    return match
+
+
+class Selection:
+    """what the emit functions of the rules get, the generator and the free scratch registers"""
+    __slots__ = "gen", "pool", "free"
+    def __init__(self, gen, pool):
+        self.gen = gen
+        self.pool = frozenset(pool)
+        self.free = list(pool)
+
+    def take(self):
+        return self.free.pop(0)
+
+    def release(self, *vals):
+        """gives back the scratch registers among vals, anything else is left alone"""
+        for val in vals:
+            if isinstance(val, str) and val in self.pool and val not in self.free:
+                self.free.append(val)
+
+
+def reduce(sel, node, nt):
+    _, rule, operands = node.costs[nt]
+    # the operands which need the most registers go first, the results of the others are
+    # held in the meantime
+    results = [None] * len(operands)
+    for i in sorted(range(len(operands)), key=lambda i: -operands[i][1].need):
+        results[i] = reduce(sel, operands[i][1], operands[i][0])
+    return rule.emit(sel, node, *results)
+
+
+def select(gen, tree, nt, patterns):
+    """emits the cheapest cover of tree as nt with gen, gives back what its rule gave back"""
+    label(tree, patterns, gen)
+    if nt not in tree.costs:
+        raise ValueError(f"no pattern covers {tree!r} as {nt}")
+    return reduce(Selection(gen, patterns.pool), tree, nt)
+
+
+def cost(tree, nt):
+    """cost of the cheapest cover of a labelled tree"""
+    return tree.costs[nt][0]
@@ -0,0 +1,89 @@
+import ir.core as ir
+
+# Data layout shared by the native backends, it is the same as C on LP64 targets so
+# structs can be passed to and from C code.
+#   unsized slices are { data: *T, len: u64 }
+#   sized slices are T[len] arrays
+#   f16 is stored as f32 as there is no portable half precision arithmetic
+
+
+def size_align(typ) -> tuple[int, int]:
+    match typ:
+        case ir.IntType() | ir.UintType():
+            size = (typ.bit_length or 64) // 8
+            return size, size
+        case ir.FloatType():
+            return (8, 8) if typ.bit_length == 64 else (4, 4)
+        case ir.BoolType():
+            return 1, 1
+        case ir.PointerType():
+            return 8, 8
+        case ir.SliceType() if typ.len is None:
+            return 16, 8
+        case ir.SliceType():
+            size, align = size_align(typ.type)
+            return size * typ.len, align
+        case ir.StructType():
+            offsets, size, align = struct_layout(typ)
+            return size, align
+        case ir.VoidType() | None:
+            return 0, 1
+        case _:
+            raise NotImplementedError(typ)
+
+
+def align_to(n, align):
+    return (n + align - 1) & -align
+
+
+def struct_layout(struct) -> tuple[list, int, int]:
+    """(member offsets, size, alignment) of a struct, kept on the struct after the first call"""
+    if struct.layout is not None:
+        return struct.layout
+
+    offsets = list()
+    pos = 0
+    max_align = 1
+    for _, typ in struct.members:
+        size, align = size_align(typ)
+        pos = align_to(pos, align)
+        offsets.append(pos)
+        pos += size
+        max_align = max(max_align, align)
+
+    struct.layout = (offsets, align_to(max(pos, 1), max_align), max_align)
+    return struct.layout
+
+
+def member_offset(struct, name):
+    offsets, _, _ = struct_layout(struct)
+    return offsets[struct.index(name)]
+
+
+def flatten(typ, offset=0, out=None) -> list:
+    """every scalar in an aggregate type as (offset, type)"""
+    out = list() if out is None else out
+    match typ:
+        case ir.StructType():
+            offsets, _, _ = struct_layout(typ)
+            for member_pos, (_, member) in zip(offsets, typ.members):
+                flatten(member, offset + member_pos, out)
+        case ir.SliceType() if typ.len is None:
+            out.append((offset, ir.PointerType(None, typ.type)))
+            out.append((offset + 8, ir.UintType(None, 64)))
+        case ir.SliceType():
+            size, _ = size_align(typ.type)
+            for i in range(typ.len):
+                flatten(typ.type, offset + i * size, out)
+        case _:
+            out.append((offset, typ))
+    return out
+
+
+def is_aggregate(typ):
+    return isinstance(typ, (ir.StructType, ir.SliceType))
+
+
+def is_float(typ):
+    return isinstance(typ, ir.FloatType)
+
@@ -1,5 +1,1153 @@
-from io import StringIO
+import re
+import struct
 
-def generate(src, ast) -> StringIO | None:
-    print("Hello linux-aarch64")
+import ir.core as ir
+from ir.core import OpEnum
+from ir.program import is_int
+from ir.vm import wrap_int, round_f32
+from asm_gen.layout import size_align, align_to, member_offset, flatten, is_aggregate, is_float
+from asm_gen import elf, encode_aarch64, isel, parallel, peephole, regalloc
 
+# AArch64 AAPCS64 backend writing GNU assembler
+#
+# Works like linux_x86_64, scalar locals, arguments and uids get registers from asm_gen.regalloc,
+# everything else lives in a stack slot below x29, integer arithmetic and indexing get covered
+# with the asm_gen.isel PATTERNS below and instructions go through scratch registers:
+#   x9, x10, x11     operands and results
+#   x1-x7, x15       more of them for the expression trees
+#   x12              memory copies
+#   x15              base address of indexing and indirect results
+#   x16, x17         addresses of memory operands which can't be encoded directly
+#   d16, d17 (s16)   float operands
+#
+# Shifts and divisions follow ir.vm: shift counts in a register get checked with csel as the
+# instructions only use their low 6 bits, and divisors get checked for zero before sdiv and udiv,
+# which would give 0, dividing by zero runs into brk (SIGTRAP). sdiv already wraps INT64_MIN / -1.
+#
+# Each function is collected as (mnemonic, operands...) tuples, goes through the asm_gen.peephole
+# rules below and is written to the output file in one go, so only one function is ever held
+# in memory. Like on x86_64 the functions get generated by asm_gen.parallel and the string labels
+# get renumbered in source order. generate_object() writes an ELF object file with the
+# instructions encoded by asm_gen.encode_aarch64.
+
+INT_ARG_REGS: int = 8
+FLOAT_ARG_REGS: int = 8
+
+# only the low 64 bits of v8-v15 are preserved, which is all a scalar needs
+REGISTERS = regalloc.RegisterFile(
+    ("x13", "x14", *(f"x{i}" for i in range(19, 29))),
+    (*(f"v{i}" for i in range(18, 32)), *(f"v{i}" for i in range(8, 16))),
+    (*(f"x{i}" for i in range(19, 29)), *(f"v{i}" for i in range(8, 16))),
+)
+
+_INT_OPS: dict = {"ADD": "add", "SUB": "sub", "MUL": "mul", "AND": "and", "OR": "orr", "XOR": "eor"}
+
+_FLOAT_OPS: dict = {
+    OpEnum.BIN_ADD: "fadd",
+    OpEnum.BIN_SUB: "fsub",
+    OpEnum.BIN_MUL: "fmul",
+    OpEnum.BIN_DIV: "fdiv",
+}
+
+
+def func_name(name):
+    return "ml_" + name.replace(".", "__")
+
+
+def wreg(reg):
+    return "w" + reg[1:]
+
+
+def freg(reg, typ):
+    """d or s view of a float register"""
+    return ("d" if typ.bit_length == 64 else "s") + reg[1:]
+
+
+def is_reg(loc):
+    return isinstance(loc, str)
+
+
+def hfa(typ):
+    """members of a homogeneous floating-point aggregate, None if typ isn't one"""
+    if not is_aggregate(typ):
+        return None
+    members = flatten(typ)
+    if not 1 <= len(members) <= 4 or not is_float(members[0][1]):
+        return None
+    if any(not is_float(member) or member.bit_length != members[0][1].bit_length for _, member in members):
+        return None
+    return members
+
+
+def classify(typ):
+    """how AAPCS64 passes a value: ("int", n) registers, ("float", n) registers or ("ref", 1)
+    for composites over 16 bytes which get passed by reference"""
+    if not is_aggregate(typ):
+        return ("float", 1) if is_float(typ) else ("int", 1)
+
+    members = hfa(typ)
+    if members is not None:
+        return ("float", len(members))
+
+    size, _ = size_align(typ)
+    if size > 16:
+        return ("ref", 1)
+    return ("int", (size + 7) // 8)
+
+
+class Location:
+    """memory operand, base is a register or a symbol"""
+    __slots__ = "base", "disp"
+    def __init__(self, base, disp=0):
+        self.base = base
+        self.disp = disp
+
+    def __add__(self, disp):
+        return Location(self.base, self.disp + disp)
+
+    def is_symbol(self):
+        return self.base not in ("x29", "sp") and not (self.base[0] == "x" and self.base[1:].isdigit())
+
+
+# peephole rules, the scratch registers make most of the moves they remove
+
+_REG_RE = re.compile(r"(?<![\w#:.])([xwvdsqhb])(\d+)\b|\bsp\b")
+
+_COPIES: tuple = ("mov", "add", "sub", "fmov") # what _is_copy() recognizes
+
+_WINDOW: int = 8 # instructions copy-forward looks ahead for the use of a copy
+
+_LIVE_AT_RET: tuple = ("x0", "x1", "v0", "v1", "v2", "v3", "sp", "x29", "x30", *REGISTERS.callee_saved)
+
+
+def _reg(match):
+    if match.group(0) == "sp":
+        return "sp"
+    return ("x" if match.group(1) in "xw" else "v") + match.group(2)
+
+
+def _regs(operand):
+    """the full registers (x0, v0, sp) an operand uses"""
+    return {_reg(match) for match in _REG_RE.finditer(operand)}
+
+
+def _rename(operand, old, new):
+    """operand with the register old replaced by the same view of new"""
+    def sub(match):
+        return match.group(0)[0] + new[1:] if _reg(match) == old else match.group(0)
+    return _REG_RE.sub(sub, operand)
+
+
+def _memory(operands):
+    """index of the memory operand of a load or store, None if there isn't one"""
+    for i, operand in enumerate(operands):
+        if operand.startswith("["):
+            return i
+    return None
+
+
+def _uses(instr):
+    op, *operands = instr
+    if op.endswith(":") or op in ("b", "bl", "br", "blr", "ret") or op.startswith(("b.", "cb", "tb")):
+        return None
+
+    mem = _memory(operands)
+    if mem is not None:
+        data = set()
+        for operand in operands[:mem]:
+            data |= _regs(operand)
+        addr = _regs(operands[mem])
+        reads, writes = (data | addr, set()) if op.startswith("st") else (addr, data)
+        if operands[mem].endswith("!") or mem + 1 < len(operands):
+            writes |= addr # writeback
+        return reads, writes
+
+    if op in ("cmp", "cmn", "tst", "fcmp"):
+        reads = set()
+        for operand in operands:
+            reads |= _regs(operand)
+        return reads, set()
+
+    reads = set()
+    for operand in operands[1:]:
+        reads |= _regs(operand)
+    writes = _regs(operands[0]) if operands else set()
+    if op == "movk":
+        reads |= writes
+    return reads, writes
+
+
+def _is_x(operand):
+    return operand[0] == "x" and operand[1:].isdigit()
+
+
+def _is_copy(instr):
+    """(dst, src) of a register to register copy of all 64 bits"""
+    match instr:
+        case ("mov", dst, src) if _is_x(dst) and _is_x(src):
+            return dst, src
+        case ("add" | "sub", dst, src, "#0" | "xzr") if _is_x(dst) and _is_x(src):
+            return dst, src
+        case ("fmov", dst, src) if dst[0] == src[0] == "d":
+            return "v" + dst[1:], "v" + src[1:]
+    return None
+
+
+def _pure(target, instr):
+    """if the instruction only writes its first operand, so it can write another register"""
+    op, *operands = instr
+    uses = target.uses(instr)
+    if uses is None or op == "movk" or op.startswith("st") or not operands:
+        return False
+    return len(uses[1]) == 1 and _regs(operands[0]) == uses[1]
+
+
+def _self_move(target, instrs, i):
+    copy = _is_copy(instrs[i])
+    if copy is not None and copy[0] == copy[1]:
+        return 1, []
+    return None
+
+
+def _move_back(target, instrs, i):
+    # mov x9, x13; mov x13, x9
+    first, second = _is_copy(instrs[i]), _is_copy(instrs[i + 1])
+    if first is not None and second is not None and first == second[::-1]:
+        return 2, [instrs[i]]
+    return None
+
+
+def _reload(target, instrs, i):
+    # str x9, [x29, #-8]; ldr x9, [x29, #-8]
+    (op, *first), (op2, *second) = instrs[i : i + 2]
+    if (op, op2) in (("str", "ldr"), ("stur", "ldur")) and first == second and len(first) == 2 \
+        and first[0][0] in "xd" and not first[1].endswith("!"):
+        return 2, [instrs[i]]
+    return None
+
+
+def _first_use(target, instrs, i, reg, keep=()):
+    """index of the first instruction after i reading reg, None if reg or keep get written
+    before or there is none within the window"""
+    for j in range(i + 1, min(i + 1 + _WINDOW, len(instrs))):
+        uses = target.uses(instrs[j])
+        if uses is None:
+            return None
+        if reg in uses[0]:
+            return j
+        if reg in uses[1] or any(other in uses[1] for other in keep):
+            return None
+    return None
+
+
+def _forward(target, instrs, i, tmp, new):
+    """the instructions from i up to the first use of tmp with tmp replaced by the view of new
+    in the use, None if the use can't take new or tmp is still needed after it"""
+    j = _first_use(target, instrs, i, tmp, (new,))
+    if j is None:
+        return None
+    instr = instrs[j]
+    if instr[0] == "movk" or _memory(instr[1:]) is not None or "sp" in target.uses(instr)[0]:
+        return None
+    if new == "xzr" and instr[0] in ("add", "sub") and instr[-1].startswith(("#", ":lo12:")):
+        return None # register 31 is sp in the immediate forms
+    if tmp not in target.uses(instr)[1] and not peephole.dead_after(target, instrs, j, tmp):
+        return None
+    new_instr = (instr[0], instr[1], *(_rename(operand, tmp, new) for operand in instr[2:]))
+    return j + 1 - i, [*instrs[i + 1 : j], new_instr]
+
+
+def _copy_forward(target, instrs, i):
+    # mov x9, x13; movz x10, #31, lsl #0; mul x11, x9, x10 -> movz x10, #31, lsl #0; mul x11, x13, x10
+    copy = _is_copy(instrs[i])
+    if copy is None:
+        return None
+    tmp, src = copy
+    return _forward(target, instrs, i, tmp, src)
+
+
+def _imm_forward(target, instrs, i):
+    # movz x10, #3, lsl #0; add x11, x9, x10 -> add x11, x9, #3
+    (op, *first), (op2, *second) = instrs[i : i + 2]
+    if op != "movz" or first[2] != "lsl #0" or not _is_x(first[0]):
+        return None
+    tmp = first[0]
+    if first[1] == "#0":
+        # the zero register works almost wherever a register is read
+        return _forward(target, instrs, i, tmp, "xzr")
+
+    imm = int(first[1][1:])
+    if len(second) != 3 or second[2] != tmp or second[1] == tmp or not _is_x(second[0]):
+        return None
+    if not ((op2 in ("add", "sub") and imm < 4096) or (op2 in ("lsl", "lsr", "asr") and imm < 64)):
+        return None
+    if second[0] != tmp and not peephole.dead_after(target, instrs, i + 1, tmp):
+        return None
+    return 2, [(op2, second[0], second[1], first[1])]
+
+
+def _dead_write(target, instrs, i):
+    # mov x9, x13; mov x9, x14
+    if not _pure(target, instrs[i]):
+        return None
+    reg, = target.uses(instrs[i])[1]
+    if not peephole.dead_after(target, instrs, i, reg):
+        return None
+    return 1, []
+
+
+def _retarget(target, instrs, i):
+    # add x11, x9, x10; mov x14, x11 -> add x14, x9, x10
+    instr = instrs[i]
+    copy = _is_copy(instrs[i + 1])
+    if copy is None or not _pure(target, instr):
+        return None
+    dst, tmp = copy
+    if _regs(instr[1]) != {tmp} or not peephole.dead_after(target, instrs, i + 1, tmp):
+        return None
+    return 2, [(instr[0], _rename(instr[1], tmp, dst), *instr[2:])]
+
+
+PEEPHOLE = peephole.Target(
+    rules=(
+        peephole.Rule("self-move", 1, _self_move, _COPIES),
+        peephole.Rule("load-after-store", 2, _reload, ("str", "stur")),
+        peephole.Rule("move-back", 2, _move_back, _COPIES),
+        peephole.Rule("copy-forward", 2, _copy_forward, _COPIES),
+        peephole.Rule("imm-forward", 2, _imm_forward, ("movz",)),
+        peephole.Rule("retarget", 2, _retarget),
+        peephole.Rule("dead-write", 1, _dead_write),
+    ),
+    uses=_uses, jump="b", ret="ret", live_at_ret=_LIVE_AT_RET,
+)
+
+
+# instruction selection, asm_gen.isel covers the integer expression trees with these patterns:
+#   reg     register holding the value extended to 64 bits, the one it already is in or a scratch
+#           register of the tree
+#   imm     constant for add and sub (12 bits)
+#   shift   constant shift amount
+#   offset  constant index
+#   base    scratch register with the address of the first element of a slice
+#   addr    Location of an element
+# The costs are instructions, results always go into a fresh scratch register so the registers
+# of the values are never written.
+
+def _result(sel, node, reg):
+    sel.gen.extend(reg, node.typ)
+    return reg
+
+
+def _operand(val):
+    return f"#{val}" if isinstance(val, int) else val
+
+
+def _in_reg(gen, node):
+    return gen.type_of(node.val) == node.typ and is_reg(gen.loc(node.val))
+
+
+def _imm12(gen, node):
+    return 0 <= isel.const(node) < 4096
+
+
+def _load(sel, node):
+    reg = sel.take()
+    sel.gen.load_int(node.val, node.typ, reg)
+    return reg
+
+
+def _shift_op(op, typ):
+    if op == "SHL":
+        return "lsl"
+    return "asr" if isinstance(typ, ir.IntType) else "lsr"
+
+
+def _op3(op):
+    def emit(sel, node, lhs, rhs):
+        sel.release(lhs, rhs)
+        reg = sel.take()
+        sel.gen.emit(_INT_OPS.get(op) or _shift_op(op, node.typ), reg, lhs, _operand(rhs))
+        return _result(sel, node, reg)
+    return emit
+
+
+def _shift(sel, node, lhs, rhs):
+    # counts of 64 or more (unsigned) shift every bit out, asr shifts by 63 instead
+    op = _shift_op(node.op, node.typ)
+    sel.release(lhs, rhs)
+    reg = sel.take()
+    gen = sel.gen
+    if isinstance(rhs, int):
+        gen.emit(op, reg, lhs, f"#{rhs}")
+    elif op == "asr":
+        gen.emit("mov", "x16", "#63")
+        gen.emit("cmp", rhs, "#64")
+        gen.emit("csel", "x16", rhs, "x16", "lo")
+        gen.emit(op, reg, lhs, "x16")
+    else:
+        gen.emit("cmp", rhs, "#64")
+        gen.emit(op, reg, lhs, rhs)
+        gen.emit("csel", reg, reg, "xzr", "lo")
+    return _result(sel, node, reg)
+
+
+def _shift_in_range(gen, node):
+    return 0 <= isel.const(node) < 64
+
+
+def _shifted(op, shift):
+    # add x9, x19, x20, lsl #3
+    def emit(sel, node, lhs, rhs, amount):
+        sel.release(lhs, rhs)
+        reg = sel.take()
+        sel.gen.emit(_INT_OPS[op], reg, lhs, rhs, f"{_shift_op(shift, node.typ)} #{amount}")
+        return _result(sel, node, reg)
+    return emit
+
+
+def _multiply_add(op):
+    # madd and msub, mneg is msub from xzr
+    def emit(sel, node, *operands):
+        *addend, lhs, rhs = operands
+        sel.release(lhs, rhs, *addend)
+        reg = sel.take()
+        sel.gen.emit(op, reg, lhs, rhs, addend[0] if addend else "xzr")
+        return _result(sel, node, reg)
+    return emit
+
+
+def _divide(sel, node, lhs, rhs):
+    div = "sdiv" if isinstance(node.typ, ir.IntType) else "udiv"
+    label = sel.gen.label()
+    sel.gen.emit("cbnz", rhs, label)
+    sel.gen.emit("brk", "#1000")
+    sel.gen.emit(f"{label}:")
+    sel.release(lhs, rhs)
+    reg = sel.take()
+    if node.op == "DIV":
+        sel.gen.emit(div, reg, lhs, rhs)
+    else:
+        sel.gen.emit(div, "x16", lhs, rhs)
+        sel.gen.emit("msub", reg, "x16", rhs, lhs)
+    return _result(sel, node, reg)
+
+
+def _unary(sel, node, src):
+    sel.release(src)
+    reg = sel.take()
+    sel.gen.emit("neg" if node.op == "NEG" else "mvn", reg, src)
+    return _result(sel, node, reg)
+
+
+def _base(sel, node):
+    reg = sel.take()
+    if node.typ.len is None:
+        sel.gen.access("ldr", reg, sel.gen.loc(node.val), 8)
+    else:
+        sel.gen.address(reg, sel.gen.loc(node.val))
+    return reg
+
+
+def _elem_size(node):
+    return size_align(node.typ.type)[0]
+
+
+def _power_of_two(gen, node, *operands):
+    size = _elem_size(node)
+    return size & (size - 1) == 0
+
+
+def _index(sel, node, base, index, offset=0):
+    size = _elem_size(node)
+    if size & (size - 1) == 0:
+        sel.gen.emit("add", base, base, index, f"lsl #{size.bit_length() - 1}")
+    else:
+        sel.gen.load_imm("x16", size)
+        sel.gen.emit("madd", base, index, "x16", base)
+    sel.release(index)
+    return Location(base, offset * size)
+
+
+def _rules():
+    Rule = isel.Rule
+    yield Rule("reg", "VAL", 1, _load)
+    yield Rule("reg", "VAL", 0, lambda sel, node: sel.gen.loc(node.val), _in_reg)
+    yield Rule("reg", "CONST", 1, _load)
+    yield Rule("imm", "CONST", 0, lambda sel, node: isel.const(node), _imm12)
+    yield Rule("shift", "CONST", 0, lambda sel, node: isel.const(node), _shift_in_range)
+    yield Rule("offset", "CONST", 0, lambda sel, node: isel.const(node))
+
+    for op in _INT_OPS:
+        yield Rule("reg", (op, "reg", "reg"), 1, _op3(op))
+    for op in ("ADD", "SUB"):
+        yield Rule("reg", (op, "reg", "imm"), 1, _op3(op))
+    for op in ("ADD", "SUB", "AND", "OR", "XOR"):
+        for shift in ("SHL", "SHR"):
+            yield Rule("reg", (op, "reg", (shift, "reg", "shift")), 1, _shifted(op, shift))
+    yield Rule("reg", ("ADD", "reg", ("MUL", "reg", "reg")), 1, _multiply_add("madd"))
+    yield Rule("reg", ("SUB", "reg", ("MUL", "reg", "reg")), 1, _multiply_add("msub"))
+    yield Rule("reg", ("NEG", ("MUL", "reg", "reg")), 1, _multiply_add("msub"))
+
+    for op in ("SHL", "SHR"):
+        yield Rule("reg", (op, "reg", "reg"), 3, _shift)
+        yield Rule("reg", (op, "reg", "shift"), 1, _shift)
+    yield Rule("reg", ("DIV", "reg", "reg"), 3, _divide)
+    yield Rule("reg", ("MOD", "reg", "reg"), 4, _divide)
+    yield Rule("reg", ("NEG", "reg"), 1, _unary)
+    yield Rule("reg", ("NOT", "reg"), 1, _unary)
+
+    yield Rule("base", "BASE", 1, _base)
+    yield Rule("addr", ("INDEX", "base", "reg"), 1, _index)
+    yield Rule("addr", ("INDEX", "base", "offset"), 0,
+        lambda sel, node, base, offset: Location(base, offset * _elem_size(node)))
+    yield Rule("addr", ("INDEX", "base", ("ADD", "reg", "offset")), 1, _index, _power_of_two)
+
+
+PATTERNS = isel.Patterns(_rules(), ("x9", "x10", "x11", "x15", *(f"x{i}" for i in range(1, 8))),
+    naive_nts=("reg", "base"))
+
+
+class AArch64Generator:
+    __slots__ = "program", "stats", "patterns", "func", "instrs", "slots", "regs", "saved", \
+        "frame_size", "sret", "strings", "name", "labels"
+    def __init__(self, program, stats=None):
+        self.program = program
+        self.stats = stats # see asm_gen.gen_asm
+        self.patterns = PATTERNS # isel.Patterns the expression trees get covered with
+        self.func = None
+        self.instrs = None
+        self.slots = None
+        self.regs = None # regalloc.Allocation of the function
+        self.saved = None # (callee saved register, slot)
+        self.frame_size = 0
+        self.sret = None
+        self.strings = dict() # bytes -> label
+        self.name = None # symbol of the function
+        self.labels = 0 # labels made by label() in the function
+
+    def label(self):
+        """a new label of the function"""
+        self.labels += 1
+        return f".L{self.name}.{self.labels}"
+
+    def emit(self, op, *operands):
+        self.instrs.append((op, *operands))
+
+    def type_of(self, val):
+        return self.program.type_of(self.func, val)
+
+    def alloc(self, typ):
+        size, align = size_align(typ)
+        size = align_to(max(size, 1), 8)
+        self.frame_size = align_to(self.frame_size + size, max(align, 8))
+        return Location("x29", -self.frame_size)
+
+    def loc(self, val):
+        """register or memory location of a named value or uid"""
+        if isinstance(val, str) and val not in self.func.locals:
+            return Location(func_name(val))
+
+        reg = self.regs.regs.get(val)
+        if reg is not None:
+            return reg
+
+        loc = self.slots.get(val)
+        if loc is None:
+            typ = self.func.locals[val] if isinstance(val, str) else self.func.types[val]
+            loc = self.slots[val] = self.alloc(typ)
+        return loc
+
+    def string(self, const):
+        label = self.strings.get(const)
+        if label is None:
+            label = self.strings[const] = f".LC{len(self.strings)}"
+        return label
+
+    # immediates and addresses
+
+    def load_imm(self, reg, val):
+        val &= (1 << 64) - 1
+        chunks = [(shift, (val >> shift) & 0xffff) for shift in (0, 16, 32, 48)]
+        chunks = [(shift, chunk) for shift, chunk in chunks if chunk] or [(0, 0)]
+
+        shift, chunk = chunks[0]
+        self.emit("movz", reg, f"#{chunk}", f"lsl #{shift}")
+        for shift, chunk in chunks[1:]:
+            self.emit("movk", reg, f"#{chunk}", f"lsl #{shift}")
+
+    def address(self, reg, loc):
+        """computes the address of loc into reg"""
+        if loc.is_symbol():
+            self.emit("adrp", reg, loc.base)
+            self.emit("add", reg, reg, f":lo12:{loc.base}")
+            base, disp = reg, loc.disp
+        else:
+            base, disp = loc.base, loc.disp
+
+        if disp == 0 and base == reg:
+            return
+        if -4096 < disp < 4096:
+            self.emit("sub" if disp < 0 else "add", reg, base, f"#{abs(disp)}")
+        else:
+            self.load_imm("x17", disp)
+            self.emit("add", reg, base, "x17")
+
+    def access(self, op, reg, loc, size, scratch="x16"):
+        """emits a load or store, op is the scaled form (ldr, strh, ldrsw, ...)"""
+        if loc.is_symbol():
+            self.address(scratch, Location(loc.base))
+            loc = Location(scratch, loc.disp)
+
+        if loc.disp >= 0 and loc.disp % size == 0 and loc.disp // size < 4096:
+            self.emit(op, reg, f"[{loc.base}, #{loc.disp}]")
+        elif -256 <= loc.disp < 256:
+            self.emit(op.replace("ldr", "ldur").replace("str", "stur"), reg, f"[{loc.base}, #{loc.disp}]")
+        else:
+            self.address(scratch, loc)
+            self.emit(op, reg, f"[{scratch}]")
+
+    # loading and storing scalars
+
+    def extend(self, reg, typ):
+        """sign or zero extends the low bits of reg to 64 bits"""
+        size, _ = size_align(typ)
+        if size == 8 or not is_int(typ):
+            return
+        if isinstance(typ, ir.IntType):
+            self.emit(f"sxt{'bhw'[(1, 2, 4).index(size)]}", reg, wreg(reg))
+        elif size == 4:
+            self.emit("mov", wreg(reg), wreg(reg))
+        else:
+            self.emit(f"uxt{'bh'[(1, 2).index(size)]}", wreg(reg), wreg(reg))
+
+    def load_mem_int(self, loc, typ, reg, scratch="x16"):
+        size, _ = size_align(typ)
+        if size == 8:
+            self.access("ldr", reg, loc, 8, scratch)
+        elif isinstance(typ, ir.IntType):
+            self.access(f"ldrs{'bhw'[(1, 2, 4).index(size)]}", reg, loc, size, scratch)
+        else:
+            self.access({1: "ldrb", 2: "ldrh", 4: "ldr"}[size], wreg(reg), loc, size, scratch)
+
+    def store_int(self, reg, typ, loc):
+        if is_reg(loc):
+            # registers hold the value extended to 64 bits
+            if reg != loc:
+                self.emit("mov", loc, reg)
+            self.extend(loc, typ)
+            return
+        size, _ = size_align(typ)
+        if size == 8:
+            self.access("str", reg, loc, 8)
+        else:
+            self.access({1: "strb", 2: "strh", 4: "str"}[size], wreg(reg), loc, size)
+
+    def load_int(self, val, typ, reg):
+        """loads an operand converted to the integer (or pointer) type typ into a 64 bit register"""
+        src_typ = self.type_of(val)
+
+        if isinstance(val, ir.Constant):
+            const = int(val.const) if val.const is not None else 0
+            self.load_imm(reg, wrap_int(const, typ) if is_int(typ) else const)
+        elif is_float(src_typ):
+            src = self.loc(val)
+            if not is_reg(src):
+                self.access("ldr", freg("v16", src_typ), src, size_align(src_typ)[0])
+                src = "v16"
+            self.emit("fcvtzs", reg, freg(src, src_typ))
+            self.extend(reg, typ)
+        else:
+            src = self.loc(val)
+            if not is_reg(src):
+                self.load_mem_int(src, src_typ, reg, "x17" if reg == "x16" else "x16")
+            elif src != reg:
+                self.emit("mov", reg, src)
+            if is_int(typ) and src_typ != typ:
+                self.extend(reg, typ)
+
+    def load_float(self, val, typ, reg):
+        """loads an operand converted to the float type typ into a v register"""
+        src_typ = self.type_of(val)
+        dst = freg(reg, typ)
+
+        if isinstance(val, ir.Constant):
+            if typ.bit_length == 64:
+                self.load_imm("x16", struct.unpack("<Q", struct.pack("<d", float(val.const)))[0])
+                self.emit("fmov", dst, "x16")
+            else:
+                self.load_imm("x16", struct.unpack("<I", struct.pack("<f", round_f32(float(val.const))))[0])
+                self.emit("fmov", dst, "w16")
+        elif is_float(src_typ):
+            src = self.loc(val)
+            if not is_reg(src):
+                self.access("ldr", freg(reg, src_typ), src, size_align(src_typ)[0])
+                src = reg
+            if src_typ.bit_length != typ.bit_length:
+                self.emit("fcvt", dst, freg(src, src_typ))
+            elif src != reg:
+                self.emit("fmov", dst, freg(src, typ))
+        else:
+            self.load_int(val, ir.IntType(None, 64), "x16")
+            self.emit("ucvtf" if isinstance(src_typ, ir.UintType) else "scvtf", dst, "x16")
+
+    def store_float(self, reg, typ, loc):
+        if is_reg(loc):
+            if reg != loc:
+                self.emit("fmov", freg(loc, typ), freg(reg, typ))
+            return
+        self.access("str", freg(reg, typ), loc, size_align(typ)[0])
+
+    # moving whole values around
+
+    def copy_mem(self, src, dst, size):
+        pos = 0
+        for chunk, load, store in ((8, "ldr", "str"), (4, "ldr", "str"), (2, "ldrh", "strh"), (1, "ldrb", "strb")):
+            reg = "x12" if chunk == 8 else "w12"
+            while size - pos >= chunk:
+                self.access(load, reg, src + pos, chunk, "x16")
+                self.access(store, reg, dst + pos, chunk, "x17")
+                pos += chunk
+
+    def zero_mem(self, dst, size):
+        pos = 0
+        for chunk, store in ((8, "str"), (4, "str"), (2, "strh"), (1, "strb")):
+            while size - pos >= chunk:
+                self.access(store, "xzr" if chunk == 8 else "wzr", dst + pos, chunk)
+                pos += chunk
+
+    def store_value(self, val, typ, dst):
+        """stores an operand converted to typ into a register or memory"""
+        if is_reg(dst) and val is None:
+            self.emit(*(("fmov", freg(dst, ir.FloatType(None, 64)), "xzr") if is_float(typ) else ("mov", dst, "#0")))
+        elif is_reg(dst) and is_float(typ):
+            self.load_float(val, typ, dst)
+        elif is_reg(dst):
+            self.load_int(val, typ, dst)
+        elif val is None:
+            self.zero_mem(dst, size_align(typ)[0])
+        elif is_float(typ):
+            self.load_float(val, typ, "v16")
+            self.store_float("v16", typ, dst)
+        elif not is_aggregate(typ):
+            self.load_int(val, typ, "x9")
+            self.store_int("x9", typ, dst)
+        elif isinstance(val, ir.Constant):
+            # string literal
+            label = self.string(val.const)
+            if typ.len is None:
+                self.address("x9", Location(label))
+                self.access("str", "x9", dst, 8)
+                self.load_imm("x9", len(val.const))
+                self.access("str", "x9", dst + 8, 8)
+            else:
+                size, _ = size_align(typ)
+                self.zero_mem(dst, size)
+                self.copy_mem(Location(label), dst, min(size, len(val.const)))
+        else:
+            src_typ = self.type_of(val)
+            if isinstance(typ, ir.SliceType) and typ.len is None and src_typ.len is not None:
+                self.address("x9", self.loc(val))
+                self.access("str", "x9", dst, 8)
+                self.load_imm("x9", src_typ.len)
+                self.access("str", "x9", dst + 8, 8)
+            else:
+                self.copy_mem(self.loc(val), dst, size_align(typ)[0])
+
+    def load_from(self, src, typ, ret):
+        """copies a value of type typ from memory into the register or slot of ret"""
+        dst = self.loc(ret)
+        if is_float(typ) and is_reg(dst):
+            self.access("ldr", freg(dst, typ), src, size_align(typ)[0])
+        elif is_reg(dst):
+            self.load_mem_int(src, typ, dst)
+        elif is_float(typ):
+            self.access("ldr", freg("v16", typ), src, size_align(typ)[0])
+            self.store_float("v16", typ, dst)
+        elif is_aggregate(typ):
+            self.copy_mem(src, dst, size_align(typ)[0])
+        else:
+            self.load_mem_int(src, typ, "x9")
+            self.store_int("x9", typ, dst)
+
+    def materialize(self, val, typ, copy=False):
+        """memory holding an operand converted to typ"""
+        if not copy and not isinstance(val, ir.Constant) and self.type_of(val) == typ:
+            return self.loc(val)
+        loc = self.alloc(typ)
+        self.store_value(val, typ, loc)
+        return loc
+
+    # passing values in registers
+
+    def to_regs(self, loc, typ, regs):
+        """loads an aggregate which is passed in registers"""
+        members = hfa(typ)
+        if members is not None:
+            for reg, (offset, member) in zip(regs, members):
+                self.access("ldr", freg(reg, member), loc + offset, size_align(member)[0])
+        else:
+            for i, reg in enumerate(regs):
+                self.access("ldr", reg, loc + i * 8, 8)
+
+    def from_regs(self, regs, typ, loc):
+        """stores an aggregate which was passed in registers"""
+        members = hfa(typ)
+        if members is not None:
+            for reg, (offset, member) in zip(regs, members):
+                self.access("str", freg(reg, member), loc + offset, size_align(member)[0])
+        else:
+            for i, reg in enumerate(regs):
+                self.access("str", reg, loc + i * 8, 8)
+
+    def assign_regs(self, types):
+        """(kind, registers) for every argument, registers is None for arguments on the stack
+        which come with their offset in the argument area"""
+        next_int = 0
+        next_float = 0
+        stack_pos = 0
+        out = list()
+        for typ in types:
+            kind, num = classify(typ)
+            if kind == "float" and next_float + num <= FLOAT_ARG_REGS:
+                out.append((kind, [f"v{next_float + i}" for i in range(num)]))
+                next_float += num
+                continue
+            elif kind != "float" and next_int + num <= INT_ARG_REGS:
+                out.append((kind, [f"x{next_int + i}" for i in range(num)]))
+                next_int += num
+                continue
+
+            # once something goes to the stack no later argument of its kind uses registers
+            if kind == "float":
+                next_float = FLOAT_ARG_REGS
+            else:
+                next_int = INT_ARG_REGS
+            size = 8 if kind == "ref" else size_align(typ)[0]
+            out.append((kind, stack_pos))
+            stack_pos += align_to(size, 8)
+        return out, stack_pos
+
+    # instructions
+
+    def call(self, ret, callee, args):
+        func = self.program.callee(callee)
+        types = [typ for _, typ in func.args]
+        assigned, stack_size = self.assign_regs(types)
+
+        # composites passed by reference get copied first, the callee is allowed to modify them
+        refs = [self.materialize(arg, typ, True) if kind == "ref" else None
+            for arg, typ, (kind, _) in zip(args, types, assigned)]
+
+        stack_size = align_to(stack_size, 16)
+        if stack_size:
+            self.emit("sub", "sp", "sp", f"#{stack_size}")
+        for arg, typ, ref, (kind, regs) in zip(args, types, refs, assigned):
+            if isinstance(regs, int) and kind == "ref":
+                self.address("x9", ref)
+                self.access("str", "x9", Location("sp", regs), 8)
+            elif isinstance(regs, int):
+                self.store_value(arg, typ, Location("sp", regs))
+
+        for arg, typ, ref, (kind, regs) in zip(args, types, refs, assigned):
+            if isinstance(regs, int):
+                continue
+            elif kind == "ref":
+                self.address(regs[0], ref)
+            elif is_aggregate(typ):
+                self.to_regs(self.materialize(arg, typ), typ, regs)
+            elif is_float(typ):
+                self.load_float(arg, typ, regs[0])
+            else:
+                self.load_int(arg, typ, regs[0])
+
+        ret_kind = None if isinstance(func.ret, ir.VoidType) else classify(func.ret)
+        if ret_kind is not None and ret_kind[0] == "ref":
+            self.address("x8", self.loc(ret))
+        self.emit("bl", func_name(func.name))
+        if stack_size:
+            self.emit("add", "sp", "sp", f"#{stack_size}")
+
+        if ret_kind is None or ret_kind[0] == "ref":
+            return
+        elif is_float(func.ret):
+            self.store_float("v0", func.ret, self.loc(ret))
+        elif not is_aggregate(func.ret):
+            self.store_int("x0", func.ret, self.loc(ret))
+        else:
+            kind, num = ret_kind
+            regs = [f"v{i}" if kind == "float" else f"x{i}" for i in range(num)]
+            self.from_regs(regs, func.ret, self.loc(ret))
+
+    def ret(self, val):
+        typ = self.func.ret
+        kind, num = classify(typ)
+
+        if kind == "ref":
+            self.access("ldr", "x15", self.sret, 8)
+            self.store_value(val, typ, Location("x15"))
+        elif is_float(typ):
+            self.load_float(val, typ, "v0")
+        elif not is_aggregate(typ):
+            self.load_int(val, typ, "x0")
+        else:
+            regs = [f"v{i}" if kind == "float" else f"x{i}" for i in range(num)]
+            self.to_regs(self.materialize(val, typ), typ, regs)
+
+        self.epilogue()
+
+    def epilogue(self):
+        for reg, slot in self.saved:
+            self.access("ldr", freg(reg, ir.FloatType(None, 64)) if reg[0] == "v" else reg, slot, 8)
+        self.emit("mov", "sp", "x29")
+        self.emit("ldp", "x29", "x30", "[sp]", "#16")
+        self.emit("ret")
+
+    def binary(self, op, ret, lhs, rhs):
+        # the integer operations are expression trees, see select()
+        typ = self.func.types[ret]
+        if op not in _FLOAT_OPS:
+            raise NotImplementedError(f"{op.name} on floats")
+        self.load_float(lhs, typ, "v16")
+        self.load_float(rhs, typ, "v17")
+        self.emit(_FLOAT_OPS[op], freg("v16", typ), freg("v16", typ), freg("v17", typ))
+        self.store_float("v16", typ, self.loc(ret))
+
+    def unary(self, op, ret, expr):
+        typ = self.func.types[ret]
+        self.load_float(expr, typ, "v16")
+        self.emit("fneg", freg("v16", typ), freg("v16", typ))
+        self.store_float("v16", typ, self.loc(ret))
+
+    def select(self, tree, instr):
+        """computes the result of instr from its isel tree"""
+        op, _, _, ret, *_ = instr
+        if op == OpEnum.SLICE_INDEXING:
+            self.load_from(isel.select(self, tree, "addr", self.patterns), tree.typ.type, ret)
+            return
+
+        reg = isel.select(self, tree, "reg", self.patterns)
+        dst = self.loc(ret)
+        if not is_reg(dst):
+            self.store_int(reg, tree.typ, dst)
+        elif reg != dst:
+            self.emit("mov", dst, reg) # already extended
+
+    def instr(self, instr):
+        op, _, _, *operands = instr
+
+        match op:
+            case OpEnum.VAR_DECL:
+                name, typ, val = operands
+                if val is None and self.func is self.program.init:
+                    return # globals are zero initialised already
+                self.store_value(val, typ, self.loc(name))
+
+            case OpEnum.ASSIGN:
+                name, val = operands
+                self.store_value(val, self.type_of(name), self.loc(name))
+
+            case OpEnum.MEMBER_ACCESS:
+                ret, obj, member = operands
+                struct_ = self.type_of(obj)
+                self.load_from(self.loc(obj) + member_offset(struct_, member), self.func.types[ret], ret)
+
+            case OpEnum.MEMBER_ASSIGN:
+                obj, member, val = operands
+                struct_ = self.type_of(obj)
+                self.store_value(val, struct_.member(member), self.loc(obj) + member_offset(struct_, member))
+
+            case OpEnum.FUNC_CALL:
+                self.call(*operands)
+
+            case OpEnum.RETURN_STMT:
+                self.ret(*operands)
+
+            case OpEnum.UNARY_NEG | OpEnum.UNARY_NOT:
+                self.unary(op, *operands)
+
+            case OpEnum.NOP:
+                pass
+
+            case _:
+                self.binary(op, *operands)
+
+    def function(self, func, name):
+        self.func = func
+        self.name = name
+        self.labels = 0
+        self.instrs = list()
+        self.slots = dict()
+        forest = isel.trees(self.program, func, self.patterns.max_need())
+        self.regs = regalloc.allocate(self.program, func, REGISTERS, set(forest.folded.values()))
+        if self.stats is not None:
+            self.stats.setdefault("regalloc", dict())[func.name] = self.regs.stats
+        self.frame_size = 0
+        self.sret = None
+
+        self.saved = [(reg, self.alloc(ir.IntType(None, 64))) for reg in self.regs.callee_saved]
+        for reg, slot in self.saved:
+            self.access("str", freg(reg, ir.FloatType(None, 64)) if reg[0] == "v" else reg, slot, 8)
+
+        if not isinstance(func.ret, ir.VoidType) and classify(func.ret)[0] == "ref":
+            self.sret = self.alloc(ir.PointerType(None, func.ret))
+            self.access("str", "x8", self.sret, 8)
+
+        # move the arguments from the registers into their registers or slots
+        assigned, _ = self.assign_regs([typ for _, typ in func.args])
+        for (arg, typ), (kind, regs) in zip(func.args, assigned):
+            if isinstance(regs, int):
+                # stack arguments are above the saved frame record
+                src = Location("x29", 16 + regs)
+                if kind == "ref":
+                    self.access("ldr", "x15", src, 8)
+                    src = Location("x15")
+                self.load_from(src, typ, arg)
+            elif kind == "ref":
+                self.copy_mem(Location(regs[0]), self.loc(arg), size_align(typ)[0])
+            elif is_aggregate(typ):
+                self.from_regs(regs, typ, self.loc(arg))
+            elif is_float(typ):
+                self.store_float(regs[0], typ, self.loc(arg))
+            else:
+                self.store_int(regs[0], typ, self.loc(arg))
+
+        for pos, instr in enumerate(func.body):
+            tree = forest.roots.get(pos)
+            if tree is not None:
+                self.select(tree, instr)
+            elif pos not in forest.folded:
+                self.instr(instr)
+
+        if not self.instrs or self.instrs[-1] != ("ret",):
+            self.emit("mov", "x0", "#0")
+            self.epilogue()
+
+        frame_size = align_to(self.frame_size, 16)
+        body = self.instrs
+        self.instrs = [(f"{name}:",), ("stp", "x29", "x30", "[sp, #-16]!"), ("mov", "x29", "sp")]
+        if frame_size >= 4096:
+            self.load_imm("x16", frame_size)
+            self.emit("sub", "sp", "sp", "x16")
+        elif frame_size:
+            self.emit("sub", "sp", "sp", f"#{frame_size}")
+        counts = None if self.stats is None else self.stats.setdefault("peephole", dict())
+        return peephole.run(self.instrs + body, PEEPHOLE, counts)
+
+    def write_function(self, out, instrs):
+        lines = list()
+        for instr in instrs:
+            if instr[0].endswith(":"):
+                lines.append(instr[0] + "\n")
+            elif len(instr) == 1:
+                lines.append(f"\t{instr[0]}\n")
+            else:
+                lines.append(f"\t{instr[0]}\t{', '.join(instr[1:])}\n")
+        out.write("".join(lines))
+
+    def merge(self, result):
+        """the instructions of a function from _function() with the string labels of the module"""
+        instrs, strings, stats = result
+        if self.stats is not None:
+            parallel.merge_stats(self.stats, stats)
+
+        labels = {label: self.string(const) for const, label in strings.items()}
+        if all(label == new for label, new in labels.items()):
+            return instrs
+        # labels only show up as the operand of adrp and the :lo12: of the add after it
+        labels.update({f":lo12:{label}": f":lo12:{new}" for label, new in labels.items()})
+        return [tuple(labels.get(val, val) for val in instr) for instr in instrs]
+
+    def generate(self, out, jobs=1):
+        program = self.program
+        out.write(f"// generated by mylang from module {program.name}\n")
+        out.write("\t.text\n")
+
+        results = parallel.map_functions(program, AArch64Generator, _function, jobs)
+        for func in program.functions.values():
+            name = func_name(func.name)
+            out.write(f"\n\t.globl {name}\n\t.type {name}, %function\n\t.p2align 2\n")
+            self.write_function(out, self.merge(next(results)))
+            out.write(f"\t.size {name}, .-{name}\n")
+
+        out.write("\n\t.p2align 2\n")
+        self.write_function(out, self.merge(next(results)))
+        out.write('\n\t.section .init_array,"aw"\n\t.p2align 3\n\t.xword ml__init\n')
+
+        if "main" in program.functions:
+            # the C runtime passes argc as an int
+            out.write("\n\t.text\n\t.globl main\n\t.type main, %function\n\t.p2align 2\nmain:\n")
+            out.write("\tsxtw\tx0, w0\n\tb\tml_main\n\t.size main, .-main\n")
+
+        if program.globals:
+            out.write("\n\t.bss\n")
+            for name, typ in program.globals.items():
+                size, align = size_align(typ)
+                out.write(f"\t.p2align 3\n{func_name(name)}:\n\t.zero {align_to(max(size, 1), 8)}\n")
+
+        if self.strings:
+            out.write("\n\t.section .rodata\n")
+            for const, label in self.strings.items():
+                data = ", ".join(str(b) for b in const) or "0"
+                out.write(f"{label}:\n\t.byte {data}\n")
+
+        out.write('\n\t.section .note.GNU-stack,"",%progbits\n')
+        return True
+
+    def generate_object(self, obj, jobs=1):
+        """the same as generate() into the elf.Object obj"""
+        program = self.program
+        text = obj.section(".text", elf.SHT_PROGBITS, elf.SHF_ALLOC | elf.SHF_EXECINSTR, 4)
+        encoder = encode_aarch64.Encoder(text)
+
+        def function(name, instrs, bind, type):
+            start = len(text.data)
+            encoder.function(instrs)
+            obj.define(name, text, start, len(text.data) - start, bind, type)
+
+        results = parallel.map_functions(program, AArch64Generator, _function, jobs)
+        for func in program.functions.values():
+            function(func_name(func.name), self.merge(next(results)), elf.STB_GLOBAL, elf.STT_FUNC)
+        function("ml__init", self.merge(next(results)), elf.STB_LOCAL, elf.STT_NOTYPE)
+        init_array = obj.section(".init_array", elf.SHT_INIT_ARRAY, elf.SHF_WRITE | elf.SHF_ALLOC, 8)
+        encode_aarch64.init_array(init_array, "ml__init")
+
+        if "main" in program.functions:
+            # the C runtime passes argc as an int
+            function("main", [("sxtw", "x0", "w0"), ("b", "ml_main")], elf.STB_GLOBAL, elf.STT_FUNC)
+
+        if program.globals:
+            bss = obj.section(".bss", elf.SHT_NOBITS, elf.SHF_WRITE | elf.SHF_ALLOC)
+            for name, typ in program.globals.items():
+                size, align = size_align(typ)
+                bss.align_to(8)
+                obj.define(func_name(name), bss, bss.size)
+                bss.size += align_to(max(size, 1), 8)
+
+        if self.strings:
+            rodata = obj.section(".rodata", elf.SHT_PROGBITS, elf.SHF_ALLOC)
+            for const, label in self.strings.items():
+                obj.define(label, rodata, len(rodata.data))
+                rodata.data += const or b"\0"
+
+        obj.section(".note.GNU-stack", elf.SHT_PROGBITS, 0)
+        return True
+
+
+def _function(gen, func):
+    # runs in the asm_gen.parallel workers, gen only keeps the program between functions
+    gen.stats = dict()
+    gen.strings = dict()
+    name = "ml__init" if func is gen.program.init else func_name(func.name)
+    return gen.function(func, name), gen.strings, gen.stats
+
+
+def generate(src, program, out, stats=None, jobs=1) -> bool:
+    return AArch64Generator(program, stats).generate(out, jobs)
+
+
+def generate_object(src, program, out, stats=None, jobs=1) -> bool:
+    obj = elf.Object(elf.EM_AARCH64)
+    if not AArch64Generator(program, stats).generate_object(obj, jobs):
+        return False
+    obj.write(out)
+    return True
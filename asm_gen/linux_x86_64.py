@@ -0,0 +1,1117 @@
+import re
+import struct
+
+import ir.core as ir
+from ir.core import OpEnum
+from ir.program import is_int
+from ir.vm import wrap_int, round_f32
+from asm_gen.layout import size_align, align_to, member_offset, flatten, is_aggregate, is_float
+from asm_gen import elf, encode_x86_64, isel, parallel, peephole, regalloc
+
+# x86_64 System V backend writing GNU assembler (AT&T syntax)
+#
+# Scalar locals, arguments and uids get registers from asm_gen.regalloc, everything else lives in
+# a stack slot below %rbp. Integer arithmetic and indexing are expression trees which asm_gen.isel
+# covers with the PATTERNS below, the other instructions load their operands into %rax/%rcx
+# (%xmm0/%xmm1 for floats), do the operation and store the result back.
+# Integers are kept sign or zero extended to 64 bits in registers and truncated when stored,
+# which gives the same wraparound as the other backends.
+#
+# Instructions are collected as (mnemonic, operands...) tuples per function, labels are (name + ":",)
+# and every function goes through the asm_gen.peephole rules below before it is written out.
+# Functions get generated by asm_gen.parallel, each by a fresh generator, and the constants they
+# need get merged into the ones of the module in source order.
+#
+# generate_object() writes the same module as an ELF object file with the instructions encoded
+# by asm_gen.encode_x86_64 instead of going through the assembler
+
+INT_ARG_REGS: tuple = ("%rdi", "%rsi", "%rdx", "%rcx", "%r8", "%r9")
+FLOAT_ARG_REGS: tuple = tuple(f"%xmm{i}" for i in range(8))
+INT_RET_REGS: tuple = ("%rax", "%rdx")
+FLOAT_RET_REGS: tuple = ("%xmm0", "%xmm1")
+
+# argument and scratch registers are left out so loading the arguments of a call never clobbers
+# a value which is still needed
+REGISTERS = regalloc.RegisterFile(
+    ("%r10", "%rbx", "%r12", "%r13", "%r14", "%r15"),
+    tuple(f"%xmm{i}" for i in range(8, 15)),
+    ("%rbx", "%r12", "%r13", "%r14", "%r15"),
+)
+
+_SUB_REGS: dict = {
+    "%rax": ("%al", "%ax", "%eax"),
+    "%rcx": ("%cl", "%cx", "%ecx"),
+    "%rdx": ("%dl", "%dx", "%edx"),
+    "%rsi": ("%sil", "%si", "%esi"),
+    "%rdi": ("%dil", "%di", "%edi"),
+    "%r8": ("%r8b", "%r8w", "%r8d"),
+    "%r9": ("%r9b", "%r9w", "%r9d"),
+    "%r10": ("%r10b", "%r10w", "%r10d"),
+    "%r11": ("%r11b", "%r11w", "%r11d"),
+    "%rbx": ("%bl", "%bx", "%ebx"),
+    "%r12": ("%r12b", "%r12w", "%r12d"),
+    "%r13": ("%r13b", "%r13w", "%r13d"),
+    "%r14": ("%r14b", "%r14w", "%r14d"),
+    "%r15": ("%r15b", "%r15w", "%r15d"),
+}
+
+_SUFFIX: dict = {1: "b", 2: "w", 4: "l", 8: "q"}
+
+_INT_OPS: dict = {"ADD": "addq", "SUB": "subq", "MUL": "imulq", "AND": "andq", "OR": "orq", "XOR": "xorq"}
+
+_FLOAT_OPS: dict = {
+    OpEnum.BIN_ADD: "add",
+    OpEnum.BIN_SUB: "sub",
+    OpEnum.BIN_MUL: "mul",
+    OpEnum.BIN_DIV: "div",
+}
+
+
+def sub_reg(reg, size):
+    if size == 8:
+        return reg
+    return _SUB_REGS[reg][(1, 2, 4).index(size)]
+
+
+def func_name(name):
+    return "ml_" + name.replace(".", "__")
+
+
+def float_suffix(typ):
+    return "sd" if typ.bit_length == 64 else "ss"
+
+
+def is_reg(loc):
+    return isinstance(loc, str)
+
+
+def classify(typ):
+    """System V classes of the eightbytes of a value, None if it is passed in memory"""
+    if not is_aggregate(typ):
+        return ["SSE" if is_float(typ) else "INTEGER"]
+
+    size, _ = size_align(typ)
+    if size > 16:
+        return None
+
+    classes = ["SSE"] * ((size + 7) // 8)
+    for offset, scalar in flatten(typ):
+        if not is_float(scalar):
+            classes[offset // 8] = "INTEGER"
+    return classes
+
+
+class Location:
+    """memory operand, base is a register or a symbol (which is %rip relative), only a register
+    base can have an index register scaled by 1, 2, 4 or 8"""
+    __slots__ = "base", "disp", "index", "scale"
+    def __init__(self, base, disp=0, index=None, scale=1):
+        self.base = base
+        self.disp = disp
+        self.index = index
+        self.scale = scale
+
+    def __add__(self, disp):
+        return Location(self.base, self.disp + disp, self.index, self.scale)
+
+    def __str__(self):
+        if self.index is not None:
+            return f"{self.disp}({self.base},{self.index},{self.scale})"
+        if self.base.startswith("%"):
+            return f"{self.disp}({self.base})"
+        return f"{self.base}{'+' if self.disp else ''}{self.disp or ''}(%rip)"
+
+
+# peephole rules, the scratch registers make most of the moves they remove
+
+_REG_NAMES: dict = {sub: reg for reg, subs in _SUB_REGS.items() for sub in subs}
+_REG_RE = re.compile(r"%[a-z0-9]+")
+
+_LIVE_AT_RET: tuple = ("%rax", "%rdx", "%xmm0", "%xmm1", "%rsp", "%rbp", *REGISTERS.callee_saved)
+
+# two operand instructions which read both operands and write the second one
+_ALU: frozenset = frozenset(("addq", "subq", "imulq", "andq", "orq", "xorq",
+    "addsd", "subsd", "mulsd", "divsd", "addss", "subss", "mulss", "divss"))
+_SHIFTS: frozenset = frozenset(("shlq", "sarq", "shrq"))
+_FLAG_READERS: tuple = ("j", "set", "cmov", "adc", "sbb")
+_MOVES: tuple = ("movq", "movaps", "movsd", "movss")
+
+
+def _is_register(operand):
+    return isinstance(operand, str) and operand.startswith("%")
+
+
+def _regs(operand):
+    """the full registers an operand uses"""
+    if isinstance(operand, Location):
+        regs = {operand.base} if operand.base.startswith("%") else set()
+        return regs if operand.index is None else regs | {operand.index}
+    return {_REG_NAMES.get(reg, reg) for reg in _REG_RE.findall(operand)}
+
+
+def _uses(instr):
+    op, *operands = instr
+    if op.endswith(":") or op in ("call", "ret") or op.startswith("j"):
+        return None
+    match op:
+        case "cqto":
+            return {"%rax"}, {"%rdx"}
+        case "idivq" | "divq":
+            return {"%rax", "%rdx", *_regs(operands[0])}, {"%rax", "%rdx"}
+        case "leave":
+            return {"%rbp"}, {"%rsp", "%rbp"}
+        case "pushq":
+            return {"%rsp", *_regs(operands[0])}, {"%rsp"}
+    if not operands:
+        return None
+
+    reads = set()
+    for operand in operands[:-1]:
+        reads |= _regs(operand)
+    dst = operands[-1]
+    if not _is_register(dst):
+        return reads | _regs(dst), set()
+
+    dst_reg = _REG_NAMES.get(dst, dst)
+    if op in ("xorl", "xorps") and operands[0] == dst:
+        return set(), {dst_reg}
+    # byte and word moves keep the rest of the register, the upper lanes of xmm registers are
+    # never used so scalar moves and conversions count as writing all of it
+    if op.startswith(("mov", "lea", "cvt")) and op not in ("movb", "movw"):
+        return reads, {dst_reg}
+    return reads | {dst_reg}, {dst_reg}
+
+
+def _self_move(target, instrs, i):
+    op, *operands = instrs[i]
+    if op in ("movq", "movaps") and _is_register(operands[0]) and operands[0] == operands[1]:
+        return 1, []
+    return None
+
+
+def _reload(target, instrs, i):
+    # movq %rax, -8(%rbp); movq -8(%rbp), %rax
+    (op, *first), (op2, *second) = instrs[i : i + 2]
+    if op == op2 and op in ("movq", "movaps", "movsd", "movss") and len(first) == 2 \
+        and (_is_register(first[0]) or _is_register(first[1])) \
+        and str(first[0]) == str(second[1]) and str(first[1]) == str(second[0]):
+        return 2, [instrs[i]]
+    return None
+
+
+def _copy_forward(target, instrs, i):
+    # movq $3, %rcx; addq %rcx, %rax -> addq $3, %rax
+    (mov, *first), (op, *second) = instrs[i : i + 2]
+    if len(first) != 2 or len(second) != 2:
+        return None
+    src, tmp = first
+    if not _is_register(tmp) or second[0] != tmp or second[1] == tmp:
+        return None
+
+    if op in _ALU:
+        if not _is_register(second[1]):
+            return None
+        if mov == "movq" and op.endswith("q"):
+            pass
+        elif mov == "movaps" and op.endswith(("sd", "ss")) and _is_register(src):
+            pass
+        elif mov in ("movsd", "movss") and op.endswith(mov[-2:]) and isinstance(src, Location):
+            pass
+        else:
+            return None
+        new = (op, src, second[1])
+    elif mov == op == "movq" and (_is_register(src) or _is_register(second[1])
+        or (isinstance(src, str) and src.startswith("$"))):
+        new = (op, src, second[1])
+    elif mov in ("movaps", "movsd", "movss") and op == "movaps" and _is_register(second[1]):
+        new = (mov, src, second[1])
+    elif mov == "movaps" and op in ("movsd", "movss") and not _is_register(second[1]):
+        new = (op, src, second[1])
+    else:
+        return None
+
+    if not peephole.dead_after(target, instrs, i + 1, tmp):
+        return None
+    return 2, [new]
+
+
+def _shift_imm(target, instrs, i):
+    # movq $3, %rcx; sarq %cl, %rax -> sarq $3, %rax
+    (mov, *first), (op, *second) = instrs[i : i + 2]
+    if mov != "movq" or first[1] != "%rcx" or op not in _SHIFTS or second[0] != "%cl" \
+        or not first[0].startswith("$") or not 0 <= int(first[0][1:]) < 64:
+        return None
+    if not peephole.dead_after(target, instrs, i + 1, "%rcx"):
+        return None
+    return 2, [(op, first[0], second[1])]
+
+
+def _retarget(target, instrs, i):
+    # movq %r10, %rax; imulq $31, %rax; addq $1, %rax; movq %rax, %rbx
+    # -> movq %r10, %rbx; imulq $31, %rbx; addq $1, %rbx
+    # which also works starting with an instruction which only writes tmp, like leaq
+    mov, *first = instrs[i]
+    pure = mov == "leaq" or (mov == "imulq" and len(first) == 3)
+    if not pure and (mov not in ("movq", "movaps", "movsd", "movss") or len(first) != 2):
+        return None
+    *srcs, tmp = first
+    if not _is_register(tmp) or (mov in ("movsd", "movss") and _is_register(srcs[0])):
+        return None
+
+    # operations on tmp up to the move out of it
+    end = i + 1
+    while end < len(instrs):
+        op, *operands = instrs[end]
+        if op in ("movq", "movaps") or not operands or operands[-1] != tmp:
+            break
+        if not ((len(operands) == 1 and op in ("negq", "notq")) or (len(operands) == 2
+            and (op in _ALU or op in _SHIFTS or op == "xorps") and operands[0] != tmp)):
+            return None
+        end += 1
+    if (end == i + 1 and not pure) or end == len(instrs):
+        return None
+
+    mov2, *last = instrs[end]
+    if mov2 not in ("movq", "movaps") or last[0] != tmp or not _is_register(last[1]):
+        return None
+    dst = last[1]
+    if any(dst in _regs(operand) for instr in instrs[i + 1 : end] for operand in instr[1:-1]):
+        return None
+    if not peephole.dead_after(target, instrs, end, tmp):
+        return None
+    return end + 1 - i, [(mov, *srcs, dst), *((op, *operands[:-1], dst) for op, *operands in instrs[i + 1 : end])]
+
+
+def _dead_write(target, instrs, i):
+    # movq %rdi, %r10; movq %rsi, %r10, only moves and leaq as they leave the flags alone
+    op, *operands = instrs[i]
+    if not op.startswith(("mov", "lea", "cvt")) or op in ("movb", "movw") or not operands \
+        or not _is_register(operands[-1]):
+        return None
+    reg = _REG_NAMES.get(operands[-1], operands[-1])
+    if not peephole.dead_after(target, instrs, i, reg):
+        return None
+    return 1, []
+
+
+def _identity(target, instrs, i):
+    # addq $0, %rax, the flags are only left alone if nothing reads them
+    op, *operands = instrs[i]
+    if len(operands) != 2:
+        return None # imulq $1, %r10, %rax copies
+    if not ((op in ("addq", "subq", "orq", "xorq", *_SHIFTS) and operands[0] == "$0")
+        or (op == "imulq" and operands[0] == "$1")):
+        return None
+    if i + 1 < len(instrs) and instrs[i + 1][0].startswith(_FLAG_READERS):
+        return None
+    return 1, []
+
+
+PEEPHOLE = peephole.Target(
+    rules=(
+        peephole.Rule("self-move", 1, _self_move, ("movq", "movaps")),
+        peephole.Rule("arith-identity", 1, _identity,
+            ("addq", "subq", "orq", "xorq", "imulq", *_SHIFTS)),
+        peephole.Rule("load-after-store", 2, _reload, _MOVES),
+        peephole.Rule("copy-forward", 2, _copy_forward, _MOVES),
+        peephole.Rule("shift-imm", 2, _shift_imm, ("movq",)),
+        peephole.Rule("retarget", 2, _retarget, (*_MOVES, "leaq", "imulq")),
+        peephole.Rule("dead-write", 1, _dead_write),
+    ),
+    uses=_uses, jump="jmp", ret="ret", live_at_ret=_LIVE_AT_RET,
+)
+
+
+# instruction selection, asm_gen.isel covers the integer expression trees with these patterns:
+#   reg    scratch register of the tree holding the value, extended to 64 bits
+#   src    register the value is already in
+#   mem    8 bytes of memory the value is already in
+#   imm    constant which fits into 32 bits
+#   scale  constant 1, 2, 4 or 8 to multiply an index with
+#   base   register with the address of the first element of a slice
+#   addr   Location of an element
+# The costs are instructions. %rax, %rcx and %rdx stay out of the scratch registers for division
+# and shifts by a register, %r11 and %xmm0 for copying the element of an indexing. Shifts and
+# divisions follow ir.vm: shift counts get checked with cmov unless they are constants below 64,
+# and signed 64-bit divisions divide by 1 instead of -1 so INT64_MIN / -1 doesn't trap.
+
+def _result(sel, node, reg):
+    sel.gen.extend(reg, node.typ)
+    return reg
+
+
+def _operand(val):
+    return f"${val}" if isinstance(val, int) else val
+
+
+def _in_reg(gen, node):
+    return gen.type_of(node.val) == node.typ and is_reg(gen.loc(node.val))
+
+
+def _in_mem(gen, node):
+    return gen.type_of(node.val) == node.typ and size_align(node.typ)[0] == 8 \
+        and not is_reg(gen.loc(node.val))
+
+
+def _imm32(gen, node):
+    return -(1 << 31) <= isel.const(node) < (1 << 31)
+
+
+def _load(sel, node):
+    reg = sel.take()
+    sel.gen.load_int(node.val, node.typ, reg)
+    return reg
+
+
+def _copy(sel, node, src):
+    reg = sel.take()
+    sel.gen.emit("movq", src, reg)
+    return reg
+
+
+def _alu(op):
+    def emit(sel, node, dst, src):
+        sel.gen.emit(_INT_OPS[op], _operand(src), dst)
+        sel.release(src)
+        return _result(sel, node, dst)
+    return emit
+
+
+def _imul3(sel, node, src, imm):
+    reg = sel.take()
+    sel.gen.emit("imulq", f"${imm}", src, reg)
+    return _result(sel, node, reg)
+
+
+def _lea(sel, node, base, index, scale=1):
+    sel.release(base, index)
+    reg = sel.take()
+    sel.gen.emit("leaq", Location(base, 0, index, scale), reg)
+    return _result(sel, node, reg)
+
+
+def _lea_disp(sel, node, base, disp):
+    sel.release(base)
+    reg = sel.take()
+    sel.gen.emit("leaq", Location(base, disp), reg)
+    return _result(sel, node, reg)
+
+
+def _shift_op(node):
+    if node.op == "SHL":
+        return "shlq"
+    return "sarq" if isinstance(node.typ, ir.IntType) else "shrq"
+
+
+def _shift_in_range(gen, node, dst, amount):
+    return 0 <= isel.const(amount) < 64
+
+
+def _shift(sel, node, dst, amount):
+    sel.gen.emit(_shift_op(node), f"${amount}", dst)
+    return _result(sel, node, dst)
+
+
+def _shift_cl(sel, node, dst, amount):
+    # shifts by a register only use the low 6 bits of %cl, ir.vm shifts every bit out when the
+    # count (unsigned) is 64 or more: the result is 0, or the sign for sarq which shifts by 63
+    gen = sel.gen
+    op = _shift_op(node)
+    gen.emit("movq", amount, "%rcx")
+    sel.release(amount)
+    if op == "sarq":
+        gen.emit("movq", "$63", "%rax")
+        gen.emit("cmpq", "%rax", "%rcx")
+        gen.emit("cmovaq", "%rax", "%rcx")
+        gen.emit(op, "%cl", dst)
+    else:
+        gen.emit(op, "%cl", dst)
+        gen.emit("xorl", "%eax", "%eax")
+        gen.emit("cmpq", "$63", "%rcx")
+        gen.emit("cmovaq", "%rax", dst)
+    return _result(sel, node, dst)
+
+
+def _divide(sel, node, dst, src):
+    gen = sel.gen
+    gen.emit("movq", dst, "%rax")
+    if isinstance(node.typ, ir.IntType) and size_align(node.typ)[0] == 8:
+        # idivq traps on INT64_MIN / -1 which wraps around to INT64_MIN with a remainder of 0,
+        # dividing -dst by 1 instead gives that. Narrower types can't overflow 64 bits
+        gen.emit("movq", src, "%rcx")
+        gen.emit("movq", "%rax", "%rdx")
+        gen.emit("negq", "%rdx")
+        gen.emit("cmpq", "$-1", "%rcx")
+        gen.emit("cmoveq", "%rdx", "%rax")
+        gen.emit("movq", "$1", "%rdx")
+        gen.emit("cmoveq", "%rdx", "%rcx")
+        gen.emit("cqto")
+        gen.emit("idivq", "%rcx")
+    elif isinstance(node.typ, ir.IntType):
+        gen.emit("cqto")
+        gen.emit("idivq", src)
+    else:
+        gen.emit("xorl", "%edx", "%edx")
+        gen.emit("divq", src)
+    gen.emit("movq", "%rax" if node.op == "DIV" else "%rdx", dst)
+    sel.release(src)
+    return _result(sel, node, dst)
+
+
+def _unary(sel, node, dst):
+    sel.gen.emit("negq" if node.op == "NEG" else "notq", dst)
+    return _result(sel, node, dst)
+
+
+def _base(sel, node):
+    reg = sel.take()
+    sel.gen.emit("movq" if node.typ.len is None else "leaq", sel.gen.loc(node.val), reg)
+    return reg
+
+
+def _elem_size(node):
+    return size_align(node.typ.type)[0]
+
+
+def _scaled(gen, node, *operands):
+    return _elem_size(node) in (1, 2, 4, 8)
+
+
+def _disp_fits(gen, node, *operands):
+    return -(1 << 31) <= isel.const(operands[-1]) * _elem_size(node) < (1 << 31)
+
+
+def _index(sel, node, base, index):
+    size = _elem_size(node)
+    if size in (1, 2, 4, 8):
+        sel.gen.emit("leaq", Location(base, 0, index, size), base)
+    else:
+        sel.gen.emit("imulq", f"${size}", index)
+        sel.gen.emit("addq", index, base)
+    sel.release(index)
+    return Location(base)
+
+
+def _index_scaled(sel, node, base, index, disp=0):
+    size = _elem_size(node)
+    return Location(base, disp * size, index, size)
+
+
+def _index_disp(sel, node, base, disp):
+    return Location(base, disp * _elem_size(node))
+
+
+def _rules():
+    Rule = isel.Rule
+    yield Rule("reg", "VAL", 1, _load)
+    yield Rule("reg", "CONST", 1, _load)
+    yield Rule("src", "VAL", 0, lambda sel, node: sel.gen.loc(node.val), _in_reg)
+    yield Rule("mem", "VAL", 0, lambda sel, node: sel.gen.loc(node.val), _in_mem)
+    yield Rule("imm", "CONST", 0, lambda sel, node: isel.const(node), _imm32)
+    yield Rule("scale", "CONST", 0, lambda sel, node: isel.const(node),
+        lambda gen, node: isel.const(node) in (1, 2, 4, 8))
+    yield Rule("reg", "src", 1, _copy)
+    yield Rule("reg", "mem", 1, _copy)
+
+    for op in _INT_OPS:
+        for src in ("reg", "src", "mem", "imm"):
+            yield Rule("reg", (op, "reg", src), 1, _alu(op))
+    yield Rule("reg", ("MUL", "src", "imm"), 1, _imul3)
+    yield Rule("reg", ("MUL", "mem", "imm"), 1, _imul3)
+
+    # three operand additions
+    yield Rule("reg", ("ADD", "src", "src"), 1, _lea)
+    yield Rule("reg", ("ADD", "src", "imm"), 1, _lea_disp)
+    for base in ("reg", "src"):
+        for index in ("reg", "src"):
+            yield Rule("reg", ("ADD", base, ("MUL", index, "scale")), 1, _lea)
+            yield Rule("reg", ("ADD", base, ("SHL", index, "imm")), 1,
+                lambda sel, node, base, index, shift: _lea(sel, node, base, index, 1 << shift),
+                lambda gen, node, base, index, shift: 0 <= isel.const(shift) <= 3)
+
+    for op in ("SHL", "SHR"):
+        yield Rule("reg", (op, "reg", "imm"), 1, _shift, _shift_in_range)
+        yield Rule("reg", (op, "reg", "reg"), 2, _shift_cl)
+        yield Rule("reg", (op, "reg", "src"), 2, _shift_cl)
+    for op in ("DIV", "MOD"):
+        for src in ("reg", "src", "mem"):
+            yield Rule("reg", (op, "reg", src), 4, _divide)
+    yield Rule("reg", ("NEG", "reg"), 1, _unary)
+    yield Rule("reg", ("NOT", "reg"), 1, _unary)
+
+    yield Rule("base", "BASE", 1, _base)
+    yield Rule("addr", ("INDEX", "base", "reg"), 1, _index)
+    yield Rule("addr", ("INDEX", "base", "reg"), 0, _index_scaled, _scaled)
+    yield Rule("addr", ("INDEX", "base", "src"), 0, _index_scaled, _scaled)
+    yield Rule("addr", ("INDEX", "base", "imm"), 0, _index_disp, _disp_fits)
+    for index in ("reg", "src"):
+        yield Rule("addr", ("INDEX", "base", ("ADD", index, "imm")), 0, _index_scaled,
+            lambda gen, node, *operands: _scaled(gen, node) and _disp_fits(gen, node, *operands))
+
+
+PATTERNS = isel.Patterns(_rules(), ("%rsi", "%rdi", "%r8", "%r9"), naive_nts=("reg", "base"))
+
+
+class X86Generator:
+    __slots__ = "program", "stats", "patterns", "func", "instrs", "slots", "regs", "saved", \
+        "frame_size", "sret", "rodata", "consts"
+    def __init__(self, program, stats=None):
+        self.program = program
+        self.stats = stats # see asm_gen.gen_asm
+        self.patterns = PATTERNS # isel.Patterns the expression trees get covered with
+        self.func = None
+        self.instrs = None
+        self.slots = None
+        self.regs = None # regalloc.Allocation of the function
+        self.saved = None # (callee saved register, slot)
+        self.frame_size = 0
+        self.sret = None
+        self.rodata = list() # (label, directive)
+        self.consts = dict()
+
+    def emit(self, op, *operands):
+        self.instrs.append((op, *operands))
+
+    def type_of(self, val):
+        return self.program.type_of(self.func, val)
+
+    def const_label(self, directive, align):
+        label = self.consts.get(directive)
+        if label is None:
+            label = self.consts[directive] = f".LC{len(self.consts)}"
+            self.rodata.append((label, directive, align))
+        return label
+
+    def alloc(self, typ):
+        size, align = size_align(typ)
+        size = align_to(max(size, 1), 8)
+        self.frame_size = align_to(self.frame_size + size, max(align, 8))
+        return Location("%rbp", -self.frame_size)
+
+    def loc(self, val):
+        """register or memory location of a named value or uid"""
+        if isinstance(val, str) and val not in self.func.locals:
+            return Location(func_name(val))
+
+        reg = self.regs.regs.get(val)
+        if reg is not None:
+            return reg
+
+        loc = self.slots.get(val)
+        if loc is None:
+            typ = self.func.locals[val] if isinstance(val, str) else self.func.types[val]
+            loc = self.slots[val] = self.alloc(typ)
+        return loc
+
+    # loading and storing scalars
+
+    def extend(self, reg, typ):
+        """sign or zero extends the low bits of reg to 64 bits"""
+        size, _ = size_align(typ)
+        if size == 8 or not is_int(typ):
+            return
+        if size == 4 and isinstance(typ, ir.UintType):
+            self.emit("movl", sub_reg(reg, 4), sub_reg(reg, 4))
+        else:
+            sign = "s" if isinstance(typ, ir.IntType) else "z"
+            self.emit(f"mov{sign}{_SUFFIX[size]}q", sub_reg(reg, size), reg)
+
+    def load_mem_int(self, mem, typ, reg):
+        size, _ = size_align(typ)
+        if size == 8:
+            self.emit("movq", mem, reg)
+        elif size == 4 and not isinstance(typ, ir.IntType):
+            self.emit("movl", mem, sub_reg(reg, 4))
+        else:
+            sign = "s" if isinstance(typ, ir.IntType) else "z"
+            self.emit(f"mov{sign}{_SUFFIX[size]}q", mem, reg)
+
+    def load_int(self, val, typ, reg):
+        """loads an operand converted to the integer (or pointer) type typ into a 64 bit register"""
+        src_typ = self.type_of(val)
+
+        if isinstance(val, ir.Constant):
+            const = int(val.const) if val.const is not None else 0
+            if is_int(typ):
+                const = wrap_int(const, typ)
+            if -(1 << 31) <= const < (1 << 31):
+                self.emit("movq", f"${const}", reg)
+            else:
+                self.emit("movabsq", f"${const}", reg)
+        elif is_float(src_typ):
+            src = self.loc(val)
+            if not is_reg(src):
+                self.emit(f"movs{float_suffix(src_typ)[1]}", src, "%xmm15")
+                src = "%xmm15"
+            self.emit(f"cvtt{float_suffix(src_typ)}2siq", src, reg)
+            self.extend(reg, typ)
+        else:
+            src = self.loc(val)
+            if not is_reg(src):
+                self.load_mem_int(src, src_typ, reg)
+            elif src != reg:
+                self.emit("movq", src, reg)
+            if is_int(typ) and src_typ != typ:
+                self.extend(reg, typ)
+
+    def load_float(self, val, typ, reg):
+        """loads an operand converted to the float type typ into an xmm register"""
+        src_typ = self.type_of(val)
+        suffix = float_suffix(typ)
+
+        if isinstance(val, ir.Constant):
+            if typ.bit_length == 64:
+                bits = struct.unpack("<Q", struct.pack("<d", float(val.const)))[0]
+                label = self.const_label(f".quad {bits}", 8)
+            else:
+                bits = struct.unpack("<I", struct.pack("<f", round_f32(float(val.const))))[0]
+                label = self.const_label(f".long {bits}", 4)
+            self.emit(f"movs{suffix[1]}", Location(label), reg)
+        elif is_float(src_typ):
+            src_suffix = float_suffix(src_typ)
+            src = self.loc(val)
+            if src_suffix != suffix:
+                self.emit(f"cvt{src_suffix}2{suffix}", src, reg)
+            elif not is_reg(src):
+                self.emit(f"movs{src_suffix[1]}", src, reg)
+            elif src != reg:
+                self.emit("movaps", src, reg)
+        else:
+            self.load_int(val, ir.IntType(None, 64), "%rax")
+            self.emit(f"cvtsi2{suffix}q", "%rax", reg)
+
+    def store_int(self, reg, typ, dst):
+        if is_reg(dst):
+            # registers hold the value extended to 64 bits
+            if reg != dst:
+                self.emit("movq", reg, dst)
+            self.extend(dst, typ)
+            return
+        size, _ = size_align(typ)
+        self.emit(f"mov{_SUFFIX[size]}", sub_reg(reg, size), dst)
+
+    def store_float(self, reg, typ, dst):
+        if not is_reg(dst):
+            self.emit(f"movs{float_suffix(typ)[1]}", reg, dst)
+        elif reg != dst:
+            self.emit("movaps", reg, dst)
+
+    # moving whole values around
+
+    def copy_mem(self, src, dst, size):
+        pos = 0
+        for chunk in (8, 4, 2, 1):
+            while size - pos >= chunk:
+                self.emit(f"mov{_SUFFIX[chunk]}", src + pos, sub_reg("%r11", chunk))
+                self.emit(f"mov{_SUFFIX[chunk]}", sub_reg("%r11", chunk), dst + pos)
+                pos += chunk
+
+    def zero_mem(self, dst, size):
+        self.emit("xorl", "%r11d", "%r11d")
+        pos = 0
+        for chunk in (8, 4, 2, 1):
+            while size - pos >= chunk:
+                self.emit(f"mov{_SUFFIX[chunk]}", sub_reg("%r11", chunk), dst + pos)
+                pos += chunk
+
+    def store_value(self, val, typ, dst):
+        """stores an operand converted to typ into a register or memory"""
+        if is_reg(dst) and val is None:
+            self.emit(*(("xorps", dst, dst) if is_float(typ) else ("xorl", sub_reg(dst, 4), sub_reg(dst, 4))))
+        elif is_reg(dst) and is_float(typ):
+            self.load_float(val, typ, dst)
+        elif is_reg(dst):
+            self.load_int(val, typ, dst)
+        elif val is None:
+            self.zero_mem(dst, size_align(typ)[0])
+        elif is_float(typ):
+            self.load_float(val, typ, "%xmm0")
+            self.store_float("%xmm0", typ, dst)
+        elif not is_aggregate(typ):
+            self.load_int(val, typ, "%rax")
+            self.store_int("%rax", typ, dst)
+        elif isinstance(val, ir.Constant):
+            # string literal
+            label = self.const_label(".byte " + ", ".join(str(b) for b in val.const or b"\0"), 1)
+            if typ.len is None:
+                self.emit("leaq", Location(label), "%rax")
+                self.emit("movq", "%rax", dst)
+                self.emit("movq", f"${len(val.const)}", dst + 8)
+            else:
+                size, _ = size_align(typ)
+                self.zero_mem(dst, size)
+                self.copy_mem(Location(label), dst, min(size, len(val.const)))
+        else:
+            src_typ = self.type_of(val)
+            if isinstance(typ, ir.SliceType) and typ.len is None and src_typ.len is not None:
+                self.emit("leaq", self.loc(val), "%rax")
+                self.emit("movq", "%rax", dst)
+                self.emit("movq", f"${src_typ.len}", dst + 8)
+            else:
+                self.copy_mem(self.loc(val), dst, size_align(typ)[0])
+
+    def load_from(self, src, typ, ret):
+        """copies a value of type typ from memory into the register or slot of ret"""
+        dst = self.loc(ret)
+        if is_float(typ) and is_reg(dst):
+            self.emit(f"movs{float_suffix(typ)[1]}", src, dst)
+        elif is_float(typ):
+            self.emit(f"movs{float_suffix(typ)[1]}", src, "%xmm0")
+            self.store_float("%xmm0", typ, dst)
+        elif is_aggregate(typ):
+            self.copy_mem(src, dst, size_align(typ)[0])
+        elif is_reg(dst):
+            self.load_mem_int(src, typ, dst)
+        else:
+            self.load_mem_int(src, typ, "%rax")
+            self.store_int("%rax", typ, dst)
+
+    def materialize(self, val, typ):
+        """memory holding an operand converted to typ"""
+        if not isinstance(val, ir.Constant) and self.type_of(val) == typ:
+            return self.loc(val)
+        loc = self.alloc(typ)
+        self.store_value(val, typ, loc)
+        return loc
+
+    # instructions
+
+    def call(self, ret, callee, args):
+        func = self.program.callee(callee)
+        ret_classes = classify(func.ret) if not isinstance(func.ret, ir.VoidType) else []
+        sret = ret_classes is None
+
+        int_regs = list(INT_ARG_REGS[1:] if sret else INT_ARG_REGS)
+        float_regs = list(FLOAT_ARG_REGS)
+
+        in_regs = list()
+        on_stack = list()
+        stack_size = 0
+        for arg, (_, typ) in zip(args, func.args):
+            classes = classify(typ)
+            num_int = 0 if classes is None else classes.count("INTEGER")
+            num_float = 0 if classes is None else classes.count("SSE")
+            if classes is None or num_int > len(int_regs) or num_float > len(float_regs):
+                on_stack.append((arg, typ, stack_size))
+                stack_size += align_to(size_align(typ)[0], 8)
+                continue
+
+            regs = [int_regs.pop(0) if cls == "INTEGER" else float_regs.pop(0) for cls in classes]
+            in_regs.append((arg, typ, regs))
+
+        stack_size = align_to(stack_size, 16)
+        if stack_size:
+            self.emit("subq", f"${stack_size}", "%rsp")
+        for arg, typ, offset in on_stack:
+            self.store_value(arg, typ, Location("%rsp", offset))
+
+        # aggregates first, they might need scratch registers to be converted
+        for arg, typ, regs in in_regs:
+            if is_aggregate(typ):
+                mem = self.materialize(arg, typ)
+                for i, reg in enumerate(regs):
+                    self.emit("movq", mem + i * 8, reg)
+        for arg, typ, regs in in_regs:
+            if is_float(typ):
+                self.load_float(arg, typ, regs[0])
+            elif not is_aggregate(typ):
+                self.load_int(arg, typ, regs[0])
+
+        if sret:
+            self.emit("leaq", self.loc(ret), "%rdi")
+        self.emit("call", func_name(func.name))
+        if stack_size:
+            self.emit("addq", f"${stack_size}", "%rsp")
+
+        if isinstance(func.ret, ir.VoidType) or sret:
+            return
+
+        if is_float(func.ret):
+            self.store_float("%xmm0", func.ret, self.loc(ret))
+        elif not is_aggregate(func.ret):
+            self.store_int("%rax", func.ret, self.loc(ret))
+        else:
+            int_regs = list(INT_RET_REGS)
+            float_regs = list(FLOAT_RET_REGS)
+            for i, cls in enumerate(ret_classes):
+                self.emit("movq", int_regs.pop(0) if cls == "INTEGER" else float_regs.pop(0), self.loc(ret) + i * 8)
+
+    def ret(self, val):
+        typ = self.func.ret
+        classes = classify(typ)
+
+        if classes is None:
+            self.emit("movq", self.sret, "%rdi")
+            self.store_value(val, typ, Location("%rdi"))
+            self.emit("movq", self.sret, "%rax")
+        elif is_float(typ):
+            self.load_float(val, typ, "%xmm0")
+        elif not is_aggregate(typ):
+            self.load_int(val, typ, "%rax")
+        else:
+            mem = self.materialize(val, typ)
+            int_regs = list(INT_RET_REGS)
+            float_regs = list(FLOAT_RET_REGS)
+            for i, cls in enumerate(classes):
+                self.emit("movq", mem + i * 8, int_regs.pop(0) if cls == "INTEGER" else float_regs.pop(0))
+
+        self.epilogue()
+
+    def epilogue(self):
+        for reg, slot in self.saved:
+            self.emit("movq", slot, reg)
+        self.emit("leave")
+        self.emit("ret")
+
+    def binary(self, op, ret, lhs, rhs):
+        # the integer operations are expression trees, see select()
+        typ = self.func.types[ret]
+        if op not in _FLOAT_OPS:
+            raise NotImplementedError(f"{op.name} on floats")
+        self.load_float(lhs, typ, "%xmm0")
+        self.load_float(rhs, typ, "%xmm1")
+        self.emit(_FLOAT_OPS[op] + float_suffix(typ), "%xmm1", "%xmm0")
+        self.store_float("%xmm0", typ, self.loc(ret))
+
+    def unary(self, op, ret, expr):
+        typ = self.func.types[ret]
+        self.load_float(expr, typ, "%xmm0")
+        if typ.bit_length == 64:
+            mask = self.const_label(f".quad {1 << 63}, 0", 16)
+        else:
+            mask = self.const_label(f".long {1 << 31}, 0, 0, 0", 16)
+        self.emit("xorps", Location(mask), "%xmm0")
+        self.store_float("%xmm0", typ, self.loc(ret))
+
+    def select(self, tree, instr):
+        """computes the result of instr from its isel tree"""
+        op, _, _, ret, *_ = instr
+        if op == OpEnum.SLICE_INDEXING:
+            self.load_from(isel.select(self, tree, "addr", self.patterns), tree.typ.type, ret)
+            return
+
+        reg = isel.select(self, tree, "reg", self.patterns)
+        dst = self.loc(ret)
+        if not is_reg(dst):
+            self.store_int(reg, tree.typ, dst)
+        elif reg != dst:
+            self.emit("movq", reg, dst) # already extended
+
+    def instr(self, instr):
+        op, _, _, *operands = instr
+
+        match op:
+            case OpEnum.VAR_DECL:
+                name, typ, val = operands
+                if val is None and self.func is self.program.init:
+                    return # globals are zero initialised already
+                self.store_value(val, typ, self.loc(name))
+
+            case OpEnum.ASSIGN:
+                name, val = operands
+                self.store_value(val, self.type_of(name), self.loc(name))
+
+            case OpEnum.MEMBER_ACCESS:
+                ret, obj, member = operands
+                struct = self.type_of(obj)
+                self.load_from(self.loc(obj) + member_offset(struct, member), self.func.types[ret], ret)
+
+            case OpEnum.MEMBER_ASSIGN:
+                obj, member, val = operands
+                struct = self.type_of(obj)
+                self.store_value(val, struct.member(member), self.loc(obj) + member_offset(struct, member))
+
+            case OpEnum.FUNC_CALL:
+                self.call(*operands)
+
+            case OpEnum.RETURN_STMT:
+                self.ret(*operands)
+
+            case OpEnum.UNARY_NEG | OpEnum.UNARY_NOT:
+                self.unary(op, *operands)
+
+            case OpEnum.NOP:
+                pass
+
+            case _:
+                self.binary(op, *operands)
+
+    def function(self, func, name):
+        self.func = func
+        self.instrs = list()
+        self.slots = dict()
+        forest = isel.trees(self.program, func, self.patterns.max_need())
+        self.regs = regalloc.allocate(self.program, func, REGISTERS, set(forest.folded.values()))
+        if self.stats is not None:
+            self.stats.setdefault("regalloc", dict())[func.name] = self.regs.stats
+        self.frame_size = 0
+        self.sret = None
+
+        self.saved = [(reg, self.alloc(ir.IntType(None, 64))) for reg in self.regs.callee_saved]
+        for reg, slot in self.saved:
+            self.emit("movq", reg, slot)
+
+        # move the arguments from the registers into their registers or slots
+        classes = classify(func.ret) if not isinstance(func.ret, ir.VoidType) else []
+        int_regs = list(INT_ARG_REGS)
+        float_regs = list(FLOAT_ARG_REGS)
+        if classes is None:
+            self.sret = self.alloc(ir.PointerType(None, func.ret))
+            self.emit("movq", int_regs.pop(0), self.sret)
+
+        stack_pos = 16
+        for arg, typ in func.args:
+            classes = classify(typ)
+            num_int = 0 if classes is None else classes.count("INTEGER")
+            num_float = 0 if classes is None else classes.count("SSE")
+            if classes is None or num_int > len(int_regs) or num_float > len(float_regs):
+                self.load_from(Location("%rbp", stack_pos), typ, arg)
+                stack_pos += align_to(size_align(typ)[0], 8)
+            elif is_float(typ):
+                self.store_float(float_regs.pop(0), typ, self.loc(arg))
+            elif not is_aggregate(typ):
+                self.store_int(int_regs.pop(0), typ, self.loc(arg))
+            else:
+                for i, cls in enumerate(classes):
+                    reg = int_regs.pop(0) if cls == "INTEGER" else float_regs.pop(0)
+                    self.emit("movq", reg, self.loc(arg) + i * 8)
+
+        for pos, instr in enumerate(func.body):
+            tree = forest.roots.get(pos)
+            if tree is not None:
+                self.select(tree, instr)
+            elif pos not in forest.folded:
+                self.instr(instr)
+
+        if not self.instrs or self.instrs[-1] != ("ret",):
+            self.emit("xorl", "%eax", "%eax")
+            self.epilogue()
+
+        frame_size = align_to(self.frame_size, 16)
+        prologue = [(f"{name}:",), ("pushq", "%rbp"), ("movq", "%rsp", "%rbp")]
+        if frame_size:
+            prologue.append(("subq", f"${frame_size}", "%rsp"))
+        counts = None if self.stats is None else self.stats.setdefault("peephole", dict())
+        return peephole.run(prologue + self.instrs, PEEPHOLE, counts)
+
+    def write_function(self, out, instrs):
+        lines = list()
+        for instr in instrs:
+            if instr[0].endswith(":"):
+                lines.append(instr[0] + "\n")
+            elif len(instr) == 1:
+                lines.append(f"\t{instr[0]}\n")
+            else:
+                lines.append(f"\t{instr[0]}\t{', '.join(str(val) for val in instr[1:])}\n")
+        out.write("".join(lines))
+
+    def merge(self, result):
+        """the instructions of a function from _function() with the constant labels of the module"""
+        instrs, rodata, stats = result
+        if self.stats is not None:
+            parallel.merge_stats(self.stats, stats)
+
+        labels = {label: self.const_label(directive, align) for label, directive, align in rodata}
+        if all(label == new for label, new in labels.items()):
+            return instrs
+        rename = lambda val: Location(labels[val.base], val.disp) \
+            if isinstance(val, Location) and val.base in labels else val
+        return [tuple(rename(val) for val in instr) for instr in instrs]
+
+    def generate(self, out, jobs=1):
+        program = self.program
+        out.write(f"# generated by mylang from module {program.name}\n")
+        out.write("\t.text\n")
+
+        results = parallel.map_functions(program, X86Generator, _function, jobs)
+        for func in program.functions.values():
+            name = func_name(func.name)
+            out.write(f"\n\t.globl {name}\n\t.type {name}, @function\n")
+            self.write_function(out, self.merge(next(results)))
+            out.write(f"\t.size {name}, .-{name}\n")
+
+        out.write("\n")
+        self.write_function(out, self.merge(next(results)))
+        out.write('\n\t.section .init_array,"aw"\n\t.balign 8\n\t.quad ml__init\n')
+
+        if "main" in program.functions:
+            # the C runtime passes argc as an int
+            out.write("\n\t.text\n\t.globl main\n\t.type main, @function\nmain:\n")
+            out.write("\tmovslq\t%edi, %rdi\n\tjmp\tml_main\n\t.size main, .-main\n")
+
+        if program.globals:
+            out.write("\n\t.bss\n")
+            for name, typ in program.globals.items():
+                size, align = size_align(typ)
+                out.write(f"\t.balign {max(align, 8)}\n{func_name(name)}:\n\t.zero {align_to(max(size, 1), 8)}\n")
+
+        if self.rodata:
+            out.write("\n\t.section .rodata\n")
+            for label, directive, align in self.rodata:
+                out.write(f"\t.balign {align}\n{label}:\n\t{directive}\n")
+
+        out.write('\n\t.section .note.GNU-stack,"",@progbits\n')
+        return True
+
+    def generate_object(self, obj, jobs=1):
+        """the same as generate() into the elf.Object obj"""
+        program = self.program
+        text = obj.section(".text", elf.SHT_PROGBITS, elf.SHF_ALLOC | elf.SHF_EXECINSTR)
+        encoder = encode_x86_64.Encoder(text)
+
+        def function(name, instrs, bind, type):
+            start = len(text.data)
+            encoder.function(instrs)
+            obj.define(name, text, start, len(text.data) - start, bind, type)
+
+        results = parallel.map_functions(program, X86Generator, _function, jobs)
+        for func in program.functions.values():
+            function(func_name(func.name), self.merge(next(results)), elf.STB_GLOBAL, elf.STT_FUNC)
+        function("ml__init", self.merge(next(results)), elf.STB_LOCAL, elf.STT_NOTYPE)
+        init_array = obj.section(".init_array", elf.SHT_INIT_ARRAY, elf.SHF_WRITE | elf.SHF_ALLOC, 8)
+        encode_x86_64.init_array(init_array, "ml__init")
+
+        if "main" in program.functions:
+            # the C runtime passes argc as an int
+            function("main", [("movslq", "%edi", "%rdi"), ("jmp", "ml_main")], elf.STB_GLOBAL,
+                elf.STT_FUNC)
+
+        if program.globals:
+            bss = obj.section(".bss", elf.SHT_NOBITS, elf.SHF_WRITE | elf.SHF_ALLOC)
+            for name, typ in program.globals.items():
+                size, align = size_align(typ)
+                bss.align_to(max(align, 8))
+                obj.define(func_name(name), bss, bss.size)
+                bss.size += align_to(max(size, 1), 8)
+
+        if self.rodata:
+            rodata = obj.section(".rodata", elf.SHT_PROGBITS, elf.SHF_ALLOC)
+            for label, directive, align in self.rodata:
+                rodata.align_to(align)
+                obj.define(label, rodata, len(rodata.data))
+                rodata.data += elf.directive_bytes(directive)
+
+        obj.section(".note.GNU-stack", elf.SHT_PROGBITS, 0)
+        return True
+
+
+def _function(gen, func):
+    # runs in the asm_gen.parallel workers, gen only keeps the program between functions
+    gen.stats = dict()
+    gen.rodata = list()
+    gen.consts = dict()
+    name = "ml__init" if func is gen.program.init else func_name(func.name)
+    return gen.function(func, name), gen.rodata, gen.stats
+
+
+def generate(src, program, out, stats=None, jobs=1) -> bool:
+    return X86Generator(program, stats).generate(out, jobs)
+
+
+def generate_object(src, program, out, stats=None, jobs=1) -> bool:
+    obj = elf.Object(elf.EM_X86_64)
+    if not X86Generator(program, stats).generate_object(obj, jobs):
+        return False
+    obj.write(out)
+    return True
+
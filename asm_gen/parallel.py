@@ -0,0 +1,82 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Code generation of the functions of a module in a pool of processes.
+#
+# The functions of a module don't depend on each other's code, so a backend can hand
+# map_functions() a setup(program) giving the per process state (usually a fresh generator) and a
+# work(state, func) doing one function. work has to give back something picklable, the
+# instructions or text of the function plus whatever it collected on the way (constants,
+# statistics), and the backend merges that into the module in the order the results come in.
+# The results come in source order (program.functions, then program.init) whatever order the
+# processes finish in, and jobs=1 runs the same setup and work in this process, so the output
+# doesn't depend on the number of jobs.
+#
+#   for func, (instrs, consts) in zip(parallel.functions(program),
+#       parallel.map_functions(program, Generator, _function, jobs)): ...
+#
+# setup and work have to be module level functions or classes so they can be sent to the pool.
+# The processes get forked where that is possible so the program doesn't get pickled.
+#
+# A program whose bodies get built while generating code (main.py --stream and --pipeline) has a
+# program.stream, map_functions() hands the setup and the work to its map(setup, work, jobs),
+# which has to give back the same results in the same order (see stream.py and pipeline.py).
+#
+# A pool only pays off with more than one core and functions which take long enough to generate
+# to make up for sending them back, bench.codegen has what got measured so far.
+
+CHUNKS_PER_JOB: int = 4 # functions are handed out in chunks of neighbouring functions
+
+_state = None # (functions, setup(program)) of a worker process
+
+
+def functions(program) -> list:
+    """the functions of program in the order their code gets written"""
+    return [*program.functions.values(), program.init]
+
+
+def _init(program, setup):
+    global _state
+    _state = (functions(program), setup(program))
+
+
+def _run(work, start, stop):
+    funcs, state = _state
+    return [work(state, func) for func in funcs[start:stop]]
+
+
+def context():
+    """the multiprocessing context pools get created with, forking where that is possible"""
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+
+def map_functions(program, setup, work, jobs=1):
+    """yields work(state, func) for every function in source order"""
+    if program.stream is not None:
+        yield from program.stream.map(setup, work, jobs)
+        return
+
+    funcs = functions(program)
+    if jobs <= 1 or len(funcs) < 2:
+        state = setup(program)
+        for func in funcs:
+            yield work(state, func)
+        return
+
+    chunk = max(1, -(-len(funcs) // (jobs * CHUNKS_PER_JOB)))
+    starts = range(0, len(funcs), chunk)
+    stops = [min(start + chunk, len(funcs)) for start in starts]
+    with ProcessPoolExecutor(jobs, mp_context=context(), initializer=_init,
+        initargs=(program, setup)) as pool:
+        for results in pool.map(_run, [work] * len(starts), starts, stops):
+            yield from results
+
+
+def merge_stats(stats, more):
+    """adds the stats a worker collected to stats (see asm_gen.gen_asm), counters get summed"""
+    for section, values in more.items():
+        merged = stats.setdefault(section, dict())
+        for key, val in values.items():
+            merged[key] = merged.get(key, 0) + val if isinstance(val, int) else val
@@ -0,0 +1,128 @@
+# Peephole optimization of the instruction lists the native backends collect for every function,
+# it runs right before a function gets written out.
+#
+# Instructions are the (mnemonic, operands...) tuples of the backend and labels are (name + ":",).
+# A backend describes its instructions with a Target: the rules to try and a uses(instr) function
+# giving the registers an instruction reads and writes (None for labels, branches and calls,
+# which the rules don't look past). A rule gets called when there are at least size instructions
+# left from i and gives back (n, new) to replace the n instructions starting at i with new, or
+# None if it doesn't apply. new always has to be shorter so the pass terminates. A rule can name
+# the mnemonics its first instruction may have so it only gets tried where it can match.
+#
+# Rules can ask if a register is still needed after an instruction with dead_after(), which
+# only looks LOOKAHEAD instructions ahead and says it is when it isn't sure.
+#
+#   PEEPHOLE = peephole.Target(rules=(peephole.Rule("self-move", 1, self_move), ...),
+#       uses=uses, jump="jmp", ret="ret", live_at_ret=("%rax", ...))
+
+LOOKAHEAD: int = 256
+
+_MISSING = object()
+
+
+class Rule:
+    __slots__ = "name", "size", "apply", "ops"
+    def __init__(self, name, size, apply, ops=None):
+        self.name = name
+        self.size = size
+        self.apply = apply # (target, instrs, i) -> (n, list) | None
+        self.ops = None if ops is None else frozenset(ops) # mnemonics the first instruction can have
+
+
+class Target:
+    __slots__ = "rules", "uses_of", "jump", "ret", "live_at_ret", "max_size", "cache", "by_op"
+    def __init__(self, rules, uses, jump, ret, live_at_ret):
+        self.rules = tuple(rules) + (Rule("jump-to-next", 2, jump_to_next, (jump,)),)
+        self.uses_of = uses
+        self.jump = jump
+        self.ret = ret
+        self.live_at_ret = frozenset(live_at_ret) # registers read by the caller or restored
+        self.max_size = max(rule.size for rule in self.rules)
+        self.cache = dict() # instr -> uses_of(instr) of the function run() is working on
+        self.by_op = dict() # mnemonic -> the rules which can start with it
+
+    def rules_for(self, op):
+        rules = self.by_op.get(op)
+        if rules is None:
+            rules = self.by_op[op] = tuple(rule for rule in self.rules
+                if rule.ops is None or op in rule.ops)
+        return rules
+
+    def uses(self, instr):
+        """uses_of(instr), rules and dead_after() ask about the same instructions over and over"""
+        uses = self.cache.get(instr, _MISSING)
+        if uses is _MISSING:
+            uses = self.cache[instr] = self.uses_of(instr)
+        return uses
+
+    def for_run(self):
+        """this Target with a cache of its own, so threads can run() it at the same time"""
+        target = object.__new__(Target)
+        for name in Target.__slots__:
+            setattr(target, name, getattr(self, name))
+        target.cache = dict()
+        return target
+
+
+def is_label(instr):
+    return instr[0].endswith(":")
+
+
+def dead_after(target, instrs, i, reg):
+    """if the value reg has after instrs[i] is never read"""
+    # indexed instead of sliced and with uses() inlined, most moves get asked about
+    cache, ret = target.cache, target.ret
+    for j in range(i + 1, min(i + 1 + LOOKAHEAD, len(instrs))):
+        instr = instrs[j]
+        if instr[0] == ret:
+            return reg not in target.live_at_ret
+        uses = cache.get(instr, _MISSING)
+        if uses is _MISSING:
+            uses = cache[instr] = target.uses_of(instr)
+        if uses is None:
+            return False
+        reads, writes = uses
+        if reg in reads:
+            return False
+        if reg in writes:
+            return True
+    return i + 1 + LOOKAHEAD >= len(instrs) and reg not in target.live_at_ret
+
+
+def jump_to_next(target, instrs, i):
+    jump, label = instrs[i], instrs[i + 1]
+    if jump[0] == target.jump and len(jump) == 2 and is_label(label) and label[0] == jump[1] + ":":
+        return 2, [label]
+    return None
+
+
+def run(instrs, target, counts=None) -> list:
+    """instrs with the rules of target applied until none of them fires anymore,
+    counts maps rule name -> how often it fired"""
+    instrs = list(instrs)
+    target = target.for_run()
+    i = 0
+    while i < len(instrs):
+        for rule in target.rules_for(instrs[i][0]):
+            if i + rule.size > len(instrs):
+                continue
+            new = rule.apply(target, instrs, i)
+            if new is not None:
+                n, new = new
+                instrs[i : i + n] = new
+                if counts is not None:
+                    counts[rule.name] = counts.get(rule.name, 0) + 1
+                # the replacement might complete a pattern which started a bit earlier
+                i = max(i - target.max_size, 0)
+                break
+        else:
+            i += 1
+    return instrs
+
+
+def report(counts) -> str:
+    """table of how often every rule fired"""
+    lines = [f"{'rule':<32} {'fired':>8}"]
+    for name, count in sorted(counts.items(), key=lambda item: -item[1]):
+        lines.append(f"{name:<32} {count:>8}")
+    return "\n".join(lines)
@@ -0,0 +1,351 @@
+from io import StringIO
+import keyword
+import math
+
+import ir.core as ir
+from ir.core import OpEnum
+from ir.program import is_int
+from ir.vm import int_range, wrap_int, is_single, round_f32, VmError
+from asm_gen import parallel
+
+# Translates every function of the program into a python function so they run at CPython speed.
+# Fixed width integers are wrapped after every operation the same way as ir.vm does it, and
+# floats follow IEEE 754 like there: f16 and f32 get rounded to single precision, dividing by
+# zero gives inf or nan and inf, nan or a float out of range converts to the integer -2^63.
+# Integer operations convert their operands to the type of the result and shift and divide like
+# ir.vm defines it, dividing by zero raises ZeroDivisionError which run() reports as a VmError.
+#
+# names get prefixed so they never collide with python names:
+#   g_<global>  f_<function>  v_<local>  t<uid>  S_<struct>
+
+_HEADER: str = '''\
+# generated by mylang from module {name}
+
+import math
+import struct
+
+_F32 = struct.Struct("f")
+
+def _f32(x):
+    try:
+        return _F32.unpack(_F32.pack(x))[0]
+    except OverflowError:
+        return math.copysign(math.inf, x)
+
+def _fdiv(a, b):
+    if b:
+        return a / b
+    if a != a or not a:
+        return math.nan
+    return math.copysign(math.inf, a) * math.copysign(1.0, b)
+
+def _int(x):
+    if math.isfinite(x) and -2.0 ** 63 <= x < 2.0 ** 63:
+        return int(x)
+    return -(1 << 63)
+
+def _div(a, b):
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+def _mod(a, b):
+    return a - b * _div(a, b)
+
+def _shl(a, n):
+    return a << n if 0 <= n < 64 else 0
+
+def _shr(a, n):
+    return a >> (n if n >= 0 else 64)
+
+def _copy(val):
+    if type(val) is list:
+        return [_copy(v) for v in val]
+    return val.__copy__() if hasattr(val, "__copy__") else val
+'''
+
+_OPERATORS: dict = {
+    OpEnum.BIN_ADD: "+",
+    OpEnum.BIN_SUB: "-",
+    OpEnum.BIN_MUL: "*",
+    OpEnum.BIN_AND: "&",
+    OpEnum.BIN_OR: "|",
+    OpEnum.BIN_XOR: "^",
+    OpEnum.BIN_SHL: "<<",
+    OpEnum.BIN_SHR: ">>",
+}
+
+
+def float_literal(val):
+    """python expression of a float, inf and nan have no literals"""
+    return repr(val) if math.isfinite(val) else f"float({str(val)!r})"
+
+
+def member_name(name):
+    return name + "_" if keyword.iskeyword(name) or name.startswith("__") else name
+
+
+def func_name(name):
+    return "f_" + name.replace(".", "__")
+
+
+def struct_name(struct):
+    return "S_" + struct.name
+
+
+def wrap(expr, typ):
+    mask, half = int_range(typ)
+    if half == 0:
+        return f"({expr}) & {mask}"
+    return f"(({expr}) + {half} & {mask}) - {half}"
+
+
+def zero_expr(typ):
+    match typ:
+        case ir.IntType() | ir.UintType() | ir.BoolType():
+            return "0"
+        case ir.FloatType():
+            return "0.0"
+        case ir.StructType():
+            return f"{struct_name(typ)}()"
+        case ir.SliceType() if typ.len is not None:
+            return f"[{zero_expr(typ.type)} for _ in range({typ.len})]"
+        case ir.SliceType():
+            return "[]"
+        case _:
+            return "None"
+
+
+def _needs_copy(typ):
+    return isinstance(typ, ir.StructType) or (isinstance(typ, ir.SliceType) and typ.len is not None)
+
+
+class PythonGenerator:
+    __slots__ = "program", "out", "func", "lines"
+    def __init__(self, program, out):
+        self.program = program
+        self.out = out
+        self.func = None
+        self.lines = None
+
+    def emit(self, line):
+        self.lines.append("    " + line)
+
+    def type_of(self, val):
+        return self.program.type_of(self.func, val)
+
+    def is_global(self, name):
+        return name not in self.func.locals and name in self.program.globals
+
+    def operand(self, val):
+        match val:
+            case int():
+                return f"t{val}"
+            case ir.Constant() if isinstance(val.const, float):
+                return float_literal(val.const)
+            case ir.Constant():
+                return repr(val.const)
+            case str() if self.is_global(val):
+                return f"g_{val}"
+            case str() if val in self.program.functions:
+                return func_name(val)
+            case str():
+                return f"v_{val}"
+
+    def convert(self, val, typ):
+        expr = self.operand(val)
+        src_typ = self.type_of(val)
+
+        # constants get converted right away
+        if isinstance(val, ir.Constant) and is_int(src_typ) and is_int(typ):
+            return repr(wrap_int(val.const, typ))
+        elif isinstance(val, ir.Constant) and isinstance(typ, ir.FloatType):
+            const = float(val.const)
+            return float_literal(round_f32(const) if is_single(typ) else const)
+
+        if is_int(typ) and is_int(src_typ):
+            if src_typ == typ:
+                return expr
+            return wrap(expr, typ)
+        elif isinstance(typ, ir.FloatType) and is_int(src_typ):
+            return f"_f32({expr})" if is_single(typ) else f"float({expr})"
+        elif is_single(typ) and isinstance(src_typ, ir.FloatType) and not is_single(src_typ):
+            return f"_f32({expr})"
+        elif is_int(typ) and isinstance(src_typ, ir.FloatType):
+            return wrap(f"_int({expr})", typ)
+        elif _needs_copy(typ) and not isinstance(val, ir.Constant):
+            return f"_copy({expr})"
+        return expr
+
+    def instr(self, instr):
+        op, _, _, *operands = instr
+
+        match op:
+            case OpEnum.VAR_DECL:
+                name, typ, val = operands
+                expr = zero_expr(typ) if val is None else self.convert(val, typ)
+                self.emit(f"{self.operand(name)} = {expr}")
+
+            case OpEnum.ASSIGN:
+                name, val = operands
+                self.emit(f"{self.operand(name)} = {self.convert(val, self.type_of(name))}")
+
+            case OpEnum.MEMBER_ACCESS:
+                ret, obj, member = operands
+                self.emit(f"t{ret} = {self.operand(obj)}.{member_name(member)}")
+
+            case OpEnum.MEMBER_ASSIGN:
+                obj, member, val = operands
+                typ = self.type_of(obj).member(member)
+                self.emit(f"{self.operand(obj)}.{member_name(member)} = {self.convert(val, typ)}")
+
+            case OpEnum.SLICE_INDEXING:
+                ret, slice_, idx = operands
+                self.emit(f"t{ret} = {self.operand(slice_)}[{self.operand(idx)}]")
+
+            case OpEnum.FUNC_CALL:
+                ret, callee, args = operands
+                callee_func = self.program.callee(callee)
+                args = ", ".join(self.convert(arg, typ) for arg, (_, typ) in zip(args, callee_func.args))
+                self.emit(f"t{ret} = {func_name(callee)}({args})")
+
+            case OpEnum.RETURN_STMT:
+                val, = operands
+                self.emit(f"return {self.convert(val, self.func.ret)}")
+
+            case OpEnum.UNARY_NEG | OpEnum.UNARY_NOT:
+                ret, expr = operands
+                typ = self.func.types[ret]
+                expr = ("-" if op == OpEnum.UNARY_NEG else "~") + self.operand(expr)
+                self.emit(f"t{ret} = {wrap(expr, typ) if is_int(typ) else expr}")
+
+            case OpEnum.NOP:
+                pass
+
+            case _:
+                ret, lhs, rhs = operands
+                typ = self.func.types[ret]
+                if isinstance(typ, ir.FloatType):
+                    lhs, rhs = self.convert(lhs, typ), self.convert(rhs, typ)
+                    if op == OpEnum.BIN_DIV:
+                        expr = f"_fdiv({lhs}, {rhs})"
+                    elif op in _OPERATORS and op not in (OpEnum.BIN_SHL, OpEnum.BIN_SHR):
+                        expr = f"{lhs} {_OPERATORS[op]} {rhs}"
+                    else:
+                        raise NotImplementedError(f"{op.name} on floats")
+                    self.emit(f"t{ret} = {f'_f32({expr})' if is_single(typ) else expr}")
+                    return
+
+                count = wrap_int(rhs.const, typ) if isinstance(rhs, ir.Constant) else None
+                lhs, rhs = self.convert(lhs, typ), self.convert(rhs, typ)
+                if op == OpEnum.BIN_DIV:
+                    expr = f"_div({lhs}, {rhs})"
+                elif op == OpEnum.BIN_MOD:
+                    expr = f"_mod({lhs}, {rhs})"
+                elif op in (OpEnum.BIN_SHL, OpEnum.BIN_SHR) and not (count is not None and 0 <= count < 64):
+                    # counts which aren't known to be in range shift every bit out
+                    expr = f"{'_shl' if op == OpEnum.BIN_SHL else '_shr'}({lhs}, {rhs})"
+                else:
+                    expr = f"{lhs} {_OPERATORS[op]} {rhs}"
+                self.emit(f"t{ret} = {wrap(expr, typ)}")
+
+    def struct(self, struct):
+        name = struct_name(struct)
+        members = [member_name(member) for member, _ in struct.members]
+
+        self.out.write(f"\nclass {name}:\n")
+        self.out.write(f"    __slots__ = {tuple(members)!r}\n")
+        self.out.write("    def __init__(self):\n")
+        for member, (_, typ) in zip(members, struct.members):
+            self.out.write(f"        self.{member} = {zero_expr(typ)}\n")
+        if not members:
+            self.out.write("        pass\n")
+
+        self.out.write("    def __copy__(self):\n")
+        self.out.write(f"        new = {name}.__new__({name})\n")
+        for member, (_, typ) in zip(members, struct.members):
+            val = f"_copy(self.{member})" if _needs_copy(typ) else f"self.{member}"
+            self.out.write(f"        new.{member} = {val}\n")
+        self.out.write("        return new\n")
+
+    def function(self, func):
+        self.func = func
+        self.lines = list()
+
+        args = ", ".join(f"v_{name}" for name, _ in func.args)
+        self.out.write(f"\ndef {func_name(func.name)}({args}):\n")
+
+        assigned = {instr[3] for instr in func.body if instr[0] in (OpEnum.ASSIGN, OpEnum.VAR_DECL)}
+        global_names = [f"g_{name}" for name in assigned if isinstance(name, str) and self.is_global(name)]
+        if global_names:
+            self.emit(f"global {', '.join(sorted(global_names))}")
+
+        for instr in func.body:
+            self.instr(instr)
+
+        if not self.lines:
+            self.emit("pass")
+        self.out.write("\n".join(self.lines) + "\n")
+
+    def init(self):
+        self.func = self.program.init
+        self.lines = list()
+        for instr in self.func.body:
+            self.instr(instr)
+
+        # module level code can read globals declared after it, they start out as zero
+        self.out.write("\n")
+        for name, typ in self.program.globals.items():
+            self.out.write(f"g_{name} = {zero_expr(typ)}\n")
+        self.out.write("\n".join(line[4:] for line in self.lines) + "\n")
+
+    def generate(self, jobs=1):
+        self.out.write(_HEADER.format(name=self.program.name))
+        for name, func in self.program.externs.items():
+            self.out.write(f"from {func.module} import {func_name(func.name)} as {func_name(name)}\n")
+        for struct in self.program.structs.values():
+            self.struct(struct)
+        for text in parallel.map_functions(self.program, _generator, _function, jobs):
+            self.out.write(text)
+
+
+def _generator(program):
+    return PythonGenerator(program, None)
+
+
+def _function(gen, func):
+    # runs in the asm_gen.parallel workers, every function gets written to its own buffer
+    gen.out = StringIO()
+    if func is gen.program.init:
+        gen.init()
+    else:
+        gen.function(func)
+    return gen.out.getvalue()
+
+
+def generate(src, program, out, stats=None, jobs=1) -> bool:
+    PythonGenerator(program, out).generate(jobs)
+    return True
+
+
+def load(program):
+    """Compiles the program and returns the namespace holding its functions"""
+    out = StringIO()
+    generate(program.src, program, out)
+    code = compile(out.getvalue(), f"<mylang {program.name}>", "exec")
+    namespace = dict()
+    exec(code, namespace)
+    return namespace
+
+
+def run(program, argv):
+    """Runs main(argc, argv) of the program and returns its exit code"""
+    namespace = load(program)
+    args = [arg.encode("utf-8") for arg in argv]
+    try:
+        ret = namespace["f_main"](len(args), args)
+    except ZeroDivisionError:
+        raise VmError("Division by zero") from None
+    except IndexError:
+        raise VmError("Index out of range") from None
+    return 0 if ret is None else ret
+
@@ -0,0 +1,194 @@
+from bisect import bisect_right
+
+import ir.core as ir
+from ir.core import OpEnum
+from ir.program import values
+
+# Linear scan register allocation over the resolved IR of a function, backends describe their
+# registers with a RegisterFile and look up where every value ended up in the Allocation.
+#
+# The IR has no branches yet so the live interval of a value is everything from its first to its
+# last occurrence and every use is weighted the same (there are no loops to be weighted by).
+# Only scalars get registers, structs and slices stay in memory. Values which are live across a
+# call only get callee saved registers, the rest prefer caller saved ones so they don't have to
+# be saved by the prologue.
+#
+# Copies (VAR_DECL and ASSIGN of a value) get coalesced when possible so the backend can leave
+# the move out entirely. Backends pass the uids asm_gen.isel computes inside of expression trees
+# as skip, they never need a register of their own.
+
+
+def reg_class(typ):
+    match typ:
+        case ir.FloatType():
+            return "float"
+        case ir.IntType() | ir.UintType() | ir.BoolType() | ir.PointerType():
+            return "int"
+        case _:
+            return None
+
+
+class RegisterFile:
+    """registers a backend hands to the allocator, in the order they should be used"""
+    __slots__ = "regs", "callee_saved"
+    def __init__(self, int_regs, float_regs, callee_saved):
+        self.regs = {"int": tuple(int_regs), "float": tuple(float_regs)}
+        self.callee_saved = frozenset(callee_saved)
+
+
+class Interval:
+    __slots__ = "val", "cls", "start", "end", "uses", "crosses_call", "hint", "share", "reg"
+    def __init__(self, val, cls, start):
+        self.val = val
+        self.cls = cls
+        self.start = start
+        self.end = start
+        self.uses = 0
+        self.crosses_call = False
+        self.hint = None # interval whose register is preferred once it is free
+        self.share = None # interval whose register can be used while it is still live
+        self.reg = None
+
+    def weight(self):
+        # spilling makes every use go through memory
+        return self.uses / (self.end - self.start + 1)
+
+    __repr__ = lambda self: f"Interval({self.val}, {self.start}-{self.end}, {self.reg})"
+
+
+class Allocation:
+    __slots__ = "regs", "spilled", "callee_saved", "stats"
+    def __init__(self):
+        self.regs = dict() # value -> register
+        self.spilled = list()
+        self.callee_saved = list() # callee saved registers the function has to preserve
+        self.stats = {"intervals": 0, "spills": 0, "moves": 0, "coalesced": 0}
+
+
+def _copies(func):
+    for pos, instr in enumerate(func.body):
+        if instr[0] == OpEnum.VAR_DECL:
+            yield pos, instr[3], instr[5]
+        elif instr[0] == OpEnum.ASSIGN:
+            yield pos, instr[3], instr[4]
+
+
+def intervals(program, func, skip=()) -> list:
+    """live intervals of the values of func which can get a register, values in skip don't"""
+    ivs = dict()
+    occurrences = dict()
+    calls = list()
+
+    def occur(val, pos):
+        kind = val.__class__ # most operands are uids or locals which already have an interval
+        if kind is not int and not (kind is str and val in func.locals):
+            return
+        iv = ivs.get(val)
+        if iv is None:
+            if val in skip:
+                return
+            cls = reg_class(program.type_of(func, val))
+            if cls is None:
+                return
+            iv = ivs[val] = Interval(val, cls, pos)
+            occurrences[val] = list()
+        iv.end = pos
+        iv.uses += 1
+        occurrences[val].append(pos)
+
+    for name, _ in func.args:
+        occur(name, -1)
+    for pos, instr in enumerate(func.body):
+        if instr[0] == OpEnum.FUNC_CALL:
+            calls.append(pos)
+        for val in values(instr):
+            occur(val, pos)
+
+    for iv in ivs.values():
+        i = bisect_right(calls, iv.start)
+        iv.crosses_call = i < len(calls) and calls[i] < iv.end
+
+    for pos, dst, src in _copies(func):
+        dst_iv = ivs.get(dst)
+        src_iv = ivs.get(src) if isinstance(src, (int, str)) else None
+        if dst_iv is None or src_iv is None or src_iv.end != pos or dst_iv.cls != src_iv.cls \
+            or program.type_of(func, dst) != program.type_of(func, src):
+            continue
+
+        if dst_iv.start == pos:
+            # the register of src is free right when dst starts
+            dst_iv.hint = src_iv
+        elif not any(src_iv.start < other < pos for other in occurrences[dst]):
+            # dst isn't touched while src is live so src can be computed in the register of dst
+            src_iv.share = dst_iv
+
+    return sorted(ivs.values(), key=lambda iv: iv.start)
+
+
+def allocate(program, func, regfile, skip=()) -> Allocation:
+    alloc = Allocation()
+    ivs = intervals(program, func, skip)
+    stats = alloc.stats
+    stats["intervals"] = len(ivs)
+
+    free = {cls: list(regs) for cls, regs in regfile.regs.items()}
+    active = list()
+
+    for iv in ivs:
+        for old in [old for old in active if old.end <= iv.start]:
+            active.remove(old)
+            # a shared register stays with the interval it was borrowed from
+            if old.share is None or old.share.reg != old.reg:
+                free[old.cls].append(old.reg)
+
+        candidates = [reg for reg in free[iv.cls] if not iv.crosses_call or reg in regfile.callee_saved]
+        if iv.share is not None and iv.share.reg is not None and iv.share in active:
+            iv.reg = iv.share.reg
+            stats["coalesced"] += 1
+        elif iv.hint is not None and iv.hint.reg in candidates:
+            iv.reg = iv.hint.reg
+            free[iv.cls].remove(iv.reg)
+            stats["coalesced"] += 1
+        elif candidates:
+            iv.reg = min(candidates, key=lambda reg: reg in regfile.callee_saved)
+            free[iv.cls].remove(iv.reg)
+        else:
+            # take the register of the cheapest live interval if it is cheaper than this one
+            victims = [old for old in active if old.cls == iv.cls and old.share is None
+                and (not iv.crosses_call or old.reg in regfile.callee_saved)
+                and not any(other.share is old for other in active)]
+            victim = min(victims, key=Interval.weight, default=None)
+            if victim is None or victim.weight() >= iv.weight():
+                alloc.spilled.append(iv.val)
+                continue
+
+            iv.reg = victim.reg
+            victim.reg = None
+            active.remove(victim)
+            alloc.spilled.append(victim.val)
+
+        active.append(iv)
+
+    for iv in ivs:
+        if iv.reg is not None:
+            alloc.regs[iv.val] = iv.reg
+
+    used = set(alloc.regs.values())
+    alloc.callee_saved = [reg for regs in regfile.regs.values() for reg in regs
+        if reg in used and reg in regfile.callee_saved]
+
+    stats["spills"] = len(alloc.spilled)
+    for _, dst, src in _copies(func):
+        if isinstance(src, (int, str)) and dst in alloc.regs and src in alloc.regs \
+            and alloc.regs[dst] != alloc.regs[src]:
+            stats["moves"] += 1
+    return alloc
+
+
+def report(stats) -> str:
+    """table of the statistics of every function, stats maps function name -> Allocation.stats"""
+    lines = [f"{'function':<32} {'intervals':>9} {'spills':>6} {'moves':>5} {'coalesced':>9}"]
+    for name, func_stats in stats.items():
+        lines.append(f"{name:<32} {func_stats['intervals']:>9} {func_stats['spills']:>6} "
+            f"{func_stats['moves']:>5} {func_stats['coalesced']:>9}")
+    return "\n".join(lines)
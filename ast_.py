@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 from tokens import Token
 
@@ -78,7 +78,7 @@ class CallExpr(Node):
 
     def pos(self): return self.func.pos()
 
-    def end(self): return self.right_paren.pos + 1 # len(')')
+    def end(self): return self.right_paren.position + 1 # len(')')
 
 @dataclass(slots=True, repr=True)
 class PostfixExpr(Node):
@@ -91,7 +91,7 @@ class PostfixExpr(Node):
 
     def pos(self): return self.expr.pos()
 
-    def end(self): return self.expr.end() + op.length
+    def end(self): return self.expr.end() + self.op.length
 
 
 @dataclass(slots=True, repr=True)
@@ -118,7 +118,7 @@ class BinaryExpr(Node):
         if self.lhs is not None: self.lhs.walk(visitor)
         if self.rhs is not None: self.rhs.walk(visitor)
 
-    def pos(self): return self.lhs.position
+    def pos(self): return self.lhs.pos()
 
     def end(self): return self.rhs.end()
 
@@ -153,7 +153,7 @@ class Slice(Node):
         if self.slice_expr is not None: self.slice_expr.walk(visitor)
         if self.subscript is not None: self.subscript.walk(visitor)
 
-    def pos(self): return self.slice_expr.pos()
+    def pos(self): return self.expr.pos()
 
     def end(self): return self.right_square.position + 1
 
@@ -168,7 +168,7 @@ class ReturnStmt(Node):
 
     def pos(self): return self.ret.position
 
-    def end(self): return self.expr.end()
+    def end(self): return self.ret.end() if self.expr is None else self.expr.end()
 
 @dataclass(slots=True, repr=True)
 class CodeBlock(Node):
@@ -207,21 +207,38 @@ class Declaration(Node):
     name: Token
     type_expr: Node
     expr: Node | None = None
+    inline: Token | None = None
 
     @walk_func
     def walk(self, visitor):
         if self.type_expr is not None: self.type_expr.walk(visitor)
         if self.expr is not None: self.expr.walk(visitor)
 
-    def pos(self): return self.name.position
+    def pos(self): return (self.inline or self.name).position
 
-    def end(self): return self.expr.end()
+    def end(self): return self.type_expr.end() if self.expr is None else self.expr.end()
+
+
+@dataclass(slots=True, repr=True)
+class Import(Node):
+    import_: Token
+    name: Token
+    alias: Token | None = None
+
+    @walk_func
+    def walk(self, visitor):
+        pass
+
+    def pos(self): return self.import_.position
+
+    def end(self): return (self.alias or self.name).end()
 
 
 @dataclass(slots=True, repr=True)
 class Module(Node):
     name: Token 
     statements: list
+    imports: list = field(default_factory=list)
     
     @walk_func
     def walk(self, visitor):
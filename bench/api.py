@@ -0,0 +1,116 @@
+import argparse
+import gc
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import api
+from bench.gen import gen_source
+
+# Throughput of api.compile_source() on many small modules held in memory, the way a service
+# embedding the compiler uses it: compiles --units modules of bench.gen (every shape, small
+# sizes, a seed of their own each) one after the other, then from pools of threads, and prints
+# units/s and source KB/s of every run. The threads have to give the same results as the
+# sequential run, the run fails when they don't.
+#
+# For comparison --subprocess of the units get compiled the way a service had to before,
+# writing them to a file and running main.py on it once per unit.
+#
+#   python3 -m bench.api
+#   python3 -m bench.api --units 1000 --threads 1,2,8 --target c
+
+# (shape, size) of the units, they take turns
+UNITS: tuple = (
+    ("functions", 8),
+    ("expressions", 60),
+    ("nesting", 10),
+    ("structs", 3),
+    ("strings", 2),
+)
+
+
+def sources(count) -> list:
+    return [gen_source(*UNITS[i % len(UNITS)], seed=i).encode() for i in range(count)]
+
+
+def compile_all(units, target, threads) -> tuple:
+    """(seconds, results) of compiling every unit with threads threads, 0 in this thread"""
+    def one(i):
+        result = api.compile_source(units[i], f"unit{i}.txt", target)
+        return result.ok, result.code
+
+    gc.collect()
+    gc.disable()
+    try:
+        time_start = time.perf_counter()
+        if threads == 0:
+            results = [one(i) for i in range(len(units))]
+        else:
+            with ThreadPoolExecutor(threads) as pool:
+                results = list(pool.map(one, range(len(units))))
+        seconds = time.perf_counter() - time_start
+    finally:
+        gc.enable()
+    return seconds, results
+
+
+def compile_processes(units, target) -> float:
+    """seconds of compiling every unit with a main.py process of its own"""
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = list()
+        for i, unit in enumerate(units):
+            paths.append(os.path.join(tmp, f"unit{i}.txt"))
+            with open(paths[-1], "wb") as fp:
+                fp.write(unit)
+        out = os.path.join(tmp, "out.s")
+        time_start = time.perf_counter()
+        for path in paths:
+            args = [sys.executable, "-m", "main", path, "-o", out]
+            if target is not None:
+                args += ["--target", target]
+            subprocess.run(args, check=True, stdout=subprocess.DEVNULL)
+        return time.perf_counter() - time_start
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="bench.api")
+    parser.add_argument("--units", type=int, default=500)
+    parser.add_argument("--threads", default="1,2,4", help="sizes of the thread pools")
+    parser.add_argument("--target", default="linux-x86_64", help="default: %(default)s")
+    parser.add_argument("--subprocess", type=int, default=20,
+        help="how many units to compile with main.py, 0 for none")
+    args = parser.parse_args()
+
+    units = sources(args.units)
+    size = sum(len(unit) for unit in units)
+    print(f"{os.cpu_count()} cores, {len(units)} units, {size / len(units):.0f} bytes on average")
+    print(f"{'run':<14} {'units':>6} {'ms':>10} {'units/s':>10} {'KB/s':>10}")
+
+    def row(name, count, seconds, check=""):
+        kb = size * count / len(units) / 1e3
+        print(f"{name:<14} {count:>6} {seconds * 1e3:10.2f} {count / seconds:10.1f} "
+            f"{kb / seconds:10.1f}{check}", flush=True)
+
+    compile_all(units[:len(UNITS)], args.target, 0) # imports the backend
+    seconds, expected = compile_all(units, args.target, 0)
+    failed = not all(ok for ok, _ in expected)
+    row("sequential", len(units), seconds, "" if not failed else "  ERRORS")
+    for threads in (int(n) for n in args.threads.split(",")):
+        seconds, results = compile_all(units, args.target, threads)
+        same = results == expected
+        failed = failed or not same
+        row(f"{threads} thread(s)", len(units), seconds, "" if same else "  DIFFERENT OUTPUT")
+
+    if args.subprocess:
+        count = min(args.subprocess, len(units))
+        row("main.py", count, compile_processes(units[:count], args.target))
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
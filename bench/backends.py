@@ -0,0 +1,76 @@
+import argparse
+import time
+
+from ir import vm
+from asm_gen import python
+from bench.vm import gen_source, compile_source
+
+# Compares running the same program in the IR virtual machine, as mylang functions compiled
+# to python and as the equivalent hand written python.
+#
+#   python3 -m bench.backends --depth 12 --width 40
+
+_MASK: int = (1 << 64) - 1
+_HALF: int = 1 << 63
+
+
+def _i64(x):
+    return ((x + _HALF) & _MASK) - _HALF
+
+
+def hand_written(n, x, y, width):
+    # what bench.vm.gen_source generates for f<n>
+    if n == 0:
+        a = x
+    else:
+        a = hand_written(n - 1, _i64(x + 1), y, width) ^ hand_written(n - 1, _i64(x * 3), y * 0.5, width)
+    b = y
+    for i in range(width):
+        a = _i64(_i64(_i64(a * 31) + i) - (a >> 3))
+        if i % 4 == 0:
+            b = b * 0.5 + float(i)
+    return _i64(int((a >> 8) + b))
+
+
+def timed(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        time_start = time.perf_counter()
+        ret = func()
+        best = min(best, time.perf_counter() - time_start)
+    return ret, best
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="bench.backends")
+    parser.add_argument("--depth", type=int, default=12)
+    parser.add_argument("--width", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    prog = compile_source(gen_source(args.depth, args.width))
+
+    time_start = time.perf_counter()
+    machine = vm.VM(prog)
+    vm_setup = time.perf_counter() - time_start
+
+    time_start = time.perf_counter()
+    namespace = python.load(prog)
+    python_setup = time.perf_counter() - time_start
+
+    results = [
+        ("vm", vm_setup, *timed(lambda: machine.call("main", 1, [b"bench"]), args.repeat)),
+        ("python", python_setup, *timed(lambda: namespace["f_main"](1, [b"bench"]), args.repeat)),
+        ("hand written", 0.0, *timed(lambda: hand_written(args.depth, 1, 1.0, args.width), args.repeat)),
+    ]
+
+    expected = results[-1][2]
+    base = results[0][3]
+    print(f"depth={args.depth} width={args.width}")
+    for name, setup, ret, best in results:
+        check = "" if ret == expected else f"  WRONG RESULT {ret} != {expected}"
+        print(f"{name:>14}: setup {setup * 1e3:7.2f}ms  run {best:.3f}s  ({base / best:.2f}x vm){check}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import argparse
+import contextlib
+import gc
+import io
+import math
+import sys
+import tempfile
+
+from parser_file import ParserFile
+from lexer import Tokens
+from parser_ import parse
+from ir import generator, program
+from timing import Timer
+from bench.gen import SHAPES, gen_source
+
+# Checks that every phase of the compiler scales about linearly with its input: runs the phases
+# on modules of bench.gen of sizes N, 2N, 4N and 8N, fits the exponent k of time ~ size^k and
+# memory ~ size^k (least squares of the logarithms, the size is the length of the source) and
+# fails with exit status 1 when any k is above --limit. n log n still passes, n^2 doesn't.
+#
+#   python3 -m bench.complexity
+#   python3 -m bench.complexity --shapes functions,errors --scale 2
+#
+# The errors shape is a module with a name which doesn't resolve on every line, its resolve
+# phase is mostly reporting size errors. Time gets measured with the garbage collector off like in
+# bench.throughput, a collection makes the time of a phase jump and the fit with it.
+#
+# tests/test_complexity.py runs the check at a quarter of N on lexing, parsing and reporting
+# errors with the other tests.
+
+SIZE_STEPS: tuple = (1, 2, 4, 8)
+
+# N of every shape, 8N is about a quarter of what bench.throughput compiles
+SIZES: dict = {
+    "functions": 60,
+    "expressions": 1500,
+    "nesting": 400, # smaller and most of it would be in one expression shallower than the rest
+    "structs": 30,
+    "strings": 30,
+    "errors": 250,
+}
+
+
+def error_source(size) -> str:
+    lines = ["module errors", ""]
+    lines.extend(f"e{n}: int = missing{n} + {n}" for n in range(size))
+    lines.append("")
+    lines.append("main: (argc: int, argv: **u8) -> int {")
+    lines.append("    return 0")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def run_phases(path, memory=False) -> Timer:
+    """the Timer of the phases up to the type inference of the file in path"""
+    timer = Timer(memory)
+    src = ParserFile(path)
+    with timer.phase("lex"):
+        toks = Tokens(src)
+    with timer.phase("parse"):
+        ast, num_errors = parse(path, src, toks)
+    assert num_errors == 0
+    with timer.phase("IR gen"):
+        num_errors, rep = generator.generate(src, ast)
+    assert num_errors == 0
+    # the errors get reported while resolving, to memory so the terminal doesn't get timed
+    with contextlib.redirect_stdout(io.StringIO()):
+        program.build(src, rep, timer)
+    timer.stop()
+    return timer
+
+
+def exponent(xs, ys) -> float:
+    """slope of the least squares line through (log x, log y)"""
+    xs = [math.log(x) for x in xs]
+    ys = [math.log(max(y, 1e-9)) for y in ys]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    var = sum((x - mean_x) ** 2 for x in xs)
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var
+
+
+def measure(source, repeat) -> dict:
+    """phase -> (best time, peak memory) of compiling source"""
+    with tempfile.NamedTemporaryFile("w", suffix=".txt") as fp:
+        fp.write(source)
+        fp.flush()
+        times = dict()
+        for _ in range(repeat):
+            gc.collect()
+            gc.disable()
+            try:
+                timer = run_phases(fp.name)
+            finally:
+                gc.enable()
+            for name, entry in timer.phases.items():
+                times[name] = min(times.get(name, entry[1]), entry[1])
+        peaks = {name: entry[3] for name, entry in run_phases(fp.name, memory=True).phases.items()}
+    return {name: (times[name], peaks[name]) for name in times}
+
+
+def check(shape, base, repeat, limit) -> list:
+    """(shape, phase, time exponent, memory exponent, times, ok) of every phase on shape"""
+    lengths, results = list(), list()
+    for step in SIZE_STEPS:
+        size = max(1, base * step)
+        source = error_source(size) if shape == "errors" else gen_source(shape, size)
+        lengths.append(len(source))
+        results.append(measure(source, repeat))
+
+    rows = list()
+    for name in results[0]:
+        times = [result[name][0] for result in results]
+        peaks = [result[name][1] for result in results]
+        k_time, k_memory = exponent(lengths, times), exponent(lengths, peaks)
+        rows.append((shape, name, k_time, k_memory, times, k_time <= limit and k_memory <= limit))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="bench.complexity")
+    parser.add_argument("--shapes", default=",".join((*SHAPES, "errors")))
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies N")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--limit", type=float, default=1.3,
+        help="the largest exponent which passes, default: %(default)s")
+    args = parser.parse_args()
+
+    steps = "".join(f" {f'{step}N ms':>9}" for step in SIZE_STEPS)
+    print(f"{'shape':<12} {'phase':<10}{steps} {'k time':>7} {'k mem':>7}", flush=True)
+    failed = False
+    for shape in args.shapes.split(","):
+        size = max(1, round(SIZES[shape] * args.scale))
+        for _, name, k_time, k_memory, times, ok in check(shape, size, args.repeat, args.limit):
+            times = "".join(f" {t * 1e3:9.2f}" for t in times)
+            print(f"{shape:<12} {name:<10}{times} {k_time:7.2f} {k_memory:7.2f}"
+                + ("" if ok else "  SUPERLINEAR"), flush=True)
+            failed = failed or not ok
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import argparse
+import random
+
+# Deterministic generator of mylang modules of a given size and shape, the same shape, size and
+# seed always give the same source. The modules compile on every target and main returns
+# something depending on all of the code so nothing of it is dead.
+#
+#   functions    size small functions, each calling the one before
+#   expressions  declarations of size terms in all, in expressions of 500 terms
+#   nesting      size levels of parentheses and calls, in expressions 100 levels deep (the
+#                parser runs out of stack at about 150)
+#   structs      size structs with members and a method each
+#   strings      size string literals of 200 to 1000 characters
+#
+#   python3 -m bench.gen functions 1000 > funcs.txt
+
+OPERATORS: tuple = ("+", "-", "*", "&", "|", "^")
+EXPRESSION_TERMS: int = 500
+NESTING_DEPTH: int = 100
+
+
+def _functions(size, rng):
+    lines = list()
+    for n in range(size):
+        lines.append(f"f{n}: (x: int) -> int {{")
+        lines.append(f"    a: int = x * {rng.randrange(1, 100)} + {rng.randrange(100)}")
+        lines.append(f"    b: int = (a >> {rng.randrange(1, 8)}) ^ x")
+        lines.append(f"    return a + b" if n == 0 else f"    return a + f{n - 1}(b & 1023)")
+        lines.append("}")
+        lines.append("")
+    lines.append("run: (x: int) -> int {")
+    lines.append(f"    return f{size - 1}(x)")
+    lines.append("}")
+    return lines
+
+
+def _terms(n, rng):
+    terms = [f"x{rng.randrange(4)}"]
+    for _ in range(n - 1):
+        term = f"x{rng.randrange(4)}" if rng.randrange(2) else str(rng.randrange(1, 1000))
+        terms.append(f"{rng.choice(OPERATORS)} {term}")
+    return " ".join(terms)
+
+
+def _expressions(size, rng):
+    lines = ["run: (x: int) -> int {"]
+    lines.extend(f"    x{i}: int = x + {i}" for i in range(4))
+    n = 0
+    while size > 0:
+        terms = min(size, EXPRESSION_TERMS)
+        lines.append(f"    x{n % 4} = {_terms(terms, rng)}")
+        size -= terms
+        n += 1
+    lines.append("    return x0 + x1 + x2 + x3")
+    lines.append("}")
+    return lines
+
+
+def _nesting(size, rng):
+    lines = [
+        "g: (x: int) -> int {",
+        "    return x * 3 + 1",
+        "}",
+        "",
+    ]
+    funcs = (size + NESTING_DEPTH - 1) // NESTING_DEPTH
+    for n in range(funcs):
+        expr = "x"
+        for i in range(min(size - n * NESTING_DEPTH, NESTING_DEPTH)):
+            op = rng.choice(OPERATORS)
+            expr = f"g({expr}) {op} {i}" if i % 2 else f"(x {op} {expr})"
+        lines.append(f"n{n}: (x: int) -> int {{")
+        lines.append(f"    return {expr}" if n == 0 else f"    return n{n - 1}({expr} & 1023)")
+        lines.append("}")
+        lines.append("")
+    lines.append("run: (x: int) -> int {")
+    lines.append(f"    return n{funcs - 1}(x)")
+    lines.append("}")
+    return lines
+
+
+def _structs(size, rng):
+    lines = list()
+    for n in range(size):
+        lines.append(f"struct S{n} {{")
+        lines.append("    a: int")
+        lines.append("    b: i32")
+        lines.append(f"    next: *S{n}")
+        lines.append("    get: (v: int) -> int {")
+        lines.append(f"        return v * {rng.randrange(1, 100)} + {n}")
+        lines.append("    }")
+        lines.append("}")
+        lines.append("")
+    lines.append("run: (x: int) -> int {")
+    lines.append("    r: int = x")
+    lines.extend(f"    r = S{n}.get(r) & 65535" for n in range(size))
+    lines.append("    return r")
+    lines.append("}")
+    return lines
+
+
+def _strings(size, rng):
+    alphabet = "abcdefghijklmnopqrstuvwxyz ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789.,;:!?-"
+    lines = list()
+    for n in range(size):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randrange(200, 1000)))
+        lines.append(f's{n}: u8[] = "{text}"')
+    lines.append("")
+    lines.append("run: (x: int) -> int {")
+    lines.append("    r: int = x")
+    lines.extend(f"    r = r + s{n}[x + {n % 100}]" for n in range(size))
+    lines.append("    return r")
+    lines.append("}")
+    return lines
+
+
+SHAPES: dict = {
+    "functions": _functions,
+    "expressions": _expressions,
+    "nesting": _nesting,
+    "structs": _structs,
+    "strings": _strings,
+}
+
+
+def gen_source(shape, size, seed=0) -> str:
+    lines = [f"module {shape}", ""]
+    lines.extend(SHAPES[shape](size, random.Random(seed)))
+    lines.append("")
+    lines.append("main: (argc: int, argv: **u8) -> int {")
+    lines.append("    return run(argc) & 255")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="bench.gen")
+    parser.add_argument("shape", choices=SHAPES)
+    parser.add_argument("size", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(gen_source(args.shape, args.size, args.seed), end="")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import argparse
+import time
+
+from asm_gen import isel, linux_x86_64, linux_aarch64, regalloc
+from bench.vm import gen_source, compile_source
+
+# Compares the tree pattern instruction selection of the native backends with lowering one IR
+# instruction at a time (the naive() rules of the same tables): the time labelling the trees
+# takes, the summed cost of the covers and the instructions of the generated functions.
+#
+#   python3 -m bench.isel --depth 200 --width 40
+
+TARGETS: dict = {
+    "linux-x86_64": (linux_x86_64, linux_x86_64.X86Generator),
+    "linux-aarch64": (linux_aarch64, linux_aarch64.AArch64Generator),
+}
+
+
+def labelled(gen, module, patterns):
+    """(seconds, summed cost) of labelling every tree of the program with patterns"""
+    elapsed = total = 0
+    for func in gen.program.functions.values():
+        forest = isel.trees(gen.program, func, patterns.max_need())
+        # the conditions of the rules look at where the leaves are
+        gen.func = func
+        gen.regs = regalloc.allocate(gen.program, func, module.REGISTERS,
+            set(forest.folded.values()))
+        time_start = time.perf_counter()
+        for tree in forest.roots.values():
+            isel.label(tree, patterns, gen)
+        elapsed += time.perf_counter() - time_start
+        total += sum(isel.cost(tree, "addr" if tree.op == "INDEX" else "reg")
+            for tree in forest.roots.values())
+    return elapsed, total
+
+
+def generated(gen, module, patterns):
+    """(seconds, instructions) of generating every function with patterns"""
+    gen.patterns = patterns
+    elapsed = count = 0
+    for func in gen.program.functions.values():
+        time_start = time.perf_counter()
+        instrs, _, _ = module._function(gen, func)
+        elapsed += time.perf_counter() - time_start
+        count += sum(1 for instr in instrs if not instr[0].endswith(":"))
+    return elapsed, count
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="bench.isel")
+    parser.add_argument("--depth", type=int, default=200)
+    parser.add_argument("--width", type=int, default=40)
+    parser.add_argument("--targets", default=",".join(TARGETS))
+    args = parser.parse_args()
+
+    prog = compile_source(gen_source(args.depth, args.width))
+    print(f"funcs={len(prog.functions)} width={args.width}")
+    for target in args.targets.split(","):
+        module, generator = TARGETS[target]
+        patterns = {"trees": module.PATTERNS, "naive": module.PATTERNS.naive()}
+        for name, rules in patterns.items():
+            label_time, cost = labelled(generator(prog), module, rules)
+            gen_time, count = generated(generator(prog), module, rules)
+            print(f"{target:>14} {name:>5}: {len(rules.rules):3} rules, label {label_time:.3f}s, "
+                f"cost {cost}, {count} instructions in {gen_time:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+
+from asm_gen import c, linux_x86_64
+from bench.vm import gen_source, compile_source
+
+# Compares the binaries of the linux-x86_64 backend with the C backend output built at -O0,
+# both get linked by the system C compiler.
+#
+#   python3 -m bench.native --depth 20 --width 40
+
+
+def build(prog, tmp, name, generator, flags):
+    path = os.path.join(tmp, name)
+    with open(path, "w") as fp:
+        generator.generate(prog.src, prog, fp)
+
+    exe = path.rsplit(".", 1)[0]
+    if c.build(path, exe, flags=flags):
+        raise SystemExit(f"building {path} failed")
+    return exe
+
+
+def timed(exe, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        time_start = time.perf_counter()
+        ret = subprocess.run([exe]).returncode
+        best = min(best, time.perf_counter() - time_start)
+    return ret, best
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="bench.native")
+    parser.add_argument("--depth", type=int, default=20)
+    parser.add_argument("--width", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    prog = compile_source(gen_source(args.depth, args.width))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = [
+            ("c -O0", *timed(build(prog, tmp, "c_O0.c", c, ("-O0",)), args.repeat)),
+            ("linux-x86_64", *timed(build(prog, tmp, "x86_64.s", linux_x86_64, ()), args.repeat)),
+        ]
+
+    expected = results[0][1]
+    base = results[0][2]
+    print(f"depth={args.depth} width={args.width}")
+    for name, ret, best in results:
+        check = "" if ret == expected else f"  WRONG RESULT {ret} != {expected}"
+        print(f"{name:>14}: run {best:.3f}s  ({base / best:.2f}x c -O0){check}")
+
+
+if __name__ == "__main__":
+    main()
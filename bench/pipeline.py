@@ -0,0 +1,100 @@
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+
+from parser_file import ParserFile
+from parser_ import parse
+from ir import generator, program
+import asm_gen
+import pipeline
+from bench.gen import SHAPES, gen_source
+from bench.throughput import SIZES
+
+# Speedup of main.py --pipeline over the sequential driver: compiles the modules of bench.gen
+# with both, --jobs processes generating code in both, and prints the best wall time of --repeat
+# compiles, the speedup and how busy the stages of the fastest pipelined compile were. Both have
+# to write the same code, the run fails when they don't.
+#
+#   python3 -m bench.pipeline
+#   python3 -m bench.pipeline --shapes functions --jobs 4
+#
+# The stages of the pipeline run in processes of their own, on a machine with fewer cores than
+# jobs + 1 they take turns and the pipeline can't be faster than the sequential driver.
+
+
+def sequential(path, target, jobs, out):
+    src = ParserFile(path)
+    tree, num_errors = parse(path, src)
+    assert num_errors == 0
+    num_errors, rep = generator.generate(src, tree)
+    assert num_errors == 0
+    num_errors, prog = program.build(src, rep)
+    assert num_errors == 0
+    with open(out, "w") as fp:
+        assert asm_gen.gen_asm(src, prog, target, fp, None, jobs)
+
+
+def pipelined(path, target, jobs, out) -> pipeline.Pipeline:
+    src = ParserFile(path)
+    num_errors, prog = pipeline.front_end(src)
+    assert num_errors == 0
+    with open(out, "w") as fp:
+        assert asm_gen.gen_asm(src, prog, target, fp, None, jobs)
+    return prog.stream
+
+
+def best_of(repeat, func):
+    best, best_ret = float("inf"), None
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            time_start = time.perf_counter()
+            ret = func()
+            wall = time.perf_counter() - time_start
+        finally:
+            gc.enable()
+        if wall < best:
+            best, best_ret = wall, ret
+    return best, best_ret
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="bench.pipeline")
+    parser.add_argument("--shapes", default=",".join(SHAPES))
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies the sizes")
+    parser.add_argument("--target", help="default: the one of this machine")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{os.cpu_count()} cores, {args.jobs} job(s)")
+    with tempfile.TemporaryDirectory() as tmp:
+        for shape in args.shapes.split(","):
+            size = max(1, round(SIZES[shape] * args.scale))
+            path = os.path.join(tmp, f"{shape}.txt")
+            with open(path, "w") as fp:
+                fp.write(gen_source(shape, size))
+            seq_out, pipe_out = os.path.join(tmp, "seq.s"), os.path.join(tmp, "pipe.s")
+
+            seq, _ = best_of(args.repeat, lambda: sequential(path, args.target, args.jobs, seq_out))
+            pipe, stages = best_of(args.repeat,
+                lambda: pipelined(path, args.target, args.jobs, pipe_out))
+            with open(seq_out) as a, open(pipe_out) as b:
+                same = a.read() == b.read()
+            failed = failed or not same
+
+            print(f"\n{shape} {size}: sequential {seq * 1e3:.2f} ms, pipelined {pipe * 1e3:.2f} ms, "
+                f"speedup {seq / pipe:.2f}x" + ("" if same else "  DIFFERENT OUTPUT"))
+            print(stages.report())
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
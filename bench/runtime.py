@@ -0,0 +1,285 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from ir import vm, optimize
+from asm_gen import c, python, linux_x86_64, linux_aarch64
+from bench.vm import compile_source
+
+# Speed of the code the compiler generates: compiles every program below with every backend
+# which can run here, without and with -O, runs them and records the best run time of --repeat.
+# All runs of a program at the same depth have to return the same value, one which returns
+# something else is marked WRONG and fails the run like a regression.
+#
+#   python3 -m bench.runtime --json base.json
+#   python3 -m bench.runtime --baseline base.json
+#
+# mylang has no loops or branches yet, so the programs are call trees: k<n> calls k<n - 1> twice
+# and the leaves do the work, 2^depth of them. The native binaries run with --depth, the vm and
+# the python backend with --interp-depth, they are a hundred times slower. Native run times
+# include starting the process. There is no way to follow a pointer yet either, the list
+# program passes List values down a chain of calls instead of walking next.
+
+MASK: str = "16777215" # keeps the values positive, / and % of negative values differ between C and python
+
+
+def gen_int(depth):
+    lines = [
+        "module int_kernel",
+        "",
+        "k0: (x: int, y: int) -> int {",
+        f"    a: int = (x * 40503 + y) & {MASK}",
+        "    b: int = (a >> 5) ^ (y << 3)",
+        "    c: int = (a * 31 + b) % 1000003",
+        "    d: int = (b / 7 + c * 3) & 65535",
+        "    e: int = (c ^ d) * (a & 255) + (b | 12)",
+        f"    return (a + b + c + d + e) & {MASK}",
+        "}",
+        "",
+    ]
+    for n in range(1, depth + 1):
+        lines.append(f"k{n}: (x: int, y: int) -> int {{")
+        lines.append(f"    return k{n - 1}(x + {n}, y ^ x) ^ k{n - 1}(x * 3 & {MASK}, y + {n})")
+        lines.append("}")
+        lines.append("")
+    lines.append("main: (argc: int, argv: **u8) -> int {")
+    lines.append(f"    return k{depth}(argc, argc + 7) & 255")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def gen_vec3(depth):
+    lines = [
+        "module vec3_kernel",
+        "",
+        "struct Vec3 {",
+        "    x: f32",
+        "    y: f32",
+        "    z: f32",
+        "",
+        "    dot: (lhs: Vec3, rhs: Vec3) -> f32 {",
+        "        return lhs.x * rhs.x + lhs.y * rhs.y + lhs.z * rhs.z",
+        "    }",
+        "}",
+        "",
+        "add: (a: Vec3, b: Vec3) -> Vec3 {",
+        "    r: Vec3",
+        "    r.x = a.x + b.x",
+        "    r.y = a.y + b.y",
+        "    r.z = a.z + b.z",
+        "    return r",
+        "}",
+        "",
+        "scale: (v: Vec3, s: f32) -> Vec3 {",
+        "    r: Vec3",
+        "    r.x = v.x * s",
+        "    r.y = v.y * s",
+        "    r.z = v.z * s",
+        "    return r",
+        "}",
+        "",
+        "v0: (x: f32) -> Vec3 {",
+        "    r: Vec3",
+        "    r.x = x",
+        "    r.y = x * 0.5",
+        "    r.z = 2.0 - x",
+        "    return r",
+        "}",
+        "",
+    ]
+    for n in range(1, depth + 1):
+        lines.append(f"v{n}: (x: f32) -> Vec3 {{")
+        lines.append(f"    a: Vec3 = v{n - 1}(x * 0.5)")
+        lines.append(f"    b: Vec3 = v{n - 1}(x + 0.25)")
+        lines.append("    return scale(add(a, b), 0.5)")
+        lines.append("}")
+        lines.append("")
+    lines.append("main: (argc: int, argv: **u8) -> int {")
+    lines.append(f"    v: Vec3 = v{depth}(argc)")
+    lines.append("    return Vec3.dot(v, v) * 16.0")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def gen_list(depth):
+    lines = [
+        "module list_kernel",
+        "",
+        "struct List {",
+        "    val: int",
+        "    next: *List",
+        "}",
+        "",
+        "push: (l: List, v: int) -> List {",
+        "    r: List",
+        f"    r.val = (l.val * 31 + v) & {MASK}",
+        "    r.next = l.next",
+        "    return r",
+        "}",
+        "",
+        "l0: (l: List, x: int) -> List {",
+        "    return push(push(l, x), x >> 1)",
+        "}",
+        "",
+    ]
+    for n in range(1, depth + 1):
+        lines.append(f"l{n}: (l: List, x: int) -> List {{")
+        lines.append(f"    return l{n - 1}(l{n - 1}(l, x + 1), x * 3 & {MASK})")
+        lines.append("}")
+        lines.append("")
+    lines.append("main: (argc: int, argv: **u8) -> int {")
+    lines.append("    l: List")
+    lines.append("    l.val = argc")
+    lines.append(f"    return l{depth}(l, argc).val & 255")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def gen_strings(depth):
+    text = "".join(chr(ord("a") + (i * 7 + i // 26) % 26) for i in range(256))
+    lines = [
+        "module strings_kernel",
+        "",
+        f'text: u8[] = "{text}"',
+        "",
+        "h0: (h: int, i: int) -> int {",
+        "    a: int = h",
+    ]
+    lines.extend(f"    a = (a * 33 ^ text[(i + {j}) & 255]) & {MASK}" for j in range(8))
+    lines.append("    return a")
+    lines.append("}")
+    lines.append("")
+    for n in range(1, depth + 1):
+        lines.append(f"h{n}: (h: int, i: int) -> int {{")
+        lines.append(f"    return h{n - 1}(h{n - 1}(h, i), i + {8 << (n - 1)})")
+        lines.append("}")
+        lines.append("")
+    lines.append("main: (argc: int, argv: **u8) -> int {")
+    lines.append(f"    return h{depth}(argc, argc) & 255")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+PROGRAMS: dict = {
+    "int": gen_int,
+    "vec3": gen_vec3,
+    "list": gen_list,
+    "strings": gen_strings,
+}
+
+NATIVE: dict = {
+    "x86_64": ("linux-x86_64", linux_x86_64),
+    "aarch64": ("linux-aarch64", linux_aarch64),
+}
+
+
+def backends() -> list:
+    """(name, native) of every backend which can run programs here"""
+    names = [("vm", False), ("python", False)]
+    if shutil.which("cc") is not None:
+        names.append(("c", True))
+        if sys.platform == "linux" and platform.machine() in NATIVE:
+            names.append((NATIVE[platform.machine()][0], True))
+    return names
+
+
+def best_of(repeat, func):
+    best = float("inf")
+    for _ in range(repeat):
+        time_start = time.perf_counter()
+        ret = func()
+        best = min(best, time.perf_counter() - time_start)
+    return ret, best
+
+
+def build_native(prog, backend, tmp) -> str:
+    generator = c if backend == "c" else NATIVE[platform.machine()][1]
+    path = os.path.join(tmp, f"{prog.name}.{'c' if backend == 'c' else 's'}")
+    with open(path, "w") as fp:
+        assert generator.generate(prog.src, prog, fp)
+    exe = path.rsplit(".", 1)[0]
+    if c.build(path, exe):
+        raise SystemExit(f"building {path} failed")
+    return exe
+
+
+def run(name, backend, native, level, depth, repeat, tmp) -> tuple:
+    """(value main returned, best run time) of program name on backend"""
+    prog = compile_source(PROGRAMS[name](depth))
+    if level:
+        optimize.optimize(prog)
+
+    if native:
+        exe = build_native(prog, backend, tmp)
+        return best_of(repeat, lambda: subprocess.run([exe]).returncode)
+    if backend == "vm":
+        machine = vm.VM(prog)
+        return best_of(repeat, lambda: machine.call("main", 1, [b"bench"]) & 255)
+    namespace = python.load(prog)
+    return best_of(repeat, lambda: namespace["f_main"](1, [b"bench"]) & 255)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="bench.runtime")
+    parser.add_argument("--programs", default=",".join(PROGRAMS))
+    parser.add_argument("--backends", help="default: every one which runs here")
+    parser.add_argument("--depth", type=int, default=22)
+    parser.add_argument("--interp-depth", type=int, default=12)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", metavar="FILE", help="writes the results to FILE")
+    parser.add_argument("--baseline", metavar="FILE", help="compares with the results in FILE")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    chosen = backends()
+    if args.backends is not None:
+        wanted = args.backends.split(",")
+        chosen = [backend for backend in chosen if backend[0] in wanted]
+
+    baseline = dict()
+    if args.baseline is not None:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)["runs"]
+
+    results = {"python": platform.python_version(), "machine": platform.machine(), "runs": dict()}
+    failed = False
+    print(f"{'program':<8} {'backend':<13} {'opt':<4} {'depth':>5} {'run ms':>10} {'vs base':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in args.programs.split(","):
+            expected = dict() # depth -> result, the depth changes what the programs return
+            for backend, native in chosen:
+                for level in (0, 1):
+                    depth = args.depth if native else args.interp_depth
+                    ret, best = run(name, backend, native, level, depth, args.repeat, tmp)
+                    key = f"{name} {backend} -O{level}"
+                    results["runs"][key] = {"depth": depth, "time": best, "result": ret}
+
+                    check = ""
+                    if expected.setdefault(depth, ret) != ret:
+                        check, failed = f"  WRONG RESULT {ret} != {expected[depth]}", True
+
+                    base = baseline.get(key)
+                    change = ""
+                    if base is not None and base["depth"] == depth:
+                        ratio = best / base["time"]
+                        change = f"{100 * (ratio - 1):+7.1f}%"
+                        if ratio > 1 + args.threshold:
+                            check, failed = check + "  REGRESSION", True
+                    print(f"{name:<8} {backend:<13} -O{level:<2} {depth:>5} {best * 1e3:10.2f} "
+                        f"{change:>8}{check}", flush=True)
+
+    if args.json is not None:
+        with open(args.json, "w") as fp:
+            json.dump(results, fp, indent=2)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import client
+from bench.vm import gen_source
+
+# Latency of compiling a module after a small edit with a fresh main.py (cold) against the
+# compile server (warm), through the thin client and straight over the socket. The edit
+# changes the constant of one line, so the server parses the file again but the python startup
+# and the imports are gone.
+#
+#   python3 -m bench.serve --depth 4 --width 10 --target linux-x86_64
+
+
+def timed(run, edit, repeat):
+    best = float("inf")
+    for i in range(repeat):
+        edit(i)
+        time_start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - time_start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="bench.serve")
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--width", type=int, default=10)
+    parser.add_argument("--target", default="linux-x86_64")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.txt")
+        out = os.path.join(tmp, "bench.s")
+        source = gen_source(args.depth, args.width)
+        marker = "a = a * 31 + 0 - (a >> 3)"
+
+        def edit(i):
+            with open(path, "w") as fp:
+                fp.write(source.replace(marker, f"a = a * 31 + {i + 1} - (a >> 3)", 1))
+
+        def unchanged(i):
+            pass
+
+        argv = ["--target", args.target, "-o", out, path]
+        sock = os.path.join(tmp, "mylang.sock")
+        env = dict(os.environ, **{client.SOCKET_ENV: sock})
+        quiet = dict(stdout=subprocess.DEVNULL, env=env)
+
+        edit(-1)
+        cold = timed(lambda: subprocess.run([sys.executable, "-m", "main", *argv], **quiet),
+            edit, args.repeat)
+
+        server = subprocess.Popen([sys.executable, "-m", "server", "--socket", sock], **quiet)
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                while probe.connect_ex(sock) != 0:
+                    time.sleep(0.01)
+            client.run(argv, sock) # first compile imports the backend
+
+            via_client = timed(lambda: subprocess.run([sys.executable, "-m", "client", *argv],
+                **quiet), edit, args.repeat)
+            direct = timed(lambda: client.run(argv, sock), edit, args.repeat)
+            same = timed(lambda: client.run(argv, sock), unchanged, args.repeat)
+        finally:
+            client.request({"stop": True}, sock)
+            server.wait()
+
+    print(f"lines={len(source.splitlines())} target={args.target}")
+    print(f"cold main.py after an edit:     {cold * 1000:8.1f}ms")
+    print(f"warm client after an edit:      {via_client * 1000:8.1f}ms  ({cold / via_client:.1f}x)")
+    print(f"warm socket after an edit:      {direct * 1000:8.1f}ms  ({cold / direct:.1f}x)")
+    print(f"warm socket, nothing changed:   {same * 1000:8.1f}ms  ({cold / same:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
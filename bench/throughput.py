@@ -0,0 +1,189 @@
+import argparse
+import gc
+import json
+import platform
+import sys
+import tempfile
+from io import StringIO
+
+from parser_file import ParserFile
+from lexer import Tokens
+from parser_ import parse
+from ir import generator, program
+import asm_gen
+from timing import Timer
+from counters import Counters
+from bench.gen import SHAPES, gen_source
+
+# Throughput of every phase of the compiler on modules of bench.gen: tokens per second of the
+# lexer, AST nodes per second of the parser and IR instructions per second of the rest, the best
+# time of --repeat compiles. One more compile with tracemalloc gets the peak memory of the phases.
+# The garbage collector is off while timing (unless --gc), which phase ends up paying for a
+# collection changes from run to run and makes the numbers move by tens of percent.
+#
+#   python3 -m bench.throughput --json base.json
+#   python3 -m bench.throughput --baseline base.json
+#
+# With --baseline a phase which got more than --threshold slower or whose peak memory grew by
+# more than that gets flagged, and the exit status is 1. Phases shorter than MIN_WALL don't get
+# flagged for their time, they are mostly noise. Compare runs of the same machine only.
+
+SIZES: dict = {
+    "functions": 2000,
+    "expressions": 50000,
+    "nesting": 2000,
+    "structs": 1000,
+    "strings": 1000,
+}
+
+# what the rate of a phase counts, the sections of counters.Counters
+UNITS: dict = {
+    "lex": "tokens",
+    "parse": "ast nodes",
+    "IR gen": "IR instructions",
+    "resolve": "IR instructions",
+    "typecheck": "IR instructions",
+    "codegen": "IR instructions",
+}
+
+MIN_WALL: float = 0.01
+
+
+def compile_once(path, target, memory=False, counters=None):
+    """the Timer of one compile of the file in path"""
+    timer = Timer(memory)
+    src = ParserFile(path)
+    with timer.phase("lex"):
+        toks = Tokens(src)
+    with timer.phase("parse"):
+        ast, num_errors = parse(path, src, toks)
+    assert num_errors == 0
+    with timer.phase("IR gen"):
+        num_errors, rep = generator.generate(src, ast)
+    assert num_errors == 0
+    num_errors, prog = program.build(src, rep, timer)
+    assert num_errors == 0
+    if target is not None:
+        with timer.phase("codegen"):
+            assert asm_gen.gen_asm(src, prog, target, StringIO())
+    timer.stop()
+
+    if counters is not None:
+        counters.tokens(toks)
+        counters.ast_nodes(ast)
+        counters.ir_instrs(rep)
+    return timer
+
+
+def measure(shape, size, target, repeat, collect=False) -> dict:
+    source = gen_source(shape, size)
+    with tempfile.NamedTemporaryFile("w", suffix=".txt") as fp:
+        fp.write(source)
+        fp.flush()
+
+        counters = Counters()
+        walls = dict()
+        for i in range(repeat):
+            gc.collect() # garbage of the compile before doesn't get collected in this one
+            if not collect:
+                gc.disable()
+            try:
+                timer = compile_once(fp.name, target, counters=counters if i == 0 else None)
+            finally:
+                gc.enable()
+            for name, (_, wall, *_) in timer.phases.items():
+                walls[name] = min(walls.get(name, wall), wall)
+        peaks = {name: entry[3] for name, entry in
+            compile_once(fp.name, target, memory=True).phases.items()}
+
+    counts = {section: sum(counts.values()) for section, counts in counters.sections.items()}
+    phases = dict()
+    for name, wall in walls.items():
+        count = counts.get(UNITS.get(name), 0)
+        phases[name] = {"wall": wall, "rate": count / wall if wall else 0.0, "peak": peaks[name]}
+    return {"size": size, "lines": source.count("\n"), "counts": counts, "phases": phases}
+
+
+def compare(results, baseline, threshold) -> list:
+    """(shape, phase, what, ratio) of everything more than threshold worse than in baseline"""
+    regressions = list()
+    for shape, result in results["shapes"].items():
+        base = baseline["shapes"].get(shape)
+        if base is None or base["size"] != result["size"]:
+            continue
+        for name, phase in result["phases"].items():
+            before = base["phases"].get(name)
+            if before is None:
+                continue
+            for what in ("wall", "peak"):
+                if what == "wall" and max(phase[what], before[what]) < MIN_WALL:
+                    continue
+                if before[what] and phase[what] / before[what] > 1 + threshold:
+                    regressions.append((shape, name, what, phase[what] / before[what]))
+    return regressions
+
+
+def report(results, baseline=None) -> str:
+    lines = [f"{'shape':<12} {'phase':<10} {'wall ms':>10} {'rate':>22} {'peak MB':>9}"
+        + (f" {'wall':>7} {'peak':>7}" if baseline else "")]
+    for shape, result in results["shapes"].items():
+        base = None if baseline is None else baseline["shapes"].get(shape)
+        if base is not None and base["size"] != result["size"]:
+            base = None
+        for name, phase in result["phases"].items():
+            unit = UNITS.get(name)
+            rate = f"{phase['rate'] / 1e3:.1f}k {unit}/s" if unit else ""
+            line = (f"{shape:<12} {name:<10} {phase['wall'] * 1e3:10.2f} {rate:>22} "
+                f"{phase['peak'] / 1e6:9.2f}")
+            before = None if base is None else base["phases"].get(name)
+            if before is not None:
+                line += "".join(f" {100 * (phase[what] / before[what] - 1):+6.1f}%"
+                    if before[what] else f" {'':>7}" for what in ("wall", "peak"))
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="bench.throughput")
+    parser.add_argument("--shapes", default=",".join(SHAPES))
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies the sizes")
+    parser.add_argument("--target", help="adds the code generation for TARGET")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--gc", action="store_true", help="keeps the garbage collector on")
+    parser.add_argument("--json", metavar="FILE", help="writes the results to FILE")
+    parser.add_argument("--baseline", metavar="FILE", help="compares with the results in FILE")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "target": args.target,
+        "gc": args.gc,
+        "shapes": dict(),
+    }
+    for shape in args.shapes.split(","):
+        size = max(1, round(SIZES[shape] * args.scale))
+        results["shapes"][shape] = measure(shape, size, args.target, args.repeat,
+            args.gc)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+    print(report(results, baseline))
+
+    if args.json is not None:
+        with open(args.json, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for shape, name, what, ratio in regressions:
+            print(f"REGRESSION {shape} {name}: {what} {ratio:.2f}x of the baseline")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
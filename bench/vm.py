@@ -0,0 +1,91 @@
+import argparse
+import time
+
+from parser_file import ParserFile
+from parser_ import parse
+from ir import generator, program, vm
+
+# Measures how many IR virtual machine instructions get executed per second.
+# The generated programs are call trees of straight line integer and float arithmetic,
+# f<n> calls f<n-1> twice so main ends up doing 2^depth calls.
+#
+#   python3 -m bench.vm --depth 14 --width 40
+
+
+def gen_source(depth, width):
+    lines = ["module bench", ""]
+
+    for n in range(depth + 1):
+        lines.append(f"f{n}: (x: int, y: f64) -> int {{")
+        if n == 0:
+            lines.append("    a: int = x")
+        else:
+            lines.append(f"    a: int = f{n - 1}(x + 1, y) ^ f{n - 1}(x * 3, y * 0.5)")
+        lines.append("    b: f64 = y")
+        for i in range(width):
+            lines.append(f"    a = a * 31 + {i} - (a >> 3)")
+            if i % 4 == 0:
+                lines.append(f"    b = b * 0.5 + {i}.0")
+        # keeps the float in range of an int so every backend converts it the same way
+        lines.append("    return (a >> 8) + b")
+        lines.append("}")
+        lines.append("")
+
+    lines.append("main: (argc: int, argv: **u8) -> int {")
+    lines.append(f"    return f{depth}(argc, 1.0)")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def executed(code, counts):
+    # the programs have no branches so every instruction runs exactly once per call
+    n = counts.get(code.name)
+    if n is None:
+        n = len(code.instrs)
+        for instr in code.instrs:
+            if instr[0] == vm.OP_CALL:
+                n += executed(instr[4], counts)
+        counts[code.name] = n
+    return n
+
+
+def compile_source(text):
+    src = ParserFile("<bench>", text)
+    ast, num_errors = parse(src.filename, src)
+    assert num_errors == 0
+    num_errors, rep = generator.generate(src, ast)
+    assert num_errors == 0
+    num_errors, prog = program.build(src, rep)
+    assert num_errors == 0
+    return prog
+
+
+def bench(depth, width, repeat):
+    prog = compile_source(gen_source(depth, width))
+
+    machine = vm.VM(prog)
+    num_instrs = executed(machine.codes["main"], dict())
+
+    best = float("inf")
+    for _ in range(repeat):
+        time_start = time.perf_counter()
+        machine.call("main", 1, [b"bench"])
+        best = min(best, time.perf_counter() - time_start)
+
+    return num_instrs, best
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="bench.vm")
+    parser.add_argument("--depth", type=int, default=12)
+    parser.add_argument("--width", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    num_instrs, best = bench(args.depth, args.width, args.repeat)
+    print(f"depth={args.depth} width={args.width}: {num_instrs} instructions in {best:.3f}s "
+        f"({num_instrs / best / 1e6:.2f}M instructions/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+import contextlib
+import hashlib
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from parser_file import ParserFile
+from parser_ import parse, parse_header
+import ast_ as ast
+from ir import generator
+from ir import program
+from ir import optimize
+from ir import serialize
+import asm_gen
+from asm_gen import parallel
+from cache import Cache
+from timing import NULL
+from counters import NULL as NULL_COUNTERS
+
+# Builds of several modules at once (main.py --build).
+#
+# scan() only parses the module statement and the imports at the top of every file to get the
+# dependency graph, order() sorts it topologically and finds import cycles. build() then compiles
+# a module as soon as every module it imports is done, independent modules in parallel in a pool
+# of jobs processes, and writes the output of every module to its own file. A module whose
+# imports failed doesn't get compiled.
+#
+# A module sees the functions of the modules it imports: the worker compiling it loads their
+# declarations (program.declarations(), from the cache when they are in there) and `c.three()`
+# calls three of the module imported as c. Structs and globals aren't shared yet.
+#
+# The critical path is the longest chain of imports weighted by how long the modules took, no
+# number of jobs builds faster than it.
+#
+# With a cache.Cache every module goes through three cached stages, keyed by its source and
+# what else they depend on:
+#
+#   ir         the IR file of the source (ir.serialize), skips parsing and generating the IR
+#   interface  hash of the declarations of the module, without the function bodies
+#   out        the generated code, depends on the target, -O and the interfaces of the imports
+#
+# so after changing a function body only that module gets compiled again, the modules importing
+# it only when its declarations changed.
+
+SOURCE_SUFFIX: str = ".txt" # what directories are searched for
+
+
+class Unit:
+    __slots__ = "path", "src", "name", "imports", "deps", "users", "start", "time", "ok"
+    def __init__(self, path, src, name, imports):
+        self.path = path
+        self.src = src # ParserFile, for the errors
+        self.name = name
+        self.imports = imports # ast.Import
+        self.deps = list() # Units imported
+        self.users = list() # Units importing it
+        self.start = None # seconds since the start of the build
+        self.time = 0.0
+        self.ok = None # None when it didn't get compiled
+
+
+def sources(paths) -> list:
+    """the files of paths, directories get searched for files ending in SOURCE_SUFFIX"""
+    files = list()
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        for root, dirs, names in os.walk(path):
+            dirs.sort()
+            files += [os.path.join(root, name) for name in sorted(names)
+                if name.endswith(SOURCE_SUFFIX)]
+    return files
+
+
+def scan(paths):
+    """(number of errors, name -> Unit) of the files, with the imports resolved"""
+    num_errors = 0
+    units = dict()
+    for path in sources(paths):
+        src = ParserFile(path)
+        name, imports, errors = parse_header(path, src)
+        num_errors += errors
+        if name is None:
+            continue
+        unit = Unit(path, src, src.get_token_string(name), imports)
+        if unit.name in units:
+            num_errors += 1
+            src.error(name, f"Module {unit.name} is already defined in {units[unit.name].path}")
+            continue
+        units[unit.name] = unit
+
+    for unit in units.values():
+        for imp in unit.imports:
+            dep = units.get(unit.src.get_token_string(imp.name))
+            if dep is None:
+                num_errors += 1
+                unit.src.error(imp.name, "No module with this name among the inputs")
+            elif dep not in unit.deps:
+                unit.deps.append(dep)
+                dep.users.append(unit)
+    return num_errors, units
+
+
+def order(units):
+    """(units in topological order, None) or (None, the units of an import cycle)"""
+    waiting = {unit: len(unit.deps) for unit in units.values()}
+    ready = [unit for unit, count in waiting.items() if count == 0]
+    result = list()
+    while ready:
+        unit = ready.pop()
+        result.append(unit)
+        for user in unit.users:
+            waiting[user] -= 1
+            if waiting[user] == 0:
+                ready.append(user)
+    if len(result) == len(units):
+        return result, None
+
+    # everything left is on a cycle or imports one, following the imports ends up on one
+    unit = next(unit for unit, count in waiting.items() if count > 0)
+    seen = list()
+    while unit not in seen:
+        seen.append(unit)
+        unit = next(dep for dep in unit.deps if waiting[dep] > 0)
+    return None, seen[seen.index(unit):]
+
+
+def interface(src, tree) -> bytes:
+    """sha256 of what other modules see of a module, its declarations without the function bodies"""
+    digest = hashlib.sha256()
+    for stmt in tree.statements:
+        match stmt:
+            case ast.Declaration(type_expr=type_expr):
+                text = src.src[stmt.pos() : type_expr.end()]
+            case ast.CompoundType():
+                text = src.src[stmt.pos() : stmt.end()]
+            case _:
+                continue
+        digest.update(text.encode() + b"\0")
+    return digest.digest()
+
+
+def front_end(src, cache=None):
+    """
+    (src, rep, interface) of the ParserFile src after parsing and generating the IR, None after
+    errors. The IR of a source the cache has seen gets loaded from there instead, src is then the
+    string table of the IR
+    """
+    key = None
+    if cache is not None:
+        key = cache.key(src.src)
+        data = cache.get("ir", key)
+        iface = None if data is None else cache.get("interface", key)
+        if iface is not None:
+            ir_src, rep = serialize.loads(data, src.filename)
+            return ir_src, rep, iface
+
+    tree, num_errors = parse(src.filename, src)
+    if num_errors:
+        print(f"Got {num_errors} error(s)")
+        return None
+
+    num_errors, rep = generator.generate(src, tree)
+    if num_errors:
+        print(f"Got {num_errors} error(s) when generating IR")
+        return None
+
+    iface = interface(src, tree)
+    if cache is not None:
+        cache.put("ir", key, serialize.dumps(src, rep))
+        cache.put("interface", key, iface)
+    return src, rep, iface
+
+
+def build_program(src, rep, timer=NULL, counters=NULL_COUNTERS, imports=None):
+    """program.build() printing the errors, None after errors"""
+    if isinstance(src, serialize.IrStrings):
+        # errors need the source to be reported against, it gets compiled again for them
+        with contextlib.redirect_stdout(io.StringIO()):
+            num_errors, prog = program.build(src, rep, timer, counters, imports)
+        if not num_errors:
+            return prog
+        front = front_end(ParserFile(src.filename))
+        if front is None:
+            return None
+        src, rep, _ = front
+
+    num_errors, prog = program.build(src, rep, timer, counters, imports)
+    if num_errors:
+        print(f"Got {num_errors} error(s)")
+        return None
+    return prog
+
+
+def imported(imports, cache=None):
+    """name imported as -> Program of the declarations of the module, imports are (name, path)"""
+    programs = dict()
+    for name, path in imports:
+        # the imported modules compiled before, there are no errors to report
+        dep_src, rep, _ = front_end(ParserFile(path), cache)
+        programs[name] = program.declarations(dep_src, rep)[1]
+    return programs
+
+
+def output_key(cache, src, target, optimize_, out, deps=()):
+    """cache key of the generated code of a module, deps are the interfaces of its imports"""
+    return cache.key(src.src, target, optimize_, os.path.splitext(out)[1], *deps)
+
+
+def compile_module(path, target, optimize_, out, cache_args=None, deps=(), imports=()):
+    """
+    (ok, start, seconds, printed output, interface, cache stats) of compiling one module, runs in
+    the workers. cache_args are the (root, limit) of the Cache, deps the interfaces of the imports
+    and imports their (name imported as, path)
+    """
+    start = time.perf_counter()
+    cache = None if cache_args is None else Cache(*cache_args)
+    printed = io.StringIO()
+    with contextlib.redirect_stdout(printed):
+        ok, iface = _compile(path, target, optimize_, out, cache, deps, imports)
+    stats = dict() if cache is None else cache.stats
+    return ok, start, time.perf_counter() - start, printed.getvalue(), iface, stats
+
+
+def _compile(path, target, optimize_, out, cache, deps, imports):
+    src = ParserFile(path)
+    key = None
+    if cache is not None and target is not None:
+        key = output_key(cache, src, target, optimize_, out, deps)
+        data = cache.get("out", key)
+        iface = None if data is None else cache.get("interface", cache.key(src.src))
+        if iface is not None:
+            with open(out, "wb") as fp:
+                fp.write(data)
+            return True, iface
+
+    front = front_end(src, cache)
+    if front is None:
+        return False, None
+    src, rep, iface = front
+    if target is None:
+        return True, iface
+
+    prog = build_program(src, rep, imports=imported(imports, cache))
+    if prog is None:
+        return False, None
+    if optimize_:
+        optimize.optimize(prog)
+
+    if out.endswith(".o"):
+        with open(out, "wb") as fp:
+            ok = asm_gen.gen_obj(src, prog, target, fp)
+    else:
+        with open(out, "w") as fp:
+            ok = asm_gen.gen_asm(src, prog, target, fp)
+    if ok and key is not None:
+        with open(out, "rb") as fp:
+            cache.put("out", key, fp.read())
+    return ok, iface
+
+
+def imports(unit):
+    """(name imported as, path) of the imports of unit"""
+    paths = {dep.name: dep.path for dep in unit.deps}
+    get = unit.src.get_token_string
+    return tuple((get(imp.alias or imp.name), paths[get(imp.name)]) for imp in unit.imports)
+
+
+def build(units, out_dir, suffix, target=None, optimize_=False, jobs=1, cache=None) -> float:
+    """compiles units (in topological order) into out_dir, gives back the seconds it took"""
+    cache_args = None if cache is None else (cache.root, cache.limit)
+    ifaces = dict() # unit -> interface of the compiled units
+    args = lambda unit: (unit.path, target, optimize_, os.path.join(out_dir, unit.name + suffix),
+        cache_args, tuple(ifaces[dep] for dep in unit.deps), imports(unit))
+    time_start = time.perf_counter()
+
+    def finished(unit, result):
+        unit.ok, start, unit.time, printed, iface, stats = result
+        unit.start = start - time_start
+        ifaces[unit] = iface
+        if cache is not None:
+            parallel.merge_stats(cache.stats, stats)
+        if printed:
+            print(printed, end="")
+
+    if jobs <= 1:
+        for unit in units:
+            if all(dep.ok for dep in unit.deps):
+                finished(unit, compile_module(*args(unit)))
+        return time.perf_counter() - time_start
+
+    waiting = {unit: len(unit.deps) for unit in units}
+    ready = [unit for unit in units if not unit.deps]
+    with ProcessPoolExecutor(jobs, mp_context=parallel.context()) as pool:
+        running = dict()
+        while ready or running:
+            for unit in ready:
+                running[pool.submit(compile_module, *args(unit))] = unit
+            ready = list()
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                unit = running.pop(future)
+                finished(unit, future.result())
+                if not unit.ok:
+                    continue
+                for user in unit.users:
+                    waiting[user] -= 1
+                    if waiting[user] == 0:
+                        ready.append(user)
+    return time.perf_counter() - time_start
+
+
+def critical_path(units):
+    """(seconds, units) of the longest chain of imports of the built units in topological order"""
+    longest = dict() # unit -> (seconds up to and with it, the dep on its path)
+    for unit in units:
+        dep = max(unit.deps, key=lambda dep: longest[dep][0], default=None)
+        longest[unit] = ((0.0 if dep is None else longest[dep][0]) + unit.time, dep)
+    if not longest:
+        return 0.0, list()
+
+    unit = max(longest, key=lambda unit: longest[unit][0])
+    seconds = longest[unit][0]
+    path = list()
+    while unit is not None:
+        path.append(unit)
+        unit = longest[unit][1]
+    return seconds, path[::-1]
+
+
+def report(units, seconds, jobs) -> str:
+    """the time of every module, the critical path and the total"""
+    width = max(len("module"), *(len(unit.name) for unit in units))
+    lines = [f"{'module':<{width}}  {'start':>8}  {'time':>8}"]
+    for unit in sorted(units, key=lambda unit: (unit.start is None, unit.start or 0)):
+        if unit.start is None:
+            lines.append(f"{unit.name:<{width}}  {'skipped':>8}")
+        else:
+            failed = "" if unit.ok else "  FAILED"
+            lines.append(f"{unit.name:<{width}}  {unit.start:7.3f}s  {unit.time:7.3f}s{failed}")
+
+    length, path = critical_path(units)
+    lines.append(f"critical path {length:.3f}s: {' -> '.join(unit.name for unit in path)}")
+    lines.append(f"built {sum(1 for unit in units if unit.ok)} of {len(units)} module(s) in "
+        f"{seconds:.3f}s with {jobs} job(s), {sum(unit.time for unit in units):.3f}s compiling")
+    return "\n".join(lines)
+
+
+def run(paths, out_dir, suffix, target=None, optimize_=False, jobs=1, cache=None) -> int:
+    num_errors, units = scan(paths)
+    if num_errors:
+        print(f"Got {num_errors} error(s)")
+        return 1
+
+    units, cycle = order(units)
+    if cycle is not None:
+        names = " -> ".join(unit.name for unit in cycle + cycle[:1])
+        print(f"Import cycle: {names}")
+        for unit, dep in zip(cycle, cycle[1:] + cycle[:1]):
+            imp = next(imp for imp in unit.imports if unit.src.get_token_string(imp.name) == dep.name)
+            unit.src.error(imp.name, f"{unit.name} imports {dep.name} here")
+        return 1
+
+    if target is not None:
+        os.makedirs(out_dir, exist_ok=True)
+    seconds = build(units, out_dir, suffix, target, optimize_, jobs, cache)
+    print(report(units, seconds, jobs))
+    return 0 if all(unit.ok for unit in units) else 1
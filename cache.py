@@ -0,0 +1,198 @@
+import fcntl
+import hashlib
+import os
+import tempfile
+import time
+
+# Content addressed cache of what the compiler stages produce (main.py --cache-dir).
+#
+#   DIR/objects/ab/abcdef...   the stored bytes, named by their sha256
+#   DIR/keys/STAGE/0123...     the sha256 of the object the key maps to
+#
+# A key is the hash of everything a stage output depends on: the sources of the compiler itself
+# (its modules, so any change to it is a new key), the module source, the flags and whatever else the stage
+# gets passed to key(). Outputs which come out the same share one object.
+#
+# Files are written to a temporary file and renamed into place, so processes sharing a cache only
+# ever see whole files, and objects are checked against their name when they are read. Reading
+# an object marks it as used, evict() removes the least recently used objects together with the
+# keys mapping to them until the objects and keys fit into the size limit again, with a lock so
+# only one process evicts at a time. Keys whose object is gone get removed as well.
+
+DEFAULT_LIMIT: int = 256 << 20
+STALE_SECONDS: int = 3600 # temporary files older than this were left behind by a crash
+PACKAGES: tuple = ("ir", "asm_gen") # where the compiler has modules besides the top directory
+
+_compiler = None # hash of the compiler sources, once per process
+
+
+def compiler_hash() -> bytes:
+    """sha256 of the python modules of the compiler"""
+    global _compiler
+    if _compiler is None:
+        root = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha256()
+        # only the modules, not whatever else lives in the checkout (virtualenvs, build outputs)
+        for package in ("", *PACKAGES):
+            directory = os.path.join(root, package)
+            for name in sorted(os.listdir(directory)):
+                if name.endswith(".py"):
+                    digest.update(os.path.join(package, name).encode() + b"\0")
+                    with open(os.path.join(directory, name), "rb") as fp:
+                        digest.update(fp.read())
+        _compiler = digest.digest()
+    return _compiler
+
+
+class Cache:
+    __slots__ = "root", "limit", "stats"
+    def __init__(self, root, limit=DEFAULT_LIMIT):
+        self.root = root
+        self.limit = limit # bytes the objects and keys may take
+        self.stats = dict() # stage -> {"hits": n, "misses": n, "stores": n}
+        compiler_hash()
+
+    def key(self, *parts) -> str:
+        """the key of a stage output depending on parts (str, bytes or anything with a repr)"""
+        digest = hashlib.sha256(compiler_hash())
+        for part in parts:
+            if isinstance(part, str):
+                data = part.encode()
+            else:
+                data = part if isinstance(part, bytes) else repr(part).encode()
+            digest.update(len(data).to_bytes(8, "little"))
+            digest.update(data)
+        return digest.hexdigest()
+
+    def _count(self, stage, what):
+        counts = self.stats.setdefault(stage, dict())
+        counts[what] = counts.get(what, 0) + 1
+
+    def _object(self, name):
+        return os.path.join(self.root, "objects", name[:2], name)
+
+    def get(self, stage, key):
+        """the bytes stored for key by stage, None if there are none"""
+        try:
+            with open(os.path.join(self.root, "keys", stage, key), "r") as fp:
+                name = fp.read()
+            path = self._object(name)
+            with open(path, "rb") as fp:
+                data = fp.read()
+            os.utime(path)
+        except OSError:
+            data = None
+
+        if data is not None and hashlib.sha256(data).hexdigest() != name:
+            data = None # can only be a file somebody else changed, it gets replaced
+        self._count(stage, "misses" if data is None else "hits")
+        return data
+
+    def put(self, stage, key, data):
+        name = hashlib.sha256(data).hexdigest()
+        path = self._object(name)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            _write(path, data)
+        _write(os.path.join(self.root, "keys", stage, key), name.encode())
+        self._count(stage, "stores")
+
+    def evict(self):
+        """
+        removes the least recently used objects and their keys over the limit and the keys of
+        objects which are gone, gives back (objects, keys, bytes)
+        """
+        objects = os.path.join(self.root, "objects")
+        if not os.path.isdir(objects):
+            return 0, 0, 0
+        with open(os.path.join(self.root, "lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = dict() # object name -> (mtime, size, path)
+            for name, path, stat in _files(objects):
+                entries[name] = (stat.st_mtime, stat.st_size, path)
+
+            # an object is always written before the keys mapping to it
+            keys = dict() # object name -> [(size, path)]
+            orphans = list()
+            for _, path, stat in _files(os.path.join(self.root, "keys")):
+                try:
+                    with open(path, "r") as fp:
+                        name = fp.read()
+                except FileNotFoundError:
+                    continue
+                found = keys.setdefault(name, list()) if name in entries else orphans
+                found.append((stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries.values()) \
+                + sum(size for found in keys.values() for size, _ in found)
+            removed_keys = freed = 0
+            for size, path in orphans:
+                _remove(path)
+                removed_keys += 1
+                freed += size
+
+            removed = 0
+            for name, (_, size, path) in sorted(entries.items(), key=lambda entry: entry[1]):
+                if total <= self.limit:
+                    break
+                _remove(path)
+                removed += 1
+                total -= size
+                freed += size
+                for size, path in keys.get(name, ()):
+                    _remove(path)
+                    removed_keys += 1
+                    total -= size
+                    freed += size
+        if removed or removed_keys:
+            counts = self.stats.setdefault("evicted", dict())
+            counts["objects"] = counts.get("objects", 0) + removed
+            counts["keys"] = counts.get("keys", 0) + removed_keys
+            counts["bytes"] = counts.get("bytes", 0) + freed
+        return removed, removed_keys, freed
+
+
+def _files(root):
+    """(name, path, os.stat_result) of the files under root, removing stale temporary files"""
+    now = time.time()
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(dirpath, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if not name.endswith(".tmp"):
+                yield name, path, stat
+            elif now - stat.st_mtime > STALE_SECONDS:
+                _remove(path)
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as fp:
+        fp.write(data)
+    os.replace(tmp, path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def report(stats) -> str:
+    """table of the hits, misses and stores of every stage"""
+    lines = [f"{'stage':<12} {'hits':>8} {'misses':>8} {'stores':>8}"]
+    for stage, counts in stats.items():
+        if stage != "evicted":
+            lines.append(f"{stage:<12} {counts.get('hits', 0):>8} {counts.get('misses', 0):>8} "
+                f"{counts.get('stores', 0):>8}")
+    if "evicted" in stats:
+        evicted = stats["evicted"]
+        lines.append(f"evicted {evicted.get('objects', 0)} object(s), {evicted.get('keys', 0)} "
+            f"key(s), {evicted['bytes']} bytes")
+    return "\n".join(lines)
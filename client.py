@@ -0,0 +1,71 @@
+import json
+import os
+import socket
+import sys
+
+# Thin client of the compile server (server.py), it only imports what it needs to talk to it so
+# it starts a lot faster than main.py. The arguments are the ones main.py takes, relative paths
+# are relative to the directory the client runs in:
+#
+#   python3 -m server &
+#   python3 -m client --target linux-x86_64 -o out.s test.txt
+#   python3 -m client --stop-server
+#
+# Without a server running the client compiles in its own process like main.py.
+#
+# Requests and responses are one line of JSON each:
+#
+#   {"cwd": "/home/me/project", "argv": ["--target", "c", "test.txt"]}
+#   {"status": 0, "output": "what main.py printed"}
+#
+# {"stop": true} stops the server.
+
+SOCKET_ENV: str = "MYLANG_SOCKET"
+
+
+def socket_path() -> str:
+    """$MYLANG_SOCKET, or mylang.sock in the runtime directory of the user"""
+    if SOCKET_ENV in os.environ:
+        return os.environ[SOCKET_ENV]
+    if "XDG_RUNTIME_DIR" in os.environ:
+        return os.path.join(os.environ["XDG_RUNTIME_DIR"], "mylang.sock")
+    return f"/tmp/mylang-{os.getuid()}.sock"
+
+
+def request(message, path=None) -> dict:
+    """sends message to the server and gives back its response, OSError without a server"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path or socket_path())
+        sock.sendall(json.dumps(message).encode() + b"\n")
+        with sock.makefile("rb") as fp:
+            line = fp.readline()
+    if not line:
+        raise ConnectionError("the server closed the connection")
+    return json.loads(line)
+
+
+def run(argv, path=None) -> tuple:
+    """(exit status, printed output) of main.py with argv compiled by the server"""
+    response = request({"cwd": os.getcwd(), "argv": list(argv)}, path)
+    return response["status"], response["output"]
+
+
+def main() -> int:
+    argv = sys.argv[1:]
+    try:
+        if argv == ["--stop-server"]:
+            request({"stop": True})
+            return 0
+        status, output = run(argv)
+    except (FileNotFoundError, ConnectionRefusedError):
+        if argv == ["--stop-server"]:
+            return 0
+        import main as compiler
+        return compiler.main(argv)
+
+    sys.stdout.write(output)
+    return status
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
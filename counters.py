@@ -0,0 +1,98 @@
+import dataclasses
+import json
+
+import ast_ as ast
+from ir.core import OpEnum
+from ir.serialize import LazyBlock
+
+# Event counters of a compile (main.py --stats), to see why a compile is slow and not only
+# which phase is.
+#
+#   counters.add("lookups", "globals")
+#   counters.update("cache", cache.stats["ir"])
+#
+# Counters are grouped by section, a section maps names to counts. Code which counts takes a
+# counters argument defaulting to NULL, whose methods do nothing, and looks at counters.enabled
+# before counting anything that takes work. What can be counted afterwards (tokens, ast nodes,
+# IR instructions) gets counted from what the phases produced instead, so the lexer, the parser
+# and the IR generator don't count anything themselves.
+
+
+class NullCounters:
+    __slots__ = ()
+    enabled = False
+
+    def add(self, section, name, n=1):
+        pass
+
+    def update(self, section, counts):
+        pass
+
+    def tokens(self, toks):
+        pass
+
+    def ast_nodes(self, node):
+        pass
+
+    def ir_instrs(self, rep):
+        pass
+
+
+NULL: NullCounters = NullCounters()
+
+
+class Counters:
+    __slots__ = ("sections",)
+    enabled = True
+
+    def __init__(self):
+        self.sections = dict() # section -> name -> count
+
+    def add(self, section, name, n=1):
+        counts = self.sections.setdefault(section, dict())
+        counts[name] = counts.get(name, 0) + n
+
+    def update(self, section, counts):
+        for name, n in counts.items():
+            self.add(section, name, n)
+
+    def tokens(self, toks):
+        """counts the lexer.Tokens by type"""
+        for tok in toks.tokens:
+            self.add("tokens", tok.type.name)
+
+    def ast_nodes(self, node):
+        """counts the nodes of the tree by class"""
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, list):
+                stack.extend(node)
+            elif isinstance(node, ast.Node):
+                self.add("ast nodes", node.__class__.__name__)
+                stack.extend(getattr(node, field.name) for field in dataclasses.fields(node))
+
+    def ir_instrs(self, rep):
+        """counts the instructions of the IR by op, the ones of function bodies and structs too"""
+        stack = [rep]
+        while stack:
+            val = stack.pop()
+            if isinstance(val, tuple) and val and isinstance(val[0], OpEnum):
+                self.add("IR instructions", val[0].name)
+                stack.extend(val[3:])
+            elif isinstance(val, (list, tuple, LazyBlock)):
+                stack.extend(val)
+
+    def json(self) -> str:
+        return json.dumps(self.sections, indent=2)
+
+    def report(self) -> str:
+        """table of every section, the biggest counts first"""
+        width = max((len(name) for counts in self.sections.values() for name in counts),
+            default=0)
+        lines = list()
+        for section, counts in self.sections.items():
+            lines.append(f"{section} ({sum(counts.values())})")
+            for name, n in sorted(counts.items(), key=lambda item: -item[1]):
+                lines.append(f"  {name:<{width}} {n:>10}")
+        return "\n".join(lines)
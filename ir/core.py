@@ -10,7 +10,7 @@ class OpEnum(Enum):
     MODULE = auto()
     # (..., is_type_expr=False, name, typ, val)
     VAR_DECL = auto()
-    # (..., name, ret_val, args: list[(name, type)], body: list | None)
+    # (..., name, ret_val, args: list[(name, type)], is_inline: bool, body: list | None)
     FUNC_DECL = auto()
 
     # (..., ret, typ_expr, is_raw, length: int | None)
@@ -23,18 +23,40 @@ class OpEnum(Enum):
     # (..., ret_val: uid | None)
     RETURN_STMT = auto()
 
-    # (..., ret, args: list[arg, arg, ...])
+    # (..., ret, func, args: list[arg, arg, ...])
     FUNC_CALL = auto()
 
-    # (..., slice, idx: uid)
+    # (..., ret, slice, idx: uid)
     SLICE_INDEXING = auto()
 
+    # (..., target, val)
+    ASSIGN = auto()
+    # (..., obj, member, val)
+    MEMBER_ASSIGN = auto()
+
+    # Unary operations
+    # (..., ret, expr)
+    UNARY_NEG = auto()
+    UNARY_NOT = auto()
+
     # Binary operations
     # (..., ret, lhs, rhs)
     BIN_ADD = auto()
+    BIN_SUB = auto()
     BIN_MUL = auto()
+    BIN_DIV = auto()
+    BIN_MOD = auto()
+    BIN_AND = auto()
+    BIN_OR = auto()
+    BIN_XOR = auto()
+    BIN_SHL = auto()
+    BIN_SHR = auto()
     MEMBER_ACCESS = auto()
 
+    # every pass looks up handlers by the op, Enum hashes the name of the member in python and
+    # the members are singletons anyway
+    __hash__ = object.__hash__
+
 
 # just a tuple (there is no decently fast way to type this)
 def Instr(*args):
@@ -57,7 +79,7 @@ class PointerType(Type):
         super().__init__(token)
         self.to = to
     __str__ = lambda self: f"*{str(self.to)}"
-    __eq__ = lambda self, other: isinstance(other, Pointer) and self.to == other.to
+    __eq__ = lambda self, other: isinstance(other, PointerType) and self.to == other.to
 
 class ModuleType(Type):
     def __init__(self, token):
@@ -71,19 +93,42 @@ class TypeType(Type):
     def __init__(self, token):
         super().__init__(token)
 
+    __str__ = lambda self: "type"
+
 class BoolType(Type):
     def __init__(self, token):
         super().__init__(token)
 
+    __str__ = lambda self: "bool"
+
 class VoidType(Type):
     def __init__(self, token):
         super().__init__(token)
 
+    __str__ = lambda self: "void"
+
 class StructType(Type):
-    def __init__(self, token):
+    __slots__ = "name", "members", "layout"
+    def __init__(self, token, name=None, members=None):
         super().__init__(token)
-    
-    __str__ = lambda self: "struct"
+        self.name = name
+        self.members = list() if members is None else members # list[(name, Type)]
+        self.layout = None # asm_gen.layout.struct_layout() of the native backends
+
+    # structs are nominal, two structs are only the same if they are the same declaration
+    __eq__ = lambda self, other: self is other
+    __hash__ = lambda self: id(self)
+    __str__ = lambda self: "struct" if self.name is None else self.name
+
+    def index(self, name):
+        for i, (member, _) in enumerate(self.members):
+            if member == name:
+                return i
+        return None
+
+    def member(self, name):
+        idx = self.index(name)
+        return None if idx is None else self.members[idx][1]
 
 class IntType(Type):
     __slots__ = ("bit_length",)
@@ -120,9 +165,12 @@ class FloatType(Type):
 
 class FuncType(Type):
     def __init__(self, ret, args):
+        self.token = None
         self.ret = ret
         self.args = args
 
+    __str__ = lambda self: "(" + ", ".join(str(arg) for arg in self.args) + f") -> {self.ret}"
+
     def __repr__(self):
         gen = (arg.name if isinstance(arg, Block) else str(arg) for arg in self.args)
         return "(" + ", ".join(gen) + f") -> {self.ret}" 
@@ -134,7 +182,10 @@ class SliceType(Type):
         self.type = typ
         self.len = length
 
-    __str__ = lambda self: f"{str(self.type)}[{self.len}]"
+    __str__ = lambda self: f"{str(self.type)}[{'' if self.len is None else self.len}]"
+
+    def __eq__(self, other):
+        return isinstance(other, SliceType) and self.type == other.type
 
 class Value:
     __slots__ = "token", "type", "name"
@@ -154,7 +205,10 @@ class Constant(Type):
         self.type = typ
         self.const = const
 
-    __repr__ = lambda self: str(self.const)
+    __repr__ = lambda self: repr(self.const)
+    __eq__ = lambda self, other: isinstance(other, Constant) \
+        and self.type == other.type and self.const == other.const
+    __hash__ = lambda self: hash(self.const)
 
 class Block:
     def __init__(self, parent_block):
@@ -21,12 +21,40 @@ BUILTIN_TYPES: dict = {
     "f64": ir.FloatType(None, 64),
 
     "int": ir.IntType(None, 64),
-    "uint": ir.IntType(None, 64),
+    "uint": ir.UintType(None, 64),
     "bool": ir.BoolType(None),
     "void": ir.VoidType(None),
     "type": ir.TypeType(None),
 }
 
+BINARY_OPS: dict = {
+    TokenEnum.Addition: OpEnum.BIN_ADD,
+    TokenEnum.Subtraction: OpEnum.BIN_SUB,
+    TokenEnum.Asterisk: OpEnum.BIN_MUL,
+    TokenEnum.Division: OpEnum.BIN_DIV,
+    TokenEnum.Modulo: OpEnum.BIN_MOD,
+    TokenEnum.Ampersand: OpEnum.BIN_AND,
+    TokenEnum.Pipe: OpEnum.BIN_OR,
+    TokenEnum.Xor: OpEnum.BIN_XOR,
+    TokenEnum.ShiftLeft: OpEnum.BIN_SHL,
+    TokenEnum.ShiftRight: OpEnum.BIN_SHR,
+    TokenEnum.Period: OpEnum.MEMBER_ACCESS,
+}
+
+# compound assignments are lowered to the binary operation followed by an assignment
+ASSIGN_OPS: dict = {
+    TokenEnum.AssignAdd: OpEnum.BIN_ADD,
+    TokenEnum.AssignSub: OpEnum.BIN_SUB,
+    TokenEnum.AssignMul: OpEnum.BIN_MUL,
+    TokenEnum.AssignDiv: OpEnum.BIN_DIV,
+    TokenEnum.AssignMod: OpEnum.BIN_MOD,
+    TokenEnum.AssignShiftLeft: OpEnum.BIN_SHL,
+    TokenEnum.AssignShiftRight: OpEnum.BIN_SHR,
+    TokenEnum.AssignXor: OpEnum.BIN_XOR,
+    TokenEnum.AssignAnd: OpEnum.BIN_AND,
+    TokenEnum.AssignPipe: OpEnum.BIN_OR,
+}
+
 class IrGenerator:
     __slots__ = "src", "blocks", "next_uid", "num_errors"
     def __init__(self, src):
@@ -63,26 +91,65 @@ class IrGenerator:
                 return ret
             else:
                 self.error(node.op, f"Unary '*' and macro calls are allowed in type expressions")
+                return None
+
+        if node.op == TokenEnum.Subtraction:
+            self.append(ir.Instr(OpEnum.UNARY_NEG, node, is_type_expr, ret, expr))
+            return ret
+        elif node.op == TokenEnum.Not:
+            self.append(ir.Instr(OpEnum.UNARY_NOT, node, is_type_expr, ret, expr))
+            return ret
 
         raise NotImplementedError(node.op)
 
+
+    def assignment(self, node, is_type_expr=False):
+        rhs = self.generate(node.rhs, is_type_expr)
+
+        op = ASSIGN_OPS.get(node.op.type)
+        if op is None and node.op.type != TokenEnum.Assignment:
+            # ~= has no binary operation to lower to, it must not turn into a plain store
+            self.error(node.op, "Unsupported compound assignment")
+            return rhs
+        if op is not None:
+            ret = self.gen_uid()
+            self.append(ir.Instr(op, node, is_type_expr, ret, self.generate(node.lhs), rhs))
+            rhs = ret
+
+        match node.lhs:
+            case ast.Identifier(name):
+                self.append(ir.Instr(OpEnum.ASSIGN, node, is_type_expr, name, rhs))
+            case ast.BinaryExpr(op, lhs, ast.Identifier(member)) if op == TokenEnum.Period:
+                obj = self.generate(lhs)
+                self.append(ir.Instr(OpEnum.MEMBER_ASSIGN, node, is_type_expr, obj, member, rhs))
+            case _:
+                self.error(node.op, "Can only assign to variables and struct members")
+
+        return rhs
+
         
     def binary_expression(self, node, is_type_expr=False):
+        if TokenEnum.ASSIGNMENT_START < node.op.type < TokenEnum.ASSIGNMENT_END:
+            return self.assignment(node, is_type_expr)
+
+        op = BINARY_OPS.get(node.op.type)
+        if op is None:
+            raise NotImplementedError(node.op)
+
         lhs = self.generate(node.lhs, is_type_expr)
         rhs = self.generate(node.rhs, is_type_expr)
         
         ret = self.gen_uid()
+        self.append(ir.Instr(op, node, is_type_expr, ret, lhs, rhs))
+        return ret
+
+    def block(self, statements):
+        """the instructions of the statements of a function body"""
+        self.blocks.append(list())
+        for stmt in statements:
+            self.generate(stmt)
+        return self.blocks.pop()
 
-        if node.op == TokenEnum.Addition:
-            self.append(ir.Instr(OpEnum.BIN_ADD, node, is_type_expr, ret, lhs, rhs))
-            return ret
-        elif node.op == TokenEnum.Asterisk:
-            self.append(ir.Instr(OpEnum.BIN_MUL, node, is_type_expr, ret, lhs, rhs))
-            return ret
-        elif node.op == TokenEnum.Period:
-            self.append(ir.Instr(OpEnum.MEMBER_ACCESS, node, is_type_expr, ret, lhs, rhs))
-        else:
-            raise NotImplementedError(node.op)
 
     def generate(self, node, is_type_expr=False):
         match node:
@@ -115,28 +182,26 @@ class IrGenerator:
                         self.error(arg, 
                             "Function argument can not have a default argument as of right now")
                     else:
-                        arg_type = self.generate(arg, True)
-                        arg_list.append((name, arg_type))
+                        arg_type = self.generate(arg.type_expr, True)
+                        arg_list.append((arg.name, arg_type))
 
                 return_val = self.generate(node.type_expr.ret, True)
                 
                 block = None
                 if node.expr is not None:
-                    self.blocks.append(list())
-
-                    for stmt in node.expr:
-                        self.generate(stmt)
-                    
-                    block = self.blocks.pop()
+                    block = self.block(node.expr)
                 
                 self.append(
                     ir.Instr(OpEnum.FUNC_DECL, node, is_type_expr, 
-                        name, return_val, arg_list, block
+                        name, return_val, arg_list, node.inline is not None, block
                     )
                 )
         
             case ast.Declaration(name, type_expr, expr):
                 # var decl
+                if node.inline is not None:
+                    self.error(node.inline, "Only functions can be inline")
+
                 typ = self.generate(type_expr, True)
                 val = None
                 if expr is not None:
@@ -165,7 +230,7 @@ class IrGenerator:
 
                 ret = self.gen_uid()
 
-                self.append(ir.Instr(OpEnum.FUNC_CALL, node, is_type_expr, ret, arg_list))
+                self.append(ir.Instr(OpEnum.FUNC_CALL, node, is_type_expr, ret, func, arg_list))
 
                 return ret
 
@@ -173,19 +238,22 @@ class IrGenerator:
                 typ = self.generate(node.expr, True)
                 subscript = None
                 if node.subscript is not None:
-                    self.generate(node.subscript)
+                    subscript = self.generate(node.subscript)
 
                 ret = self.gen_uid()
-                self.append(ir.Instr(OpEnum.SLICE_TYPE, node, is_type_expr, True, subscript))
+                self.append(ir.Instr(OpEnum.SLICE_TYPE, node, is_type_expr, ret, typ, True, subscript))
+                return ret
 
             case ast.Slice():
                 expr = self.generate(node.expr)
                 if node.subscript is None:
-                    self.error(node.subscript, "Empty subscript in slice expression")
+                    self.error(node.right_square, "Empty subscript in slice expression")
                     return None
                 else:
                     subscript = self.generate(node.subscript)
-                    self.append(ir.Instr(OpEnum.SLICE_INDEXING, node, is_type_expr, subscript))
+                    ret = self.gen_uid()
+                    self.append(ir.Instr(OpEnum.SLICE_INDEXING, node, is_type_expr, ret, expr, subscript))
+                    return ret
 
             case ast.ReturnStmt(ret, expr):
                 if expr is not None:
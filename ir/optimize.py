@@ -0,0 +1,322 @@
+import math
+
+import ir.core as ir
+from ir.core import OpEnum
+from ir.program import is_int, map_values, values
+from ir.vm import wrap_int
+from timing import NULL
+
+# Optimizations of the resolved IR from ir.program, they change the program in place.
+#   inline      replaces calls to `inline` and small leaf functions with their bodies
+#   propagate   propagates and folds constants and drops the computations nobody uses
+# There are no branches in the IR yet so everything after the first return of a function is dead.
+
+INLINE_BUDGET: int = 12 # instructions a leaf function without `inline` may have to get inlined
+GROWTH_LIMIT: int = 2000 # instructions a function may grow to by inlining functions without `inline`
+
+_PURE: tuple = (OpEnum.UNARY_NEG, OpEnum.UNARY_NOT, OpEnum.BIN_ADD, OpEnum.BIN_SUB, OpEnum.BIN_MUL,
+    OpEnum.BIN_DIV, OpEnum.BIN_MOD, OpEnum.BIN_AND, OpEnum.BIN_OR, OpEnum.BIN_XOR, OpEnum.BIN_SHL,
+    OpEnum.BIN_SHR, OpEnum.MEMBER_ACCESS)
+
+
+def _is_value(val):
+    return isinstance(val, (int, str)) and not isinstance(val, bool)
+
+
+def is_scalar(typ):
+    return is_int(typ) or isinstance(typ, (ir.FloatType, ir.BoolType, ir.PointerType))
+
+
+def _div(a, b):
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+
+class Remark:
+    __slots__ = "node", "caller", "callee", "inlined", "reason"
+    def __init__(self, node, caller, callee, inlined, reason):
+        self.node = node
+        self.caller = caller
+        self.callee = callee
+        self.inlined = inlined
+        self.reason = reason
+
+    def format(self, src):
+        pos = ""
+        if self.node is not None:
+            line, col = src.get_tok_human_pos(self.node)
+            pos = f"{line}:{col}:"
+        what = "inlined" if self.inlined else "did not inline"
+        return f"{src.filename}:{pos} remark: {what} {self.callee!r} into {self.caller!r}: {self.reason}"
+
+
+class Inliner:
+    __slots__ = "program", "remarks", "next_uid", "count"
+    def __init__(self, program, remarks):
+        self.program = program
+        self.remarks = remarks
+        self.count = 0
+
+        funcs = (*program.functions.values(), program.init)
+        self.next_uid = 1 + max((uid for func in funcs for uid in func.types), default=0)
+
+    def decide(self, func, callee, stack, size):
+        """(inline or not, why)"""
+        if callee.name in stack:
+            return False, "recursive call"
+        if callee.module is not None:
+            return False, f"defined in module {callee.module!r}"
+        if not callee.body:
+            return False, "has no body"
+
+        # a global used by the callee must not end up referring to a local of the caller
+        for instr in callee.body:
+            for val in values(instr):
+                if isinstance(val, str) and val not in callee.locals and val in func.locals:
+                    return False, f"global {val!r} is shadowed in the caller"
+
+        if callee.is_inline:
+            return True, "marked inline"
+        if any(instr[0] == OpEnum.FUNC_CALL for instr in callee.body):
+            return False, "not a leaf function and not marked inline"
+        if len(callee.body) > INLINE_BUDGET:
+            return False, f"too big ({len(callee.body)} > {INLINE_BUDGET} instructions)"
+        if size + len(callee.body) > GROWTH_LIMIT:
+            return False, f"caller would grow over {GROWTH_LIMIT} instructions"
+        return True, f"small leaf function ({len(callee.body)} instructions)"
+
+    def instrs(self, func, body, stack, out, subst):
+        read = lambda val: subst.get(val, val) if _is_value(val) else val
+        for instr in body:
+            instr = map_values(instr, read, lambda val: val)
+            if instr[0] != OpEnum.FUNC_CALL:
+                out.append(instr)
+                continue
+
+            _, node, _, ret, callee, args = instr
+            callee = self.program.callee(callee)
+            inline, reason = self.decide(func, callee, stack, len(out))
+            self.remarks.append(Remark(node, func.name, callee.name, inline, reason))
+            if not inline:
+                out.append(instr)
+            else:
+                self.inline(func, instr, callee, stack, out, subst)
+
+    def inline(self, func, instr, callee, stack, out, subst):
+        _, node, _, ret, _, args = instr
+        self.count += 1
+
+        names = dict()
+        for name, typ in callee.locals.items():
+            new = f"_{self.count}_{name}"
+            while new in func.locals:
+                new = "_" + new
+            names[name] = new
+            func.locals[new] = typ
+
+        uids = dict()
+        def rename(val):
+            if isinstance(val, str):
+                return names.get(val, val)
+            elif _is_value(val):
+                uid = uids.get(val)
+                if uid is None:
+                    uid = uids[val] = self.next_uid
+                    func.types[uid] = callee.types.get(val)
+                    self.next_uid += 1
+                return uid
+            return val
+
+        for (arg, typ), val in zip(callee.args, args):
+            out.append((OpEnum.VAR_DECL, node, False, names[arg], typ, val))
+
+        body = list()
+        result = None
+        for callee_instr in callee.body:
+            if callee_instr[0] == OpEnum.RETURN_STMT:
+                result = rename(callee_instr[3])
+                break
+            body.append(map_values(callee_instr, rename))
+
+        # calls in the body get inlined as well
+        self.instrs(func, body, (*stack, callee.name), out, subst)
+        if _is_value(result):
+            result = subst.get(result, result)
+
+        if isinstance(callee.ret, ir.VoidType):
+            return
+        if _is_value(result) and (isinstance(result, int) or result in names.values()) \
+            and self.program.type_of(func, result) == callee.ret:
+            subst[ret] = result
+        else:
+            name = f"_{self.count}_ret"
+            func.locals[name] = callee.ret
+            out.append((OpEnum.VAR_DECL, node, False, name, callee.ret, result))
+            subst[ret] = name
+
+    def function(self, func):
+        out = list()
+        self.instrs(func, func.body, (func.name,), out, dict())
+        func.body = out
+
+
+def inline(program, remarks):
+    inliner = Inliner(program, remarks)
+    for func in program.functions.values():
+        inliner.function(func)
+
+    for instr in program.init.body:
+        if instr[0] == OpEnum.FUNC_CALL:
+            remarks.append(Remark(instr[1], program.init.name, instr[4], False,
+                "calls at module scope are not inlined"))
+
+
+def _constant(typ, const):
+    """const converted to typ if typ is a type constants get propagated for"""
+    if is_int(typ):
+        if isinstance(const, float) and not math.isfinite(const):
+            return None
+        return wrap_int(int(const), typ)
+    elif isinstance(typ, ir.FloatType) and typ.bit_length == 64:
+        return float(const)
+    return None
+
+
+def _fold(op, typ, a, b=None):
+    # the same semantics as ir.vm, None when the operation can't be folded. Dividing by zero
+    # is left to fail when the program runs
+    if isinstance(typ, ir.FloatType):
+        if typ.bit_length != 64:
+            return None
+        a = float(a)
+        b = None if b is None else float(b)
+        match op:
+            case OpEnum.UNARY_NEG: return -a
+            case OpEnum.BIN_ADD: return a + b
+            case OpEnum.BIN_SUB: return a - b
+            case OpEnum.BIN_MUL: return a * b
+            case OpEnum.BIN_DIV if b != 0: return a / b
+        return None
+    elif not is_int(typ) or isinstance(a, float) or isinstance(b, float):
+        return None
+
+    # the operands get converted to the type of the result first
+    a = wrap_int(a, typ)
+    b = None if b is None else wrap_int(b, typ)
+    match op:
+        case OpEnum.UNARY_NEG: val = -a
+        case OpEnum.UNARY_NOT: val = ~a
+        case OpEnum.BIN_ADD: val = a + b
+        case OpEnum.BIN_SUB: val = a - b
+        case OpEnum.BIN_MUL: val = a * b
+        case OpEnum.BIN_DIV if b != 0: val = _div(a, b)
+        case OpEnum.BIN_MOD if b != 0: val = a - b * _div(a, b)
+        case OpEnum.BIN_AND: val = a & b
+        case OpEnum.BIN_OR: val = a | b
+        case OpEnum.BIN_XOR: val = a ^ b
+        case OpEnum.BIN_SHL: val = a << b if 0 <= b < 64 else 0
+        case OpEnum.BIN_SHR: val = a >> (b if b >= 0 else 64)
+        case _: return None
+    return wrap_int(val, typ)
+
+
+def propagate(program, func):
+    is_init = func is program.init
+    consts = dict() # local or uid -> ir.Constant or the uid it is a copy of
+    read = lambda val: consts.get(val, val) if _is_value(val) else val
+
+    body = list()
+    for instr in func.body:
+        instr = map_values(instr, read, lambda val: val)
+        op, node, _, *operands = instr
+
+        if op in (OpEnum.VAR_DECL, OpEnum.ASSIGN) and not is_init and operands[0] in func.locals:
+            name, val = operands[0], operands[-1]
+            typ = operands[1] if op == OpEnum.VAR_DECL else func.locals[name]
+            const = None
+            if val is None:
+                const = _constant(typ, 0)
+            elif isinstance(val, ir.Constant) and isinstance(val.const, (int, float)):
+                const = _constant(typ, val.const)
+
+            if const is not None:
+                consts[name] = ir.Constant(getattr(val, "token", None), typ, const)
+            elif isinstance(val, int) and is_scalar(typ) and program.type_of(func, val) == typ:
+                # uids never change so reads of a copy can use the uid directly
+                consts[name] = val
+            else:
+                consts.pop(name, None)
+
+        elif op in _PURE and op != OpEnum.MEMBER_ACCESS \
+            and all(isinstance(val, ir.Constant) for val in operands[1:]):
+            typ = func.types[operands[0]]
+            const = _fold(op, typ, *(val.const for val in operands[1:]))
+            if const is not None:
+                consts[operands[0]] = ir.Constant(operands[1].token, typ, const)
+                continue
+
+        body.append(instr)
+        if op == OpEnum.RETURN_STMT:
+            break
+
+    func.body = eliminate(program, func, body)
+
+
+def _may_fail(func, instr):
+    """if instr is an integer division by something which might be zero, it fails when it is"""
+    if instr[0] not in (OpEnum.BIN_DIV, OpEnum.BIN_MOD):
+        return False
+    _, _, _, ret, _, rhs = instr
+    typ = func.types[ret]
+    return is_int(typ) and not (isinstance(rhs, ir.Constant) and isinstance(rhs.const, int)
+        and wrap_int(rhs.const, typ) != 0)
+
+
+def eliminate(program, func, body):
+    """drops the computations and local assignments nobody reads, divisions which can fail
+    are kept"""
+    is_init = func is program.init
+    live = set()
+    mentioned = set()
+    is_local = lambda val: isinstance(val, int) or (not is_init and val in func.locals)
+
+    out = list()
+    for instr in reversed(body):
+        op = instr[0]
+        defs = list()
+        reads = list()
+        map_values(instr, lambda val: reads.append(val) or val, lambda val: defs.append(val) or val)
+
+        if op in _PURE or op == OpEnum.ASSIGN:
+            if is_local(defs[0]) and defs[0] not in live and not _may_fail(func, instr):
+                continue
+        elif op == OpEnum.VAR_DECL:
+            if is_local(defs[0]) and defs[0] not in mentioned:
+                continue
+        elif op == OpEnum.MEMBER_ASSIGN:
+            # the struct is modified, not replaced
+            reads += defs
+            defs = []
+
+        out.append(instr)
+        live.difference_update(defs)
+        live.update(val for val in reads if _is_value(val))
+        mentioned.update(val for val in (*defs, *reads) if _is_value(val))
+
+    out.reverse()
+
+    args = {name for name, _ in func.args}
+    for name in [name for name in func.locals if name not in mentioned and name not in args]:
+        del func.locals[name]
+    for uid in [uid for uid in func.types if uid not in mentioned]:
+        del func.types[uid]
+    return out
+
+
+def optimize(program, remarks=None, timer=NULL):
+    """inlines and propagates constants, the inlining decisions get appended to remarks"""
+    with timer.phase("inline"):
+        inline(program, list() if remarks is None else remarks)
+    with timer.phase("propagate"):
+        for func in (*program.functions.values(), program.init):
+            propagate(program, func)
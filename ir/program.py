@@ -0,0 +1,488 @@
+import ir.core as ir
+from ir.core import OpEnum
+from ir.generator import BUILTIN_TYPES
+from ir import typechecker
+
+from tokens import Token, TokenEnum
+from timing import NULL
+from counters import NULL as NULL_COUNTERS
+
+# Resolves the output of ir.generator.generate into something the backends can consume directly.
+#
+# In the resolved instructions names are str, literals are ir.Constant and types are ir.Type,
+# type expression instructions (POINTER_TYPE, SLICE_TYPE) are folded into the types that use them
+# and static member functions like `Vec3.dot` are referenced as "Vec3.dot".
+# The types of the uids get inferred by ir.typechecker once every declaration is known.
+#
+# build() can get the Programs of the imported modules (their signatures from declarations()),
+# `c.three()` then calls "c.three" of Program.externs, a Function without a body named "three"
+# like in module c, which is the name the backends call it by. Functions using structs are
+# private to their module for now, the structs of two modules are different types.
+# The instructions keep the layout from ir.core.OpEnum with these exceptions:
+#   VAR_DECL        (..., name: str, typ: ir.Type, val)
+#   FUNC_CALL       (..., ret, func: str, args: list)
+#   MEMBER_ACCESS   (..., ret, obj, member: str)
+#   MEMBER_ASSIGN   (..., obj, member: str, val)
+
+_ESCAPES: dict = {
+    '0': 0, 'a': 7, 'b': 8, 'e': 27, 'f': 12, 'n': 10, 'r': 13, 't': 9, 'v': 11,
+    '\\': ord('\\'), '\'': ord('\''), '"': ord('"'),
+}
+
+def unescape(s: str) -> bytes:
+    out = bytearray()
+    i = 0
+    while i < len(s):
+        ch = s[i]
+        i += 1
+        if ch != '\\':
+            out += ch.encode("utf-8")
+        elif s[i] == 'x':
+            out.append(int(s[i + 1 : i + 3], 16))
+            i += 3
+        else:
+            out.append(_ESCAPES[s[i]])
+            i += 1
+    return bytes(out)
+
+
+def is_int(typ):
+    return isinstance(typ, (ir.IntType, ir.UintType))
+
+
+def map_values(instr, read, write=None):
+    """copy of a resolved instruction with read applied to the values it reads and write to
+    the values it defines"""
+    write = read if write is None else write
+    op, node, is_type_expr, *operands = instr
+    match op:
+        case OpEnum.VAR_DECL:
+            name, typ, val = operands
+            operands = (write(name), typ, read(val))
+        case OpEnum.ASSIGN:
+            name, val = operands
+            operands = (write(name), read(val))
+        case OpEnum.MEMBER_ASSIGN:
+            obj, member, val = operands
+            operands = (write(obj), member, read(val))
+        case OpEnum.MEMBER_ACCESS:
+            ret, obj, member = operands
+            operands = (write(ret), read(obj), member)
+        case OpEnum.FUNC_CALL:
+            ret, callee, args = operands
+            operands = (write(ret), callee, [read(arg) for arg in args])
+        case OpEnum.RETURN_STMT | OpEnum.NOP:
+            operands = [read(val) for val in operands]
+        case _:
+            ret, *operands = operands
+            operands = (write(ret), *(read(val) for val in operands))
+    return (op, node, is_type_expr, *operands)
+
+
+def values(instr):
+    """value operands of a resolved instruction, member names and called functions are left out"""
+    op, _, _, *operands = instr
+    match op:
+        case OpEnum.VAR_DECL | OpEnum.MEMBER_ASSIGN:
+            return [operands[0], operands[2]]
+        case OpEnum.MEMBER_ACCESS:
+            return operands[:2]
+        case OpEnum.FUNC_CALL:
+            return [operands[0], *operands[2]]
+        case _:
+            return operands
+
+
+class Function:
+    __slots__ = "name", "token", "args", "ret", "locals", "types", "body", "is_inline", "module"
+    def __init__(self, name, token, args, ret, is_inline=False, module=None):
+        self.name = name
+        self.token = token
+        self.args = args # list[(name, Type)]
+        self.ret = ret
+        self.locals = dict(args) # name -> Type, args first
+        self.types = dict() # uid -> Type
+        self.body = list()
+        self.is_inline = is_inline
+        self.module = module # the module an imported function is defined in, None for own ones
+
+    def type(self):
+        return ir.FuncType(self.ret, [typ for _, typ in self.args])
+
+    __repr__ = lambda self: f"Function({self.name}: {self.type()})"
+
+    def dissasemble(self):
+        s = f"{'inline ' if self.is_inline else ''}{self.name}: {self.type()}\n"
+        s += "\n".join("    " + " ".join(str(val) for val in (instr[0].name, *instr[3:]))
+            for instr in self.body)
+        return s + "\n"
+
+
+class Program:
+    __slots__ = "src", "name", "structs", "globals", "functions", "externs", "init", "stream"
+    def __init__(self, src, name):
+        self.src = src
+        self.name = name
+        self.structs = dict() # name -> StructType
+        self.globals = dict() # name -> Type
+        self.functions = dict() # name -> Function
+        self.externs = dict() # "module.name" -> Function of an imported module that gets called
+
+        # module level code, every VAR_DECL in it declares a global
+        self.init = Function("<init>", None, list(), ir.VoidType(None))
+
+        # builds the bodies while generating code, a stream.Stream or a pipeline.Pipeline
+        self.stream = None
+
+    def type_of(self, func, val):
+        match val:
+            case int():
+                return func.types.get(val)
+            case ir.Constant():
+                return val.type
+            case str() if val in func.locals:
+                return func.locals[val]
+            case str() if val in self.globals:
+                return self.globals[val]
+            case str() if val in self.functions:
+                return self.functions[val].type()
+            case str() if val in self.externs:
+                return self.externs[val].type()
+            case _:
+                return None
+
+    def callee(self, name):
+        """the Function called by name, own or imported"""
+        func = self.functions.get(name)
+        return self.externs.get(name) if func is None else func
+
+    def dissasemble(self):
+        s = f"module {self.name}\n\n"
+        for struct in self.structs.values():
+            s += f"struct {struct.name} {{ "
+            s += ", ".join(f"{name}: {typ}" for name, typ in struct.members) + " }\n"
+        for name, typ in self.globals.items():
+            s += f"{name}: {typ}\n"
+        s += "\n" + self.init.dissasemble()
+        for func in self.functions.values():
+            s += "\n" + func.dissasemble()
+        return s
+
+
+class ProgramBuilder:
+    __slots__ = "src", "program", "type_uids", "aliases", "unresolved", "num_errors", "counters", \
+        "handlers", "imports"
+    def __init__(self, src, counters=NULL_COUNTERS, imports=None):
+        self.src = src
+        self.counters = counters # counts the name lookups by the scope they end up in
+        self.imports = imports or dict() # name the module is imported as -> its Program
+        self.program = None
+        self.type_uids = dict() # uid -> Type for the type expression instructions
+        self.aliases = dict() # uid -> function name for static member function references
+        self.unresolved = list() # tokens of module level names that might get declared later
+        self.num_errors = 0
+
+        # opcode -> handler, the binary operations are the rest
+        self.handlers = {
+            OpEnum.POINTER_TYPE: lambda func, instr: self.type_instr(instr),
+            OpEnum.SLICE_TYPE: lambda func, instr: self.type_instr(instr),
+            OpEnum.VAR_DECL: self.var_decl,
+            OpEnum.FUNC_CALL: self.func_call,
+            OpEnum.MEMBER_ACCESS: self.member_access,
+            OpEnum.MEMBER_ASSIGN: self.member_assign,
+            OpEnum.SLICE_INDEXING: self.slice_indexing,
+            OpEnum.UNARY_NEG: self.unary,
+            OpEnum.UNARY_NOT: self.unary,
+            OpEnum.RETURN_STMT: self.operands,
+            OpEnum.ASSIGN: self.operands,
+            OpEnum.NOP: self.operands,
+            OpEnum.FUNC_DECL: self.nested,
+            OpEnum.COMPOUND_TYPE: self.nested,
+        }
+
+    def error(self, token, msg):
+        self.num_errors += 1
+        if token is None: # IR loaded from a file has no ast nodes to point at
+            print(f"{self.src.filename}: ERROR: {msg}")
+        else:
+            self.src.error(token, msg)
+
+    def name(self, token):
+        # src.get_token_string() without its EOF case, names always have a length
+        return self.src.src[token.position : token.position + token.length]
+
+    def literal(self, token):
+        s = self.src.get_token_string(token)
+        match token.type:
+            # the types are shared like the builtin ones, nothing changes them
+            case TokenEnum.IntegerLiteral:
+                return ir.Constant(token, BUILTIN_TYPES["i64"], int(s))
+            case TokenEnum.HexLiteral:
+                return ir.Constant(token, BUILTIN_TYPES["i64"], int(s, 16))
+            case TokenEnum.FloatLiteral:
+                return ir.Constant(token, BUILTIN_TYPES["f64"], float(s))
+            case TokenEnum.CharLiteral:
+                return ir.Constant(token, BUILTIN_TYPES["u8"], unescape(s[1:-1])[0])
+            case TokenEnum.StringLiteral:
+                val = unescape(s[1:-1])
+                return ir.Constant(token, ir.SliceType(None, ir.UintType(None, 8), len(val)), val)
+            case _:
+                raise NotImplementedError(token)
+
+    def type(self, val):
+        match val:
+            case None:
+                return None
+            case int():
+                return self.type_uids.get(val)
+            case Token(type=TokenEnum.Identifier):
+                name = self.name(val)
+                typ = BUILTIN_TYPES.get(name) or self.program.structs.get(name)
+                if typ is None:
+                    self.error(val, f"Could not resolve type {name!r}")
+                return typ
+            case _:
+                self.error(val, "Expected a type")
+                return None
+
+    def type_instr(self, instr):
+        match instr:
+            case (OpEnum.POINTER_TYPE, _, _, ret, to):
+                self.type_uids[ret] = ir.PointerType(None, self.type(to))
+            case (OpEnum.SLICE_TYPE, _, _, ret, typ, _, length):
+                if length is not None:
+                    length = self.literal(length).const if isinstance(length, Token) else None
+                self.type_uids[ret] = ir.SliceType(None, self.type(typ), length)
+            case _:
+                return False
+        return True
+
+    def is_declared(self, func, name):
+        program = self.program
+        if self.counters.enabled:
+            scope = next((scope for scope, names in (("locals", func.locals),
+                ("globals", program.globals), ("functions", program.functions),
+                ("structs", program.structs)) if name in names), "not found")
+            self.counters.add("lookups", scope)
+        return name in func.locals or name in program.globals or name in program.functions \
+            or name in program.structs
+
+    def operand(self, func, val):
+        cls = val.__class__
+        if cls is int:
+            return self.aliases.get(val, val)
+        elif cls is not Token:
+            return val
+        elif val.type != TokenEnum.Identifier:
+            return self.literal(val)
+
+        # is_declared() inlined unless the lookups get counted, this runs for every name
+        name = self.src.src[val.position : val.position + val.length]
+        program = self.program
+        if self.counters.enabled:
+            declared = self.is_declared(func, name)
+        else:
+            declared = name in func.locals or name in program.globals \
+                or name in program.functions or name in program.structs
+        if declared:
+            pass
+        elif func is program.init:
+            self.unresolved.append(val)
+        else:
+            self.error(val, f"Could not resolve value {name!r}")
+        return name
+
+    def instr(self, func, instr):
+        self.handlers.get(instr[0], self.binary)(func, instr)
+
+    def var_decl(self, func, instr):
+        op, node, is_type_expr, name, typ, val = instr
+        program = self.program
+        name_str = self.name(name)
+        typ = self.type(typ)
+        val = self.operand(func, val)
+
+        scope = program.globals if func is program.init else func.locals
+        if name_str in scope:
+            self.error(name, f"{name_str!r} is already declared")
+        scope[name_str] = typ
+
+        func.body.append(ir.Instr(op, node, is_type_expr, name_str, typ, val))
+
+    def func_call(self, func, instr):
+        op, node, is_type_expr, ret, callee_tok, args = instr
+        callee = self.operand(func, callee_tok)
+        args = [self.operand(func, arg) for arg in args]
+        func.body.append(ir.Instr(op, node, is_type_expr, ret, callee, args))
+
+    def member_access(self, func, instr):
+        op, node, is_type_expr, ret, obj, member = instr
+        program = self.program
+        member_str = self.name(member)
+        if obj.__class__ is Token and obj.type == TokenEnum.Identifier and self.imports:
+            module = self.name(obj)
+            if module in self.imports and not self.is_declared(func, module):
+                # function of an imported module, called by name like a static member function
+                self.aliases[ret] = self.extern(module, member_str)
+                return
+        obj = self.operand(func, obj)
+
+        if isinstance(obj, str) and obj in program.structs and obj not in func.locals \
+            and obj not in program.globals:
+            # static reference to a member function, nothing to do at runtime
+            self.aliases[ret] = f"{obj}.{member_str}"
+            return
+
+        func.body.append(ir.Instr(op, node, is_type_expr, ret, obj, member_str))
+
+    def extern(self, module, name):
+        """the key of the function name of the imported module in Program.externs"""
+        qualified = f"{module}.{name}"
+        imported = self.imports[module]
+        func = imported.functions.get(name)
+        if qualified not in self.program.externs and func is not None and not any(
+            _has_struct(typ) for typ in (func.ret, *(typ for _, typ in func.args))):
+            self.program.externs[qualified] = Function(func.name, None, func.args, func.ret,
+                module=imported.name)
+        return qualified
+
+    def member_assign(self, func, instr):
+        op, node, is_type_expr, obj, member, val = instr
+        obj = self.operand(func, obj)
+        val = self.operand(func, val)
+        func.body.append(ir.Instr(op, node, is_type_expr, obj, self.name(member), val))
+
+    def slice_indexing(self, func, instr):
+        op, node, is_type_expr, ret, slice_, idx = instr
+        slice_ = self.operand(func, slice_)
+        idx = self.operand(func, idx)
+        func.body.append(ir.Instr(op, node, is_type_expr, ret, slice_, idx))
+
+    def unary(self, func, instr):
+        op, node, is_type_expr, ret, expr = instr
+        func.body.append(ir.Instr(op, node, is_type_expr, ret, self.operand(func, expr)))
+
+    def operands(self, func, instr):
+        op, node, is_type_expr, *operands = instr
+        operands = [self.operand(func, val) for val in operands]
+        func.body.append(ir.Instr(op, node, is_type_expr, *operands))
+
+    def nested(self, func, instr):
+        self.error(instr[3], "Nested declarations are not supported")
+
+    def binary(self, func, instr):
+        op, node, is_type_expr, ret, lhs, rhs = instr
+        # most operands are uids which stay the same
+        if lhs.__class__ is not int or self.aliases:
+            lhs = self.operand(func, lhs)
+        if rhs.__class__ is not int or self.aliases:
+            rhs = self.operand(func, rhs)
+        func.body.append(ir.Instr(op, node, is_type_expr, ret, lhs, rhs))
+
+    def signature(self, instr, prefix=""):
+        _, _, _, name, ret, args, is_inline, body = instr
+        name_str = prefix + self.name(name)
+        args = [(self.name(arg), self.type(typ)) for arg, typ in args]
+
+        if name_str in self.program.functions:
+            self.error(name, f"{name_str!r} is already declared")
+
+        func = Function(name_str, name, args, self.type(ret), is_inline)
+        self.program.functions[name_str] = func
+        return func, body
+
+    def struct(self, instr, bodies):
+        _, _, _, which, name, block = instr
+        struct = self.program.structs[self.name(name)]
+
+        for member in block:
+            if self.type_instr(member):
+                continue
+
+            match member:
+                case (OpEnum.VAR_DECL, _, _, member_name, typ, val):
+                    if val is not None:
+                        self.error(member_name, "Struct members can not have default values")
+                    struct.members.append((self.name(member_name), self.type(typ)))
+                case (OpEnum.FUNC_DECL, *_):
+                    bodies.append(self.signature(member, struct.name + "."))
+                case _:
+                    self.error(name, "Struct can only have declarations")
+
+    def module(self, rep, bodies_=True):
+        """the Program of rep, only the declarations without bodies_"""
+        _, _, _, name = rep[0]
+        self.program = program = Program(self.src, self.name(name))
+
+        # structs and functions can be used before they are declared
+        for instr in rep:
+            if instr[0] == OpEnum.COMPOUND_TYPE:
+                _, _, _, which, name, _ = instr
+                if name is None:
+                    self.error(which, "Module scope can not have anonymus structs")
+                    continue
+                program.structs[self.name(name)] = ir.StructType(name, self.name(name))
+
+        bodies = list()
+        for instr in rep[1:]:
+            match instr[0]:
+                case OpEnum.COMPOUND_TYPE if instr[4] is not None:
+                    self.struct(instr, bodies)
+                case OpEnum.FUNC_DECL:
+                    bodies.append(self.signature(instr))
+                case OpEnum.COMPOUND_TYPE:
+                    pass
+                case _ if not bodies_:
+                    self.type_instr(instr) # the types of the signatures
+                case _:
+                    self.instr(program.init, instr)
+        if not bodies_:
+            return program
+
+        # module level code can use the globals and functions declared after it
+        for token in self.unresolved:
+            if not self.is_declared(program.init, self.name(token)):
+                self.error(token, f"Could not resolve value {self.name(token)!r}")
+
+        for func, body in bodies:
+            if body is None:
+                continue
+            # instr() inlined, the bodies are most of the instructions
+            handlers, binary = self.handlers, self.binary
+            for instr in body:
+                handlers.get(instr[0], binary)(func, instr)
+
+        return program
+
+
+def _has_struct(typ):
+    match typ:
+        case ir.StructType():
+            return True
+        case ir.PointerType():
+            return _has_struct(typ.to)
+        case ir.SliceType():
+            return _has_struct(typ.type)
+    return False
+
+
+def declarations(src, rep):
+    """(number of errors, Program of rep with the signatures of the functions but no code)"""
+    builder = ProgramBuilder(src)
+    program = builder.module(rep, False)
+    return builder.num_errors, program
+
+
+def build(src, rep, timer=NULL, counters=NULL_COUNTERS, imports=None):
+    """
+    (number of errors, Program) of the IR rep, imports maps the names of the imported modules to
+    their Programs from declarations()
+    """
+    builder = ProgramBuilder(src, counters, imports)
+    with timer.phase("resolve"):
+        program = builder.module(rep)
+    if builder.num_errors:
+        return builder.num_errors, program
+    with timer.phase("typecheck"):
+        return typechecker.infer(src, program, counters), program
+
@@ -0,0 +1,334 @@
+import io
+import mmap
+import struct
+
+from tokens import Token, TokenEnum
+from parser_file import ParserFile
+from ir.core import OpEnum
+from ir.generator import BUILTIN_TYPES
+import ir.core as ir
+
+# Binary IR file layout (all integers little endian):
+#
+#   header   magic, version, flags, then (offset, size) of every section
+#   strings  utf-8 blob, every token in the IR points into it
+#   types    (kind, bit_length, name offset, name length) for every named builtin type used
+#   code     instruction arrays, function bodies first so they can be decoded lazily
+#
+# Instructions are (op, is_type_expr, operands...) where every operand is a tagged value.
+# The ast.Node of an instruction is not stored and gets loaded as None.
+
+IR_MAGIC: bytes = b"MYIR"
+IR_VERSION: int = 3
+
+_HEADER = struct.Struct("<4sHHIIIIIIII")
+_TYPE_ENTRY = struct.Struct("<BBII")
+_TOKEN = struct.Struct("<BII")
+_INSTR = struct.Struct("<BBB")
+_BLOCK = struct.Struct("<II")
+
+# operand tags
+TAG_NONE: int = 0
+TAG_FALSE: int = 1
+TAG_TRUE: int = 2
+TAG_INT: int = 3
+TAG_TOKEN: int = 4
+TAG_TYPE: int = 5
+TAG_TUPLE: int = 6
+TAG_LIST: int = 7
+TAG_INSTR: int = 8
+TAG_BLOCK: int = 9
+TAG_LAZY_BLOCK: int = 10
+
+# kinds in the type table
+TYPE_INT: int = 1
+TYPE_UINT: int = 2
+TYPE_FLOAT: int = 3
+TYPE_BOOL: int = 4
+TYPE_VOID: int = 5
+TYPE_TYPE: int = 6
+
+
+def _type_kind(typ):
+    match typ:
+        case ir.IntType(): return TYPE_INT, typ.bit_length
+        case ir.UintType(): return TYPE_UINT, typ.bit_length
+        case ir.FloatType(): return TYPE_FLOAT, typ.bit_length
+        case ir.BoolType(): return TYPE_BOOL, 8
+        case ir.VoidType(): return TYPE_VOID, 0
+        case _: return TYPE_TYPE, 0
+
+
+def _is_block(val):
+    return isinstance(val, list) and len(val) > 0 \
+        and isinstance(val[0], tuple) and isinstance(val[0][0], OpEnum)
+
+
+class IrStrings(ParserFile):
+    """The string table of a loaded IR file, stands in for the ParserFile of the source"""
+    __slots__ = ()
+    def __init__(self, filename, strings):
+        self.filename = filename
+        self.src = strings
+        self.pos = 0
+        self.newlines = None
+        self.diagnostics = None
+
+
+class IrWriter:
+    __slots__ = "src", "strings", "string_pos", "string_len", "types", "code"
+    def __init__(self, src):
+        self.src = src
+        self.strings = list()
+        self.string_pos = dict()
+        self.string_len = 0
+        self.types = dict() # name -> (index, entry)
+        self.code = bytearray()
+
+    def intern(self, s):
+        pos = self.string_pos.get(s)
+        if pos is None:
+            pos = self.string_len
+            self.string_pos[s] = pos
+            self.strings.append(s)
+            self.string_len += len(s)
+        return pos
+
+    def type_index(self, name):
+        entry = self.types.get(name)
+        if entry is None:
+            kind, bit_length = _type_kind(BUILTIN_TYPES[name])
+            entry = (len(self.types), (kind, bit_length, self.intern(name), len(name)))
+            self.types[name] = entry
+        return entry[0]
+
+    def varint(self, buf, n):
+        # zig-zag encoded LEB128
+        n = (n << 1) ^ (n >> 63)
+        while n > 0x7f:
+            buf.append((n & 0x7f) | 0x80)
+            n >>= 7
+        buf.append(n)
+
+    def operand(self, buf, val, lazy=False):
+        match val:
+            case None:
+                buf.append(TAG_NONE)
+            case bool():
+                buf.append(TAG_TRUE if val else TAG_FALSE)
+            case int():
+                buf.append(TAG_INT)
+                self.varint(buf, val)
+            case Token():
+                s = self.src.get_token_string(val)
+                if val.type == TokenEnum.Identifier and s in BUILTIN_TYPES:
+                    buf.append(TAG_TYPE)
+                    self.varint(buf, self.type_index(s))
+                else:
+                    buf.append(TAG_TOKEN)
+                    buf += _TOKEN.pack(val.type, self.intern(s), len(s))
+            case tuple() if val and isinstance(val[0], OpEnum):
+                buf.append(TAG_INSTR)
+                self.instr(buf, val)
+            case tuple():
+                buf.append(TAG_TUPLE)
+                self.varint(buf, len(val))
+                for item in val:
+                    self.operand(buf, item)
+            case list() if lazy and _is_block(val):
+                buf.append(TAG_LAZY_BLOCK)
+                buf += _BLOCK.pack(self.block(val), len(val))
+            case list() if _is_block(val):
+                buf.append(TAG_BLOCK)
+                self.varint(buf, len(val))
+                for instr in val:
+                    self.instr(buf, instr)
+            case list():
+                buf.append(TAG_LIST)
+                self.varint(buf, len(val))
+                for item in val:
+                    self.operand(buf, item)
+            case _:
+                raise TypeError(f"Can not serialize IR operand {val!r}")
+
+    def instr(self, buf, instr):
+        op, _node, is_type_expr, *operands = instr
+        buf += _INSTR.pack(op.value, is_type_expr, len(operands))
+
+        # function bodies get their own instruction array so they can be decoded on demand
+        last = len(operands) - 1 if op == OpEnum.FUNC_DECL else -1
+        for i, val in enumerate(operands):
+            self.operand(buf, val, lazy=i == last)
+
+    def block(self, block):
+        buf = bytearray()
+        for instr in block:
+            self.instr(buf, instr)
+
+        pos = len(self.code)
+        self.code += buf
+        return pos
+
+    def write(self, fp, rep):
+        code_pos = self.block(rep)
+
+        strings = "".join(self.strings).encode("utf-8")
+        types = b"".join(_TYPE_ENTRY.pack(*entry) for _, entry in self.types.values())
+
+        str_off = _HEADER.size
+        type_off = str_off + len(strings)
+        code_off = type_off + len(types)
+
+        fp.write(_HEADER.pack(IR_MAGIC, IR_VERSION, 0,
+            str_off, len(strings),
+            type_off, len(self.types),
+            code_off, len(self.code),
+            code_pos, len(rep),
+        ))
+        fp.write(strings)
+        fp.write(types)
+        fp.write(self.code)
+
+
+class LazyBlock:
+    """Instruction array of a function body which gets decoded on first use"""
+    __slots__ = "reader", "pos", "count", "instrs"
+    def __init__(self, reader, pos, count):
+        self.reader = reader
+        self.pos = pos
+        self.count = count
+        self.instrs = None
+
+    def decode(self):
+        if self.instrs is None:
+            self.instrs, _ = self.reader.block(self.pos, self.count)
+        return self.instrs
+
+    __len__ = lambda self: self.count
+    __iter__ = lambda self: iter(self.decode())
+    __getitem__ = lambda self, i: self.decode()[i]
+    __repr__ = lambda self: repr(self.decode()) if self.instrs is not None \
+        else f"LazyBlock(pos={self.pos}, count={self.count})"
+
+
+class IrReader:
+    __slots__ = "data", "strings", "types", "code_off", "code_pos", "count"
+    def __init__(self, data):
+        self.data = data # the IR file, mapped or in memory
+
+        magic, version, _flags, str_off, str_size, type_off, type_count, \
+            self.code_off, _code_size, self.code_pos, self.count = _HEADER.unpack_from(self.data, 0)
+
+        if magic != IR_MAGIC:
+            raise ValueError("Not an IR file")
+        if version != IR_VERSION:
+            raise ValueError(f"IR file version {version} is not supported (expected {IR_VERSION})")
+
+        self.strings = str(self.data[str_off : str_off + str_size], "utf-8")
+
+        self.types = list()
+        for i in range(type_count):
+            _kind, _bit_length, pos, length = _TYPE_ENTRY.unpack_from(self.data, type_off + i * _TYPE_ENTRY.size)
+            self.types.append(Token(TokenEnum.Identifier, pos, length))
+
+    def varint(self, pos):
+        n = 0
+        shift = 0
+        data = self.data
+        while True:
+            b = data[pos]
+            pos += 1
+            n |= (b & 0x7f) << shift
+            if b < 0x80:
+                break
+            shift += 7
+        return (n >> 1) ^ -(n & 1), pos
+
+    def operand(self, pos):
+        tag = self.data[pos]
+        pos += 1
+
+        if tag == TAG_INT:
+            return self.varint(pos)
+        elif tag == TAG_TOKEN:
+            typ, s_pos, length = _TOKEN.unpack_from(self.data, pos)
+            return Token(TokenEnum(typ), s_pos, length), pos + _TOKEN.size
+        elif tag == TAG_TYPE:
+            idx, pos = self.varint(pos)
+            return self.types[idx], pos
+        elif tag == TAG_NONE:
+            return None, pos
+        elif tag == TAG_FALSE:
+            return False, pos
+        elif tag == TAG_TRUE:
+            return True, pos
+        elif tag == TAG_INSTR:
+            return self.instr(pos)
+        elif tag == TAG_TUPLE or tag == TAG_LIST:
+            count, pos = self.varint(pos)
+            items = list()
+            for _ in range(count):
+                item, pos = self.operand(pos)
+                items.append(item)
+            return (tuple(items) if tag == TAG_TUPLE else items), pos
+        elif tag == TAG_BLOCK:
+            count, pos = self.varint(pos)
+            block = list()
+            for _ in range(count):
+                instr, pos = self.instr(pos)
+                block.append(instr)
+            return block, pos
+        elif tag == TAG_LAZY_BLOCK:
+            block_pos, count = _BLOCK.unpack_from(self.data, pos)
+            return LazyBlock(self, block_pos, count), pos + _BLOCK.size
+        else:
+            raise ValueError(f"Corrupt IR file, unknown operand tag {tag}")
+
+    def instr(self, pos):
+        op, is_type_expr, num_operands = _INSTR.unpack_from(self.data, pos)
+        pos += _INSTR.size
+
+        instr = [OpEnum(op), None, bool(is_type_expr)]
+        for _ in range(num_operands):
+            val, pos = self.operand(pos)
+            instr.append(val)
+
+        return tuple(instr), pos
+
+    def block(self, block_pos, count):
+        pos = self.code_off + block_pos
+        block = list()
+        for _ in range(count):
+            instr, pos = self.instr(pos)
+            block.append(instr)
+        return block, pos
+
+
+def dump(src, rep, filename):
+    with open(filename, "wb") as fp:
+        IrWriter(src).write(fp, rep)
+
+
+def dumps(src, rep) -> bytes:
+    """the IR file dump() writes as bytes"""
+    fp = io.BytesIO()
+    IrWriter(src).write(fp, rep)
+    return fp.getvalue()
+
+
+def load(filename):
+    """
+    Loads an IR file written by dump(), function bodies are decoded when they are first used.
+    Returns (src, rep) where src is the string table to resolve tokens with
+    """
+    with open(filename, "rb") as fp:
+        data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    return loads(data, filename)
+
+
+def loads(data, filename):
+    """load() of an IR file in data, filename is what errors get reported against"""
+    reader = IrReader(data)
+    rep, _ = reader.block(reader.code_pos, reader.count)
+    return IrStrings(filename, reader.strings), rep
+
@@ -1,48 +1,275 @@
+from collections import deque
+
 import ir.core as ir
+from ir.core import OpEnum
+from counters import NULL
+
+# Type inference and checking of the resolved IR from ir.program.
+#
+# Every uid gets the type of the instruction defining it. The instructions of all functions go
+# through a worklist in program order: an instruction using a uid which has no type yet waits on
+# that uid and goes back on the worklist once the uid has one. Declared values (args, locals,
+# globals and functions) already have their types, so module level code can use declarations
+# further down.
+#
+# The errors point at the part of the source an instruction came from. A value whose type could
+# not be inferred gets the type None and isn't checked again, so one mistake gets reported once.
+
+_ARITH: frozenset = frozenset((ir.IntType, ir.UintType, ir.FloatType, ir.BoolType))
+_INTS: frozenset = frozenset((ir.IntType, ir.UintType))
+
+# operations the backends only have for integers, % included
+_INT_ONLY: frozenset = frozenset((OpEnum.UNARY_NOT, OpEnum.BIN_MOD, OpEnum.BIN_AND, OpEnum.BIN_OR,
+    OpEnum.BIN_XOR, OpEnum.BIN_SHL, OpEnum.BIN_SHR))
+
+_OP_NAMES: dict = {
+    OpEnum.UNARY_NEG: "-", OpEnum.UNARY_NOT: "~",
+    OpEnum.BIN_ADD: "+", OpEnum.BIN_SUB: "-", OpEnum.BIN_MUL: "*", OpEnum.BIN_DIV: "/",
+    OpEnum.BIN_MOD: "%", OpEnum.BIN_AND: "&", OpEnum.BIN_OR: "|", OpEnum.BIN_XOR: "^",
+    OpEnum.BIN_SHL: "<<", OpEnum.BIN_SHR: ">>",
+}
+
+_MISSING = object()
+
+
+def is_arith(typ):
+    return typ.__class__ in _ARITH
+
+
+def assignable(dst, src):
+    """if a value of type src can be stored in dst, numbers get converted to each other"""
+    if dst is None or src is None:
+        return True
+    if dst.__class__ in _ARITH and src.__class__ in _ARITH:
+        return True
+    return dst == src
+
+
+def _part(node, attr):
+    # the part of the node an error is about, the whole node when it doesn't have it
+    part = getattr(node, attr, None)
+    return node if part is None else part
+
+
+class Waiting(Exception):
+    """an instruction used a uid that has no type yet"""
+    def __init__(self, uid):
+        self.uid = uid
+
+
+class Inference:
+    __slots__ = "src", "program", "num_errors", "names", "waiting", "worklist", "handlers", \
+        "counters"
+    def __init__(self, src, program, counters=NULL):
+        self.src = src
+        self.program = program
+        self.counters = counters
+        self.num_errors = 0
+        self.names = dict() # global or function name -> Type
+        self.waiting = dict() # (function name, uid) -> [(func, instr)] waiting for its type
+        self.worklist = deque()
+
+        self.handlers = {op: self.binary for op in _OP_NAMES}
+        self.handlers.update({
+            OpEnum.VAR_DECL: self.var_decl,
+            OpEnum.ASSIGN: self.assign,
+            OpEnum.MEMBER_ASSIGN: self.member_assign,
+            OpEnum.MEMBER_ACCESS: self.member_access,
+            OpEnum.FUNC_CALL: self.call,
+            OpEnum.SLICE_INDEXING: self.slice_indexing,
+            OpEnum.UNARY_NEG: self.unary,
+            OpEnum.UNARY_NOT: self.unary,
+            OpEnum.RETURN_STMT: self.return_stmt,
+            OpEnum.NOP: lambda func, instr: None,
+        })
 
-def get_type(rep, val):
-    if isinstance(val, ir.Constant):
+    def error(self, node, msg):
+        self.num_errors += 1
+        if node is None: # IR loaded from a file has no ast nodes to point at
+            print(f"{self.src.filename}: ERROR: {msg}")
+        else:
+            self.src.error(node, msg)
+
+    def type_of(self, func, val):
+        cls = val.__class__
+        if cls is int:
+            typ = func.types.get(val, _MISSING)
+            if typ is _MISSING:
+                raise Waiting(val)
+            return typ
+        elif cls is str:
+            typ = func.locals.get(val, _MISSING)
+            # unresolved names got reported by ir.program already
+            return self.names.get(val) if typ is _MISSING else typ
+        elif val is None:
+            return None
         return val.type
-    else:
-        val = rep.lookup(val)
-        return val
 
-def typecheck(src, rep, num_errors=0):
+    def define(self, func, uid, typ):
+        func.types[uid] = typ
+        if self.waiting:
+            waiting = self.waiting.pop((func.name, uid), None)
+            if waiting is not None:
+                self.counters.add("typecheck", "requeued", len(waiting))
+                self.worklist.extend(waiting)
+
+    def check_store(self, node, what, dst, src):
+        if not assignable(dst, src):
+            self.error(node, f"Can not store a value of type {src} in {what} of type {dst}")
+        elif dst.__class__ is ir.SliceType and src.__class__ is ir.SliceType \
+            and dst.len is not None and src.len is not None and dst.len < src.len:
+            self.error(node, f"Slice must be a length of {src.len} or greater")
+
+    def member(self, node, struct, member):
+        if struct is None:
+            return None
+        if struct.__class__ is not ir.StructType or struct.index(member) is None:
+            self.error(node, f"{member!r} is not a member of {struct}")
+            return None
+        return struct.member(member)
+
+    def var_decl(self, func, instr):
+        _, node, _, name, typ, val = instr
+        if val is not None:
+            self.check_store(_part(node, "expr"), repr(name), typ, self.type_of(func, val))
 
-    for instr in rep.instr_list:
-        if instr.op == ir.OpEnum.MUL:
-            lhs = get_type(rep, instr.args[1])
-            rhs = get_type(rep, instr.args[2])
+    def assign(self, func, instr):
+        _, node, _, name, val = instr
+        self.check_store(_part(node, "rhs"), repr(name), self.type_of(func, name),
+            self.type_of(func, val))
 
-            if lhs is None or rhs is None:
-                continue
+    def member_assign(self, func, instr):
+        _, node, _, obj, member, val = instr
+        obj_type = self.type_of(func, obj)
+        val_type = self.type_of(func, val)
+        typ = self.member(node, obj_type, member)
+        if typ is not None:
+            self.check_store(_part(node, "rhs"), repr(member), typ, val_type)
 
-            if lhs != rhs:
-                num_errors += 1
-                continue
+    def member_access(self, func, instr):
+        _, node, _, ret, obj, member = instr
+        self.define(func, ret, self.member(node, self.type_of(func, obj), member))
+
+    def call(self, func, instr):
+        _, node, _, ret, callee, args = instr
+        arg_types = [self.type_of(func, val) for val in args]
+
+        callee_func = self.program.callee(callee) if callee.__class__ is str else None
+        if callee_func is None:
+            if callee.__class__ is str and "." in callee:
+                self.error(node, f"{callee!r} is not declared")
+            else:
+                self.error(node, "Can only call functions by name")
+            self.define(func, ret, None)
+            return
+
+        if len(args) != len(callee_func.args):
+            self.error(node,
+                f"Expected {len(callee_func.args)} arguments to function but got {len(args)}")
+        else:
+            arg_nodes = getattr(node, "args", None) or [node] * len(args)
+            for (arg, typ), val_type, arg_node in zip(callee_func.args, arg_types, arg_nodes):
+                self.check_store(arg_node, f"argument {arg!r} of {callee!r}", typ, val_type)
+        self.define(func, ret, callee_func.ret)
 
-            ret = rep.lookup(instr.args[0])
-            ret.type = lhs
+    def slice_indexing(self, func, instr):
+        _, node, _, ret, slice_, idx = instr
+        typ = self.type_of(func, slice_)
+        idx_type = self.type_of(func, idx)
+        if idx_type is not None and idx_type.__class__ not in _INTS:
+            self.error(node, f"Can not index with a value of type {idx_type}")
+        if typ is not None and typ.__class__ is not ir.SliceType:
+            self.error(node, f"Can not index a value of type {typ}")
+            typ = None
+        self.define(func, ret, None if typ is None else typ.type)
 
-        elif instr.op == ir.OpEnum.ADD:
-            lhs = get_type(rep, instr.args[1])
-            rhs = get_type(rep, instr.args[2])
+    def unary(self, func, instr):
+        op, node, _, ret, expr = instr
+        typ = self.type_of(func, expr)
+        if typ is not None and (typ.__class__ not in _ARITH
+            or (op in _INT_ONLY and typ.__class__ is ir.FloatType)):
+            self.error(node, f"Can not use {_OP_NAMES[op]!r} on a value of type {typ}")
+            typ = None
+        self.define(func, ret, typ)
 
-            if lhs is None or rhs is None:
-                continue
+    def binary(self, func, instr):
+        op, node, _, ret, lhs, rhs = instr
+        # type_of() inlined for the uids which already have their type, most operands are
+        types = func.types
+        lhs_type = types[lhs] if lhs.__class__ is int and lhs in types else self.type_of(func, lhs)
+        rhs_type = types[rhs] if rhs.__class__ is int and rhs in types else self.type_of(func, rhs)
+        if lhs_type is None or rhs_type is None:
+            self.define(func, ret, None)
+            return
 
-            if lhs != rhs:
-                num_errors += 1
-                continue
+        lhs_cls, rhs_cls = lhs_type.__class__, rhs_type.__class__
+        if lhs_cls not in _INTS or rhs_cls not in _INTS:
+            for typ in (lhs_type, rhs_type):
+                if typ.__class__ not in _ARITH or (op in _INT_ONLY and typ.__class__ is ir.FloatType):
+                    self.error(node, f"Can not use {_OP_NAMES[op]!r} on a value of type {typ}")
+                    self.define(func, ret, None)
+                    return
 
-            ret = rep.lookup(instr.args[0])
-            ret.type = lhs
-        elif instr.op == ir.OpEnum.MOVE:
-            lhs = get_type(rep, instr.args[0])
-            rhs = get_type(rep, instr.args[1])
-            print(lhs, rhs)
+        # ints get promoted to floats, untyped literals take the type of the other side
+        typ = lhs_type
+        if rhs_cls is ir.FloatType and lhs_cls is not ir.FloatType:
+            typ = rhs_type
+        elif lhs.__class__ is ir.Constant and rhs.__class__ is not ir.Constant \
+            and lhs_cls is not ir.FloatType:
+            typ = rhs_type
+        if self.waiting:
+            self.define(func, ret, typ)
         else:
-            raise NotImplementedError(instr.op.name)
-    
-    return num_errors
+            types[ret] = typ
+
+    def return_stmt(self, func, instr):
+        _, node, _, val = instr
+        if func.ret.__class__ is ir.VoidType:
+            if val is not None:
+                self.error(node, f"{func.name!r} does not return a value")
+        else:
+            self.check_store(_part(node, "expr"), f"the return value of {func.name!r}", func.ret,
+                self.type_of(func, val))
+
+    def visit(self, func, instr):
+        try:
+            self.handlers[instr[0]](func, instr)
+        except Waiting as waiting:
+            self.counters.add("typecheck", "waits")
+            self.waiting.setdefault((func.name, waiting.uid), list()).append((func, instr))
+
+    def declare(self):
+        program = self.program
+        self.names.update(program.globals)
+        self.names.update((name, func.type()) for name, func in program.functions.items())
+        self.names.update((name, func.type()) for name, func in program.externs.items())
+
+    def function(self, func):
+        # uids are defined before they are used in the generated IR so instructions only have
+        # to wait in IR that got reordered
+        for instr in func.body:
+            self.visit(func, instr)
+            while self.worklist:
+                self.visit(*self.worklist.popleft())
+        self.counters.add("typecheck", "instructions", len(func.body))
+
+    def undefined(self):
+        """reports the instructions still waiting for the type of a uid"""
+        for (name, uid), instrs in self.waiting.items():
+            for func, instr in instrs:
+                self.error(instr[1], f"Value %{uid} is used in {name!r} but never defined")
+        self.waiting.clear()
+
+    def run(self):
+        # the bodies are the initial worklist
+        program = self.program
+        self.declare()
+        for func in (program.init, *program.functions.values()):
+            self.function(func)
+        self.undefined()
+        return self.num_errors
+
 
+def infer(src, program, counters=NULL):
+    """gives every uid in program its type, returns the number of errors"""
+    return Inference(src, program, counters).run()
@@ -0,0 +1,476 @@
+import math
+import struct
+
+import ir.core as ir
+from ir.core import OpEnum
+from ir.program import is_int
+
+# Virtual machine running a resolved ir.program.Program
+#
+# Every function is decoded once into a Code object: a flat list of (op, d, a, b, c, e) tuples
+# where d, a and b are indices into the register file of the function (args, then locals,
+# then uids, then constants) and c, e are extra immediates (the wraparound mask and half range
+# for fixed width integers, member indices, Code objects of callees, ...).
+# A call copies the register file template of the callee, so constants never have to be loaded.
+#
+# Floats follow IEEE 754 like the native backends: f16 and f32 values get rounded to single
+# precision after every operation and conversion (they are C floats), dividing by zero gives
+# inf or nan, and converting inf, nan or a float out of range to an integer gives -2^63 (wrapped
+# to the type) like cvttsd2si does.
+#
+# Integers are the definition the backends follow: the operands of an operation get converted to
+# the type of its result first and the result wraps around to it. Shift counts are unsigned, a
+# count of 64 or more (or a negative one) shifts every bit out, which gives 0, or -1 when a
+# negative value of a signed type gets shifted right. The smallest value of a signed type
+# divided by -1 wraps around to itself and its remainder is 0. Dividing or taking the remainder
+# by zero is an error, the VM raises a VmError pointing at the division and the compiled
+# programs get killed by a signal.
+
+# opcodes, roughly in order of how often they show up
+OP_MOVE: int = 0        # regs[d] = regs[a]
+OP_ADD: int = 1         # regs[d] = wrap(regs[a] + regs[b])
+OP_MUL: int = 2
+OP_SUB: int = 3
+OP_GETFIELD: int = 4    # regs[d] = regs[a][b]
+OP_CALL: int = 5        # regs[d] = call(c, regs[i] for i in a)
+OP_RET: int = 6         # return regs[a]
+OP_INDEX: int = 7       # regs[d] = regs[a][regs[b]]
+OP_LOADG: int = 8       # regs[d] = globals[a]
+OP_STOREG: int = 9      # globals[d] = regs[a]
+OP_SETFIELD: int = 10   # regs[d][a] = regs[b]
+OP_FADD: int = 11       # regs[d] = regs[a] + regs[b]
+OP_FSUB: int = 12
+OP_FMUL: int = 13
+OP_FDIV: int = 14       # regs[d] = fdiv(regs[a], regs[b])
+OP_DIV: int = 15        # regs[d] = wrap(regs[a] / regs[b]) rounding towards zero like C
+OP_MOD: int = 16
+OP_AND: int = 17
+OP_OR: int = 18
+OP_XOR: int = 19
+OP_SHL: int = 20        # regs[d] = wrap(regs[a] << regs[b]), 0 when the count isn't below 64
+OP_SHR: int = 21        # regs[d] = wrap(regs[a] >> regs[b]), counts below 0 shift by 64
+OP_NEG: int = 22        # regs[d] = wrap(-regs[a])
+OP_NOT: int = 23        # regs[d] = wrap(~regs[a])
+OP_FNEG: int = 24
+OP_WRAP: int = 25       # regs[d] = wrap(regs[a])
+OP_TOFLOAT: int = 26    # regs[d] = float(regs[a])
+OP_TOINT: int = 27      # regs[d] = wrap(float_to_int(regs[a]))
+OP_NEW: int = 28        # regs[d] = c() zero initialised struct or slice
+OP_COPY: int = 29       # regs[d] = c(regs[a]) copy of a struct
+OP_ROUND32: int = 30    # regs[d] = round_f32(regs[a])
+
+_INT_OPS: dict = {
+    OpEnum.BIN_ADD: OP_ADD,
+    OpEnum.BIN_SUB: OP_SUB,
+    OpEnum.BIN_MUL: OP_MUL,
+    OpEnum.BIN_DIV: OP_DIV,
+    OpEnum.BIN_MOD: OP_MOD,
+    OpEnum.BIN_AND: OP_AND,
+    OpEnum.BIN_OR: OP_OR,
+    OpEnum.BIN_XOR: OP_XOR,
+    OpEnum.BIN_SHL: OP_SHL,
+    OpEnum.BIN_SHR: OP_SHR,
+    OpEnum.UNARY_NEG: OP_NEG,
+    OpEnum.UNARY_NOT: OP_NOT,
+}
+
+_FLOAT_OPS: dict = {
+    OpEnum.BIN_ADD: OP_FADD,
+    OpEnum.BIN_SUB: OP_FSUB,
+    OpEnum.BIN_MUL: OP_FMUL,
+    OpEnum.BIN_DIV: OP_FDIV,
+    OpEnum.UNARY_NEG: OP_FNEG,
+}
+
+
+_F32 = struct.Struct("f")
+
+
+class VmError(Exception):
+    """an error of the program, node is the IR node it happened at when it is known"""
+    def __init__(self, msg, node=None):
+        super().__init__(msg)
+        self.node = node
+
+
+def int_range(typ):
+    """(mask, half) so that ((x + half) & mask) - half wraps x to the integer type"""
+    bits = 64 if typ.bit_length is None else typ.bit_length
+    mask = (1 << bits) - 1
+    half = (1 << (bits - 1)) if isinstance(typ, ir.IntType) else 0
+    return mask, half
+
+
+def wrap_int(val, typ):
+    mask, half = int_range(typ)
+    return ((val + half) & mask) - half
+
+
+def is_single(typ):
+    """if typ is a float of single precision, f16 gets stored as f32"""
+    return isinstance(typ, ir.FloatType) and typ.bit_length != 64
+
+
+def round_f32(x):
+    """x rounded to single precision, inf when it is too big for one"""
+    try:
+        return _F32.unpack(_F32.pack(x))[0]
+    except OverflowError:
+        return math.copysign(math.inf, x)
+
+
+def fdiv(a, b):
+    """a / b with the inf and nan of IEEE 754 instead of ZeroDivisionError"""
+    if b:
+        return a / b
+    if a != a or not a:
+        return math.nan
+    return math.copysign(math.inf, a) * math.copysign(1.0, b)
+
+
+def float_to_int(x):
+    """x truncated towards zero, -2^63 when it doesn't fit 64 bits like cvttsd2si"""
+    if math.isfinite(x) and -2.0 ** 63 <= x < 2.0 ** 63:
+        return int(x)
+    return -(1 << 63)
+
+
+def zero_value(typ):
+    match typ:
+        case ir.IntType() | ir.UintType() | ir.BoolType():
+            return 0
+        case ir.FloatType():
+            return 0.0
+        case ir.StructType():
+            return [zero_value(member) for _, member in typ.members]
+        case ir.SliceType() if typ.len is not None:
+            return [zero_value(typ.type) for _ in range(typ.len)]
+        case ir.SliceType():
+            return []
+        case _:
+            return None
+
+
+def copy_value(val):
+    if type(val) is list:
+        return [copy_value(v) for v in val]
+    return val
+
+
+def _needs_copy(typ):
+    return isinstance(typ, ir.StructType) or (isinstance(typ, ir.SliceType) and typ.len is not None)
+
+
+class Code:
+    __slots__ = "name", "num_args", "regs", "instrs", "nodes"
+    def __init__(self, name, num_args):
+        self.name = name
+        self.num_args = num_args
+        self.regs = list()
+        self.instrs = list()
+        self.nodes = dict() # d of the instructions which can fail -> IR node they came from
+
+    __repr__ = lambda self: f"Code({self.name}, regs={len(self.regs)}, instrs={len(self.instrs)})"
+
+    def dissasemble(self):
+        return f"{self.name}:\n" + "\n".join(f"    {instr}" for instr in self.instrs) + "\n"
+
+
+class Decoder:
+    __slots__ = "program", "vm", "func", "code", "regs", "consts"
+    def __init__(self, vm, func, code):
+        self.program = vm.program
+        self.vm = vm
+        self.func = func
+        self.code = code
+        self.regs = dict() # local name or uid -> register
+        self.consts = dict()
+
+        for name in func.locals:
+            self.reg(name)
+
+    def reg(self, key, init=None):
+        reg = self.regs.get(key)
+        if reg is None:
+            reg = len(self.code.regs)
+            self.regs[key] = reg
+            self.code.regs.append(init)
+        return reg
+
+    def scratch(self):
+        reg = len(self.code.regs)
+        self.code.regs.append(None)
+        return reg
+
+    def emit(self, op, d=0, a=0, b=0, c=None, e=None):
+        self.code.instrs.append((op, d, a, b, c, e))
+
+    def type_of(self, val):
+        return self.program.type_of(self.func, val)
+
+    def is_global(self, val):
+        return isinstance(val, str) and val not in self.func.locals and val in self.vm.global_index
+
+    def load(self, val):
+        """register holding the value of an operand"""
+        match val:
+            case ir.Constant():
+                key = (type(val.const), val.const)
+                reg = self.consts.get(key)
+                if reg is None:
+                    reg = self.consts[key] = self.scratch()
+                    self.code.regs[reg] = val.const
+                return reg
+            case str() if self.is_global(val):
+                reg = self.scratch()
+                self.emit(OP_LOADG, reg, self.vm.global_index[val])
+                return reg
+            case _:
+                return self.reg(val)
+
+    def convert(self, val, typ):
+        """register holding the value of an operand converted to typ"""
+        src_typ = self.type_of(val)
+
+        # constants get converted right away
+        if isinstance(val, ir.Constant) and is_int(src_typ) and is_int(typ):
+            return self.load(ir.Constant(val.token, typ, wrap_int(val.const, typ)))
+        elif isinstance(val, ir.Constant) and isinstance(typ, ir.FloatType):
+            const = float(val.const)
+            return self.load(ir.Constant(val.token, typ, round_f32(const) if is_single(typ) else const))
+
+        reg = self.load(val)
+
+        if is_int(typ) and is_int(src_typ):
+            if src_typ == typ:
+                return reg
+            out = self.scratch()
+            self.emit(OP_WRAP, out, reg, 0, *int_range(typ))
+            return out
+        elif isinstance(typ, ir.FloatType) and is_int(src_typ):
+            out = self.scratch()
+            self.emit(OP_TOFLOAT, out, reg)
+            if is_single(typ):
+                self.emit(OP_ROUND32, out, out)
+            return out
+        elif is_single(typ) and isinstance(src_typ, ir.FloatType) and not is_single(src_typ):
+            out = self.scratch()
+            self.emit(OP_ROUND32, out, reg)
+            return out
+        elif is_int(typ) and isinstance(src_typ, ir.FloatType):
+            out = self.scratch()
+            self.emit(OP_TOINT, out, reg, 0, *int_range(typ))
+            return out
+        elif _needs_copy(typ) and not isinstance(val, ir.Constant):
+            out = self.scratch()
+            self.emit(OP_COPY, out, reg, 0, copy_value)
+            return out
+        return reg
+
+    def store(self, name, reg):
+        if self.is_global(name):
+            self.emit(OP_STOREG, self.vm.global_index[name], reg)
+        else:
+            self.emit(OP_MOVE, self.reg(name), reg)
+
+    def instr(self, instr):
+        op, node, _, *operands = instr
+
+        match op:
+            case OpEnum.VAR_DECL:
+                name, typ, val = operands
+                if val is None:
+                    zero = zero_value(typ)
+                    if isinstance(zero, list):
+                        reg = self.scratch()
+                        self.emit(OP_NEW, reg, 0, 0, lambda zero=zero: copy_value(zero))
+                    else:
+                        reg = self.load(ir.Constant(None, typ, zero))
+                else:
+                    reg = self.convert(val, typ)
+                self.store(name, reg)
+
+            case OpEnum.ASSIGN:
+                name, val = operands
+                self.store(name, self.convert(val, self.type_of(name)))
+
+            case OpEnum.MEMBER_ACCESS:
+                ret, obj, member = operands
+                struct = self.type_of(obj)
+                self.emit(OP_GETFIELD, self.reg(ret), self.load(obj), struct.index(member))
+
+            case OpEnum.MEMBER_ASSIGN:
+                obj, member, val = operands
+                struct = self.type_of(obj)
+                val = self.convert(val, struct.member(member))
+                self.emit(OP_SETFIELD, self.load(obj), struct.index(member), val)
+
+            case OpEnum.SLICE_INDEXING:
+                ret, slice_, idx = operands
+                self.code.nodes[self.reg(ret)] = node
+                self.emit(OP_INDEX, self.reg(ret), self.load(slice_), self.load(idx))
+
+            case OpEnum.FUNC_CALL:
+                ret, callee, args = operands
+                callee_func = self.program.functions[callee] # the vm runs one module, no externs
+                args = tuple(self.convert(arg, typ) for arg, (_, typ) in zip(args, callee_func.args))
+                self.emit(OP_CALL, self.reg(ret), args, 0, self.vm.codes[callee])
+
+            case OpEnum.RETURN_STMT:
+                val, = operands
+                self.emit(OP_RET, 0, self.convert(val, self.func.ret))
+
+            case OpEnum.UNARY_NEG | OpEnum.UNARY_NOT:
+                ret, expr = operands
+                typ = self.func.types[ret]
+                if isinstance(typ, ir.FloatType):
+                    self.emit(_FLOAT_OPS[op], self.reg(ret), self.load(expr))
+                else:
+                    self.emit(_INT_OPS[op], self.reg(ret), self.load(expr), 0, *int_range(typ))
+
+            case OpEnum.NOP:
+                pass
+
+            case _:
+                ret, lhs, rhs = operands
+                typ = self.func.types[ret]
+                if isinstance(typ, ir.FloatType):
+                    if op not in _FLOAT_OPS:
+                        raise VmError(f"{op.name} is not supported on floats", node)
+                    self.emit(_FLOAT_OPS[op], self.reg(ret), self.convert(lhs, typ), self.convert(rhs, typ))
+                    if is_single(typ):
+                        self.emit(OP_ROUND32, self.reg(ret), self.reg(ret))
+                elif is_int(typ):
+                    if op in (OpEnum.BIN_DIV, OpEnum.BIN_MOD):
+                        self.code.nodes[self.reg(ret)] = node
+                    self.emit(_INT_OPS[op], self.reg(ret), self.convert(lhs, typ), self.convert(rhs, typ),
+                        *int_range(typ))
+                else:
+                    raise VmError(f"{op.name} is not supported on {typ}", node)
+
+    def decode(self):
+        for instr in self.func.body:
+            self.instr(instr)
+        return self.code
+
+
+def _div(a, b):
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+
+class VM:
+    __slots__ = "program", "globals", "global_index", "codes"
+    def __init__(self, program):
+        self.program = program
+        self.global_index = {name: i for i, name in enumerate(program.globals)}
+        self.globals = [zero_value(typ) for typ in program.globals.values()]
+
+        self.codes = {name: Code(name, len(func.args)) for name, func in program.functions.items()}
+        for name, func in program.functions.items():
+            Decoder(self, func, self.codes[name]).decode()
+
+        init = Decoder(self, program.init, Code(program.init.name, 0)).decode()
+        self.execute(init, ())
+
+    def call(self, name, *args):
+        code = self.codes.get(name)
+        if code is None:
+            raise VmError(f"No function named {name!r}")
+        if len(args) != code.num_args:
+            raise VmError(f"{name!r} takes {code.num_args} arguments but got {len(args)}")
+        return self.execute(code, args)
+
+    def execute(self, code, args):
+        regs = code.regs.copy()
+        regs[:len(args)] = args
+        execute = self.execute
+        globals_ = self.globals
+
+        # the instructions which can fail are in code.nodes, d is the one which did
+        try:
+            for op, d, a, b, c, e in code.instrs:
+                if op == OP_MOVE:
+                    regs[d] = regs[a]
+                elif op == OP_ADD:
+                    regs[d] = ((regs[a] + regs[b] + e) & c) - e
+                elif op == OP_MUL:
+                    regs[d] = ((regs[a] * regs[b] + e) & c) - e
+                elif op == OP_SUB:
+                    regs[d] = ((regs[a] - regs[b] + e) & c) - e
+                elif op == OP_GETFIELD:
+                    regs[d] = regs[a][b]
+                elif op == OP_CALL:
+                    regs[d] = execute(c, [regs[i] for i in a])
+                elif op == OP_RET:
+                    return regs[a]
+                elif op == OP_INDEX:
+                    regs[d] = regs[a][regs[b]]
+                elif op == OP_LOADG:
+                    regs[d] = globals_[a]
+                elif op == OP_STOREG:
+                    globals_[d] = regs[a]
+                elif op == OP_SETFIELD:
+                    regs[d][a] = regs[b]
+                elif op == OP_FADD:
+                    regs[d] = regs[a] + regs[b]
+                elif op == OP_FSUB:
+                    regs[d] = regs[a] - regs[b]
+                elif op == OP_FMUL:
+                    regs[d] = regs[a] * regs[b]
+                elif op == OP_FDIV:
+                    regs[d] = fdiv(regs[a], regs[b])
+                elif op == OP_DIV:
+                    regs[d] = ((_div(regs[a], regs[b]) + e) & c) - e
+                elif op == OP_MOD:
+                    x = regs[a]
+                    y = regs[b]
+                    regs[d] = ((x - y * _div(x, y) + e) & c) - e
+                elif op == OP_AND:
+                    regs[d] = (((regs[a] & regs[b]) + e) & c) - e
+                elif op == OP_OR:
+                    regs[d] = (((regs[a] | regs[b]) + e) & c) - e
+                elif op == OP_XOR:
+                    regs[d] = (((regs[a] ^ regs[b]) + e) & c) - e
+                elif op == OP_SHL:
+                    x = regs[b]
+                    regs[d] = (((regs[a] << x) + e) & c) - e if 0 <= x < 64 else 0
+                elif op == OP_SHR:
+                    x = regs[b]
+                    regs[d] = (((regs[a] >> (x if x >= 0 else 64)) + e) & c) - e
+                elif op == OP_NEG:
+                    regs[d] = ((e - regs[a]) & c) - e
+                elif op == OP_NOT:
+                    regs[d] = ((~regs[a] + e) & c) - e
+                elif op == OP_FNEG:
+                    regs[d] = -regs[a]
+                elif op == OP_WRAP:
+                    regs[d] = ((regs[a] + e) & c) - e
+                elif op == OP_TOFLOAT:
+                    regs[d] = float(regs[a])
+                elif op == OP_TOINT:
+                    regs[d] = ((float_to_int(regs[a]) + e) & c) - e
+                elif op == OP_NEW:
+                    regs[d] = c()
+                elif op == OP_COPY:
+                    regs[d] = c(regs[a])
+                elif op == OP_ROUND32:
+                    regs[d] = round_f32(regs[a])
+                else:
+                    raise VmError(f"Invalid opcode {op}")
+
+        except ZeroDivisionError:
+            raise VmError("Division by zero", code.nodes.get(d)) from None
+        except IndexError:
+            raise VmError("Index out of range", code.nodes.get(d)) from None
+
+        return None
+
+
+def run(program, argv):
+    """Runs main(argc, argv) of the program and returns its exit code"""
+    vm = VM(program)
+    args = [arg.encode("utf-8") for arg in argv]
+    ret = vm.call("main", len(args), args)
+    return 0 if ret is None else ret
+
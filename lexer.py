@@ -340,3 +340,19 @@ class Lexer:
 
             else:
                 return self._make_token(TokenEnum.Invalid)
+
+class Tokens:
+    """A Lexer which lexes the whole file up front, so lexing can be timed apart from parsing"""
+    __slots__ = "tokens", "pos"
+    def __init__(self, src: ParserFile):
+        lexer = Lexer(src)
+        self.tokens = [lexer.next()]
+        while self.tokens[-1].type != TokenEnum.Eof:
+            self.tokens.append(lexer.next())
+        self.pos = 0
+
+    def next(self):
+        tok = self.tokens[self.pos]
+        if self.pos < len(self.tokens) - 1:
+            self.pos += 1
+        return tok
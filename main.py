@@ -1,20 +1,35 @@
 from pprint import pprint, pformat
 import argparse
-import time
+import io
+import os
 
 from parser_file import ParserFile
-from lexer import Lexer
+from lexer import Tokens
 from parser_ import parse
 import ast_ as ast
 #from typecheck import Typechecker
 
 from ir import generator
+from ir import serialize
+from ir import vm
+from ir import optimize
+import asm_gen
+import build
+from cache import Cache, DEFAULT_LIMIT, report as cache_report
+from timing import NULL, Timer
+from counters import Counters, NULL as NULL_COUNTERS
+import profiling
+import stream
+import pipeline
 
 PROGRAM_NAME = "mylang"
 PROGRAM_VERSION = "0.0.1-dev0"
 
+# OUTPUT_FILE without -o by target, anything else writes assembly
+DEFAULT_OUTPUT: dict = {"c": "out.c", "python": "out.py"}
 
-def parse_args():
+
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(prog=PROGRAM_NAME)
 
     parser.add_argument("-v", "--version",
@@ -28,9 +43,158 @@ def parse_args():
         help="dumps to the stdout",
         )
 
+    parser.add_argument("--emit-ir",
+        metavar="IR_FILE",
+        help="writes the generated IR to a binary IR file",
+        )
+
+    parser.add_argument("--run",
+        action="store_true",
+        help="runs main(argc, argv) of the program",
+        )
+
+    parser.add_argument("--engine",
+        choices=("vm", "python"),
+        default="vm",
+        help="what --run executes the program with, the IR virtual machine or "
+            "functions compiled to python",
+        )
+
+    parser.add_argument("-O",
+        dest="optimize",
+        action="store_true",
+        help="inlines functions and propagates constants before running or generating code",
+        )
+
+    parser.add_argument("--remarks",
+        action="store_true",
+        help="prints why calls were or were not inlined (with -O)",
+        )
+
+    parser.add_argument("--target",
+        help="generates code for TARGET and writes it to OUTPUT_FILE",
+        )
+
+    parser.add_argument("--exe",
+        metavar="EXE_FILE",
+        help="builds EXE_FILE from OUTPUT_FILE with the system C compiler "
+            "(with --target c or linux-x86_64)",
+        )
+
+    parser.add_argument("-j", "--jobs",
+        type=int,
+        default=1,
+        help="generates the functions with JOBS processes, the output is the same for any number",
+        )
+
+    parser.add_argument("--stream",
+        action="store_true",
+        help="generates the code of one function at a time, only the signatures and the module "
+            "level code are kept for the whole compile, so it needs about the memory of the "
+            "biggest function (with --target but not c, without -j or the cache, -O only "
+            "propagates constants)",
+        )
+
+    parser.add_argument("--pipeline",
+        action="store_true",
+        help="runs the phases at the same time, every function gets parsed, checked and "
+            "generated by one of JOBS processes while this one writes the code of the ones "
+            "before, with --time-report prints how busy every stage was (like --stream, "
+            "-O only propagates constants)",
+        )
+
+    parser.add_argument("--regalloc-stats",
+        action="store_true",
+        help="prints the spills and moves left by register allocation of every function",
+        )
+
+    parser.add_argument("--peephole-stats",
+        action="store_true",
+        help="prints how often every peephole rule fired",
+        )
+
+    parser.add_argument("--build",
+        metavar="BUILD_DIR",
+        help="builds the modules in INPUT_FILE and ARGS (files or directories of *.txt files) in "
+            "the order of their imports, independent ones in parallel with -j, every module "
+            "goes to BUILD_DIR/MODULE with the extension of OUTPUT_FILE",
+        )
+
+    parser.add_argument("--cache-dir",
+        metavar="CACHE_DIR",
+        help="keeps the IR and the generated code of every module in CACHE_DIR and reuses them "
+            "while the source, the flags and the compiler stay the same",
+        )
+
+    parser.add_argument("--cache-size",
+        metavar="MB",
+        type=int,
+        default=DEFAULT_LIMIT >> 20,
+        help="how big CACHE_DIR may get, the least recently used outputs and their keys get removed",
+        )
+
+    parser.add_argument("--cache-stats",
+        action="store_true",
+        help="prints the hits, misses and stores of the cache of every stage",
+        )
+
+    parser.add_argument("--time-report",
+        action="store_true",
+        help="prints the wall and CPU time of every phase of the compile",
+        )
+
+    parser.add_argument("--time-json",
+        metavar="JSON_FILE",
+        help="writes the times of every phase to JSON_FILE",
+        )
+
+    parser.add_argument("--time-memory",
+        action="store_true",
+        help="adds the peak memory of every phase to the time report (tracemalloc slows "
+            "every phase down)",
+        )
+
+    parser.add_argument("--profile",
+        metavar="PREFIX",
+        help="profiles the compile, writes collapsed stacks for flamegraph tools to "
+            "PREFIX.folded and a pstats file to PREFIX.pstats",
+        )
+
+    parser.add_argument("--profile-mode",
+        choices=("sample", "cprofile"),
+        default="sample",
+        help="sample takes a sample every --profile-interval of CPU time (about 5%% slower at "
+            "most), cprofile profiles every call (exact call counts, about 2x slower), "
+            "default: %(default)s",
+        )
+
+    parser.add_argument("--profile-interval",
+        metavar="MS",
+        type=float,
+        default=profiling.DEFAULT_INTERVAL * 1e3,
+        help="milliseconds of CPU time between samples, default: %(default)s",
+        )
+
+    parser.add_argument("--stats",
+        action="store_true",
+        help="prints counts of what the compile did: tokens, ast nodes, name lookups, IR "
+            "instructions, type inference and cache hits",
+        )
+
+    parser.add_argument("--stats-json",
+        metavar="JSON_FILE",
+        help="writes the counts of --stats to JSON_FILE",
+        )
+
+    parser.add_argument("--list-targets",
+        action="store_true",
+        help="lists the targets code can be generated for",
+        )
+
     parser.add_argument("-o",
         metavar="OUTPUT_FILE",
-        default="out.s"
+        help="where the generated code goes, the native targets write an ELF object file "
+            "directly when it ends in .o, default: out.s, out.c or out.py by --target",
         )
 
     parser.add_argument("input_file",
@@ -38,45 +202,257 @@ def parse_args():
         default=None
         )
 
-    return parser.parse_args()
+    parser.add_argument("program_args",
+        metavar="ARGS",
+        nargs="*",
+        help="arguments passed to the program with --run",
+        )
 
+    args = parser.parse_args(argv)
+    if args.o is None:
+        args.o = DEFAULT_OUTPUT.get(args.target, "out.s")
+    return args
 
-def main() -> int:
-    args = parse_args()
 
-    src = ParserFile(args.input_file)
-    
-    time_start = time.perf_counter()
-    ast, num_errors = parse(args.input_file, src)
-    time_end = time.perf_counter()
-    print(f"Parsing took {time_end - time_start :.3f}s")
+def main(argv=None, modules=None) -> int:
+    """runs the compiler with the command line argv, modules are the ones server.py keeps"""
+    args = parse_args(argv)
 
-    if num_errors:
-        print(f"Got {num_errors} error(s)")
+    if args.list_targets:
+        asm_gen.list_targets()
+        return 0
+
+    cache = None
+    if args.cache_dir is not None:
+        cache = Cache(args.cache_dir, args.cache_size << 20)
+
+    if args.build is not None:
+        ret = build.run([args.input_file, *args.program_args], args.build,
+            os.path.splitext(args.o)[1], args.target, args.optimize, args.jobs, cache)
+    else:
+        ret = compile_file(args, cache, modules)
+
+    if cache is not None:
+        cache.evict()
+        if args.cache_stats:
+            print(cache_report(cache.stats))
+    return ret
+
+
+def compile_file(args, cache, modules=None) -> int:
+    timer = NULL
+    if args.time_report or args.time_json is not None:
+        timer = Timer(args.time_memory)
+    counters = NULL_COUNTERS
+    if args.stats or args.stats_json is not None:
+        counters = Counters()
+    profiler = None
+    if args.profile is not None:
+        # stands in for the timer so the samples know their phase
+        profiler = profiling.profiler(timer, args.profile_mode, args.profile_interval / 1e3)
+        profiler.start()
+    try:
+        return _compile_file(args, cache, modules, timer if profiler is None else profiler,
+            counters)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            profiler.write(args.profile)
+            print(profiler.report())
+        if timer.enabled:
+            timer.stop()
+            if args.time_report:
+                print(timer.report())
+            if args.time_json is not None:
+                with open(args.time_json, "w") as fp:
+                    fp.write(timer.json())
+        if counters.enabled:
+            for stage, counts in ({} if cache is None else cache.stats).items():
+                counters.update(f"cache {stage}", counts)
+            if args.stats:
+                print(counters.report())
+            if args.stats_json is not None:
+                with open(args.stats_json, "w") as fp:
+                    fp.write(counters.json())
+
+
+def _compile_file(args, cache, modules, timer, counters) -> int:
+    with timer.phase("read"):
+        src = ParserFile(args.input_file)
+
+    if args.stream or args.pipeline:
+        return _stream_file(args, src, timer, counters)
+
+    # the generated code comes straight from the cache unless something else gets asked for
+    out_key = None
+    if cache is not None and args.target is not None and not (args.run or args.dump
+        or args.emit_ir or args.remarks or args.regalloc_stats or args.peephole_stats):
+        with timer.phase("cache"):
+            out_key = build.output_key(cache, src, args.target, args.optimize, args.o)
+            data = cache.get("out", out_key)
+        if data is not None:
+            with timer.phase("write"), open(args.o, "wb") as fp:
+                fp.write(data)
+            return build_exe(args)
+
+    if (cache is not None or modules is not None) and args.dump is None and not args.remarks:
+        with timer.phase("front end"):
+            if modules is not None:
+                front = modules.front_end(args.input_file, cache)
+            else:
+                front = build.front_end(src, cache)
+        if front is None:
+            return 1
+        src, rep, _ = front
+        counters.ir_instrs(rep)
+    else:
+        # the lexer runs while parsing, unless it gets timed or counted on its own
+        lexer = None
+        if timer.enabled or counters.enabled:
+            with timer.phase("lex"):
+                lexer = Tokens(src)
+            counters.tokens(lexer)
+
+        with timer.phase("parse"):
+            ast, num_errors = parse(args.input_file, src, lexer)
+        counters.ast_nodes(ast)
+
+        if num_errors:
+            print(f"Got {num_errors} error(s)")
+            return 1
+
+        if args.dump == "ast":
+            pprint(ast)
+            # return 0
+
+
+        #typechecker = Typechecker(src)
+        #nun_errors = typechecker.typecheck(ast)
+
+        #if num_errors:
+        #    print(f"Got {num_errors} error(s)")
+        #    return 1
+
+        with timer.phase("IR gen"):
+            num_errors, rep = generator.generate(src, ast)
+        counters.ir_instrs(rep)
+
+        if num_errors:
+            print(f"Got {num_errors} error(s) when generating IR")
+            return 1 
+
+    if args.emit_ir is not None:
+        with timer.phase("write IR"):
+            serialize.dump(src, rep, args.emit_ir)
+
+    if not args.run and args.target is None:
+        return 0
+
+    prog = build.build_program(src, rep, timer, counters)
+    if prog is None:
         return 1
-    
-    if args.dump == "ast":
-        pprint(ast)
-        # return 0
 
+    if args.optimize:
+        remarks = list()
+        optimize.optimize(prog, remarks, timer)
+        if args.remarks:
+            print("\n".join(remark.format(src) for remark in remarks))
+
+    if args.target is not None:
+        stats = dict() if args.regalloc_stats or args.peephole_stats else None
+        binary = args.o.endswith(".o")
+        gen = asm_gen.gen_obj if binary else asm_gen.gen_asm
+        with open(args.o, "wb" if binary else "w") as fp:
+            # the code goes to memory first when writing it gets timed on its own
+            out = fp
+            if timer.enabled:
+                out = io.BytesIO() if binary else io.StringIO()
+            with timer.phase("codegen"):
+                ok = gen(src, prog, args.target, out, stats, args.jobs)
+            if out is not fp:
+                with timer.phase("write"):
+                    fp.write(out.getvalue())
+        if not ok:
+            return 1
+        print_stats(args, stats)
+        if out_key is not None:
+            with timer.phase("cache"), open(args.o, "rb") as fp:
+                cache.put("out", out_key, fp.read())
+
+    if build_exe(args):
+        return 1
 
-    #typechecker = Typechecker(src)
-    #nun_errors = typechecker.typecheck(ast)
+    if not args.run:
+        return 0
+    try:
+        if args.engine == "python":
+            from asm_gen import python
+            return python.run(prog, [args.input_file, *args.program_args])
+        return vm.run(prog, [args.input_file, *args.program_args])
+    except vm.VmError as e:
+        # errors of the program, like dividing by zero
+        if hasattr(e.node, "pos"):
+            src.error(e.node, str(e))
+        else:
+            print(f"{args.input_file}: ERROR: {e}")
+        return 1
 
-    #if num_errors:
-    #    print(f"Got {num_errors} error(s)")
-    #    return 1
 
-    time_start = time.perf_counter()
-    num_errors, rep = generator.generate(src, ast)
-    time_end = time.perf_counter()
-    print(f"Generating IR took {time_end - time_start :.3f}s")
+def _stream_file(args, src, timer, counters) -> int:
+    """--stream and --pipeline, the bodies get built while generating code"""
+    flag = "--stream" if args.stream else "--pipeline"
+    if args.target is None or args.target == "c" or args.run or args.dump or args.emit_ir:
+        print(f"{flag} needs --target, and can't generate c, --run, --dump or --emit-ir")
+        return 1
 
+    if args.stream:
+        num_errors, prog = stream.signatures(src, args.optimize, timer, counters)
+    else:
+        with timer.phase("signatures"):
+            num_errors, prog = pipeline.front_end(src, args.optimize, counters)
     if num_errors:
-        print(f"Got {num_errors} error(s) when generating IR")
-        return 1 
+        print(f"Got {num_errors} error(s)")
+        return 1
 
-    return 0
+    stats = dict() if args.regalloc_stats or args.peephole_stats else None
+    binary = args.o.endswith(".o")
+    gen = asm_gen.gen_obj if binary else asm_gen.gen_asm
+    # the code goes straight to the file, the bodies get built while generating it
+    try:
+        with timer.phase("codegen"), open(args.o, "wb" if binary else "w") as fp:
+            ok = gen(src, prog, args.target, fp, stats, args.jobs)
+    except stream.Failed as failed:
+        os.remove(args.o) # only has the functions before the first one with errors
+        print(f"Got {failed.num_errors} error(s)")
+        return 1
+    if not ok:
+        os.remove(args.o)
+        return 1
+    if args.pipeline and args.time_report:
+        print(prog.stream.report())
+    print_stats(args, stats)
+    return build_exe(args)
+
+
+def print_stats(args, stats):
+    if args.regalloc_stats and "regalloc" in stats:
+        from asm_gen import regalloc
+        print(regalloc.report(stats["regalloc"]))
+    if args.peephole_stats and "peephole" in stats:
+        from asm_gen import peephole
+        print(peephole.report(stats["peephole"]))
+
+
+def build_exe(args) -> int:
+    if args.exe is None:
+        return 0
+    from asm_gen import c
+    if args.target not in ("c", "linux-x86_64"):
+        print("--exe needs --target c or linux-x86_64")
+        return 1
+    # the compiler goes by the extension, C source in a file without .c would get assembled
+    flags = ("-O2", "-x", "c") if args.target == "c" else ("-O2",)
+    return 1 if c.build(args.o, args.exe, flags=flags) else 0
 
 
 if __name__ == "__main__": 
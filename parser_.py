@@ -5,29 +5,30 @@ from lexer import Lexer
 import ast_ as ast
 
 PARSER_DEBUG: bool = 0 # note: bool is a subclass of int
-parser_debug_uid: int = 0
+RULES: set = set() # code of the grammar rules, profiling.py shows them as rules
 
 def parser_func(func):
+    RULES.add(func.__code__)
     if PARSER_DEBUG:
-        def f(*args):
-            global parser_debug_uid
-            uid = parser_debug_uid
-            parser_debug_uid += 1
+        def f(self, *args):
+            uid = self.debug_uid
+            self.debug_uid += 1
             print(f"parser START: {func.__name__}", uid)
-            print(*args)
-            ret = func(*args)
+            print(self, *args)
+            ret = func(self, *args)
             print(f"parser END: {func.__name__}", uid)
             return ret
         return f
     return func
 
 class Parser:
-    __slots__ = "src", "errors", "lexer", "current", "lookahead"
-    def __init__(self, filename, src):
+    __slots__ = "src", "errors", "lexer", "current", "lookahead", "debug_uid"
+    def __init__(self, filename, src, lexer=None):
         self.src = src
         self.errors = 0
+        self.debug_uid = 0 # numbers the rules PARSER_DEBUG traces
 
-        self.lexer = Lexer(self.src)
+        self.lexer = Lexer(self.src) if lexer is None else lexer
 
         self.current = self.lexer.next()
         self.lookahead = self.lexer.next()
@@ -102,20 +103,20 @@ class Parser:
                 self._error(f"Expected identifier but got {self.current.type.name}")
                 return None
             member = ast.Identifier(self.expect(TokenEnum.Identifier))
-            return ast.BinaryExpr(op, primary, member)
+            return self.postfix_expression(ast.BinaryExpr(op, primary, member))
 
         elif self.current.type == TokenEnum.LeftParen:
             lp = self.next()
             args = self.argument_expression_list()
             rp = self.expect(TokenEnum.RightParen)
-            return ast.CallExpr(primary, lp, args, rp)
+            return self.postfix_expression(ast.CallExpr(primary, lp, args, rp))
         elif self.current == TokenEnum.LeftSquare:
             ls = self.next()
             subscript = None
             if self.current != TokenEnum.RightSquare:
                 subscript = self.assignment_expression()
             rs = self.expect(TokenEnum.RightSquare)
-            return ast.Slice(primary, ls, subscript, rs)
+            return self.postfix_expression(ast.Slice(primary, ls, subscript, rs))
         else:
             return primary
 
@@ -212,19 +213,25 @@ class Parser:
         #pub = self.next() if self.current == TokenEnum.Pub else None
         #const = self.next() if self.current == TokenEnum.Const else None
         #macro = self.next() if self.current == TokenEnum.Macro else None
+        inline = self.next() if self.current == TokenEnum.Inline else None
         
         decl = self.declaration()
+        decl.inline = inline
 
         if self.current.type == TokenEnum.Assignment:
             self.next()
             decl.expr = self.expression_statement()
         elif self.current.type == TokenEnum.LeftCurly:
-            decl.expr = self.code_block()
+            decl.expr = self.body(decl)
         else:
             self.expect(TokenEnum.Newline, TokenEnum.Semicolon)
 
         return decl
 
+    def body(self, decl):
+        # the code block of a declaration, stream.SignatureParser leaves out the ones of functions
+        return self.code_block()
+
     @parser_func
     def compound_type(self):
         which = self.next()
@@ -243,6 +250,8 @@ class Parser:
     def statement(self):
         if self.current.type == TokenEnum.Identifier and self.lookahead.type == TokenEnum.Colon:
             return self.declaration_statement()
+        elif self.current == TokenEnum.Inline:
+            return self.declaration_statement()
         elif self.current == TokenEnum.Newline:
             self.next()
             return None
@@ -250,6 +259,10 @@ class Parser:
             return self.compound_type()
         elif self.current.type == TokenEnum.Return:
             return self.return_statement()
+        elif self.current == TokenEnum.Import:
+            self._error("Imports have to come right after the module statement")
+            self.import_list()
+            return None
         else:
             return self.expression_statement()
 
@@ -271,19 +284,45 @@ class Parser:
         return ast.CodeBlock(lc, statements, rc)
 
     @parser_func
-    def module(self):
+    def import_list(self):
+        # import name [as alias], only right after the module statement
+        imports = list()
+        while True:
+            while self.current == TokenEnum.Newline:
+                self.next()
+            if self.current != TokenEnum.Import:
+                return imports
+
+            import_ = self.next()
+            name = self.expect(TokenEnum.Identifier)
+            alias = None
+            if self.optional(TokenEnum.As) is not None:
+                alias = self.expect(TokenEnum.Identifier)
+            self.expect(TokenEnum.Newline, TokenEnum.Semicolon)
+            if name is not None:
+                imports.append(ast.Import(import_, name, alias))
 
+    @parser_func
+    def header(self):
+        """the name token of the module and its imports, the name is None after an error"""
         if self.current.type != TokenEnum.Module:
             self._error("No module statement at the start of file")
-            return None
+            return None, list()
 
         module = self.next()
 
         name = self.expect(TokenEnum.Identifier)
-        if name is None: return None
+        if name is None: return None, list()
 
         semi = self.expect(TokenEnum.Newline, TokenEnum.Semicolon)
-        if semi is None: return None
+        if semi is None: return None, list()
+
+        return name, self.import_list()
+
+    @parser_func
+    def module(self):
+        name, imports = self.header()
+        if name is None: return None
 
         statements = None
         if self.current.type == TokenEnum.Eof:
@@ -291,11 +330,18 @@ class Parser:
         else:
             statements = self.statement_list()
 
-        return ast.Module(name, statements)
+        return ast.Module(name, statements, imports)
 
-def parse(filename, src):
-    parser = Parser(filename, src)
+def parse(filename, src, lexer=None):
+    parser = Parser(filename, src, lexer)
     ast = parser.module()
 
     return ast, parser.errors
 
+def parse_header(filename, src):
+    # only lexes up to the first statement after the imports
+    parser = Parser(filename, src)
+    name, imports = parser.header()
+
+    return name, imports, parser.errors
+
@@ -1,15 +1,56 @@
+from bisect import bisect_left, bisect_right
+
 from tokens import Token, TokenEnum
 
 TABSPACE: int = "    "
 
+
+class Diagnostic:
+    """an error reported against a source, format() gives the text ParserFile.error() prints"""
+    __slots__ = "filename", "line", "column", "length", "message", "line_str", "end_msg"
+    def __init__(self, filename, line, column, length, message, line_str, end_msg=None):
+        self.filename = filename
+        self.line = line # None for errors about the whole source
+        self.column = column
+        self.length = length # of the underlined part of the line
+        self.message = message
+        self.line_str = line_str # None at the end of the file
+        self.end_msg = end_msg
+
+    def format(self):
+        if self.line is None:
+            return f"{self.filename}: ERROR: {self.message}"
+        lines = [f"{self.filename}:{self.line}:{self.column}: ERROR: {self.message}"]
+        if self.line_str is None:
+            lines.append("EOF")
+            return "\n".join(lines)
+
+        lines.append(self.line_str.expandtabs(len(TABSPACE)))
+        lines.append("".join(TABSPACE if self.line_str[i] == '\t' else " "
+            for i in range(self.column - 1)) + '^' + '~' * (self.length - 1))
+        if self.end_msg is not None: lines.append(self.end_msg)
+        return "\n".join(lines)
+
+
 class ParserFile:
-    __slots__ = "filename", "src", "pos"
-    def __init__(self, filename):
+    __slots__ = "filename", "src", "pos", "newlines", "diagnostics"
+    def __init__(self, filename, text=None, diagnostics=None):
         self.filename = filename
-        with open(filename, "r") as fp:
-            self.src = fp.read()
+        if text is None:
+            with open(filename, "r") as fp:
+                text = fp.read()
+        elif isinstance(text, (bytes, bytearray, memoryview)):
+            text = bytes(text).decode()
+        self.src = text
 
         self.pos = 0
+        self.newlines = None # positions of the '\n's, made by the first error
+        self.diagnostics = diagnostics # list the errors go to instead of stdout
+
+    def _newlines(self):
+        if self.newlines is None:
+            self.newlines = [i for i, ch in enumerate(self.src) if ch == '\n']
+        return self.newlines
 
     def is_eof(self):
         return self.pos >= len(self.src)
@@ -29,15 +70,18 @@ class ParserFile:
 
         line_pos, col_pos = self.get_tok_human_pos(tok)
         line_str = self.get_line(tok)
-        
-        print(f"{self.filename}:{line_pos}:{col_pos}: ERROR: {msg}")
-        if line_str is None:
-            print("EOF")
-            return
-
-        print(line_str.expandtabs(len(TABSPACE)))
-        print("".join(TABSPACE if line_str[i] == '\t' else " " for i in range(col_pos - 1)) + '^')
-        if end_msg is not None: print(end_msg)
+
+        # underlines tokens and nodes up to their end, or the end of the line if they span more
+        length = 1
+        if line_str is not None:
+            line_end = tok.pos() - (col_pos - 1) + len(line_str)
+            length = max(1, min(tok.end(), line_end) - tok.pos())
+
+        diagnostic = Diagnostic(self.filename, line_pos, col_pos, length, msg, line_str, end_msg)
+        if self.diagnostics is None:
+            print(diagnostic.format())
+        else:
+            self.diagnostics.append(diagnostic)
     
     def get_token_string(self, tok):
         if tok.pos() == len(self.src):
@@ -45,30 +89,20 @@ class ParserFile:
         return self.src[tok.pos() : tok.end()]
 
     def get_tok_human_pos(self, tok):
-        line = 1
-        col = 0
-
-        pos = 0
-        for ch in self.src:
-            col += 1
-            if ch == '\n':
-                line += 1
-                col = 0
-            if pos >= tok.pos():
-                break
-            pos += 1
-
-        return line, col
+        # a token on a '\n' is at column 0 of the next line
+        newlines = self._newlines()
+        pos = min(tok.pos(), len(self.src) - 1)
+        line = bisect_right(newlines, pos)
+        line_start = newlines[line - 1] + 1 if line else 0
+        return line + 1, pos + 1 - line_start
 
     def get_line(self, tok):
-        
-        pos = 0
-        for line in self.src.splitlines():
-            new_pos = pos + len(line) + 1
-
-            if new_pos > tok.pos():
-                return line
-
-            pos = new_pos
-        
-        return None
+        # the line of the token without its '\n', None after the last one
+        newlines = self._newlines()
+        line = bisect_left(newlines, tok.pos())
+        line_start = newlines[line - 1] + 1 if line else 0
+        if line < len(newlines):
+            return self.src[line_start : newlines[line]]
+        if line_start == len(self.src) or tok.pos() > len(self.src):
+            return None
+        return self.src[line_start:]
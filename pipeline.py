@@ -0,0 +1,123 @@
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import stream
+from asm_gen import parallel
+from timing import Timer
+from counters import NULL as NULL_COUNTERS
+
+# Compiles a module with its phases running at the same time (main.py --pipeline).
+#
+# This process parses the module without the function bodies like main.py --stream and queues
+# every function for a pool of jobs processes, forked once the signatures are known. A process
+# parses the body of the function it got, generates its IR, resolves and type checks it and
+# generates its code, so the front end of later functions runs while the code of earlier ones
+# gets generated and written. This process merges the results and writes them in source order.
+#
+# Functions cross to the pool as their position in the source: parsing a body takes less time
+# than pickling its ast or IR for another process, and threads don't run python at the same
+# time. At most IN_FLIGHT_PER_JOB functions per job are queued, the pool can't get further
+# ahead of the writing than that.
+#
+# Every stage counts the CPU time it was busy, report() gives the utilisation of the stages
+# against the wall time of the compile. The output is the one of --stream, -O only propagates.
+
+IN_FLIGHT_PER_JOB: int = 4
+
+MAIN_STAGES: tuple = ("signatures", "write") # the stages of this process, the rest are the pool's
+
+_state = None # (stream.Stream, functions, setup(program)) of a process of the pool
+
+
+def _init(stream_, setup):
+    global _state
+    _state = (stream_, parallel.functions(stream_.program), setup(stream_.program))
+
+
+def _run(work, index):
+    stream_, funcs, state = _state
+    func = funcs[index]
+    timer = Timer()
+    try:
+        stream_.load(func, timer)
+    except stream.Failed:
+        sys.stdout.flush() # the errors have to be out before the compile fails
+        raise
+    with timer.phase("codegen"):
+        result = work(state, func)
+    stream_.release(func)
+    return result, {name: cpu for name, (_, _, cpu, *_) in timer.phases.items()}
+
+
+class Pipeline:
+    __slots__ = "stream", "busy", "start", "wall", "jobs"
+    def __init__(self, stream_, busy, start):
+        self.stream = stream_
+        self.busy = busy # stage -> CPU seconds
+        self.start = start
+        self.wall = 0.0
+        self.jobs = 1
+
+    def map(self, setup, work, jobs=1):
+        """asm_gen.parallel.map_functions() of the program, building every function in the pool"""
+        funcs = parallel.functions(self.stream.program)
+        self.jobs = jobs = max(1, jobs)
+        cpu = time.process_time()
+
+        with ProcessPoolExecutor(jobs, mp_context=parallel.context(), initializer=_init,
+            initargs=(self.stream, setup)) as pool:
+            pending = deque()
+            try:
+                for index in range(len(funcs)):
+                    if len(pending) >= jobs * IN_FLIGHT_PER_JOB:
+                        yield self.result(pending.popleft())
+                    pending.append(pool.submit(_run, work, index))
+                while len(pending) > 1:
+                    yield self.result(pending.popleft())
+                last = self.result(pending.popleft())
+            except stream.Failed as failed:
+                # functions already running finish and report their errors too, count them all
+                pool.shutdown(cancel_futures=True)
+                raise stream.Failed(failed.num_errors + sum(future.exception().num_errors
+                    for future in pending if not future.cancelled()
+                    and isinstance(future.exception(), stream.Failed)))
+
+        # the backend stops asking after the last result, the generator never gets resumed
+        self.busy["write"] = time.process_time() - cpu
+        self.wall = time.perf_counter() - self.start
+        yield last
+
+    def result(self, future):
+        result, busy = future.result()
+        for stage, cpu in busy.items():
+            self.busy[stage] = self.busy.get(stage, 0.0) + cpu
+        return result
+
+    def report(self) -> str:
+        """the busy time and utilisation of every stage"""
+        lines = [f"{'stage':<10} {'procs':>5} {'busy ms':>10} {'util':>6}"]
+        stages = [stage for stage in self.busy if stage not in MAIN_STAGES]
+        for stage in (MAIN_STAGES[0], *stages, *MAIN_STAGES[1:]):
+            procs = 1 if stage in MAIN_STAGES else self.jobs
+            busy = self.busy.get(stage, 0.0)
+            lines.append(f"{stage:<10} {procs:>5} {busy * 1e3:10.2f} "
+                f"{100 * busy / (procs * self.wall):5.1f}%")
+        lines.append(f"{'wall':<10} {'':>5} {self.wall * 1e3:10.2f}")
+        return "\n".join(lines)
+
+
+def front_end(src, optimize=False, counters=NULL_COUNTERS):
+    """
+    (number of errors, Program) of the ParserFile src with every function body left out, the
+    Program's pipeline builds them in a pool of processes while generating code
+    """
+    start = time.perf_counter()
+    timer = Timer()
+    num_errors, program = stream.signatures(src, optimize, timer, counters)
+    if num_errors:
+        return num_errors, None
+    busy = {"signatures": sum(cpu for _, _, cpu, *_ in timer.phases.values())}
+    program.stream = Pipeline(program.stream, busy, start)
+    return 0, program
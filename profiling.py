@@ -0,0 +1,239 @@
+import cProfile
+import marshal
+import os
+import pstats
+import signal
+import threading
+import time
+from contextlib import contextmanager
+
+from parser_ import RULES
+from timing import NULL
+
+# Profiler of a compile (main.py --profile PREFIX), writes PREFIX.folded with collapsed stacks
+# for flamegraph tools (flamegraph.pl, speedscope, inferno) and PREFIX.pstats for pstats/snakeviz.
+#
+#   flamegraph.pl PREFIX.folded > compile.svg
+#   python3 -m pstats PREFIX.pstats
+#
+# Every stack starts with the phase it was taken in (the phases of timing.py, the profiler stands
+# in for the timer) and the grammar rules of the parser show up as "rule:statement" and so on,
+# the rest of the frames as "module:function".
+#
+# Sampler interrupts the compile every interval seconds of CPU time with SIGPROF and counts the
+# stack it interrupted, so the compile runs like it does without the profiler, only the handler
+# costs something. The handler times itself and when it takes more than budget (5% by default) of
+# the CPU time it makes the interval longer, the overhead stays below the budget however deep the
+# stacks get. The kernel may deliver the signal less often than asked for (every tick of the
+# scheduler at most), so a sample stands for the CPU time of the compile divided by the samples.
+# The pstats file gets made from the samples, its call counts are counts of samples.
+#
+# Without setitimer (Windows) or outside of the main thread CProfiler profiles with cProfile
+# instead, one profile per phase. It knows exact call counts but slows everything calling
+# functions down around 2x, and its collapsed stacks are only "phase;function" with the time spent
+# in the function in microseconds since cProfile doesn't keep stacks.
+#
+# Neither sees the code generation in the processes of -j.
+
+DEFAULT_INTERVAL: float = 0.001
+DEFAULT_BUDGET: float = 0.05
+NO_PHASE: str = "(no phase)"
+
+_ROOTS = (os.path.dirname(os.path.abspath(__file__)), os.path.dirname(os.__file__))
+
+
+def _label(code) -> str:
+    if code in RULES:
+        return f"rule:{code.co_name}"
+    module = code.co_filename # <frozen importlib._bootstrap> and the like stay as they are
+    if module.endswith(".py"):
+        path = os.path.abspath(module)
+        root = next((root for root in _ROOTS if path.startswith(root + os.sep)), None)
+        module = os.path.basename(path) if root is None else os.path.relpath(path, root)
+        module = module[:-len(".py")].replace(os.sep, ".").removesuffix(".__init__")
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def _key(code) -> tuple:
+    return (code.co_filename, code.co_firstlineno, code.co_name)
+
+
+class Sampler:
+    __slots__ = ("timer", "interval", "budget", "current", "samples", "count", "cost", "wall",
+        "cpu", "previous")
+    enabled = True
+
+    def __init__(self, timer=NULL, interval=DEFAULT_INTERVAL, budget=DEFAULT_BUDGET):
+        self.timer = timer # the phases still get timed with --time-report
+        self.interval = interval
+        self.budget = budget
+        self.current = NO_PHASE
+        self.samples = dict() # (phase, code of the frames, innermost first) -> count
+        self.count = 0
+        self.cost = 0.0 # time spent in the handler
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.previous = None
+
+    @contextmanager
+    def phase(self, name):
+        outer, self.current = self.current, name
+        try:
+            with self.timer.phase(name):
+                yield
+        finally:
+            self.current = outer
+
+    def start(self):
+        self.previous = signal.signal(signal.SIGPROF, self._sample)
+        self.wall, self.cpu = time.perf_counter(), time.process_time()
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self.previous)
+        self.wall = time.perf_counter() - self.wall
+        self.cpu = time.process_time() - self.cpu
+
+    def period(self) -> float:
+        """CPU time a sample stands for"""
+        return self.cpu / self.count if self.count else self.interval
+
+    def _sample(self, signum, frame):
+        start = time.perf_counter()
+        codes = list()
+        while frame is not None:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        key = (self.current, tuple(codes))
+        self.samples[key] = self.samples.get(key, 0) + 1
+        self.count += 1
+        self.cost += time.perf_counter() - start
+
+        # keeps the handler under the budget, checked every few samples since timing one is noisy
+        if self.count % 64 == 0 and self.cost > self.budget * self.count * self.interval:
+            self.interval = self.cost / self.count / self.budget
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def folded(self) -> str:
+        stacks = dict()
+        for (phase, codes), n in self.samples.items():
+            stack = ";".join((phase, *(_label(code) for code in reversed(codes))))
+            stacks[stack] = stacks.get(stack, 0) + n
+        return "".join(f"{stack} {n}\n" for stack, n in sorted(stacks.items()))
+
+    def stats(self) -> dict:
+        """the samples in the format of the files of pstats"""
+        period = self.period()
+        stats = dict() # key -> [samples, self time, total time, callers]
+        for (_, codes), n in self.samples.items():
+            seconds = n * period
+            seen = set()
+            for i, code in enumerate(codes):
+                key = _key(code)
+                entry = stats.setdefault(key, [0, 0.0, 0.0, dict()])
+                if i == 0:
+                    entry[1] += seconds
+                if key not in seen: # recursion counts once
+                    seen.add(key)
+                    entry[0] += n
+                    entry[2] += seconds
+                if i + 1 < len(codes):
+                    caller = entry[3].setdefault(_key(codes[i + 1]), [0, 0, 0.0, 0.0])
+                    caller[0] += n
+                    caller[1] += n
+                    caller[2] += seconds if i == 0 else 0.0
+                    caller[3] += seconds
+        return {key: (n, n, tt, ct, {caller: tuple(value) for caller, value in callers.items()})
+            for key, (n, tt, ct, callers) in stats.items()}
+
+    def write(self, prefix):
+        with open(prefix + ".folded", "w") as fp:
+            fp.write(self.folded())
+        with open(prefix + ".pstats", "wb") as fp:
+            marshal.dump(self.stats(), fp)
+
+    def report(self) -> str:
+        """the phases and grammar rules by samples, and what the sampling cost"""
+        phases, rules = dict(), dict()
+        for (phase, codes), n in self.samples.items():
+            phases[phase] = phases.get(phase, 0) + n
+            for code in set(codes) & RULES:
+                rules[code.co_name] = rules.get(code.co_name, 0) + n
+        total = max(self.count, 1)
+        width = max(len("phase"), max((len(name) for name in (*phases, *rules)), default=0))
+        lines = [f"{'phase':<{width}} {'samples':>8} {'%':>6}"]
+        for name, n in sorted(phases.items(), key=lambda item: -item[1]):
+            lines.append(f"{name:<{width}} {n:>8} {100 * n / total:6.1f}")
+        if rules:
+            lines.append(f"{'rule':<{width}} {'samples':>8} {'%':>6}")
+            for name, n in sorted(rules.items(), key=lambda item: -item[1])[:10]:
+                lines.append(f"{name:<{width}} {n:>8} {100 * n / total:6.1f}")
+        lines.append(f"{self.count} samples, one every {self.period() * 1e3:.2f}ms of CPU time, "
+            f"sampling took {self.cost * 1e3:.2f}ms ({100 * self.cost / max(self.wall, 1e-9):.1f}% "
+            "of the wall time)")
+        return "\n".join(lines)
+
+
+class CProfiler:
+    __slots__ = "timer", "current", "profiles"
+    enabled = True
+
+    def __init__(self, timer=NULL):
+        self.timer = timer
+        self.current = NO_PHASE
+        self.profiles = dict() # phase -> cProfile.Profile
+
+    def _switch(self, name):
+        self.profiles[self.current].disable()
+        self.current = name
+        self.profiles.setdefault(name, cProfile.Profile()).enable()
+
+    @contextmanager
+    def phase(self, name):
+        outer = self.current
+        self._switch(name)
+        try:
+            with self.timer.phase(name):
+                yield
+        finally:
+            self._switch(outer)
+
+    def start(self):
+        self.profiles.setdefault(self.current, cProfile.Profile()).enable()
+
+    def stop(self):
+        self.profiles[self.current].disable()
+
+    def folded(self) -> str:
+        lines = list()
+        for phase, profile in self.profiles.items():
+            for entry in profile.getstats():
+                label = entry.code if isinstance(entry.code, str) else _label(entry.code)
+                if microseconds := round(entry.inlinetime * 1e6):
+                    lines.append(f"{phase};{label} {microseconds}\n")
+        return "".join(lines)
+
+    def write(self, prefix):
+        with open(prefix + ".folded", "w") as fp:
+            fp.write(self.folded())
+        pstats.Stats(*self.profiles.values()).dump_stats(prefix + ".pstats")
+
+    def report(self) -> str:
+        """the phases by CPU time"""
+        times = {phase: sum(entry.inlinetime for entry in profile.getstats())
+            for phase, profile in self.profiles.items()}
+        width = max(len("phase"), max((len(phase) for phase in times), default=0))
+        lines = [f"{'phase':<{width}} {'cpu ms':>10}"]
+        for phase, seconds in sorted(times.items(), key=lambda item: -item[1]):
+            lines.append(f"{phase:<{width}} {seconds * 1e3:10.2f}")
+        lines.append("profiled with cProfile, every call got slower")
+        return "\n".join(lines)
+
+
+def profiler(timer=NULL, mode="sample", interval=DEFAULT_INTERVAL):
+    """Sampler if it can sample here and sampling got asked for, CProfiler otherwise"""
+    if (mode == "sample" and hasattr(signal, "setitimer")
+        and threading.current_thread() is threading.main_thread()):
+        return Sampler(timer, interval)
+    return CProfiler(timer)
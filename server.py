@@ -0,0 +1,147 @@
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import traceback
+
+from parser_file import ParserFile
+import build
+import main as compiler
+from client import socket_path
+
+# Compile server, keeps the compiler imported and the parsed modules in memory between compiles
+# so a compile doesn't pay for starting python, importing the compiler and parsing files which
+# didn't change. Requests come from client.py over a Unix domain socket (see there for the
+# protocol) and get handled one after the other, each runs main.main() with the arguments of the
+# client in its directory and sends back what it printed.
+#
+#   python3 -m server [--socket PATH]
+#
+# Modules keeps the front end (ir.serialize-able IR and the interface, see build.front_end()) of
+# every file it saw by path. A file whose mtime and size didn't change isn't even read again, one
+# which got touched but has the same content only gets hashed. Everything after the front end
+# (program.build(), -O and the code generation) runs for every request, the cache of --cache-dir
+# covers the generated code.
+
+
+class Module:
+    __slots__ = "stat", "digest", "front"
+    def __init__(self, stat, digest, front):
+        self.stat = stat # (mtime_ns, size) of the file
+        self.digest = digest # sha256 of the source
+        self.front = front # (src, rep, interface) from build.front_end()
+
+
+class Modules:
+    __slots__ = ("modules",)
+    def __init__(self):
+        self.modules = dict() # absolute path -> Module
+
+    def front_end(self, path, cache=None):
+        """build.front_end() of the file in path, from memory while the file stays the same"""
+        key = os.path.abspath(path)
+        stat = os.stat(key)
+        stat = (stat.st_mtime_ns, stat.st_size)
+        module = self.modules.get(key)
+        if module is not None and module.stat == stat:
+            return module.front
+
+        src = ParserFile(path)
+        digest = hashlib.sha256(src.src.encode()).digest()
+        if module is not None and module.digest == digest:
+            module.stat = stat
+            return module.front
+
+        front = build.front_end(src, cache)
+        if front is None:
+            self.modules.pop(key, None)
+        else:
+            self.modules[key] = Module(stat, digest, front)
+        return front
+
+
+class Server(socketserver.UnixStreamServer):
+    def __init__(self, path):
+        # only the user gets to connect
+        umask = os.umask(0o177)
+        try:
+            super().__init__(path, Handler)
+        finally:
+            os.umask(umask)
+        self.modules = Modules()
+        self.stopping = False
+
+    def compile(self, cwd, argv):
+        """(exit status, printed output) of main.py run with argv in cwd"""
+        printed = io.StringIO()
+        previous = os.getcwd()
+        with contextlib.redirect_stdout(printed), contextlib.redirect_stderr(printed):
+            try:
+                os.chdir(cwd)
+                status = compiler.main(argv, self.modules)
+            except SystemExit as e: # argparse
+                status = e.code if isinstance(e.code, int) else int(e.code is not None)
+            except Exception:
+                traceback.print_exc()
+                status = 1
+            finally:
+                os.chdir(previous)
+        return status, printed.getvalue()
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return # somebody checking if the server runs
+        message = json.loads(line)
+        if message.get("stop"):
+            self.server.stopping = True
+            status, output = 0, ""
+        else:
+            status, output = self.server.compile(message["cwd"], message["argv"])
+        self.wfile.write(json.dumps({"status": status, "output": output}).encode() + b"\n")
+
+
+def serve(path) -> int:
+    path = os.path.abspath(path) # requests change the working directory while they run
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        if sock.connect_ex(path) == 0:
+            print(f"A server is already running on {path}")
+            return 1
+    if os.path.exists(path):
+        os.remove(path) # left behind by a server which didn't get to clean up
+
+    server = Server(path)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"Serving on {path}")
+    try:
+        with server:
+            while not server.stopping:
+                server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        os.remove(path)
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="server")
+    parser.add_argument("--socket",
+        metavar="PATH",
+        help="the socket to listen on, $MYLANG_SOCKET or mylang.sock in $XDG_RUNTIME_DIR "
+            "or /tmp by default",
+        )
+    args = parser.parse_args()
+    return serve(args.socket or socket_path())
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,169 @@
+from parser_ import Parser
+from tokens import TokenEnum
+import ast_ as ast
+from ir.generator import IrGenerator
+from ir.program import ProgramBuilder
+from ir.typechecker import Inference
+from ir.optimize import propagate
+from asm_gen import parallel
+from timing import NULL
+from counters import NULL as NULL_COUNTERS
+
+# Compiles a module one function at a time (main.py --stream), so the memory a compile needs is
+# about that of its biggest function and not that of the whole module.
+#
+# signatures() parses the module leaving out the function bodies, it only remembers where every
+# body starts, and builds a Program of the structs, globals, module level code and the
+# signatures of the functions. The Program gets a Stream, which asm_gen.parallel.map_functions()
+# hands the code generation to: the body of every function gets parsed, turned into IR, resolved
+# and type checked right before generating its code, and released with its ast nodes once its
+# code is written. The source text, the module level code and the signatures stay in memory.
+#
+# Errors in a body only turn up while generating code, Stream then raises Failed and main.py
+# removes the incomplete output file. Without the other bodies -O can't inline, it only propagates constants.
+
+
+class Failed(Exception):
+    """a function body had errors, they got reported already"""
+    def __init__(self, num_errors):
+        self.num_errors = num_errors
+
+
+class SignatureParser(Parser):
+    """a Parser skipping function bodies, bodies maps the position of the name of a function to
+    the position of its '{'"""
+    __slots__ = ("bodies",)
+    def __init__(self, filename, src):
+        super().__init__(filename, src)
+        self.bodies = dict()
+
+    def body(self, decl):
+        if not isinstance(decl.type_expr, ast.FuncType) or decl.name is None:
+            return self.code_block()
+
+        self.bodies[decl.name.position] = self.current.position
+        depth = 0
+        while self.current.type != TokenEnum.Eof:
+            tok = self.next()
+            depth += (tok.type == TokenEnum.LeftCurly) - (tok.type == TokenEnum.RightCurly)
+            if depth == 0:
+                return None
+        self.expect(TokenEnum.RightCurly)
+        return None
+
+
+class Stream:
+    __slots__ = "src", "program", "bodies", "generator", "first_uid", "builder", "inference", \
+        "optimize", "counters"
+    def __init__(self, src, program, bodies, generator, builder, inference, optimize=False,
+        counters=NULL_COUNTERS):
+        self.src = src
+        self.program = program
+        self.bodies = bodies # see SignatureParser
+        self.generator = generator
+        self.first_uid = generator.next_uid # where the uids of every body start
+        self.builder = builder
+        self.inference = inference
+        self.optimize = optimize
+        self.counters = counters
+
+    def load(self, func, timer=NULL):
+        """builds the body of func"""
+        start = None if func.token is None else self.bodies.get(func.token.position)
+        if start is None:
+            return # module level code or a function without a body
+
+        with timer.phase("parse"):
+            self.src.pos = start
+            parser = Parser(self.src.filename, self.src)
+            block = parser.code_block()
+        if parser.errors:
+            raise Failed(parser.errors)
+        self.counters.ast_nodes(block)
+
+        # a process of a pipeline goes on with other functions after one with errors, their
+        # counts must not carry over
+        self.generator.num_errors = self.builder.num_errors = self.inference.num_errors = 0
+        with timer.phase("IR gen"):
+            self.generator.next_uid = self.first_uid
+            body = self.generator.block(block)
+        if self.generator.num_errors:
+            raise Failed(self.generator.num_errors)
+        self.counters.ir_instrs(body)
+
+        with timer.phase("resolve"):
+            for instr in body:
+                self.builder.instr(func, instr)
+        if self.builder.num_errors:
+            raise Failed(self.builder.num_errors)
+
+        with timer.phase("typecheck"):
+            self.inference.function(func)
+            self.inference.undefined()
+        if self.inference.num_errors:
+            raise Failed(self.inference.num_errors)
+
+        if self.optimize:
+            with timer.phase("propagate"):
+                propagate(self.program, func)
+
+    def map(self, setup, work, jobs=1):
+        """asm_gen.parallel.map_functions() of the program, one function at a time in this process"""
+        state = setup(self.program)
+        for func in parallel.functions(self.program):
+            self.load(func)
+            result = work(state, func)
+            self.release(func)
+            yield result
+
+    def release(self, func):
+        """drops the body of func again, its code has been generated"""
+        if func.token is None or func.token.position not in self.bodies:
+            return
+        func.body = list()
+        func.types = dict()
+        func.locals = dict(func.args)
+        self.builder.type_uids.clear()
+        self.builder.aliases.clear()
+
+
+def signatures(src, optimize=False, timer=NULL, counters=NULL_COUNTERS):
+    """
+    (number of errors, Program) of the ParserFile src with every function body left out, the
+    Program's stream builds them while generating code
+    """
+    parser = SignatureParser(src.filename, src)
+    with timer.phase("parse"):
+        tree = parser.module()
+    if parser.errors:
+        return parser.errors, None
+    counters.ast_nodes(tree)
+
+    generator = IrGenerator(src)
+    with timer.phase("IR gen"):
+        rep = generator.generate(tree)
+    if generator.num_errors:
+        return generator.num_errors, None
+    counters.ir_instrs(rep)
+
+    builder = ProgramBuilder(src, counters)
+    with timer.phase("resolve"):
+        program = builder.module(rep)
+    if builder.num_errors:
+        return builder.num_errors, None
+
+    inference = Inference(src, program, counters)
+    with timer.phase("typecheck"):
+        inference.declare()
+        inference.function(program.init)
+        inference.undefined()
+    if inference.num_errors:
+        return inference.num_errors, None
+
+    if optimize:
+        propagate(program, program.init)
+    builder.type_uids.clear()
+    builder.aliases.clear()
+    program.stream = Stream(src, program, parser.bodies, generator, builder, inference, optimize,
+        counters)
+    return 0, program
@@ -0,0 +1,77 @@
+// generated by mylang from module arith
+	.text
+
+	.globl ml_main
+	.type ml_main, %function
+	.p2align 2
+ml_main:
+	stp	x29, x30, [sp, #-16]!
+	mov	x29, sp
+	sub	sp, sp, #32
+	stur	x19, [x29, #-8]
+	stur	x20, [x29, #-16]
+	stur	x21, [x29, #-24]
+	mov	x13, x0
+	sxtb	x14, w13
+	movz	x9, #40503, lsl #0
+	mul	x10, x13, x9
+	add	x19, x10, #7
+	asr	x9, x19, #3
+	eor	x10, x9, x19, lsl #2
+	cmp	x13, #64
+	lsl	x11, x19, x13
+	csel	x11, x11, xzr, lo
+	eor	x15, x10, x11
+	mov	x20, x15
+	sub	x9, x13, #1
+	cbnz	x9, .Lml_main.1
+	brk	#1000
+.Lml_main.1:
+	sdiv	x10, x19, x9
+	mov	x21, x10
+	cbnz	x13, .Lml_main.2
+	brk	#1000
+.Lml_main.2:
+	sdiv	x16, x19, x13
+	msub	x13, x16, x13, x19
+	mov	w13, w13
+	sxtb	x9, w20
+	add	x10, x14, x9
+	sxtb	x10, w10
+	sxtb	x11, w21
+	add	x15, x10, x11
+	sxtb	x15, w15
+	sxtb	x1, w13
+	add	x2, x15, x1
+	sxtb	x0, w2
+	ldur	x19, [x29, #-8]
+	ldur	x20, [x29, #-16]
+	ldur	x21, [x29, #-24]
+	mov	sp, x29
+	ldp	x29, x30, [sp], #16
+	ret
+	.size ml_main, .-ml_main
+
+	.p2align 2
+ml__init:
+	stp	x29, x30, [sp, #-16]!
+	mov	x29, sp
+	mov	x0, #0
+	mov	sp, x29
+	ldp	x29, x30, [sp], #16
+	ret
+
+	.section .init_array,"aw"
+	.p2align 3
+	.xword ml__init
+
+	.text
+	.globl main
+	.type main, %function
+	.p2align 2
+main:
+	sxtw	x0, w0
+	b	ml_main
+	.size main, .-main
+
+	.section .note.GNU-stack,"",%progbits
@@ -0,0 +1,149 @@
+// generated by mylang from module calls
+	.text
+
+	.globl ml_bump
+	.type ml_bump, %function
+	.p2align 2
+ml_bump:
+	stp	x29, x30, [sp, #-16]!
+	mov	x29, sp
+	sxtw	x13, w0
+	adrp	x16, ml_counter
+	add	x16, x16, :lo12:ml_counter
+	ldrsw	x9, [x16, #0]
+	add	x10, x9, x13
+	sxtw	x9, w10
+	adrp	x16, ml_counter
+	add	x16, x16, :lo12:ml_counter
+	str	w9, [x16, #0]
+	adrp	x16, ml_counter
+	add	x16, x16, :lo12:ml_counter
+	ldrsw	x0, [x16, #0]
+	mov	sp, x29
+	ldp	x29, x30, [sp], #16
+	ret
+	.size ml_bump, .-ml_bump
+
+	.globl ml_swap
+	.type ml_swap, %function
+	.p2align 2
+ml_swap:
+	stp	x29, x30, [sp, #-16]!
+	mov	x29, sp
+	stur	x0, [x29, #-16]
+	stur	x1, [x29, #-8]
+	stur	xzr, [x29, #-32]
+	stur	xzr, [x29, #-24]
+	ldur	d18, [x29, #-8]
+	fcvtzs	x9, d18
+	stur	x9, [x29, #-32]
+	ldur	x16, [x29, #-16]
+	scvtf	d16, x16
+	stur	d16, [x29, #-24]
+	ldur	x0, [x29, #-32]
+	ldur	x1, [x29, #-24]
+	mov	sp, x29
+	ldp	x29, x30, [sp], #16
+	ret
+	.size ml_swap, .-ml_swap
+
+	.globl ml_main
+	.type ml_main, %function
+	.p2align 2
+ml_main:
+	stp	x29, x30, [sp, #-16]!
+	mov	x29, sp
+	mov	x13, x0
+	adrp	x9, .LC0
+	add	x9, x9, :lo12:.LC0
+	stur	x9, [x29, #-16]
+	movz	x9, #6, lsl #0
+	stur	x9, [x29, #-8]
+	stur	xzr, [x29, #-32]
+	stur	xzr, [x29, #-24]
+	mov	x9, x13
+	stur	x9, [x29, #-32]
+	movz	x16, #16388, lsl #48
+	fmov	d16, x16
+	stur	d16, [x29, #-24]
+	ldur	x12, [x29, #-32]
+	stur	x12, [x29, #-48]
+	ldur	x12, [x29, #-24]
+	stur	x12, [x29, #-40]
+	stur	xzr, [x29, #-64]
+	stur	xzr, [x29, #-56]
+	ldur	d18, [x29, #-40]
+	fcvtzs	x9, d18
+	stur	x9, [x29, #-64]
+	ldur	x16, [x29, #-48]
+	scvtf	d16, x16
+	stur	d16, [x29, #-56]
+	ldur	x12, [x29, #-64]
+	stur	x12, [x29, #-32]
+	ldur	x12, [x29, #-56]
+	stur	x12, [x29, #-24]
+	sxtw	x14, w13
+	adrp	x16, ml_counter
+	add	x16, x16, :lo12:ml_counter
+	ldrsw	x9, [x16, #0]
+	add	x10, x9, x14
+	sxtw	x9, w10
+	adrp	x16, ml_counter
+	add	x16, x16, :lo12:ml_counter
+	str	w9, [x16, #0]
+	ldur	x14, [x29, #-32]
+	ldur	d19, [x29, #-24]
+	scvtf	d16, x14
+	fadd	d20, d16, d19
+	ldur	x9, [x29, #-16]
+	add	x9, x9, x13, lsl #0
+	ldrb	w16, [x9, #0]
+	ucvtf	d17, x16
+	fadd	d16, d20, d17
+	adrp	x17, ml_counter
+	add	x17, x17, :lo12:ml_counter
+	ldrsw	x16, [x17, #0]
+	scvtf	d17, x16
+	fadd	d22, d16, d17
+	fcvtzs	x0, d22
+	mov	sp, x29
+	ldp	x29, x30, [sp], #16
+	ret
+	.size ml_main, .-ml_main
+
+	.p2align 2
+ml__init:
+	stp	x29, x30, [sp, #-16]!
+	mov	x29, sp
+	movz	x9, #0, lsl #0
+	adrp	x16, ml_counter
+	add	x16, x16, :lo12:ml_counter
+	str	w9, [x16, #0]
+	mov	x0, #0
+	mov	sp, x29
+	ldp	x29, x30, [sp], #16
+	ret
+
+	.section .init_array,"aw"
+	.p2align 3
+	.xword ml__init
+
+	.text
+	.globl main
+	.type main, %function
+	.p2align 2
+main:
+	sxtw	x0, w0
+	b	ml_main
+	.size main, .-main
+
+	.bss
+	.p2align 3
+ml_counter:
+	.zero 8
+
+	.section .rodata
+.LC0:
+	.byte 72, 101, 108, 108, 111, 10
+
+	.section .note.GNU-stack,"",%progbits
@@ -0,0 +1,139 @@
+// generated by mylang from module calls
+	.text
+
+	.globl ml_bump
+	.type ml_bump, %function
+	.p2align 2
+ml_bump:
+	stp	x29, x30, [sp, #-16]!
+	mov	x29, sp
+	sxtw	x13, w0
+	adrp	x16, ml_counter
+	add	x16, x16, :lo12:ml_counter
+	ldrsw	x9, [x16, #0]
+	add	x10, x9, x13
+	sxtw	x9, w10
+	adrp	x16, ml_counter
+	add	x16, x16, :lo12:ml_counter
+	str	w9, [x16, #0]
+	adrp	x16, ml_counter
+	add	x16, x16, :lo12:ml_counter
+	ldrsw	x0, [x16, #0]
+	mov	sp, x29
+	ldp	x29, x30, [sp], #16
+	ret
+	.size ml_bump, .-ml_bump
+
+	.globl ml_swap
+	.type ml_swap, %function
+	.p2align 2
+ml_swap:
+	stp	x29, x30, [sp, #-16]!
+	mov	x29, sp
+	stur	x0, [x29, #-16]
+	stur	x1, [x29, #-8]
+	stur	xzr, [x29, #-32]
+	stur	xzr, [x29, #-24]
+	ldur	d18, [x29, #-8]
+	fcvtzs	x9, d18
+	stur	x9, [x29, #-32]
+	ldur	x16, [x29, #-16]
+	scvtf	d16, x16
+	stur	d16, [x29, #-24]
+	ldur	x0, [x29, #-32]
+	ldur	x1, [x29, #-24]
+	mov	sp, x29
+	ldp	x29, x30, [sp], #16
+	ret
+	.size ml_swap, .-ml_swap
+
+	.globl ml_main
+	.type ml_main, %function
+	.p2align 2
+ml_main:
+	stp	x29, x30, [sp, #-16]!
+	mov	x29, sp
+	sub	sp, sp, #64
+	stur	x19, [x29, #-8]
+	mov	x19, x0
+	mov	x13, x1
+	adrp	x9, .LC0
+	add	x9, x9, :lo12:.LC0
+	stur	x9, [x29, #-24]
+	movz	x9, #6, lsl #0
+	stur	x9, [x29, #-16]
+	stur	xzr, [x29, #-40]
+	stur	xzr, [x29, #-32]
+	mov	x9, x19
+	stur	x9, [x29, #-40]
+	movz	x16, #16388, lsl #48
+	fmov	d16, x16
+	stur	d16, [x29, #-32]
+	ldur	x0, [x29, #-40]
+	ldur	x1, [x29, #-32]
+	bl	ml_swap
+	stur	x0, [x29, #-56]
+	stur	x1, [x29, #-48]
+	ldur	x12, [x29, #-56]
+	stur	x12, [x29, #-40]
+	ldur	x12, [x29, #-48]
+	stur	x12, [x29, #-32]
+	sxtw	x0, w19
+	bl	ml_bump
+	ldur	x13, [x29, #-40]
+	ldur	d18, [x29, #-32]
+	scvtf	d16, x13
+	fadd	d19, d16, d18
+	ldur	x9, [x29, #-24]
+	add	x9, x9, x19, lsl #0
+	ldrb	w16, [x9, #0]
+	ucvtf	d17, x16
+	fadd	d16, d19, d17
+	adrp	x17, ml_counter
+	add	x17, x17, :lo12:ml_counter
+	ldrsw	x16, [x17, #0]
+	scvtf	d17, x16
+	fadd	d21, d16, d17
+	fcvtzs	x0, d21
+	ldur	x19, [x29, #-8]
+	mov	sp, x29
+	ldp	x29, x30, [sp], #16
+	ret
+	.size ml_main, .-ml_main
+
+	.p2align 2
+ml__init:
+	stp	x29, x30, [sp, #-16]!
+	mov	x29, sp
+	movz	x9, #0, lsl #0
+	adrp	x16, ml_counter
+	add	x16, x16, :lo12:ml_counter
+	str	w9, [x16, #0]
+	mov	x0, #0
+	mov	sp, x29
+	ldp	x29, x30, [sp], #16
+	ret
+
+	.section .init_array,"aw"
+	.p2align 3
+	.xword ml__init
+
+	.text
+	.globl main
+	.type main, %function
+	.p2align 2
+main:
+	sxtw	x0, w0
+	b	ml_main
+	.size main, .-main
+
+	.bss
+	.p2align 3
+ml_counter:
+	.zero 8
+
+	.section .rodata
+.LC0:
+	.byte 72, 101, 108, 108, 111, 10
+
+	.section .note.GNU-stack,"",%progbits
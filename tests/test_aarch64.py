@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+import api
+
+# Checks the linux-aarch64 output of small programs against the assembly in tests/golden, there
+# is no aarch64 machine to run it on. After a change of the backend the files get written again
+# with MYLANG_UPDATE_GOLDEN=1 python -m pytest tests/test_aarch64.py, review their diff.
+
+GOLDEN: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+
+PROGRAMS: dict = {
+    "arith": """\
+module arith
+
+main: (argc: int, argv: **u8) -> int {
+    a: i8 = argc
+    x: int = argc * 40503 + 7
+    y: int = (x >> 3) ^ (x << 2) ^ (x << argc)
+    q: int = x / (argc - 1)
+    r: u32 = x % argc
+    return a + y + q + r
+}
+""",
+    "calls": """\
+module calls
+
+struct Pair {
+    a: int
+    b: f64
+}
+
+counter: i32 = 0
+
+bump: (n: i32) -> i32 {
+    counter += n
+    return counter
+}
+
+swap: (p: Pair) -> Pair {
+    r: Pair
+    r.a = p.b
+    r.b = p.a
+    return r
+}
+
+main: (argc: int, argv: **u8) -> int {
+    hello: u8[] = "Hello\\n"
+    p: Pair
+    p.a = argc
+    p.b = 2.5
+    p = swap(p)
+    bump(argc)
+    return p.a + p.b + hello[argc] + counter
+}
+""",
+}
+
+
+@pytest.mark.parametrize("optimize", (False, True), ids=("O0", "O1"))
+@pytest.mark.parametrize("name", PROGRAMS)
+def test_golden(name, optimize):
+    result = api.compile_source(PROGRAMS[name], f"{name}.txt", target="linux-aarch64", optimize=optimize)
+    assert result.ok, "\n".join(diagnostic.format() for diagnostic in result.diagnostics)
+
+    path = os.path.join(GOLDEN, f"{name}{'-O' if optimize else ''}.aarch64.s")
+    if os.environ.get("MYLANG_UPDATE_GOLDEN"):
+        with open(path, "w") as fp:
+            fp.write(result.code)
+    with open(path) as fp:
+        assert result.code == fp.read()
@@ -0,0 +1,43 @@
+import hashlib
+import os
+
+import cache
+
+# Fills a small cache and checks that evict() removes the least recently used objects together
+# with their keys and the keys of objects which are gone.
+
+
+def store(stage, root, count, size):
+    """count objects of size bytes, the lower i the longer ago it got used"""
+    store_ = cache.Cache(root, 0)
+    for i in range(count):
+        data = bytes([i]) * size
+        store_.put(stage, store_.key(i), data)
+        os.utime(store_._object(hashlib.sha256(data).hexdigest()), (i, i))
+    return store_
+
+
+def keys(root):
+    return sum(len(names) for _, _, names in os.walk(os.path.join(root, "keys")))
+
+
+def test_evict_removes_keys(tmp_path):
+    root = str(tmp_path)
+    store("out", root, 10, 1000)
+    orphan = tmp_path / "keys" / "ir" / "orphan"
+    orphan.parent.mkdir()
+    orphan.write_text("0" * 64)
+
+    # 2 objects and their keys fit, 3 don't
+    evicting = cache.Cache(root, 3000)
+    assert evicting.evict() == (8, 9, 8 * (1000 + 64) + 64)
+    assert keys(root) == 2
+    assert [evicting.get("out", evicting.key(i)) is not None for i in range(10)] \
+        == [False] * 8 + [True] * 2
+
+
+def test_evict_under_limit(tmp_path):
+    root = str(tmp_path)
+    store("out", root, 3, 100)
+    assert cache.Cache(root).evict() == (0, 0, 0)
+    assert keys(root) == 3
@@ -0,0 +1,26 @@
+import pytest
+
+from bench import complexity
+
+# bench.complexity on small modules, the exponents of lexing, parsing and reporting errors have to
+# stay under its limit. A quarter of the N of the bench takes a few seconds and still shows the
+# quadratic error positions it found first (an exponent of about 1.7 at this size).
+
+LIMIT: float = 1.3
+REPEAT: int = 3
+
+CHECKS: dict = {
+    "functions": ("lex", "parse"),
+    "expressions": ("lex", "parse"),
+    "errors": ("lex", "parse", "resolve"), # resolve is mostly reporting the errors
+}
+
+
+@pytest.mark.parametrize("shape", CHECKS)
+def test_linear(shape):
+    rows = complexity.check(shape, max(1, complexity.SIZES[shape] // 4), REPEAT, LIMIT)
+    exponents = {name: (round(k_time, 2), round(k_memory, 2))
+        for _, name, k_time, k_memory, _, _ in rows}
+    for name in CHECKS[shape]:
+        k_time, k_memory = exponents[name]
+        assert k_time <= LIMIT and k_memory <= LIMIT, f"{name} of {shape} grows like size^{k_time}"
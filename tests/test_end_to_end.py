@@ -0,0 +1,297 @@
+import os
+import platform
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+import api
+from asm_gen import python
+from ir import vm
+
+# Compiles programs with main.py --target c --exe, runs them and checks that their exit code is
+# the one ir.vm.run() gives for the same program. The SEMANTICS programs run on every backend
+# and have to give the exit codes ir.vm defines, None where they divide by zero: an error of
+# --run or a signal.
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ARITHMETIC: str = """\
+module arithmetic
+
+counter: i32 = 0
+
+bump: (n: i32) -> i32 {
+    counter += n
+    return counter
+}
+
+main: (argc: int, argv: **u8) -> int {
+    small: i8 = 100
+    small = small + 100
+    u: u8 = 0
+    u -= 1
+    q: int = -7 / 2
+    r: int = -7 % 2
+    x: int = (argc * 40503 + 7) & 16777215
+    x = (x >> 3) ^ (x << 2)
+    bump(3)
+    bump(argc)
+    return small + u + q + r + x + counter
+}
+"""
+
+STRUCTS: str = """\
+module structs
+
+struct Vec3 {
+    x: f32
+    y: f32
+    z: f32
+
+    dot: (lhs: Vec3, rhs: Vec3) -> f32 {
+        return lhs.x * rhs.x + lhs.y * rhs.y + lhs.z * rhs.z
+    }
+}
+
+struct List {
+    val: int
+    next: *List
+}
+
+scale: (v: Vec3, s: f32) -> Vec3 {
+    r: Vec3 = v
+    r.x = v.x * s
+    r.y = v.y * s
+    r.z = v.z * s
+    return r
+}
+
+push: (l: List, v: int) -> List {
+    r: List
+    r.val = l.val * 31 + v
+    r.next = l.next
+    return r
+}
+
+main: (argc: int, argv: **u8) -> int {
+    hello: u8[] = "Hello World!\\n"
+    a: Vec3
+    a.x = 1.5
+    a.y = 2
+    a.z = -3.0
+    b: Vec3 = scale(a, argc)
+    l: List
+    l = push(push(l, argc), 5)
+    return Vec3.dot(a, b) + l.val + hello[argc]
+}
+"""
+
+FLOATS: str = """\
+module floats
+
+main: (argc: int, argv: **u8) -> int {
+    a: f32 = 16777216.0
+    b: f32 = a + argc
+    c: f64 = 0.1
+    d: f32 = c * 3.0
+    e: f64 = d * 1000000000.0
+    return (b - a) + e / 1000
+}
+"""
+
+
+def read(path):
+    with open(os.path.join(ROOT, path)) as fp:
+        return fp.read()
+
+
+PROGRAMS: dict = {
+    "test.txt": lambda: read("test.txt"),
+    "arithmetic": lambda: ARITHMETIC,
+    "structs": lambda: STRUCTS,
+    "floats": lambda: FLOATS,
+}
+
+
+@pytest.mark.skipif(shutil.which("cc") is None, reason="needs a C compiler")
+@pytest.mark.parametrize("optimize", (False, True), ids=("O0", "O1"))
+@pytest.mark.parametrize("name", PROGRAMS)
+def test_c_exit_code(tmp_path, name, optimize):
+    source = PROGRAMS[name]()
+    path, exe = tmp_path / "prog.txt", tmp_path / "prog"
+    path.write_text(source)
+    args = [sys.executable, "-m", "main", str(path), "--target", "c", "-o", str(tmp_path / "prog.c"),
+        "--exe", str(exe)]
+    if optimize:
+        args.append("-O")
+    build = subprocess.run(args, cwd=ROOT, capture_output=True, text=True)
+    assert build.returncode == 0, build.stdout + build.stderr
+
+    result = api.compile_source(source, name, optimize=optimize)
+    assert result.ok, "\n".join(diagnostic.format() for diagnostic in result.diagnostics)
+    for argv in ([str(exe)], [str(exe), "a", "b"]):
+        expected = vm.run(result.program, argv) & 255
+        assert subprocess.run(argv).returncode == expected
+
+
+SEMANTICS: dict = {
+    # operands get converted to the type of the result, 200 is -56 as an i8
+    "mixed-width": ("""\
+module mixed
+
+main: (argc: int, argv: **u8) -> int {
+    a: i8 = argc
+    x: i8 = 200 / (a + 2)
+    v0: i8 = argc
+    s: i8 = (128 / (v0 + 1)) & 7
+    v3: i64 = 256 >> s
+    return x + v3
+}
+""", 238, 245),
+    "shifts": ("""\
+module shifts
+
+main: (argc: int, argv: **u8) -> int {
+    x: int = 1 << (argc - 2)
+    y: int = 1 << 70
+    z: int = -5 >> (argc + 100)
+    n: u8 = 3
+    w: u8 = n << 9
+    return x + y + z + w + 7
+}
+""", 6, 8),
+    "min-div-minus-one": ("""\
+module divmin
+
+main: (argc: int, argv: **u8) -> int {
+    m: int = -9223372036854775807 - argc
+    q: int = m / -argc
+    r: int = m % -argc
+    return (q - m) + r + 5
+}
+""", 5, 93),
+    "div-by-zero": ("""\
+module divzero
+
+main: (argc: int, argv: **u8) -> int {
+    x: int = 7 / (argc - 1)
+    return x
+}
+""", None, 3),
+    "unused-div-by-zero": ("""\
+module deaddiv
+
+main: (argc: int, argv: **u8) -> int {
+    x: int = 7 % (argc - 1)
+    return 4
+}
+""", None, 4),
+    "keyword-members": ("""\
+module members
+
+struct Kw {
+    long: int
+    float: i32
+    int: u8
+    class: int
+}
+
+main: (argc: int, argv: **u8) -> int {
+    k: Kw
+    k.long = argc * 3
+    k.float = 40
+    k.int = 250 + argc
+    k.class = k.long + k.float
+    return k.class + k.int
+}
+""", 38, 46),
+}
+
+NATIVE: dict = {
+    "c": (shutil.which("cc") is not None, "prog.c"),
+    "linux-x86_64": (shutil.which("cc") is not None and platform.machine() == "x86_64", "prog.s"),
+}
+
+
+def run_engine(engine, program, argv):
+    try:
+        return (vm.run if engine == "vm" else python.run)(program, argv) & 255
+    except vm.VmError:
+        return None
+
+
+def run_native(target, source, tmp_path, optimize):
+    available, output = NATIVE[target]
+    if not available:
+        pytest.skip(f"needs a C compiler to build {target}")
+    path, exe = tmp_path / "prog.txt", tmp_path / "prog"
+    path.write_text(source)
+    args = [sys.executable, "-m", "main", str(path), "--target", target, "-o", str(tmp_path / output),
+        "--exe", str(exe)]
+    if optimize:
+        args.append("-O")
+    build = subprocess.run(args, cwd=ROOT, capture_output=True, text=True)
+    assert build.returncode == 0, build.stdout + build.stderr
+
+    codes = list()
+    for argv in ([str(exe)], [str(exe), "a", "b"]):
+        code = subprocess.run(argv).returncode
+        codes.append(None if code < 0 else code) # killed by a signal
+    return codes
+
+
+@pytest.mark.parametrize("optimize", (False, True), ids=("O0", "O1"))
+@pytest.mark.parametrize("backend", ("vm", "python", *NATIVE))
+@pytest.mark.parametrize("name", SEMANTICS)
+def test_semantics(tmp_path, name, backend, optimize):
+    source, *expected = SEMANTICS[name]
+    if backend in NATIVE:
+        assert run_native(backend, source, tmp_path, optimize) == expected
+        return
+
+    result = api.compile_source(source, name, optimize=optimize)
+    assert result.ok, "\n".join(diagnostic.format() for diagnostic in result.diagnostics)
+    assert [run_engine(backend, result.program, argv) for argv in (["prog"], ["prog", "a", "b"])] \
+        == expected
+
+
+MODULES: dict = {
+    "shapes.txt": """module shapes
+
+area: (w: int, h: i32) -> int {
+    return w * h
+}
+""",
+    "prog.txt": """module prog
+import shapes as s
+
+main: (argc: int, argv: **u8) -> int {
+    return s.area(argc, 7) + 1
+}
+""",
+}
+
+
+@pytest.mark.parametrize("optimize", (False, True), ids=("O0", "O1"))
+@pytest.mark.parametrize("target", NATIVE)
+def test_build_imports(tmp_path, target, optimize):
+    available, output = NATIVE[target]
+    if not available:
+        pytest.skip(f"needs a C compiler to build {target}")
+    for name, source in MODULES.items():
+        (tmp_path / name).write_text(source)
+    out_dir, exe = tmp_path / "out", tmp_path / "prog"
+    args = [sys.executable, "-m", "main", "--build", str(out_dir), "--target", target,
+        "-o", output, str(tmp_path / "prog.txt"), str(tmp_path / "shapes.txt")]
+    if optimize:
+        args.append("-O")
+    build = subprocess.run(args, cwd=ROOT, capture_output=True, text=True)
+    assert build.returncode == 0, build.stdout + build.stderr
+
+    ext = os.path.splitext(output)[1]
+    link = subprocess.run(["cc", "-no-pie", "-o", str(exe), str(out_dir / ("prog" + ext)),
+        str(out_dir / ("shapes" + ext))], capture_output=True, text=True)
+    assert link.returncode == 0, link.stderr
+    assert [subprocess.run(argv).returncode for argv in ([str(exe)], [str(exe), "a", "b"])] == [8, 22]
@@ -0,0 +1,72 @@
+import re
+import shutil
+import subprocess
+
+import pytest
+
+import api
+
+# Reads the object files of the native backends back with readelf -h -S -s, which checks the
+# ELF headers, sections and symbols asm_gen.elf writes without having to link or run them.
+
+SOURCE: str = """\
+module objects
+
+counter: int = 0
+
+bump: (n: int) -> int {
+    counter += n
+    return counter
+}
+
+main: (argc: int, argv: **u8) -> int {
+    hello: u8[] = "Hello\\n"
+    return bump(argc) + hello[argc]
+}
+"""
+
+MACHINES: dict = {"linux-x86_64": "Advanced Micro Devices X86-64", "linux-aarch64": "AArch64"}
+
+_SECTION_RE = re.compile(r"\[\s*\d+\]\s+(\S+)\s+(\S+)")
+_SYMBOL_RE = re.compile(r"\d+:\s+[0-9a-f]+\s+(\d+)\s+(\w+)\s+(\w+)\s+\w+\s+(\w+)\s+(\S+)$")
+
+
+def readelf(path):
+    out = subprocess.run(["readelf", "-h", "-S", "-s", "-W", str(path)], capture_output=True,
+        text=True, check=True).stdout
+    header = dict(re.findall(r"^\s+([^:\n]+):\s+(.*?)\s*$", out.split("Section Headers:")[0], re.M))
+    sections = {name: typ for name, typ in _SECTION_RE.findall(out)}
+    symbols = dict()
+    for line in out.splitlines():
+        match = _SYMBOL_RE.search(line)
+        if match is not None:
+            size, typ, bind, ndx, name = match.groups()
+            symbols[name] = (int(size), typ, bind, ndx)
+    return header, sections, symbols
+
+
+@pytest.mark.skipif(shutil.which("readelf") is None, reason="needs readelf")
+@pytest.mark.parametrize("target", MACHINES)
+def test_object_file(tmp_path, target):
+    result = api.compile_source(SOURCE, "objects.txt", target=target, object_file=True)
+    assert result.ok, "\n".join(diagnostic.format() for diagnostic in result.diagnostics)
+    path = tmp_path / "objects.o"
+    path.write_bytes(result.code)
+
+    header, sections, symbols = readelf(path)
+    assert header["Class"] == "ELF64"
+    assert header["Type"].startswith("REL ")
+    assert header["Machine"] == MACHINES[target]
+
+    assert sections[".text"] == "PROGBITS"
+    assert sections[".init_array"] == "INIT_ARRAY"
+    assert sections[".rela.text"] == "RELA"
+    assert sections[".bss"] == "NOBITS"
+    assert sections[".rodata"] == "PROGBITS"
+    assert sections[".symtab"] == "SYMTAB"
+
+    for name in ("ml_main", "ml_bump", "main"):
+        size, typ, bind, ndx = symbols[name]
+        assert (typ, bind) == ("FUNC", "GLOBAL") and size > 0 and ndx != "UND", name
+    assert symbols["ml__init"][2] == "LOCAL"
+    assert symbols["ml_counter"][3] != "UND"
@@ -0,0 +1,66 @@
+from asm_gen import linux_aarch64, linux_x86_64, peephole
+
+# Runs the peephole rules of the native backends on short instruction lists and checks what is
+# left of them and how often every rule fired.
+
+
+def run(instrs, target):
+    counts = dict()
+    return peephole.run(instrs, target, counts), counts
+
+
+def test_x86_dead_copy():
+    instrs, counts = run([
+        ("movq", "%rdi", "%r10"),
+        ("movq", "%rsi", "%r10"),
+        ("movq", "%r10", "%rbx"),
+        ("ret",),
+    ], linux_x86_64.PEEPHOLE)
+    assert instrs == [("movq", "%rsi", "%rbx"), ("ret",)]
+    assert counts == {"dead-write": 1, "copy-forward": 1}
+
+
+def test_x86_dead_load():
+    instrs, counts = run([
+        ("movzbq", "7(%rsi)", "%r10"),
+        ("movq", "%rax", "%r10"),
+        ("addq", "%r10", "%rbx"),
+        ("ret",),
+    ], linux_x86_64.PEEPHOLE)
+    assert instrs == [("addq", "%rax", "%rbx"), ("ret",)]
+    assert counts == {"dead-write": 1, "copy-forward": 1}
+
+
+def test_x86_dead_copy_after_return_value():
+    instrs, counts = run([
+        ("movaps", "%xmm1", "%xmm0"),
+        ("movaps", "%xmm0", "%xmm12"),
+        ("leave",),
+        ("ret",),
+    ], linux_x86_64.PEEPHOLE)
+    assert instrs == [("movaps", "%xmm1", "%xmm0"), ("leave",), ("ret",)]
+    assert counts == {"dead-write": 1}
+
+
+def test_x86_writes_kept():
+    # the call might read %rdi, xorl sets the flags cmovaq reads
+    instrs = [
+        ("movq", "%r10", "%rdi"),
+        ("call", "ml_f"),
+        ("xorl", "%eax", "%eax"),
+        ("cmpq", "$63", "%rcx"),
+        ("cmovaq", "%rax", "%rbx"),
+        ("ret",),
+    ]
+    assert run(instrs, linux_x86_64.PEEPHOLE) == (instrs, {})
+
+
+def test_aarch64_dead_copy():
+    instrs, counts = run([
+        ("mov", "x9", "x13"),
+        ("mov", "x9", "x14"),
+        ("add", "x19", "x9", "#1"),
+        ("ret",),
+    ], linux_aarch64.PEEPHOLE)
+    assert instrs == [("add", "x19", "x14", "#1"), ("ret",)]
+    assert counts == {"dead-write": 1, "copy-forward": 1}
@@ -0,0 +1,97 @@
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# Per phase timing of a compile (main.py --time-report).
+#
+#   timer = Timer(memory=True)
+#   with timer.phase("parse"):
+#       ...
+#   print(timer.report())
+#
+# A phase gets its wall time, CPU time (including the processes of a -j pool once they are
+# done) and with memory the peak of the memory tracemalloc saw during it and what the phase
+# kept allocated. Phases run again (like the same pass on every function) add up. Phases don't
+# nest, the total is the sum of them.
+#
+# Functions taking a timer default to NULL, its phase() is a context manager doing nothing so
+# a compile without a report doesn't pay for one.
+
+
+class NullTimer:
+    __slots__ = ()
+    enabled = False
+
+    def phase(self, name):
+        return _NOTHING
+
+
+_NOTHING = nullcontext()
+NULL: NullTimer = NullTimer()
+
+
+def _cpu():
+    # the children only get counted once they are waited for
+    times = os.times()
+    return time.process_time() + times.children_user + times.children_system
+
+
+class Timer:
+    __slots__ = "memory", "phases"
+    enabled = True
+
+    def __init__(self, memory=False):
+        self.memory = memory # tracemalloc slows everything down, so only when asked for
+        self.phases = dict() # name -> [calls, wall, cpu, peak, retained]
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def phase(self, name):
+        if self.memory:
+            tracemalloc.reset_peak()
+            mem_start = tracemalloc.get_traced_memory()[0]
+        wall_start, cpu_start = time.perf_counter(), _cpu()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall_start, _cpu() - cpu_start
+            peak = retained = 0
+            if self.memory:
+                current, peak = tracemalloc.get_traced_memory()
+                retained = current - mem_start
+            entry = self.phases.setdefault(name, [0, 0.0, 0.0, 0, 0])
+            entry[0] += 1
+            entry[1] += wall
+            entry[2] += cpu
+            entry[3] = max(entry[3], peak)
+            entry[4] += retained
+
+    def stop(self):
+        if self.memory:
+            tracemalloc.stop()
+
+    def json(self) -> str:
+        phases = [{"phase": name, "calls": calls, "wall": wall, "cpu": cpu, "peak": peak,
+            "retained": retained} for name, (calls, wall, cpu, peak, retained) in self.phases.items()]
+        return json.dumps({
+            "phases": phases,
+            "wall": sum(phase["wall"] for phase in phases),
+            "cpu": sum(phase["cpu"] for phase in phases),
+            "memory": self.memory,
+        }, indent=2)
+
+    def report(self) -> str:
+        """aligned table of the phases in the order they first ran"""
+        width = max(len("phase"), len("total"), *(len(name) for name in self.phases))
+        mem = f" {'peak MB':>9} {'kept MB':>9}" if self.memory else ""
+        lines = [f"{'phase':<{width}} {'calls':>6} {'wall ms':>10} {'cpu ms':>10}{mem}"]
+        for name, (calls, wall, cpu, peak, retained) in self.phases.items():
+            mem = f" {peak / 1e6:9.2f} {retained / 1e6:9.2f}" if self.memory else ""
+            lines.append(f"{name:<{width}} {calls:>6} {wall * 1e3:10.2f} {cpu * 1e3:10.2f}{mem}")
+        wall = sum(entry[1] for entry in self.phases.values())
+        cpu = sum(entry[2] for entry in self.phases.values())
+        lines.append(f"{'total':<{width}} {'':>6} {wall * 1e3:10.2f} {cpu * 1e3:10.2f}")
+        return "\n".join(lines)